@@ -9,22 +9,121 @@ namespace PyJettyFJTools
 {
     // fraction of pT of jet j1 contained in j0 - constit by constit
     double matched_pt(const fastjet::PseudoJet &j0, const fastjet::PseudoJet &j1)
+    {
+        ConstituentMatcher matcher(j1);
+        return matcher.matched_pt(j0);
+    }
+
+    ConstituentMatcher::ConstituentMatcher()
+    : fpt_map()
+    , fpt_sums()
+    {
+        ;
+    }
+
+    ConstituentMatcher::ConstituentMatcher(const fastjet::PseudoJet &ref)
+    : fpt_map()
+    , fpt_sums()
+    {
+        std::vector<fastjet::PseudoJet> refs(1, ref);
+        reset(refs);
+    }
+
+    ConstituentMatcher::ConstituentMatcher(const std::vector<fastjet::PseudoJet> &refs)
+    : fpt_map()
+    , fpt_sums()
+    {
+        reset(refs);
+    }
+
+    ConstituentMatcher::~ConstituentMatcher()
+    {
+        ;
+    }
+
+    void ConstituentMatcher::reset(const std::vector<fastjet::PseudoJet> &refs)
+    {
+        fpt_map.clear();
+        fpt_sums.assign(refs.size(), 0);
+        for (unsigned int iref = 0; iref < refs.size(); iref++)
+            add_constituents(refs[iref], iref);
+    }
+
+    void ConstituentMatcher::add_constituents(const fastjet::PseudoJet &ref, unsigned int iref)
+    {
+        if (!ref.has_constituents())
+            return;
+        std::vector<fastjet::PseudoJet> constituents = ref.constituents();
+        fpt_map.reserve(fpt_map.size() + constituents.size());
+        for (auto &p : constituents)
+        {
+            fpt_map.emplace(p.user_index(), std::make_pair(iref, p.pt()));
+            fpt_sums[iref] += p.pt();
+        }
+    }
+
+    double ConstituentMatcher::matched_pt(const fastjet::PseudoJet &j, unsigned int iref) const
     {
         double pt_sum = 0;
-        double pt_sum_1 = 0;
-        for (auto &p1 : j1.constituents())
-            pt_sum_1 += p1.pt();
-        for (auto &p0 : j0.constituents())
+        if (j.has_constituents())
         {
-            for (auto &p1 : j1.constituents())
+            for (auto &p : j.constituents())
             {
-                if (p0.user_index() == p1.user_index())
+                auto range = fpt_map.equal_range(p.user_index());
+                for (auto it = range.first; it != range.second; ++it)
                 {
-                    pt_sum += p1.pt();
+                    if (it->second.first == iref)
+                        pt_sum += it->second.second;
                 }
             }
         }
-        return (pt_sum / pt_sum_1);
+        return (pt_sum / fpt_sums[iref]);
+    }
+
+    std::vector<double> ConstituentMatcher::matched_pt_all(const std::vector<fastjet::PseudoJet> &queries) const
+    {
+        std::size_t nq = queries.size();
+        std::vector<double> pt_sums(fpt_sums.size() * nq, 0);
+        for (std::size_t iq = 0; iq < nq; iq++)
+        {
+            if (!queries[iq].has_constituents())
+                continue;
+            for (auto &p : queries[iq].constituents())
+            {
+                auto range = fpt_map.equal_range(p.user_index());
+                for (auto it = range.first; it != range.second; ++it)
+                    pt_sums[it->second.first * nq + iq] += it->second.second;
+            }
+        }
+        for (std::size_t i = 0; i < pt_sums.size(); i++)
+            pt_sums[i] /= fpt_sums[i / nq];
+        return pt_sums;
+    }
+
+    // fraction of pT of jet j_norm carried by the embedded (user_index >= 0) constituents of jet j
+    double mc_fraction(const fastjet::PseudoJet &j_norm, const fastjet::PseudoJet &j)
+    {
+        double pt_contained = 0;
+        for (auto &p : j.constituents())
+        {
+            if (p.user_index() >= 0)
+                pt_contained += p.pt();
+        }
+        return (pt_contained / j_norm.pt());
+    }
+
+    // all pT matching fractions for prong matching of a truth jet to a combined (embedded) jet in one call
+    std::vector<double> prong_matched_pt(const fastjet::PseudoJet &truth_prong1, const fastjet::PseudoJet &truth_prong2,
+                                         const fastjet::PseudoJet &combined_prong1, const fastjet::PseudoJet &combined_prong2,
+                                         const fastjet::PseudoJet &combined_groomed, const fastjet::PseudoJet &combined,
+                                         const fastjet::PseudoJet &truth)
+    {
+        std::vector<fastjet::PseudoJet> refs = {truth_prong2, truth_prong1};
+        std::vector<fastjet::PseudoJet> queries = {combined_prong2, combined_prong1, combined_groomed, combined};
+        ConstituentMatcher matcher(refs);
+        std::vector<double> retv = matcher.matched_pt_all(queries);
+        retv.push_back(mc_fraction(truth, combined));
+        return retv;
     }
 
     // return indices of jets matched to j jet  
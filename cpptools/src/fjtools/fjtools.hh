@@ -6,6 +6,7 @@ class TF1;
 #include <THn.h>
 #include <string>
 #include <vector>
+#include <unordered_map>
 #include <fastjet/PseudoJet.hh>
 
 namespace PyJettyFJTools
@@ -49,6 +50,44 @@ namespace PyJettyFJTools
 	// fraction of pT of jet j1 contained in j0 - constit by constit
 	double matched_pt(const fastjet::PseudoJet &j0, const fastjet::PseudoJet &j1);
 
+	// user_index -> pT map of the constituents of one or more reference jets - built once
+	// and then used to compute the fraction of pT of each reference contained in many query jets
+	class ConstituentMatcher
+	{
+	public:
+		ConstituentMatcher();
+		ConstituentMatcher(const fastjet::PseudoJet &ref);
+		ConstituentMatcher(const std::vector<fastjet::PseudoJet> &refs);
+		~ConstituentMatcher();
+
+		void reset(const std::vector<fastjet::PseudoJet> &refs);
+		unsigned int n_refs() const {return fpt_sums.size();}
+
+		// fraction of pT of reference iref contained in jet j (same as matched_pt(j, refs[iref]))
+		double matched_pt(const fastjet::PseudoJet &j, unsigned int iref = 0) const;
+		// fraction of pT of each reference contained in each query jet - one pass per query jet
+		// ordered as [iref * queries.size() + iquery]
+		std::vector<double> matched_pt_all(const std::vector<fastjet::PseudoJet> &queries) const;
+
+	private:
+		void add_constituents(const fastjet::PseudoJet &ref, unsigned int iref);
+
+		std::unordered_multimap<int, std::pair<unsigned int, double> > fpt_map;
+		std::vector<double> fpt_sums;
+	};
+
+	// fraction of pT of jet j_norm carried by the embedded (user_index >= 0) constituents of jet j
+	double mc_fraction(const fastjet::PseudoJet &j_norm, const fastjet::PseudoJet &j);
+
+	// all pT matching fractions for prong matching of a truth jet to a combined (embedded) jet in one call
+	// returns fraction of pT of truth_prong2 (subleading) and then truth_prong1 (leading) contained in
+	//   {combined_prong2, combined_prong1, combined_groomed, combined} (8 values)
+	// followed by mc_fraction(truth, combined)
+	std::vector<double> prong_matched_pt(const fastjet::PseudoJet &truth_prong1, const fastjet::PseudoJet &truth_prong2,
+										 const fastjet::PseudoJet &combined_prong1, const fastjet::PseudoJet &combined_prong2,
+										 const fastjet::PseudoJet &combined_groomed, const fastjet::PseudoJet &combined,
+										 const fastjet::PseudoJet &truth);
+
 	// return indices of jets matched to j jet - using rapidity to calculate deltaR
 	std::vector<int> matched_Ry(const fastjet::PseudoJet &j, const std::vector<fastjet::PseudoJet> &v, double Rmatch);
 	// return indices of jets matched to j jet - using pseudorapidity to calculate deltaR
@@ -1,6 +1,7 @@
 %module fjtools
 %include "std_vector.i"
 %template(IntVector) std::vector<int>;
+%template(DoubleVector) std::vector<double>;
 %{
 	#define SWIG_FILE_WITH_INIT
 	// #include <Pythia8/Pythia.h>
@@ -2,83 +2,160 @@
 #define __PYJETTY_PARTICLEGRID__HH
 
 #include <TObject.h>
-#include <TH2F.h>
 #include <cmath>
+#include <vector>
+#include <algorithm>
 #include <fastjet/PseudoJet.hh>
 
 namespace RUtil
 {
+	// Grid of uniform (eta, phi) cells, summing e per cell
+	// - cells are located by index arithmetic (as TAxis::FindBin for fixed bins)
+	// - occupied cells are tracked, so that readout and reset are O(occupied cells)
+	// - particles outside of the grid are ignored
 	class ParticleGrid : public TObject
 	{
 	public:
-		ParticleGrid() : TObject(), fGrid(0)
+		ParticleGrid() : TObject()
+		, fNbinsEta(0), fMinEta(0), fMaxEta(0)
+		, fNbinsPhi(0), fMinPhi(0), fMaxPhi(0)
+		, fContent()
+		, fFlag()
+		, fOccupied()
 		{;}
 		ParticleGrid(Double_t fNbinsEta, Double_t fMinEta, Double_t fMaxEta, Double_t fNbinsPhi, Double_t fMinPhi, Double_t fMaxPhi)
 		: TObject()
-		, fGrid(0)
+		, fContent()
+		, fFlag()
+		, fOccupied()
 		{
 			newGrid(fNbinsEta, fMinEta, fMaxEta, fNbinsPhi, fMinPhi, fMaxPhi);
 		}
 
 		virtual ~ParticleGrid()
-		{
-			delete fGrid;
-		}
+		{;}
 
 		void fillParticle(Double_t eta, Double_t phi, Double_t e)
 		{
-			fGrid->Fill(eta, phi, e);
+			int icell = cellIndex(eta, phi);
+			if (icell < 0)
+				return;
+			if (!fFlag[icell])
+			{
+				fFlag[icell] = 1;
+				fOccupied.push_back(icell);
+			}
+			fContent[icell] += Float_t(e);
 		}
 
 		void fillParticle(const fastjet::PseudoJet &p)
 		{
-			fGrid->Fill(p.eta(), p.phi(), p.e());
+			fillParticle(p.eta(), p.phi(), p.e());
 		}
 
 		void fillParticles(const std::vector<fastjet::PseudoJet> &parts)
 		{
 			for (auto &p : parts)
 			{
-				fGrid->Fill(p.eta(), p.phi(), p.e());
+				fillParticle(p.eta(), p.phi(), p.e());
 			}
 		}
 
+		// batch fill from arrays (e.g. numpy) of n particles
+		void fillArrays(const int &n, const double *eta, const double *phi, const double *e)
+		{
+			for (int i = 0; i < n; i++)
+			{
+				fillParticle(eta[i], phi[i], e[i]);
+			}
+		}
+
+		// one massless particle per occupied cell with positive content, at the cell center,
+		// in order of (eta bin, phi bin)
 		std::vector<fastjet::PseudoJet> getGridParticles()
 		{
+			std::sort(fOccupied.begin(), fOccupied.end());
 			std::vector<fastjet::PseudoJet> outv;
-			for (int ieta = 1; ieta < fGrid->GetNbinsX()+1; ieta++)
+			outv.reserve(fOccupied.size());
+			for (auto icell : fOccupied)
 			{
-				for (int iphi = 1; iphi < fGrid->GetNbinsY()+1; iphi++)
+				if (fContent[icell] > 0)
 				{
-					if (fGrid->GetBinContent(ieta, iphi) > 0)
-					{
-						fastjet::PseudoJet psj;
-						psj.reset_PtYPhiM(	fGrid->GetBinContent(ieta, iphi),
-											fGrid->GetXaxis()->GetBinCenter(ieta),
-											fGrid->GetYaxis()->GetBinCenter(iphi),
-											0.);
-						outv.push_back(psj);
-					}
+					fastjet::PseudoJet psj;
+					psj.reset_PtYPhiM(	fContent[icell],
+										binCenter(icell / fNbinsPhi, fNbinsEta, fMinEta, fMaxEta),
+										binCenter(icell % fNbinsPhi, fNbinsPhi, fMinPhi, fMaxPhi),
+										0.);
+					outv.push_back(psj);
 				}
 			}
 			return outv;
 		}
 
+		Int_t getNOccupied() const
+		{
+			return fOccupied.size();
+		}
+
 		void Reset()
 		{
-			fGrid->Reset();
+			for (auto icell : fOccupied)
+			{
+				fContent[icell] = 0;
+				fFlag[icell] = 0;
+			}
+			fOccupied.clear();
 		}
 
 	private:
 		void newGrid(Double_t fNbinsEta, Double_t fMinEta, Double_t fMaxEta, Double_t fNbinsPhi, Double_t fMinPhi, Double_t fMaxPhi)
 		{
-			if (fGrid != 0x0)
-				delete fGrid;
-			fGrid = new TH2F("ParticleGrid", "ParticleGrid", fNbinsEta, fMinEta, fMaxEta, fNbinsPhi, fMinPhi, fMaxPhi);
-			fGrid->SetDirectory(0);
+			this->fNbinsEta = Int_t(fNbinsEta);
+			this->fMinEta = fMinEta;
+			this->fMaxEta = fMaxEta;
+			this->fNbinsPhi = Int_t(fNbinsPhi);
+			this->fMinPhi = fMinPhi;
+			this->fMaxPhi = fMaxPhi;
+			fContent.assign(this->fNbinsEta * this->fNbinsPhi, 0);
+			fFlag.assign(fContent.size(), 0);
+			fOccupied.clear();
+			fOccupied.reserve(fContent.size());
+		}
+
+		// bin (0..nbins-1) as TAxis::FindBin - 1, or -1 if outside of [min, max)
+		static Int_t binIndex(Double_t x, Int_t nbins, Double_t min, Double_t max)
+		{
+			if (!(x >= min) || !(x < max))
+				return -1;
+			Int_t ibin = Int_t(nbins * (x - min) / (max - min));
+			return ibin < nbins ? ibin : -1;
+		}
+
+		static Double_t binCenter(Int_t ibin, Int_t nbins, Double_t min, Double_t max)
+		{
+			Double_t width = (max - min) / nbins;
+			return min + ibin * width + 0.5 * width;
+		}
+
+		Int_t cellIndex(Double_t eta, Double_t phi) const
+		{
+			Int_t ieta = binIndex(eta, fNbinsEta, fMinEta, fMaxEta);
+			Int_t iphi = binIndex(phi, fNbinsPhi, fMinPhi, fMaxPhi);
+			if (ieta < 0 || iphi < 0)
+				return -1;
+			return ieta * fNbinsPhi + iphi;
 		}
-		TH2F *fGrid; //!
-	ClassDef(ParticleGrid, 1)
+
+		Int_t fNbinsEta;
+		Double_t fMinEta;
+		Double_t fMaxEta;
+		Int_t fNbinsPhi;
+		Double_t fMinPhi;
+		Double_t fMaxPhi;
+		std::vector<Float_t> fContent; //!
+		std::vector<Char_t> fFlag; //!
+		std::vector<Int_t> fOccupied; //!
+	ClassDef(ParticleGrid, 2)
 	};
 };
 #endif
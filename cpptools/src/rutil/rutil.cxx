@@ -741,6 +741,28 @@ namespace RUtil
         return;
     }
 
+    //---------------------------------------------------------------
+    // Bulk filling of n entries of a TH3 in one call
+    //---------------------------------------------------------------
+    void HistUtils::fill_th3(TH3* hist, const int & n, const double* x, const double* y,
+                             const double* z, const double* w) {
+
+        for (int i = 0; i < n; i++) {
+            hist->Fill(x[i], y[i], z[i], w[i]);
+        }
+    }
+
+    //---------------------------------------------------------------
+    // Bulk filling of n entries of a THn/THnSparse in one call
+    //---------------------------------------------------------------
+    void HistUtils::fill_thn(THnBase* hist, const int & n, const double* x, const double* w) {
+
+        const int n_dim = hist->GetNdimensions();
+        for (int i = 0; i < n; i++) {
+            hist->Fill(x + i * n_dim, w[i]);
+        }
+    }
+
     //---------------------------------------------------------------
     // Remove outliers from a TH1 via "simple" method:
     //   delete any bin contents with N counts < limit
@@ -986,57 +1008,138 @@ namespace RUtil
 								   const double & sd_zcut/*=0.2*/, 
 								   const std::string & option/*=""*/) {
 
+		std::vector<double> Omegas(1, Omega);
+		std::vector<TH2D*> hists(1, const_cast<TH2D*>(&h));
+		std::vector<std::string> names(1, name);
+		return HistUtils::convolve_F_np_batch(Omegas, R, beta, ob_bins, n_ob_bins, obs, ob_bin_width,
+											  pT_bins, n_pT_bins, pTs, hists, names,
+											  groomed, sd_beta, sd_zcut, option)[0];
+
+    }  // FnpUtils::convolve_F_np
+
+
+    //---------------------------------------------------------------
+    // Convolve each histogram of hists with the shape function, for each Omega
+    // The kernel dk * F_np(Omega, k) only depends on (pT, ob_np, ob) for a given
+    // Omega, beta and grooming: k and dk are computed once, the kernel matrix
+    // (triangular, ob <= ob_np) once per Omega, and then applied to all histograms
+    // Returns the histograms ordered [i_Omega * hists.size() + i_hist]
+    std::vector<TH2D*> HistUtils::convolve_F_np_batch(
+								   const std::vector<double> & Omegas, const double & R, const double & beta,
+								   const double* ob_bins, const int & n_ob_bins, const double* obs,
+								   const double* ob_bin_width,
+								   const double* pT_bins, const int & n_pT_bins, const double* pTs,
+								   const std::vector<TH2D*> & hists, const std::vector<std::string> & names,
+								   const bool groomed/*=false*/, const double & sd_beta/*=0*/,
+								   const double & sd_zcut/*=0.2*/,
+								   const std::string & option/*=""*/) {
+
 		if (groomed && sd_beta != 0) {
 			printf("ERROR: currently only implemented for sd_beta == 0\n");
 			throw 1;
 		}
 
-		// Initialize NP-convolved histogram to have the same binnings as h
-		TH2D* h_np = (TH2D*) h.Clone();
-		h_np->SetNameTitle(name.c_str(), name.c_str());
+		const int n_Omegas = Omegas.size();
+		const int n_hists = hists.size();
+		if ((int) names.size() != n_Omegas * n_hists) {
+			printf("ERROR: %i names given for %i Omega values x %i histograms\n",
+				   (int) names.size(), n_Omegas, n_hists);
+			throw 1;
+		}
+
+		const bool width = (option == "width");
+		// Groomed case (assumes sd_beta == 0 for simplification)
+		const double zcut_factor = groomed ? std::pow(sd_zcut, beta - 1) : 1.;
+
+		// Index of (ob_np, ob) in the triangular kernel of a pT bin
+		const int n_tri = n_ob_bins * (n_ob_bins + 1) / 2;
+		auto tri_index = [n_tri](int pT_i, int ob_np_i, int ob_i) {
+			return pT_i * n_tri + ob_np_i * (ob_np_i + 1) / 2 + ob_i; };
 
-        // Numerical integration
-		// Loop over all x-bins in the final histogram
+		// k(ob_np, ob) and dk(ob) per pT bin, independent of Omega
+		std::vector<double> k(n_pT_bins * n_tri);
+		std::vector<double> dk(n_pT_bins * n_ob_bins);
 		for(int pT_i = 0; pT_i < n_pT_bins; pT_i++) {
 			double pT = pTs[pT_i];
-			// Loop over all y-bins in the final histogram
+			for(int ob_i = 0; ob_i < n_ob_bins; ob_i++) {
+				// Use chain rule to find dk in terms of dob and dpT
+				double dk_i = pT * R;
+				if (groomed) {
+					dk_i = pT * R * std::pow(obs[ob_i], (1 - beta) / beta) * zcut_factor;
+				}
+				if (width) { dk_i *= ob_bin_width[ob_i]; }
+				dk[pT_i * n_ob_bins + ob_i] = dk_i;
+			}
 			for(int ob_np_i = 0; ob_np_i < n_ob_bins; ob_np_i++) {
 				double ob_np = obs[ob_np_i];
-
-				// Calculate the integral for this bin
-				double integral = 0;
-				int ob_i = 0;
-				double ob; double k; double dk;
-				do {
-					ob = obs[ob_i];
-					if (!groomed) { 
-						k = (ob_np - ob) * pT * R;
-						// Use chain rule to find dk in terms of dob and dpT
-						dk = pT * R;
-						if (option == "width") { dk *= ob_bin_width[ob_i]; }
-					} else {  // groomed case (assumes sd_beta == 0 for simplification)
-						k = pT * R * std::pow((ob_np - ob) * std::pow(sd_zcut, beta - 1), 1. / beta);
-						dk = pT * R * std::pow(ob, (1 - beta) / beta) *
-							std::pow(sd_zcut, beta - 1);
-						if (option == "width") { dk *= ob_bin_width[ob_i]; }
+				for(int ob_i = 0; ob_i <= ob_np_i; ob_i++) {
+					double ob = obs[ob_i];
+					if (!groomed) {
+						k[tri_index(pT_i, ob_np_i, ob_i)] = (ob_np - ob) * pT * R;
+					} else {
+						k[tri_index(pT_i, ob_np_i, ob_i)] =
+							pT * R * std::pow((ob_np - ob) * zcut_factor, 1. / beta);
 					}
+				}
+			}
+		}
 
-					integral += dk * HistUtils::F_np(Omega, k, beta) * 
-						h.GetBinContent(pT_i+1, ob_i+1);
-
-					ob_i++;
-				} while (ob_i <= ob_np_i);
-
-				if (option == "width") { h_np->SetBinContent(pT_i+1, ob_np_i+1, integral); }
-				else { h_np->SetBinContent(pT_i+1, ob_np_i+1, integral * ob_bin_width[ob_np_i]); }
-				h_np->SetBinError(pT_i+1, ob_np_i+1, 0);
-
-			}  // for(ob)
-		}  // for(pT)
-
-		return h_np;
+		// Contents of the input histograms, read once
+		std::vector<std::vector<double>> contents(n_hists, std::vector<double>(n_pT_bins * n_ob_bins));
+		for(int h_i = 0; h_i < n_hists; h_i++) {
+			for(int pT_i = 0; pT_i < n_pT_bins; pT_i++) {
+				for(int ob_i = 0; ob_i < n_ob_bins; ob_i++) {
+					contents[h_i][pT_i * n_ob_bins + ob_i] = hists[h_i]->GetBinContent(pT_i+1, ob_i+1);
+				}
+			}
+		}
 
-    }  // FnpUtils::convolve_F_np
+		std::vector<TH2D*> h_nps;
+		h_nps.reserve(n_Omegas * n_hists);
+		std::vector<double> kernel(n_pT_bins * n_tri);
+		for(int Omega_i = 0; Omega_i < n_Omegas; Omega_i++) {
+			const double Omega = Omegas[Omega_i];
+
+			// Kernel matrix for this Omega
+			for(int pT_i = 0; pT_i < n_pT_bins; pT_i++) {
+				for(int ob_np_i = 0; ob_np_i < n_ob_bins; ob_np_i++) {
+					for(int ob_i = 0; ob_i <= ob_np_i; ob_i++) {
+						int index = tri_index(pT_i, ob_np_i, ob_i);
+						kernel[index] = dk[pT_i * n_ob_bins + ob_i] * HistUtils::F_np(Omega, k[index], beta);
+					}
+				}
+			}
+
+			// Numerical integration, for all histograms
+			for(int h_i = 0; h_i < n_hists; h_i++) {
+				// Initialize NP-convolved histogram to have the same binnings as h
+				TH2D* h_np = (TH2D*) hists[h_i]->Clone();
+				const std::string & name = names[Omega_i * n_hists + h_i];
+				h_np->SetNameTitle(name.c_str(), name.c_str());
+
+				const std::vector<double> & content = contents[h_i];
+				for(int pT_i = 0; pT_i < n_pT_bins; pT_i++) {
+					for(int ob_np_i = 0; ob_np_i < n_ob_bins; ob_np_i++) {
+						const double* kernel_row = &kernel[tri_index(pT_i, ob_np_i, 0)];
+						const double* content_row = &content[pT_i * n_ob_bins];
+						double integral = 0;
+						for(int ob_i = 0; ob_i <= ob_np_i; ob_i++) {
+							integral += kernel_row[ob_i] * content_row[ob_i];
+						}
+
+						if (width) { h_np->SetBinContent(pT_i+1, ob_np_i+1, integral); }
+						else { h_np->SetBinContent(pT_i+1, ob_np_i+1, integral * ob_bin_width[ob_np_i]); }
+						h_np->SetBinError(pT_i+1, ob_np_i+1, 0);
+					}  // for(ob)
+				}  // for(pT)
+
+				h_nps.push_back(h_np);
+			}  // for(h)
+		}  // for(Omega)
+
+		return h_nps;
+
+    }  // FnpUtils::convolve_F_np_batch
 
 
     // Non-perturbative parameter with factored-out beta dependence
@@ -3,8 +3,12 @@
 
 #include <TObject.h>
 #include <TH2.h>
+#include <TH3.h>
 #include <THn.h>
 
+#include <string>
+#include <vector>
+
 //#if USE_ROOUNFOLD
 #include <RooUnfoldResponse.h>
 //#endif
@@ -142,6 +146,16 @@ namespace RUtil
         //---------------------------------------------------------------
         THn* pThatRemoveOutliers(THn* hist, bool verbose, const double & limit, int dim, int pTdim);
 
+        //---------------------------------------------------------------
+        // Bulk filling of n entries in one call (for TH3 and THn, which have no FillN)
+        // Entries are filled in order, with the same result as calling Fill() for each entry
+        //---------------------------------------------------------------
+        void fill_th3(TH3* hist, const int & n, const double* x, const double* y,
+                      const double* z, const double* w);
+
+        // x is an (n, n_dim) row-major array of coordinates
+        void fill_thn(THnBase* hist, const int & n, const double* x, const double* w);
+
         //------------------------------------------------------
         // Convolution of nonperturbative shape functions
 
@@ -154,6 +168,18 @@ namespace RUtil
                             const double & sd_beta = 0, const double & sd_zcut = 0.2,
                             const std::string & option = "");
 
+        // Convolve each histogram of hists with the shape function, for each Omega.
+        // The kernel matrix is computed once per pT bin and Omega for all histograms.
+        // Returns the histograms ordered [i_Omega * hists.size() + i_hist], named with names
+        std::vector<TH2D*> convolve_F_np_batch(
+                            const std::vector<double> & Omegas, const double & R, const double & beta,
+                            const double* ob_bins, const int & n_ob_bins, const double* obs,
+                            const double* ob_bin_width,
+                            const double* pT_bins, const int & n_pT_bins, const double* pTs,
+                            const std::vector<TH2D*> & hists, const std::vector<std::string> & names,
+                            const bool groomed = false, const double & sd_beta = 0,
+                            const double & sd_zcut = 0.2, const std::string & option = "");
+
         double find_cell(double val, const double * cell, const int range, bool phi);
 
     private:
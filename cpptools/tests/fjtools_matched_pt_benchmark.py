@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Benchmark of prong matching of PYTHIA jets embedded into a thermal (Pb-Pb like) background:
+# 8x fjtools.matched_pt + python mc_fraction (as in process_groomers) vs one fjtools.prong_matched_pt call
+
+from __future__ import print_function
+
+import fastjet as fj
+import fjcontrib
+import fjtools
+
+import tqdm
+import argparse
+import os
+import time
+import numpy as np
+
+from heppy.pythiautils import configuration as pyconf
+import pythia8
+import pythiafjext
+
+
+def mc_fraction(jet_truth, jet_combined):
+	pt_contained = 0.
+	for track in jet_combined.constituents():
+		if track.user_index() >= 0:
+			pt_contained += track.pt()
+	return pt_contained / jet_truth.pt()
+
+
+def matched_pt_per_pair(jt, jt_lund, jc, jc_lund):
+	jt_prong1, jt_prong2 = jt_lund.harder(), jt_lund.softer()
+	jc_prong1, jc_prong2 = jc_lund.harder(), jc_lund.softer()
+	jc_groomed = jc_lund.pair()
+	retv = []
+	for jt_prong in [jt_prong2, jt_prong1]:
+		for jc_query in [jc_prong2, jc_prong1, jc_groomed, jc]:
+			retv.append(fjtools.matched_pt(jc_query, jt_prong))
+	retv.append(mc_fraction(jt, jc))
+	return retv
+
+
+def matched_pt_one_call(jt, jt_lund, jc, jc_lund):
+	return list(fjtools.prong_matched_pt(jt_lund.harder(), jt_lund.softer(), jc_lund.harder(), jc_lund.softer(),
+										 jc_lund.pair(), jc, jt))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmark fjtools prong matching on embedded jets', prog=os.path.basename(__file__))
+	pyconf.add_standard_pythia_args(parser)
+	parser.add_argument('--mult', help='thermal background multiplicity per unit eta', default=2000, type=int)
+	parser.add_argument('--mean-pt', help='thermal background mean pt', default=0.7, type=float)
+	parser.add_argument('--nrep', help='repetitions of the matching per jet pair', default=10, type=int)
+	args = parser.parse_args()
+
+	if args.nev < 10:
+		args.nev = 10
+
+	mycfg = ['PhaseSpace:pThatMin = 40']
+	pythia = pyconf.create_and_init_pythia_from_args(args, mycfg)
+	part_selection = [pythiafjext.kFinal, pythiafjext.kCharged]
+
+	max_eta = 0.9
+	jet_R0 = 0.4
+	jet_def = fj.JetDefinition(fj.antikt_algorithm, jet_R0)
+	jet_selector = fj.SelectorPtMin(20.0) & fj.SelectorAbsEtaMax(max_eta - jet_R0)
+	bg = fjtools.BoltzmannBackground(args.mean_pt, 0.15, 5.)
+
+	pairs = []
+	for iev in tqdm.tqdm(range(args.nev)):
+		if not pythia.next():
+			continue
+		parts = pythiafjext.vectorize_select(pythia, part_selection, 0, True)
+		jets_truth = fj.sorted_by_pt(jet_selector(jet_def(parts)))
+		if len(jets_truth) < 1:
+			continue
+
+		# Background tracks have negative user_index
+		bg_parts = bg.generate(int(args.mult * 2 * max_eta), max_eta, -100000)
+		full_event = fj.vectorPJ()
+		_tmp = [full_event.push_back(p) for p in bg_parts]
+		_tmp = [full_event.push_back(p) for p in parts]
+		cs_combined = fj.ClusterSequence(full_event, jet_def)
+		jets_combined = fj.sorted_by_pt(jet_selector(cs_combined.inclusive_jets()))
+
+		for jt in jets_truth:
+			jc = min(jets_combined, key=lambda j: j.delta_R(jt), default=None)
+			if jc is None or jc.delta_R(jt) > 0.6 * jet_R0:
+				continue
+			gshop_truth = fjcontrib.GroomerShop(jt, jet_R0, fj.cambridge_algorithm)
+			gshop_combined = fjcontrib.GroomerShop(jc, jet_R0, fj.cambridge_algorithm)
+			jt_lund = gshop_truth.soft_drop(0., 0.1, jet_R0)
+			jc_lund = gshop_combined.soft_drop(0., 0.1, jet_R0)
+			if not (jt_lund.pair().has_constituents() and jc_lund.pair().has_constituents()):
+				continue
+			# keep the cluster sequence and groomers alive
+			pairs.append((jt, jt_lund, jc, jc_lund, (cs_combined, gshop_truth, gshop_combined)))
+
+	print('number of embedded jet pairs: {}, mean combined jet multiplicity: {:.1f}'.format(
+		len(pairs), np.mean([len(p[2].constituents()) for p in pairs])))
+
+	results = {}
+	for name, f in [('8x matched_pt + python mc_fraction', matched_pt_per_pair),
+					('prong_matched_pt', matched_pt_one_call)]:
+		start = time.time()
+		for _ in range(args.nrep):
+			values = [f(jt, jt_lund, jc, jc_lund) for jt, jt_lund, jc, jc_lund, _cs in pairs]
+		duration = (time.time() - start) / (args.nrep * max(len(pairs), 1))
+		results[name] = np.array(values)
+		print('{:>40s}: {:.2f} us per jet pair'.format(name, duration * 1e6))
+
+	values = list(results.values())
+	print('max abs difference: {}'.format(np.max(np.abs(values[0] - values[1])) if len(pairs) else 0))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Benchmark of histogram filling in the event loop:
+# getattr(self, name).Fill(...) per entry vs buffered hist_registry handles (FillN / RUtil bulk fill),
+# and check that the bin contents are identical
+
+from __future__ import print_function
+
+import argparse
+import os
+import time
+import numpy as np
+from array import array
+
+import ROOT
+ROOT.gROOT.SetBatch(True)
+ROOT.TH1.AddDirectory(False)
+
+from pyjetty.alice_analysis.process.base import hist_registry
+
+
+class Owner(object):
+	pass
+
+
+def create_histograms(owner, suffix):
+	setattr(owner, 'hPt' + suffix, ROOT.TH1F('hPt' + suffix, 'hPt', 200, 0, 100))
+	setattr(owner, 'hZ' + suffix, ROOT.TH2F('hZ' + suffix, 'hZ', 200, 0, 200, 100, 0, 1))
+	setattr(owner, 'hResidual' + suffix, ROOT.TH3F('hResidual' + suffix, 'hResidual', 20, 0, 200, 100, 0, 1, 200, -2, 2))
+	nbins = array('i', [20, 20, 50, 50])
+	xmin = array('d', [0, 0, 0, 0])
+	xmax = array('d', [200, 200, 1, 1])
+	setattr(owner, 'hResponse' + suffix, ROOT.THnF('hResponse' + suffix, 'hResponse', 4, nbins, xmin, xmax))
+
+
+def fill_direct(owner, entries):
+	for x in entries:
+		getattr(owner, 'hPt_direct').Fill(x[0])
+		getattr(owner, 'hZ_direct').Fill(x[0], x[1])
+		getattr(owner, 'hResidual_direct').Fill(x[0], x[1], x[2], x[4])
+		getattr(owner, 'hResponse_direct').Fill(array('d', [x[0], x[3], x[1], x[2]]))
+
+
+def fill_registry(owner, entries, registry):
+	for x in entries:
+		registry['hPt_registry'].fill(x[0])
+		registry['hZ_registry'].fill(x[0], x[1])
+		registry['hResidual_registry'].fill(x[0], x[1], x[2], x[4])
+		registry['hResponse_registry'].fill_array([x[0], x[3], x[1], x[2]])
+	registry.flush()
+
+
+def max_difference(h1, h2):
+	n = h1.GetNbins() if isinstance(h1, ROOT.THnBase) else h1.GetNcells()
+	c1 = np.array([h1.GetBinContent(i) for i in range(n)])
+	c2 = np.array([h2.GetBinContent(i) for i in range(n)])
+	e1 = np.array([h1.GetBinError(i) for i in range(n)])
+	e2 = np.array([h2.GetBinError(i) for i in range(n)])
+	return max(np.max(np.abs(c1 - c2)), np.max(np.abs(e1 - e2)))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmark buffered histogram filling', prog=os.path.basename(__file__))
+	parser.add_argument('--nentries', help='number of entries per histogram', default=200000, type=int)
+	parser.add_argument('--flush-size', help='buffered entries per histogram', default=10000, type=int)
+	args = parser.parse_args()
+
+	rng = np.random.default_rng(1234)
+	entries = np.column_stack([rng.exponential(20., args.nentries), rng.uniform(0, 1, args.nentries),
+							   rng.normal(0, 0.5, args.nentries), rng.exponential(20., args.nentries),
+							   rng.uniform(0.5, 1.5, args.nentries)]).tolist()
+
+	owner = Owner()
+	create_histograms(owner, '_direct')
+	create_histograms(owner, '_registry')
+	registry = hist_registry.HistogramRegistry(owner=owner, flush_size=args.flush_size)
+
+	n_fills = 4 * args.nentries
+	for name, f in [('getattr(...).Fill', lambda: fill_direct(owner, entries)),
+					('hist_registry', lambda: fill_registry(owner, entries, registry))]:
+		start = time.time()
+		f()
+		duration = time.time() - start
+		print('{:>20s}: {:.3g} entries per second'.format(name, n_fills / duration))
+
+	for hname in ['hPt', 'hZ', 'hResidual', 'hResponse']:
+		print('{:>20s}: max abs difference {}'.format(hname, max_difference(getattr(owner, hname + '_direct'),
+																			   getattr(owner, hname + '_registry'))))
+
+
+if __name__ == '__main__':
+	main()
@@ -56,8 +56,6 @@ def main():
 		fjev.run_jet_finder_csaa(particles=parts, evid=e.get_header().n())
 		njets = len(fjev.inclusive_jets)
 		if njets > 0:
-			# print("njets = {} df:{}".format(njets, len(_jets_df)))
-			_jets_df = fjev.jets_df
 			# R_T analysis on charged tracks
 			df_charged = df.loc[df['pwflag'] != 0 ]
 			rtanalysis.process_event(df_charged, fjev.leading_pt_jet(), e.get_header().n())
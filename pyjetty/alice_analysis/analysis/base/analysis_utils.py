@@ -310,9 +310,16 @@ class AnalysisUtils(common_utils.CommonUtils):
 
   #----------------------------------------------------------------------
   # Check if re-binned response file exists -- create it if not (or if forced)
+  #   If a response cache is used, the existing file is ignored: the cache
+  #   decides whether to rebin, based on a hash of the rebinning inputs
   #----------------------------------------------------------------------
-  def check_rebin_response(self, output_dir, force_rebin_response):
-    
+  def check_rebin_response(self, output_dir, force_rebin_response, response_cache=None):
+
+    if response_cache:
+      if force_rebin_response:
+        print('Response cache in {} -- force re-create...'.format(response_cache.cache_dir))
+      return force_rebin_response
+
     rebin_response = True
     response_path = os.path.join(output_dir, 'response.root')
     if os.path.exists(response_path):
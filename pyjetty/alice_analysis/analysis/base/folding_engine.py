@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+  Batched folding of histograms with RooUnfold responses.
+
+  RooUnfoldResponse.ApplyToTruth builds the truth vector, multiplies it by the
+  (measured x truth) response matrix and fills a clone of the measured histogram.
+  Here the response matrix of each response is extracted once as a dense numpy
+  array, and all histograms to fold with it (e.g. scale variations) are folded
+  in a single matrix product. Histogram contents are read and written through
+  the GetArray() buffers, with the same bin ordering as RooUnfold (x fastest).
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import ROOT
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+
+# numpy dtype of the GetArray() buffer for each TArray type
+array_types = [('TArrayD', np.float64), ('TArrayF', np.float32), ('TArrayI', np.int32),
+               ('TArrayS', np.int16), ('TArrayC', np.int8)]
+
+################################################################
+class FoldingEngine(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, **kwargs):
+    super(FoldingEngine, self).__init__(**kwargs)
+
+    # Dense response matrices, keyed by (response name, response object)
+    self.matrices = {}
+
+  #---------------------------------------------------------------
+  # Return the normalized response matrix (n_measured x n_truth) of a RooUnfoldResponse
+  #---------------------------------------------------------------
+  def response_matrix(self, response):
+
+    key = (response.GetName(), id(response))
+    if key not in self.matrices:
+      m = response.Mresponse()
+      n_rows = m.GetNrows()
+      n_cols = m.GetNcols()
+      buffer = m.GetMatrixArray()
+      buffer.reshape((n_rows*n_cols,))
+      self.matrices[key] = np.array(np.ndarray((n_rows*n_cols,), dtype=np.float64, buffer=buffer)).reshape(n_rows, n_cols)
+    return self.matrices[key]
+
+  #---------------------------------------------------------------
+  # Fold the histograms hists with response, and return the folded histograms
+  # (clones of the measured histogram of the response) with the given names.
+  # Equivalent to response.ApplyToTruth(h) followed by SetNameTitle(name, name).
+  #---------------------------------------------------------------
+  def fold(self, response, hists, names):
+
+    if len(hists) == 0:
+      return []
+
+    matrix = self.response_matrix(response)
+    overflow = response.UseOverflowStatus()
+
+    truth = np.column_stack([self.hist_to_vector(h, overflow) for h in hists])
+    if truth.shape[0] != matrix.shape[1]:
+      raise ValueError('FoldingEngine: {} has {} bins, response {} has {} truth bins'.format(
+        hists[0].GetName(), truth.shape[0], response.GetName(), matrix.shape[1]))
+    folded = matrix.dot(truth)
+
+    h_measured = response.Hmeasured()
+    result = []
+    for i, name in enumerate(names):
+      h = h_measured.Clone(name)
+      h.SetTitle(name)
+      h.Reset()
+      self.vector_to_hist(folded[:, i], h, overflow)
+      h.SetEntries(folded.shape[0])
+      result.append(h)
+    return result
+
+  #---------------------------------------------------------------
+  # Multiply each histogram of hists by h_factor, in place.
+  # Equivalent to h.Multiply(h_factor) for each h (contents and errors).
+  #---------------------------------------------------------------
+  def multiply(self, hists, h_factor):
+
+    c1, s1 = self.hist_arrays(h_factor)
+    c1 = c1.astype(np.float64)
+    if s1 is None:
+      s1 = np.abs(c1)
+
+    for h in hists:
+      if h.GetSumw2N() == 0 and h_factor.GetSumw2N() != 0:
+        h.Sumw2()
+      content, sumw2 = self.hist_arrays(h)
+      c0 = content.astype(np.float64)
+      h.SetMinimum()
+      h.SetMaximum()
+      if sumw2 is not None:
+        sumw2[:] = sumw2 * c1 * c1 + s1 * c0 * c0
+      content[:] = c0 * c1
+      h.ResetStats()
+
+  #---------------------------------------------------------------
+  # Update the in-range bins of the (1D/2D/3D) histograms h_min and h_max with
+  # the minimum and maximum of their contents and the contents of h
+  #---------------------------------------------------------------
+  def update_envelope(self, h, h_min, h_max):
+
+    content = self.cells(h, self.hist_arrays(h)[0], False)
+    content_min = self.cells(h_min, self.hist_arrays(h_min)[0], False)
+    content_max = self.cells(h_max, self.hist_arrays(h_max)[0], False)
+    np.minimum(content_min, content, out=content_min)
+    np.maximum(content_max, content, out=content_max)
+
+  #---------------------------------------------------------------
+  # Return the histogram as a vector, in the bin order of RooUnfold (x fastest)
+  #---------------------------------------------------------------
+  def hist_to_vector(self, h, overflow=False):
+
+    content = self.hist_arrays(h)[0].astype(np.float64)
+    return self.cells(h, content, overflow).ravel()
+
+  #---------------------------------------------------------------
+  # Set the histogram contents from a vector in the bin order of RooUnfold
+  #---------------------------------------------------------------
+  def vector_to_hist(self, v, h, overflow=False):
+
+    content = self.hist_arrays(h)[0]
+    cells = self.cells(h, content, overflow)
+    cells[...] = v.reshape(cells.shape)
+
+  #---------------------------------------------------------------
+  # Return a view of the (in-range, or all if overflow) cells of a 1D/2D/3D histogram,
+  # with axes ordered (z, y, x)
+  #---------------------------------------------------------------
+  def cells(self, h, content, overflow):
+
+    shape = [h.GetNbinsX() + 2]
+    if h.GetDimension() > 1:
+      shape.insert(0, h.GetNbinsY() + 2)
+    if h.GetDimension() > 2:
+      shape.insert(0, h.GetNbinsZ() + 2)
+    content = content.reshape(shape)
+    if overflow:
+      return content
+    return content[tuple([slice(1, -1)] * len(shape))]
+
+  #---------------------------------------------------------------
+  # Return (content, sumw2) numpy views of the GetArray() buffers of a TH1/TH2/TH3
+  # sumw2 is None if the histogram has no Sumw2 structure
+  #---------------------------------------------------------------
+  def hist_arrays(self, h):
+
+    n_cells = h.GetNcells()
+    content = None
+    for array_type, dtype in array_types:
+      if h.InheritsFrom(getattr(ROOT, array_type).Class()):
+        buffer = h.GetArray()
+        buffer.reshape((n_cells,))
+        content = np.ndarray((n_cells,), dtype=dtype, buffer=buffer)
+        break
+    if content is None:
+      raise TypeError('FoldingEngine: unsupported array type for {}'.format(h.GetName()))
+
+    sumw2 = None
+    if h.GetSumw2N() > 0:
+      buffer = h.GetSumw2().GetArray()
+      buffer.reshape((n_cells,))
+      sumw2 = np.ndarray((n_cells,), dtype=np.float64, buffer=buffer)
+
+    return content, sumw2
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+"""
+  HEPData submissions built from final results in array form.
+
+  When the systematics are computed, each final result (one per jet R, subconfiguration
+  and pt bin) is stored in ResultTables: bin edges, values, statistical uncertainties,
+  and the percentage systematic uncertainty of each source. These are kept in a json file,
+  so that the submission can be rebuilt (e.g. after changing a table description, or
+  recomputing one systematic) without reading histograms or rerunning the systematics.
+
+  HEPDataWriter builds all tables of the submission from these arrays in one pass, writes
+  the submission files, and validates them offline against the HEPData schemas shipped
+  with hepdata_validator (no remote schemas are loaded).
+"""
+
+from __future__ import print_function
+
+# General
+import os
+import json
+
+import numpy as np
+import hepdata_lib
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+
+################################################################
+class ResultTables(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor: results stored in the json file path (read if it exists)
+  #---------------------------------------------------------------
+  def __init__(self, path='', **kwargs):
+    super(ResultTables, self).__init__(**kwargs)
+    self.path = path
+    self.results = {}
+    if self.path and os.path.exists(self.path):
+      with open(self.path, 'r') as f:
+        self.results = json.load(f)
+
+  #---------------------------------------------------------------
+  # Return the key of a result
+  #---------------------------------------------------------------
+  def key(self, jetR, obs_label, min_pt, max_pt):
+
+    return 'R{}_{}_{}-{}'.format(jetR, obs_label, min_pt, max_pt)
+
+  #---------------------------------------------------------------
+  # Add (or replace) a result
+  #   x_edges: bin edges; y, stat: values and statistical uncertainties of the bins
+  #   systematics: {source: percentage uncertainties of the bins}, in the order of the table
+  #---------------------------------------------------------------
+  def add(self, key, x_edges, y, stat, systematics):
+
+    self.results[key] = {'x_edges': np.asarray(x_edges, dtype=np.float64).tolist(),
+                         'y': np.asarray(y, dtype=np.float64).tolist(),
+                         'stat': np.asarray(stat, dtype=np.float64).tolist(),
+                         'systematics': {source: np.asarray(values, dtype=np.float64).tolist()
+                                         for source, values in systematics.items()}}
+
+  #---------------------------------------------------------------
+  # Return a result, or None
+  #---------------------------------------------------------------
+  def get(self, key):
+
+    return self.results.get(key)
+
+  #---------------------------------------------------------------
+  # Write results via temporary file + rename
+  #---------------------------------------------------------------
+  def write(self):
+
+    tmp = '{}.tmp{}'.format(self.path, os.getpid())
+    with open(tmp, 'w') as f:
+      json.dump(self.results, f)
+    os.replace(tmp, self.path)
+
+################################################################
+class HEPDataWriter(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, output_dir='.', n_significant_digits=3, **kwargs):
+    super(HEPDataWriter, self).__init__(**kwargs)
+    self.output_dir = output_dir
+    self.n_significant_digits = n_significant_digits
+    self.submission = hepdata_lib.Submission()
+
+  #---------------------------------------------------------------
+  # Add the variables of a result (see ResultTables) to table, and the table
+  # to the submission
+  #   qualifiers: list of (name, value[, units]) of the dependent variable
+  #   Systematic uncertainties are named sys,<source>, with absolute values
+  #   (percentage * value / 100)
+  #---------------------------------------------------------------
+  def add_table(self, table, result, x_label, y_label, qualifiers=[]):
+
+    x_edges = result['x_edges']
+    y_values = np.array(result['y'])
+
+    x = hepdata_lib.Variable(x_label, is_independent=True, is_binned=True, units='')
+    x.digits = self.n_significant_digits
+    x.values = list(zip(x_edges[:-1], x_edges[1:]))
+
+    y = hepdata_lib.Variable(y_label, is_independent=False, is_binned=False, units='')
+    y.digits = self.n_significant_digits
+    y.values = result['y']
+    for qualifier in qualifiers:
+      y.add_qualifier(*qualifier)
+
+    stat = hepdata_lib.Uncertainty('stat', is_symmetric=True)
+    stat.values = result['stat']
+
+    table.add_variable(x)
+    table.add_variable(y)
+    y.add_uncertainty(stat)
+
+    for source, percentages in result['systematics'].items():
+      sys = hepdata_lib.Uncertainty('sys,{}'.format(source), is_symmetric=True)
+      sys.values = (np.array(percentages[:len(y_values)]) * y_values / 100.).tolist()
+      y.add_uncertainty(sys)
+
+    self.submission.add_table(table)
+
+  #---------------------------------------------------------------
+  # Write the submission files, and validate them (if validate)
+  #---------------------------------------------------------------
+  def write(self, validate=True):
+
+    self.submission.create_files(self.output_dir, validate=False, remove_old=True)
+    if validate:
+      self.validate()
+
+  #---------------------------------------------------------------
+  # Validate the submission files against the HEPData schemas, offline;
+  # return whether they are valid (None if hepdata_validator is not installed)
+  #---------------------------------------------------------------
+  def validate(self):
+
+    try:
+      from hepdata_validator.full_submission_validator import FullSubmissionValidator
+    except ImportError:
+      print('HEPDataWriter: hepdata_validator not installed, submission not validated')
+      return None
+
+    validator = FullSubmissionValidator(autoload_remote_schemas=False)
+    is_valid = validator.validate(directory=self.output_dir)
+    if is_valid:
+      print('HEPDataWriter: {} tables written to {} and validated'.format(
+        len(self.submission.tables), self.output_dir))
+    else:
+      print('HEPDataWriter: submission in {} is not valid:'.format(self.output_dir))
+      for filename in validator.get_messages():
+        validator.print_errors(filename)
+    return is_valid
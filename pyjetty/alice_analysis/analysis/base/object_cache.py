@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""
+  Process-wide cache of open ROOT files, objects read from them, and projections.
+
+  The analysis and plotting stages repeatedly open the same files, re-read the
+  same TH2/THn objects, and project them again (SetRangeUser + ProjectionY /
+  Projection) for each pt bin, overlay and plot. Here:
+    - files are kept open (up to max_open_files, least recently used are closed)
+    - objects are read once per (file, modification time, name)
+    - projections are cached by (source object, projected axes, axis ranges, rebinning)
+  Cached objects are evicted in least-recently-used order when their estimated
+  memory exceeds max_bytes.
+
+  Objects returned by get() are the cached objects, shared by all callers: they
+  should not be modified, and axis ranges should be passed to projection() rather
+  than set on them. Projections are returned as clones, which the caller can modify
+  freely. Projections of objects which are modified in place after having been
+  projected must be dropped with invalidate().
+"""
+
+from __future__ import print_function
+
+# General
+import os
+import collections
+from array import array
+
+import ROOT
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+
+# Bytes per bin of the content array of each histogram type
+bin_sizes = [('TArrayD', 8), ('TArrayF', 4), ('TArrayI', 4), ('TArrayS', 2), ('TArrayC', 1)]
+
+################################################################
+class ObjectCache(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, max_bytes=2e9, max_open_files=32, **kwargs):
+    super(ObjectCache, self).__init__(**kwargs)
+    self.max_bytes = max_bytes
+    self.max_open_files = max_open_files
+
+    # path -> (modification time, TFile), in LRU order
+    self.files = collections.OrderedDict()
+
+    # key -> (object, source object, estimated bytes), in LRU order
+    self.objects = collections.OrderedDict()
+    self.n_bytes = 0
+
+    self.n_hits = 0
+    self.n_misses = 0
+    self.n_evicted = 0
+    self.n_projections = 0
+
+  #---------------------------------------------------------------
+  # Return open TFile for path (reopened if the file was modified)
+  #---------------------------------------------------------------
+  def get_file(self, path):
+
+    path = os.path.realpath(path)
+    mtime = os.stat(path).st_mtime_ns
+    if path in self.files:
+      file_mtime, f = self.files[path]
+      if file_mtime == mtime:
+        self.files.move_to_end(path)
+        return f
+      self.close_file(path)
+
+    f = ROOT.TFile(path, 'READ')
+    if not f or f.IsZombie():
+      raise IOError('ObjectCache: cannot open {}'.format(path))
+    self.files[path] = (mtime, f)
+    while len(self.files) > self.max_open_files:
+      self.close_file(next(iter(self.files)))
+    return f
+
+  #---------------------------------------------------------------
+  # Close file (objects read from it stay in the cache)
+  #---------------------------------------------------------------
+  def close_file(self, path):
+
+    mtime, f = self.files.pop(path)
+    f.Close()
+
+  #---------------------------------------------------------------
+  # Forget the open files, so that they are reopened on next use
+  # (e.g. in a forked process, which shares the file offsets with its parent)
+  #---------------------------------------------------------------
+  def reset_files(self):
+
+    self.files = collections.OrderedDict()
+
+  #---------------------------------------------------------------
+  # Return object name from file path (read once, and not to be modified)
+  #---------------------------------------------------------------
+  def get(self, path, name):
+
+    path = os.path.realpath(path)
+    key = ('file', path, os.stat(path).st_mtime_ns, name)
+    obj = self.lookup(key)
+    if obj is not None:
+      return obj
+
+    f = self.get_file(path)
+    obj = f.Get(name)
+    if not obj:
+      raise AttributeError('{} not found in {}'.format(name, path))
+    if isinstance(obj, ROOT.TH1):
+      obj.SetDirectory(0)
+    self.insert(key, obj, None)
+    return obj
+
+  #---------------------------------------------------------------
+  # Return a clone (named name) of the projection of h, which is a histogram
+  # or a (path, name) tuple of a histogram in a file
+  #   axes: 'x' or 'y' for TH2 (ProjectionX/Y), option of Project3D for TH3 (e.g. 'z'),
+  #         axis index or tuple of axis indices for THnBase (as THnBase::Projection)
+  #   ranges: {axis index: (min, max)}, set with SetRangeUser for the projection only
+  #           (the previous ranges of these axes are restored afterwards)
+  #   rebin: bin edges (or number of bins to merge) of the projection
+  # Ranges already set on the other axes of h are applied as well.
+  #---------------------------------------------------------------
+  def projection(self, h, axes, ranges=None, name=None, rebin=None):
+
+    if isinstance(h, tuple):
+      h = self.get(*h)
+    if isinstance(axes, int):
+      axes = (axes,)
+    elif isinstance(axes, list):
+      axes = tuple(axes)
+
+    axis_list = self.axes(h)
+    ranges = ranges if ranges else {}
+    previous_ranges = {}
+    for i, (range_min, range_max) in ranges.items():
+      previous_ranges[i] = self.axis_range(axis_list[i])
+      axis_list[i].SetRangeUser(range_min, range_max)
+    axis_ranges = tuple([self.axis_range(axis) for axis in axis_list])
+
+    source_key = ('object', id(h), h.GetName(), self.fingerprint(h))
+    key = (source_key, axes, axis_ranges)
+    h_proj = self.lookup(key)
+    if h_proj is None:
+      h_proj = self.project(h, axes)
+      self.n_projections += 1
+      self.insert(key, h_proj, h)
+
+    for i, (first, last, is_set) in previous_ranges.items():
+      if is_set:
+        axis_list[i].SetRange(first, last)
+      else:
+        axis_list[i].SetRange(0, 0)
+
+    if rebin is not None:
+      rebin_key = tuple(rebin) if hasattr(rebin, '__len__') else rebin
+      key_rebin = (source_key, axes, axis_ranges, rebin_key)
+      h_rebin = self.lookup(key_rebin)
+      if h_rebin is None:
+        h_rebin = self.rebin(h_proj, rebin)
+        self.insert(key_rebin, h_rebin, h)
+      h_proj = h_rebin
+
+    h_clone = h_proj.Clone(name if name else h_proj.GetName())
+    h_clone.SetDirectory(0)
+    return h_clone
+
+  #---------------------------------------------------------------
+  # Drop all cached projections of h
+  #---------------------------------------------------------------
+  def invalidate(self, h):
+
+    for key in [key for key, entry in self.objects.items() if entry[1] is h]:
+      self.remove(key)
+
+  #---------------------------------------------------------------
+  # Drop all cached objects and close all files
+  #---------------------------------------------------------------
+  def clear(self):
+
+    for key in list(self.objects.keys()):
+      self.remove(key)
+    for path in list(self.files.keys()):
+      self.close_file(path)
+
+  #---------------------------------------------------------------
+  # Print cache statistics
+  #---------------------------------------------------------------
+  def print_stats(self):
+
+    print('ObjectCache: {} hits, {} misses, {} projections, {} evicted; {} objects ({:.1f} MB), {} open files'.format(
+      self.n_hits, self.n_misses, self.n_projections, self.n_evicted,
+      len(self.objects), self.n_bytes / 1e6, len(self.files)))
+
+  #---------------------------------------------------------------
+  # Return cached object for key (and mark it as recently used), or None
+  #---------------------------------------------------------------
+  def lookup(self, key):
+
+    entry = self.objects.get(key)
+    if entry is None:
+      self.n_misses += 1
+      return None
+    self.n_hits += 1
+    self.objects.move_to_end(key)
+    return entry[0]
+
+  #---------------------------------------------------------------
+  # Insert object in the cache, and evict least recently used objects if needed
+  #   source is the projected object, kept alive so that its id stays unique
+  #---------------------------------------------------------------
+  def insert(self, key, obj, source):
+
+    n_bytes = self.size(obj)
+    self.objects[key] = (obj, source, n_bytes)
+    self.n_bytes += n_bytes
+    while self.n_bytes > self.max_bytes and len(self.objects) > 1:
+      self.remove(next(iter(self.objects)))
+      self.n_evicted += 1
+
+  #---------------------------------------------------------------
+  # Remove object from the cache
+  #---------------------------------------------------------------
+  def remove(self, key):
+
+    obj, source, n_bytes = self.objects.pop(key)
+    self.n_bytes -= n_bytes
+
+  #---------------------------------------------------------------
+  # Estimated memory of a histogram (content and sumw2 arrays), in bytes
+  #---------------------------------------------------------------
+  def size(self, obj):
+
+    if isinstance(obj, ROOT.THnBase):
+      n_dim = obj.GetNdimensions()
+      n_bins = obj.GetNbins()
+      # content, sumw2 and (for THnSparse) the compacted bin coordinates
+      return n_bins * (8 + (8 if obj.GetCalculateErrors() else 0) +
+                       (n_dim * 4 if isinstance(obj, ROOT.THnSparse) else 0))
+
+    if isinstance(obj, ROOT.TH1):
+      bin_size = 8
+      for array_type, size in bin_sizes:
+        if obj.InheritsFrom(getattr(ROOT, array_type).Class()):
+          bin_size = size
+          break
+      n_cells = obj.GetNcells()
+      return n_cells * (bin_size + (8 if obj.GetSumw2N() > 0 else 0))
+
+    return 1024
+
+  #---------------------------------------------------------------
+  # Return list of the axes of a histogram
+  #---------------------------------------------------------------
+  def axes(self, h):
+
+    if isinstance(h, ROOT.THnBase):
+      return [h.GetAxis(i) for i in range(h.GetNdimensions())]
+    axis_list = [h.GetXaxis()]
+    if h.GetDimension() > 1:
+      axis_list.append(h.GetYaxis())
+    if h.GetDimension() > 2:
+      axis_list.append(h.GetZaxis())
+    return axis_list
+
+  #---------------------------------------------------------------
+  # Return (first bin, last bin, whether a range is set) of an axis
+  #---------------------------------------------------------------
+  def axis_range(self, axis):
+    return (axis.GetFirst(), axis.GetLast(), axis.TestBit(ROOT.TAxis.kAxisRange))
+
+  #---------------------------------------------------------------
+  # Quantities which change when a histogram is filled
+  #---------------------------------------------------------------
+  def fingerprint(self, h):
+
+    if isinstance(h, ROOT.THnBase):
+      return (h.GetEntries(), h.GetSumw())
+    return (h.GetEntries(),)
+
+  #---------------------------------------------------------------
+  # Project h, detached from any directory
+  #---------------------------------------------------------------
+  def project(self, h, axes):
+
+    # Unique name: ROOT reuses (and resets) existing histograms with the projection name
+    name = '{}_cache{}'.format(h.GetName(), self.n_projections)
+    if isinstance(h, ROOT.THnBase):
+      h_proj = h.Projection(*axes)
+      h_proj.SetName(name)
+    elif isinstance(h, ROOT.TH3):
+      h_proj = h.Project3D(axes)
+      h_proj.SetName(name)
+    elif axes == 'x':
+      h_proj = h.ProjectionX(name)
+    elif axes == 'y':
+      h_proj = h.ProjectionY(name)
+    else:
+      raise ValueError('ObjectCache: projection {} of {} not implemented'.format(axes, h.GetName()))
+    h_proj.SetDirectory(0)
+    return h_proj
+
+  #---------------------------------------------------------------
+  # Return rebinned clone of a 1D histogram
+  #---------------------------------------------------------------
+  def rebin(self, h, rebin):
+
+    name = '{}_rebin'.format(h.GetName())
+    if hasattr(rebin, '__len__'):
+      h_rebin = h.Rebin(len(rebin)-1, name, array('d', rebin))
+    else:
+      h_rebin = h.Rebin(rebin, name)
+    h_rebin.SetDirectory(0)
+    return h_rebin
+
+# Process-wide cache, shared by all analysis and plotting classes
+object_cache = None
+
+#---------------------------------------------------------------
+# Return the process-wide ObjectCache (created on first use)
+#---------------------------------------------------------------
+def get_object_cache(**kwargs):
+
+  global object_cache
+  if object_cache is None:
+    object_cache = ObjectCache(**kwargs)
+  return object_cache
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+"""
+  Run plotting functions as independent tasks in a process pool.
+
+  Each task is a function call (typically a bound method of a plotting class, which
+  sets its own state and saves its canvases), together with the files it reads.
+  Tasks are run in forked worker processes, so that each worker holds its own ROOT
+  state (gStyle, canvases, open files); init functions (e.g. style setup, reopening
+  files) are called once in each worker.
+
+  A task is skipped if its content hash is unchanged since its last successful run
+  (and its outputs exist). The hash covers the task name, arguments and parameters,
+  the content of its input files, and the source file of its function (other sources
+  used by the task, e.g. plotting utilities, are given as inputs). Outputs can be files,
+  or directories: the files written in an output directory during a task are recorded,
+  and the task is run again if one of them is deleted. Hashes, recorded outputs and
+  render times are stored in plot_tasks.json in the state directory.
+"""
+
+from __future__ import print_function
+
+# General
+import os
+import sys
+import json
+import time
+import inspect
+import hashlib
+import traceback
+import multiprocessing
+
+import yaml
+import ROOT
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import object_cache
+
+# Tasks of the running PlotTaskRunner, inherited by the forked workers
+tasks_running = []
+
+################################################################
+class PlotTask(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #   function is called as function(*args, **kwargs)
+  #   inputs: files read by the task; outputs: files (or directories) written by the task
+  #   params: other settings of the task (e.g. its config section), only used in its hash
+  #---------------------------------------------------------------
+  def __init__(self, name='', function=None, args=(), kwargs=None, inputs=[], outputs=[],
+               params=None, **kw):
+    super(PlotTask, self).__init__(**kw)
+    self.name = name
+    self.function = function
+    self.args = tuple(args)
+    self.kwargs = kwargs if kwargs else {}
+    self.inputs = list(inputs)
+    self.outputs = list(outputs)
+    self.params = params
+
+################################################################
+class PlotTaskRunner(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #   n_workers: number of worker processes (0: number of cores)
+  #   init_functions: called once in each worker before running tasks
+  #   force: run all tasks, also if unchanged
+  #---------------------------------------------------------------
+  def __init__(self, state_dir='.', n_workers=0, init_functions=[], force=False, **kwargs):
+    super(PlotTaskRunner, self).__init__(**kwargs)
+    self.state_dir = state_dir
+    if not os.path.exists(self.state_dir):
+      os.makedirs(self.state_dir)
+    self.n_workers = n_workers if n_workers > 0 else multiprocessing.cpu_count()
+    self.init_functions = list(init_functions)
+    self.force = force
+    self.tasks = []
+
+    self.state_path = os.path.join(self.state_dir, 'plot_tasks.json')
+    self.state = {'file_hashes': {}, 'tasks': {}, 'times': {}, 'outputs': {}}
+    if os.path.exists(self.state_path):
+      with open(self.state_path, 'r') as f:
+        self.state.update(json.load(f))
+
+  #---------------------------------------------------------------
+  # Add a task (see PlotTask)
+  #---------------------------------------------------------------
+  def add(self, name, function, args=(), kwargs=None, inputs=[], outputs=[], params=None):
+
+    if name in [task.name for task in self.tasks]:
+      raise ValueError('PlotTaskRunner: task {} already exists'.format(name))
+    self.tasks.append(PlotTask(name=name, function=function, args=args, kwargs=kwargs,
+                               inputs=inputs, outputs=outputs, params=params))
+
+  #---------------------------------------------------------------
+  # Run all changed tasks, print a summary of render times, and return
+  # the names of the failed tasks
+  #---------------------------------------------------------------
+  def run(self):
+
+    global tasks_running
+
+    start = time.time()
+    keys = {}
+    tasks_to_run = []
+    n_skipped = 0
+    for task in self.tasks:
+      keys[task.name] = self.task_key(task)
+      unchanged = (self.state['tasks'].get(task.name) == keys[task.name])
+      if unchanged and not self.force and self.outputs_exist(task):
+        n_skipped += 1
+      else:
+        tasks_to_run.append(task)
+
+    # Start the longest tasks (from the previous runs) first
+    tasks_to_run.sort(key=lambda task: -self.state['times'].get(task.name, 0.))
+    print('Plot tasks: {} to render, {} unchanged, in {} workers'.format(
+      len(tasks_to_run), n_skipped, min(self.n_workers, max(len(tasks_to_run), 1))))
+
+    tasks_running = tasks_to_run
+    results = []
+    if self.n_workers == 1 or len(tasks_to_run) < 2:
+      for i in range(len(tasks_to_run)):
+        results.append(run_task(i))
+    else:
+      context = multiprocessing.get_context('fork')
+      pool = context.Pool(min(self.n_workers, len(tasks_to_run)), initializer=init_worker,
+                          initargs=(self.init_functions,))
+      for result in pool.imap_unordered(run_task, range(len(tasks_to_run))):
+        results.append(result)
+      pool.close()
+      pool.join()
+    tasks_running = []
+
+    failed = []
+    for i, duration, error, written in results:
+      task = tasks_to_run[i]
+      if error:
+        failed.append(task.name)
+        self.state['tasks'].pop(task.name, None)
+        print('Plot task {} failed:\n{}'.format(task.name, error))
+      else:
+        self.state['tasks'][task.name] = keys[task.name]
+        self.state['times'][task.name] = duration
+        self.state['outputs'][task.name] = written
+    self.write_state()
+
+    self.print_summary(results, tasks_to_run, n_skipped, failed, time.time() - start)
+    return failed
+
+  #---------------------------------------------------------------
+  # Print render time of each task, and totals
+  #---------------------------------------------------------------
+  def print_summary(self, results, tasks, n_skipped, failed, wall_time):
+
+    print('Plot task render times:')
+    for i, duration, error, written in sorted(results, key=lambda result: -result[1]):
+      print('  {:8.1f} s  {}{}'.format(duration, tasks[i].name, '  (failed)' if error else ''))
+    total = sum([result[1] for result in results])
+    print('Plot tasks: {} rendered, {} unchanged, {} failed; {:.1f} s render time in {:.1f} s wall time'.format(
+      len(results) - len(failed), n_skipped, len(failed), total, wall_time))
+
+  #---------------------------------------------------------------
+  # Return whether the outputs of a task exist: output files, and the files
+  # recorded in output directories at its last run
+  #---------------------------------------------------------------
+  def outputs_exist(self, task):
+
+    if not all([os.path.exists(path) for path in task.outputs]):
+      return False
+    return all([os.path.exists(path) for path in self.state['outputs'].get(task.name, [])])
+
+  #---------------------------------------------------------------
+  # Content hash of a task
+  #---------------------------------------------------------------
+  def task_key(self, task):
+
+    function = task.function
+    source = None
+    try:
+      source = inspect.getsourcefile(function)
+    except TypeError:
+      pass
+    inputs = {'name': task.name,
+              'function': getattr(function, '__qualname__', repr(function)),
+              'args': repr(task.args),
+              'kwargs': repr(sorted(task.kwargs.items())),
+              'params': repr(task.params),
+              'inputs': [(path, self.file_hash(path)) for path in task.inputs],
+              'source': self.file_hash(source) if source else None}
+    serialized = json.dumps(inputs, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+  #---------------------------------------------------------------
+  # Return sha256 of the content of a file (memoized on path, size, mtime),
+  # or None if the file does not exist
+  #---------------------------------------------------------------
+  def file_hash(self, path):
+
+    if not os.path.exists(path):
+      return None
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    index_key = '{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns)
+    if index_key in self.state['file_hashes']:
+      return self.state['file_hashes'][index_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 24), b''):
+        sha.update(block)
+    digest = sha.hexdigest()
+    self.state['file_hashes'][index_key] = digest
+    return digest
+
+  #---------------------------------------------------------------
+  # Write state via temporary file + rename
+  #---------------------------------------------------------------
+  def write_state(self):
+
+    tmp = '{}.tmp{}'.format(self.state_path, os.getpid())
+    with open(tmp, 'w') as f:
+      json.dump(self.state, f)
+    os.replace(tmp, self.state_path)
+
+#---------------------------------------------------------------
+# Initialize a worker process
+#---------------------------------------------------------------
+def init_worker(init_functions):
+
+  ROOT.gROOT.SetBatch(True)
+
+  # Files opened by the parent process share their offsets with it: reopen them
+  if object_cache.object_cache is not None:
+    object_cache.object_cache.reset_files()
+
+  for function in init_functions:
+    function()
+
+#---------------------------------------------------------------
+# Run task i of tasks_running, and return (i, render time, error or None,
+# files written in its output directories)
+#---------------------------------------------------------------
+def run_task(i):
+
+  task = tasks_running[i]
+  start = time.time()
+  error = None
+  try:
+    task.function(*task.args, **task.kwargs)
+  except Exception:
+    error = traceback.format_exc()
+  sys.stdout.flush()
+  duration = time.time() - start
+  return (i, duration, error, written_files(task.outputs, start))
+
+#---------------------------------------------------------------
+# Return the files in the directories of outputs modified since start
+# (with a margin for the time resolution of the file system).
+# Files written at the same time by another task in the same directory are
+# also included, which can only cause an extra rerun.
+#---------------------------------------------------------------
+def written_files(outputs, start):
+
+  files = []
+  for path in outputs:
+    if not os.path.isdir(path):
+      continue
+    for dirpath, dirnames, filenames in os.walk(path):
+      for filename in filenames:
+        file_path = os.path.join(dirpath, filename)
+        if os.path.getmtime(file_path) >= start - 2.:
+          files.append(file_path)
+  return sorted(files)
+
+#---------------------------------------------------------------
+# Return the existing files named in a (yaml) config section, recursively;
+# yaml files are followed, for the files named in them
+#---------------------------------------------------------------
+def config_input_files(config, files=None):
+
+  if files is None:
+    files = []
+  if isinstance(config, dict):
+    for value in config.values():
+      config_input_files(value, files)
+  elif isinstance(config, list):
+    for value in config:
+      config_input_files(value, files)
+  elif isinstance(config, str) and os.path.isfile(config) and config not in files:
+    files.append(config)
+    if config.endswith('.yaml'):
+      with open(config, 'r') as stream:
+        config_input_files(yaml.safe_load(stream), files)
+  return files
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+  Content-addressed cache of rebinned response files.
+
+  A rebinned response.root is fully determined by the input THn file and the
+  rebinning settings (binnings, prior variation, move_underflow, use_miss_fake, ...).
+  We hash these inputs into a key, and store one response file per key in a
+  common cache directory, so that systematics and analyses sharing identical
+  rebinning inputs reuse a single rebinned artifact across re-runs.
+"""
+
+from __future__ import print_function
+
+# General
+import os
+import json
+import shutil
+import hashlib
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+
+################################################################
+class ResponseCache(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, cache_dir='', **kwargs):
+    super(ResponseCache, self).__init__(**kwargs)
+    self.cache_dir = cache_dir
+    if not os.path.exists(self.cache_dir):
+      os.makedirs(self.cache_dir)
+
+    # Index of file content hashes, keyed by (path, size, mtime), so that
+    # large input files are only hashed once
+    self.file_hash_index_path = os.path.join(self.cache_dir, 'file_hashes.json')
+    self.file_hash_index = {}
+    if os.path.exists(self.file_hash_index_path):
+      with open(self.file_hash_index_path, 'r') as f:
+        self.file_hash_index = json.load(f)
+
+  #---------------------------------------------------------------
+  # Return sha256 of the content of a file (memoized on path, size, mtime)
+  #---------------------------------------------------------------
+  def file_hash(self, path):
+
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    index_key = '{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns)
+    if index_key in self.file_hash_index:
+      return self.file_hash_index[index_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 24), b''):
+        sha.update(block)
+    digest = sha.hexdigest()
+
+    self.file_hash_index[index_key] = digest
+    self.write_atomic_json(self.file_hash_index_path, self.file_hash_index)
+    return digest
+
+  #---------------------------------------------------------------
+  # Compute cache key from input file(s) and a dict of rebinning settings
+  #   Binning arrays (array('d'), np.array, list) are converted to lists
+  #---------------------------------------------------------------
+  def key(self, input_files, settings):
+
+    inputs = {'files': [self.file_hash(path) for path in input_files],
+              'settings': settings}
+    serialized = json.dumps(inputs, sort_keys=True, default=lambda x: [float(v) for v in x])
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+  #---------------------------------------------------------------
+  # Path to the cached response file for a given key
+  #---------------------------------------------------------------
+  def path(self, key):
+    return os.path.join(self.cache_dir, 'response_{}.root'.format(key))
+
+  #---------------------------------------------------------------
+  # If key is cached, copy the response to response_file_name and return True
+  #---------------------------------------------------------------
+  def fetch(self, key, response_file_name):
+
+    cached_path = self.path(key)
+    if not os.path.exists(cached_path):
+      print('Response cache miss ({}) -- rebin response...'.format(key[:12]))
+      return False
+
+    print('Response cache hit ({}) -- load {}'.format(key[:12], cached_path))
+    if os.path.realpath(cached_path) != os.path.realpath(response_file_name):
+      self.copy_atomic(cached_path, response_file_name)
+    return True
+
+  #---------------------------------------------------------------
+  # Store a freshly rebinned response file under key
+  #---------------------------------------------------------------
+  def store(self, key, response_file_name):
+
+    cached_path = self.path(key)
+    self.copy_atomic(response_file_name, cached_path)
+    print('Stored rebinned response in cache: {}'.format(cached_path))
+
+  #---------------------------------------------------------------
+  # Copy file via temporary file + rename, so that an interrupted copy
+  # never leaves a truncated file behind
+  #---------------------------------------------------------------
+  def copy_atomic(self, src, dst):
+
+    tmp = '{}.tmp{}'.format(dst, os.getpid())
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+  #---------------------------------------------------------------
+  # Write json via temporary file + rename
+  #---------------------------------------------------------------
+  def write_atomic_json(self, path, obj):
+
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+      json.dump(obj, f)
+    os.replace(tmp, path)
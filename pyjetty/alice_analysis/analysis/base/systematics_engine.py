@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""
+  Array-native computation of systematic uncertainties.
+
+  The 2D unfolded results (pt x observable) of all systematic variations of an
+  observable are stacked into one array, projected onto all reported pt bins and
+  normalized at once, giving an array of distributions (variation x pt bin x
+  observable bin). Percentage deviations from the reference result, averages,
+  maximum deviations, RMS and sums in quadrature are computed with vectorized
+  operations over the variation axis, for all pt bins in one call (table()).
+  ROOT histograms are only read and created at the boundary (stack(), to_hist()).
+
+  The operations reproduce the ROOT histogram operations they replace:
+  projection (TAxis::SetRangeUser + TH2::ProjectionY), TH1::Scale(1, 'width'),
+  TH1::Integral(first, last, 'width') and TH1::Divide (zero where the divisor is zero).
+  Arrays of 1D distributions include the under- and overflow bins.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+
+# Base class
+from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import folding_engine
+
+################################################################
+class SystematicsEngine(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, **kwargs):
+    super(SystematicsEngine, self).__init__(**kwargs)
+
+    # Access to the GetArray() buffers of histograms
+    self.histograms = folding_engine.FoldingEngine()
+
+  #---------------------------------------------------------------
+  # Return (contents, sumw2) of the (identically-binned) histograms, stacked
+  # along the first axis, with the cells of each histogram ordered (z, y, x).
+  # Without Sumw2 structure, sumw2 is the absolute value of the contents (as in ROOT).
+  #---------------------------------------------------------------
+  def stack(self, hists, overflow=True):
+
+    contents = []
+    sumw2 = []
+    for h in hists:
+      content, h_sumw2 = self.histograms.hist_arrays(h)
+      content = content.astype(np.float64)
+      h_sumw2 = np.abs(content) if h_sumw2 is None else np.array(h_sumw2)
+      contents.append(self.histograms.cells(h, content, overflow))
+      sumw2.append(self.histograms.cells(h, h_sumw2, overflow))
+    return np.stack(contents), np.stack(sumw2)
+
+  #---------------------------------------------------------------
+  # Set the contents (and sumw2, if given) of a 1D/2D/3D histogram, in place
+  #---------------------------------------------------------------
+  def set_hist(self, h, contents=None, sumw2=None, overflow=True):
+
+    if contents is not None:
+      content = self.histograms.hist_arrays(h)[0]
+      self.histograms.cells(h, content, overflow)[...] = contents
+    if sumw2 is not None:
+      if h.GetSumw2N() == 0:
+        h.Sumw2()
+      h_sumw2 = self.histograms.hist_arrays(h)[1]
+      self.histograms.cells(h, h_sumw2, overflow)[...] = sumw2
+    h.ResetStats()
+
+  #---------------------------------------------------------------
+  # Return a clone of template, named name, with the given contents and sumw2
+  #---------------------------------------------------------------
+  def to_hist(self, template, name, contents, sumw2=None):
+
+    h = template.Clone(name)
+    h.SetDirectory(0)
+    self.set_hist(h, contents, sumw2)
+    return h
+
+  #---------------------------------------------------------------
+  # Return the bin edges of an axis
+  #---------------------------------------------------------------
+  def axis_edges(self, axis):
+
+    if axis.GetXbins().GetSize() > 0:
+      return np.array([axis.GetXbins()[i] for i in range(axis.GetXbins().GetSize())])
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins() + 1)
+
+  #---------------------------------------------------------------
+  # Return the (first, last) bins selected by TAxis::SetRangeUser(x_min, x_max)
+  #---------------------------------------------------------------
+  def range_bins(self, edges, x_min, x_max):
+
+    n_bins = len(edges) - 1
+    def find_bin(x):
+      if x < edges[0]:
+        return 0
+      if x >= edges[-1]:
+        return n_bins + 1
+      return int(np.searchsorted(edges, x, side='right'))
+    def low_edge(i):
+      return edges[min(max(i, 1), n_bins + 1) - 1]
+    def up_edge(i):
+      return edges[min(max(i, 0), n_bins)]
+
+    first = find_bin(x_min)
+    last = find_bin(x_max)
+    if up_edge(first) <= x_min:
+      first += 1
+    if low_edge(last) >= x_max:
+      last -= 1
+
+    # TAxis::SetRange
+    if last < first or (first < 0 and last < 0) or (first > n_bins + 1 and last > n_bins + 1) or \
+       (first == 0 and last == 0):
+      return 1, n_bins
+    return max(first, 0), min(last, n_bins + 1)
+
+  #---------------------------------------------------------------
+  # Return normalized 1D distributions of the observable (y axis) of 2D histograms
+  # (pt x observable) of all variations, for all pt bins at once:
+  #   - projection onto the observable for each pt bin (min, max) of pt_bins
+  #   - scaling by bin width
+  #   - normalization by the integral (weighted by bin width) over bins [minbin, maxbin]
+  #     of each pt bin, i.e. by N_jets,inclusive
+  # Returns (contents, sumw2, n_inclusive, n_tagged): contents and sumw2 are arrays
+  # (variation x pt bin x observable bin), n_inclusive (variation x pt bin) the
+  # normalizations, and n_tagged (if tagged) the integrals over [minbin+1, maxbin],
+  # e.g. the number of SD-tagged jets (the untagged jets are in the first bin)
+  #---------------------------------------------------------------
+  def distributions(self, hists, pt_bins, minbins, maxbins, tagged=False):
+
+    # (variation x observable x pt) cells
+    contents, sumw2 = self.stack(hists)
+    pt_edges = self.axis_edges(hists[0].GetXaxis())
+    obs_edges = self.axis_edges(hists[0].GetYaxis())
+
+    # Projection: sum over the pt bins selected for each reported pt bin
+    ranges = [self.range_bins(pt_edges, pt_min, pt_max) for pt_min, pt_max in pt_bins]
+    contents = np.stack([contents[:, :, first:last+1].sum(axis=2) for first, last in ranges], axis=1)
+    sumw2 = np.stack([sumw2[:, :, first:last+1].sum(axis=2) for first, last in ranges], axis=1)
+
+    # Scale by bin width (under- and overflow by the width of the first and last bins)
+    widths = np.diff(obs_edges)
+    widths = np.concatenate(([widths[0]], widths, [widths[-1]]))
+    contents /= widths
+    sumw2 /= widths * widths
+
+    # Normalize by integral, weighted by bin width
+    bins = np.arange(len(widths))
+    minbins = np.array(minbins)[:, np.newaxis]
+    maxbins = np.array(maxbins)[:, np.newaxis]
+    in_range = (bins >= minbins) & (bins <= maxbins)
+    n_inclusive = (contents * widths * in_range).sum(axis=2)
+    n_tagged = None
+    if tagged:
+      n_tagged = (contents * widths * (in_range & (bins > minbins))).sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      contents /= n_inclusive[:, :, np.newaxis]
+      sumw2 /= (n_inclusive * n_inclusive)[:, :, np.newaxis]
+
+    return contents, sumw2, n_inclusive, n_tagged
+
+  #---------------------------------------------------------------
+  # Return (ratio, sumw2) of c1/c2, as TH1::Divide (zero where c2 is zero)
+  #---------------------------------------------------------------
+  def divide(self, c1, sumw2_1, c2, sumw2_2):
+
+    nonzero = (c2 != 0)
+    c2_safe = np.where(nonzero, c2, 1.)
+    c2_sq = c2_safe * c2_safe
+    ratio = np.where(nonzero, c1 / c2_safe, 0.)
+    sumw2 = np.where(nonzero, (sumw2_1 * c2_sq + sumw2_2 * c1 * c1) / (c2_sq * c2_sq), 0.)
+    return ratio, sumw2
+
+  #---------------------------------------------------------------
+  # Return percentage deviation of a ratio from 1 (absolute value unless signed)
+  #---------------------------------------------------------------
+  def percentage(self, ratio, signed=False):
+
+    deviation = 1. - ratio
+    if not signed:
+      deviation = np.abs(deviation)
+    return deviation * 100
+
+  #---------------------------------------------------------------
+  # Combinations of variations, along the first axis
+  #---------------------------------------------------------------
+  def average(self, values):
+
+    return values.sum(axis=0) / len(values)
+
+  def max_deviation(self, values):
+
+    return np.maximum(values.max(axis=0), -1)
+
+  def rms(self, values):
+
+    return np.sqrt((values * values).sum(axis=0) / len(values))
+
+  def quadrature(self, values):
+
+    return np.sqrt((values * values).sum(axis=0))
+
+  #---------------------------------------------------------------
+  # Return the absolute errors of contents, from percentage uncertainties
+  #---------------------------------------------------------------
+  def errors(self, contents, percentages):
+
+    return contents * percentages * 0.01
+
+  #---------------------------------------------------------------
+  # Compute the systematic table of an observable, for all pt bins in one call
+  #   distributions: {label: (contents, sumw2)}, arrays (pt bin x observable bin)
+  #   sources: {name: (reference label, [variation labels], method)}, with method
+  #            'signed' or 'abs' (percentage deviation of one variation),
+  #            'average' or 'max' (of the absolute percentage deviations)
+  #   groups: {name: ([source or earlier group names], method)}, with method 'rms' or 'quadrature'
+  # Returns (deviations, table):
+  #   deviations: {variation label: (signed percentage deviation, sumw2 of the ratio)}
+  #   table: {source or group name: (percentages, sumw2)}; the sumw2 of a combination
+  #          is that of its first member, as for the histogram combinations
+  #---------------------------------------------------------------
+  def table(self, distributions, sources, groups={}):
+
+    # Percentage deviations of all variations from their reference, in one stacked division
+    pairs = []
+    for reference, labels, method in sources.values():
+      for label in labels:
+        if label not in [pair[1] for pair in pairs]:
+          pairs.append((reference, label))
+    deviations = {}
+    if pairs:
+      c1 = np.stack([distributions[reference][0] for reference, label in pairs])
+      sumw2_1 = np.stack([distributions[reference][1] for reference, label in pairs])
+      c2 = np.stack([distributions[label][0] for reference, label in pairs])
+      sumw2_2 = np.stack([distributions[label][1] for reference, label in pairs])
+      ratio, sumw2 = self.divide(c1, sumw2_1, c2, sumw2_2)
+      percentages = self.percentage(ratio, signed=True)
+      deviations = {label: (percentages[i], sumw2[i]) for i, (reference, label) in enumerate(pairs)}
+
+    table = {}
+    for name, (reference, labels, method) in sources.items():
+      values = np.stack([deviations[label][0] for label in labels])
+      if method == 'signed':
+        percentages = values[0]
+      elif method == 'abs':
+        percentages = np.abs(values[0])
+      elif method == 'average':
+        percentages = self.average(np.abs(values))
+      elif method == 'max':
+        percentages = self.max_deviation(np.abs(values))
+      else:
+        raise ValueError('SystematicsEngine: unknown method {} of source {}'.format(method, name))
+      table[name] = (percentages, deviations[labels[0]][1])
+
+    for name, (members, method) in groups.items():
+      values = np.stack([table[member][0] for member in members])
+      if method == 'rms':
+        percentages = self.rms(values)
+      elif method == 'quadrature':
+        percentages = self.quadrature(values)
+      else:
+        raise ValueError('SystematicsEngine: unknown method {} of group {}'.format(method, name))
+      table[name] = (percentages, table[members[0]][1])
+
+    return deviations, table
+
+  #---------------------------------------------------------------
+  # Return the contents of the in-range bins of (identically-binned) histograms, stacked
+  #---------------------------------------------------------------
+  def hist_values(self, hists):
+
+    return self.stack(hists, overflow=False)[0]
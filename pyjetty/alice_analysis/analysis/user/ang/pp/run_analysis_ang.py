@@ -23,6 +23,7 @@ from mpl_toolkits.axes_grid1 import make_axes_locatable
 plt.rcParams["yaxis.labellocation"] = 'top'
 plt.rcParams["xaxis.labellocation"] = 'right'
 
+from pyjetty.alice_analysis.analysis.base import folding_engine
 from pyjetty.alice_analysis.analysis.user.substructure import run_analysis
 
 # Load pyjetty ROOT utils
@@ -159,6 +160,9 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
     # Initialize yaml config
     self.initialize_user_config()
 
+    # Folds all scale variations with a response in one matrix product
+    self.folding_engine = folding_engine.FoldingEngine()
+
     print(self)
   
   #---------------------------------------------------------------
@@ -801,27 +805,22 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
       folded_ch_hists = ( ([], [], []), ([], [], []), ([], [], []) )
       folded_h_hists = ( ([], [], []), ([], [], []), ([], [], []) )
 
+      # Scale variations to fold
+      variations = [(l, m, n) for l in range(0, 3) for m in range(0, 3) for n in range(0, 3) if not \
+                    ((scale_req and m != n) or (0 in (l, m, n) and 2 in (l, m, n)))]
+
+      # Fold theory predictions: all scale variations at once for each response
+      hists = [parton_hists[l][m][n] for l, m, n in variations]
+      names_ch = ["theory_%i%i%i_%s_%s_ch_%i" % (l, m, n, self.observable, label, ri) for l, m, n in variations]
+      names_h = ["theory_%i%i%i_%s_%s_h_%i" % (l, m, n, self.observable, label, ri) for l, m, n in variations]
+      folded_ch = dict(zip(variations, self.folding_engine.fold(response_ch, hists, names_ch)))
+      folded_h = dict(zip(variations, self.folding_engine.fold(response_h, hists, names_h)))
+
       for l in range(0, 3):
         for m in range(0, 3):
           for n in range(0, 3):
-
-            if (scale_req and m != n) or (0 in (l, m, n) and 2 in (l, m, n)):
-              folded_h_hists[l][m].append(None)
-              folded_ch_hists[l][m].append(None)
-              continue
-
-            # Fold theory predictions
-            h_folded_ch = response_ch.ApplyToTruth(parton_hists[l][m][n])
-            h_folded_h = response_h.ApplyToTruth(parton_hists[l][m][n])
-
-            name_ch = "theory_%i%i%i_%s_%s_ch_%i" % (l, m, n, self.observable, label, ri)
-            name_h = "theory_%i%i%i_%s_%s_h_%i" % (l, m, n, self.observable, label, ri)
-
-            h_folded_ch.SetNameTitle(name_ch, name_ch)
-            h_folded_h.SetNameTitle(name_h, name_h)
-
-            folded_ch_hists[l][m].append(h_folded_ch)
-            folded_h_hists[l][m].append(h_folded_h)
+            folded_ch_hists[l][m].append(folded_ch.get((l, m, n)))
+            folded_h_hists[l][m].append(folded_h.get((l, m, n)))
 
       printstring = "Scaling theory predictions for MPI effects for %s" % \
                     self.theory_response_labels[ri]
@@ -1009,19 +1008,8 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
               h_max_h_bin.SetNameTitle(
                 name_max + ("_h%s_%i" % (pt_label, ri)), name_max + ("_h%s_%i" % (pt_label, ri)))
             else:  # Update the min/max histograms
-              for b in range(1, h_folded_h_bin.GetNbinsX()+1):
-
-                h_val = h_folded_h_bin.GetBinContent(b)
-                if h_val < h_min_h_bin.GetBinContent(b):
-                  h_min_h_bin.SetBinContent(b, h_val)
-                elif h_val > h_max_h_bin.GetBinContent(b):
-                  h_max_h_bin.SetBinContent(b, h_val)
-
-                ch_val = h_folded_ch_bin.GetBinContent(b)
-                if ch_val < h_min_ch_bin.GetBinContent(b):
-                  h_min_ch_bin.SetBinContent(b, ch_val)
-                elif ch_val > h_max_ch_bin.GetBinContent(b):
-                  h_max_ch_bin.SetBinContent(b, ch_val)
+              self.folding_engine.update_envelope(h_folded_h_bin, h_min_h_bin, h_max_h_bin)
+              self.folding_engine.update_envelope(h_folded_ch_bin, h_min_ch_bin, h_max_ch_bin)
 
 
       # Steal ownership from ROOT
@@ -1085,13 +1073,39 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
                            i in range(len(obs_bins_Fnp)-1)]
     '''
 
+    # Scale variations included in the envelope
+    variations = [(l, m, n) for l in range(0, 3) for m in range(0, 3) for n in range(0, 3)
+                  if not ((scale_req and m != n) or (0 in (l, m, n) and 2 in (l, m, n)))]
+
+    # Apply shape function to all scale variations, for all Omega values at once:
+    # the kernel matrix is computed once per Omega and pT bin
+    # (histograms are returned as [i_Omega * len(variations) + i_variation])
+    #for ri in range(len(self.theory_response_files)):
+    # just use the first ri for now...
+    ri = 0
+    pTs = [self.pt_avg_jetR(self.theory_pt_bins[i], self.theory_pt_bins[i+1], jetR) for
+           i in range(0, len(self.theory_pt_bins) - 1)]
+    Omegas = ROOT.std.vector('double')()
+    names_h = ROOT.std.vector('string')()
     for Omega in self.Omega_list:
+      Omegas.push_back(Omega)
+      for l, m, n in variations:
+        names_h.push_back("theory_%i%i%i_%s_%s_h_Fnp_Omega%s_%i" % \
+                          (l, m, n, self.observable, label, str(Omega), ri))
+    parton_hists_Fnp = ROOT.std.vector('TH2D*')()
+    for l, m, n in variations:
+      parton_hists_Fnp.push_back(parton_hists[l][m][n])
+    h_nps = self.histutils.convolve_F_np_batch(
+      Omegas, jetR, alpha, array('d', obs_bins_Fnp),
+      len(obs_bins_center_Fnp), array('d', obs_bins_center_Fnp),
+      array('d', obs_bins_width_Fnp),
+      array('d', self.theory_pt_bins), len(self.theory_pt_bins_center),
+      array('d', pTs), parton_hists_Fnp, names_h, grooming)
+
+    for i_Omega, Omega in enumerate(self.Omega_list):
       print("  ... Omega = %s" % str(Omega))
 
       # Simultaneously fold using H --> CH response (with MPI on)
-      #for ri in range(len(self.theory_response_files)):
-      # just use the first ri for now...
-      ri = 0
       # Load hadron-to-charged-hadron response matrix
       response_name = "hResponse_theory_Fnp_%s_Roounfold_%i" % (label, ri)
       response = getattr(self, response_name)
@@ -1112,74 +1126,43 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
       h_cent_h_name = "theory_cent_%s_%s_h_Fnp_Omega%s_%i" % \
                       (self.observable, label, str(Omega), ri)
 
-      for l in range(0, 3):
-        for m in range(0, 3):
-          for n in range(0, 3):
-
-            if (scale_req and m != n) or (0 in (l, m, n) and 2 in (l, m, n)):
-              continue
-
-            # For some reason there are some binning-dependant things happening, so
-            # rebin everything to have the smallest of bins everywhere
-            parton_hist = parton_hists[l][m][n].Clone()
-            parton_hist.SetNameTitle(parton_hist.GetName() + "_finebin",
-                                     parton_hist.GetName() + "_finebin")
-
-            # Apply shape function
-            name_h = "theory_%i%i%i_%s_%s_h_Fnp_Omega%s_%i" % \
-                     (l, m, n, self.observable, label, str(Omega), ri)
-            pTs = [self.pt_avg_jetR(self.theory_pt_bins[i], self.theory_pt_bins[i+1], jetR) for
-                   i in range(0, len(self.theory_pt_bins) - 1)]
-            h_np = self.histutils.convolve_F_np(
-              Omega, jetR, alpha, array('d', obs_bins_Fnp),
-              len(obs_bins_center_Fnp), array('d', obs_bins_center_Fnp),
-              array('d', obs_bins_width_Fnp),
-              array('d', self.theory_pt_bins), len(self.theory_pt_bins_center),
-              array('d', pTs), parton_hists[l][m][n], name_h, grooming)
-
-            # Rebin to correct binning
-            # note: currently not using underflow in groomed RM here
-            h_np_rebinned = self.histutils.rebin_th2(
-              h_np, h_np.GetName()+"_rebinned", array('d', self.theory_pt_bins),
-              len(self.theory_pt_bins)-1, array('d', self.theory_obs_bins), 
-              len(self.theory_obs_bins)-1)
-
-            # Fold hadron-level predictions to CH level
-            h_folded_Fnp = response.ApplyToTruth(h_np_rebinned)
-            name_ch = "theory_%i%i%i_%s_%s_ch_Fnp_Omega%s_%i" % \
-                      (l, m, n, self.observable, label, str(Omega), ri)
-            h_folded_Fnp.SetNameTitle(name_ch, name_ch)
-
-            # Update min/max/cent histograms
-            if l == m == n == 1: # set central variation
-              h_cent_ch = h_folded_Fnp.Clone()
-              h_cent_ch.SetNameTitle(h_cent_ch_name, h_cent_ch_name)
-              h_cent_h = h_np_rebinned.Clone()
-              h_cent_h.SetNameTitle(h_cent_h_name, h_cent_h_name)
-
-            if l == m == n == 0:  # initialize min/max histograms
-              h_min_ch = h_folded_Fnp.Clone()
-              h_min_ch.SetNameTitle(h_min_ch_name, h_min_ch_name)
-              h_min_h = h_np_rebinned.Clone()
-              h_min_h.SetNameTitle(h_min_h_name, h_min_h_name)
-              h_max_ch = h_folded_Fnp.Clone()
-              h_max_ch.SetNameTitle(h_max_ch_name, h_max_ch_name)
-              h_max_h = h_np_rebinned.Clone()
-              h_max_h.SetNameTitle(h_max_h_name, h_max_h_name)
-
-            else:  # loop through pT & obs bins and update each min/max value
-              for i in range(h_folded_Fnp.GetNbinsX()):
-                for j in range(h_folded_Fnp.GetNbinsY()):
-                  val_ch = h_folded_Fnp.GetBinContent(i+1, j+1)
-                  if float(val_ch) < h_min_ch.GetBinContent(i+1, j+1):
-                    h_min_ch.SetBinContent(i+1, j+1, val_ch)
-                  if float(val_ch) > h_max_ch.GetBinContent(i+1, j+1):
-                    h_max_ch.SetBinContent(i+1, j+1, val_ch)
-                  val_h = h_np_rebinned.GetBinContent(i+1, j+1)
-                  if float(val_h) < h_min_h.GetBinContent(i+1, j+1):
-                    h_min_h.SetBinContent(i+1, j+1, val_h)
-                  if float(val_h) > h_max_h.GetBinContent(i+1, j+1):
-                    h_max_h.SetBinContent(i+1, j+1, val_h)
+      # Rebin to correct binning
+      # note: currently not using underflow in groomed RM here
+      hists_np_rebinned = []
+      for i, (l, m, n) in enumerate(variations):
+        h_np = h_nps[i_Omega * len(variations) + i]
+        hists_np_rebinned.append(self.histutils.rebin_th2(
+          h_np, h_np.GetName()+"_rebinned", array('d', self.theory_pt_bins),
+          len(self.theory_pt_bins)-1, array('d', self.theory_obs_bins), 
+          len(self.theory_obs_bins)-1))
+
+      # Fold hadron-level predictions to CH level, all variations at once
+      names_ch = ["theory_%i%i%i_%s_%s_ch_Fnp_Omega%s_%i" % \
+                  (l, m, n, self.observable, label, str(Omega), ri) for l, m, n in variations]
+      hists_folded_Fnp = self.folding_engine.fold(response, hists_np_rebinned, names_ch)
+
+      for (l, m, n), h_np_rebinned, h_folded_Fnp in zip(variations, hists_np_rebinned, hists_folded_Fnp):
+
+        # Update min/max/cent histograms
+        if l == m == n == 1: # set central variation
+          h_cent_ch = h_folded_Fnp.Clone()
+          h_cent_ch.SetNameTitle(h_cent_ch_name, h_cent_ch_name)
+          h_cent_h = h_np_rebinned.Clone()
+          h_cent_h.SetNameTitle(h_cent_h_name, h_cent_h_name)
+
+        if l == m == n == 0:  # initialize min/max histograms
+          h_min_ch = h_folded_Fnp.Clone()
+          h_min_ch.SetNameTitle(h_min_ch_name, h_min_ch_name)
+          h_min_h = h_np_rebinned.Clone()
+          h_min_h.SetNameTitle(h_min_h_name, h_min_h_name)
+          h_max_ch = h_folded_Fnp.Clone()
+          h_max_ch.SetNameTitle(h_max_ch_name, h_max_ch_name)
+          h_max_h = h_np_rebinned.Clone()
+          h_max_h.SetNameTitle(h_max_h_name, h_max_h_name)
+
+        else:  # update each min/max value of the pT & obs bins
+          self.folding_engine.update_envelope(h_folded_Fnp, h_min_ch, h_max_ch)
+          self.folding_engine.update_envelope(h_np_rebinned, h_min_h, h_max_h)
 
       setattr(self, h_cent_ch_name, h_cent_ch)
       setattr(self, h_min_ch_name, h_min_ch)
@@ -2718,12 +2701,9 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
     h = None
     if do_direct_files:  # Read from TH2
 
-      f = ROOT.TFile(self.main_response, 'READ')
       name = "h_%s_JetPt_Truth_R%s_%sScaled" % (self.observable, str(jetR), obs_label) \
         if obs_label else "h_%s_JetPt_Truth_R%sScaled" % (self.observable, str(jetR))
-      th2 = f.Get(name)
-      if not th2:
-        raise AttributeError("%s not found in %s" % (name, self.main_response))
+      th2 = self.object_cache.get(self.main_response, name)
       if not th2.GetSumw2():
         th2.Sumw2()
 
@@ -2737,13 +2717,14 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
                                   i in range(1, h_data.GetNbinsX()+2)])
       move_underflow = (obs_bin_array[0] < 0)
 
-      th2.GetXaxis().SetRangeUser(min_pt_truth, max_pt_truth)
-      h = th2.ProjectionY()
-
-      # Finally, rename and truncate the histogram to the correct size
+      # Projection and rebinning are cached, for all overlays and plots of this pt bin
       name = 'hPythia_{}_R{}_{}_{}-{}'.format(
         self.observable, jetR, obs_label, min_pt_truth, max_pt_truth)
-      h_rebin = h.Rebin(len(obs_bin_array)-1, name+"_Rebin", obs_bin_array)
+      ranges = {0: (min_pt_truth, max_pt_truth)}
+      h = self.object_cache.projection(th2, 'y', ranges)
+
+      # Finally, rename and truncate the histogram to the correct size
+      h_rebin = self.object_cache.projection(th2, 'y', ranges, name+"_Rebin", obs_bin_array)
       if move_underflow:
         h_rebin.SetBinContent(1, h.GetBinContent(0))
         h_rebin.SetBinError(1, h.GetBinError(0))
@@ -2754,18 +2735,14 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
       output_dir = getattr(self, 'output_dir_main')
 
       filepath = os.path.join(output_dir, 'response.root')
-      f = ROOT.TFile(filepath, 'READ')
 
       thn_name = 'hResponse_JetPt_{}_R{}_{}_rebinned'.format(
         self.observable, jetR, obs_label).replace("__", "_")
-      thn = f.Get(thn_name)
-      if not thn:
-        raise AttributeError("%s not found in %s" % (thn_name, filepath))
-      thn.GetAxis(1).SetRangeUser(min_pt_truth, max_pt_truth)
 
       name = 'hPythia_{}_R{}_{}_{}-{}'.format(
         self.observable, jetR, obs_label, min_pt_truth, max_pt_truth)
-      h = self.truncate_hist(thn.Projection(3), None, maxbin, name)
+      h = self.truncate_hist(self.object_cache.projection(
+        (filepath, thn_name), 3, {1: (min_pt_truth, max_pt_truth)}), None, maxbin, name)
       h.SetDirectory(0)
 
     return h
@@ -2781,12 +2758,9 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
 
     if do_direct_files:  # Read from TH2
 
-      f = ROOT.TFile(self.fastsim_response_list[1], 'READ')
       name = "h_%s_JetPt_Truth_R%s_%sScaled" % (self.observable, str(jetR), obs_label) \
         if obs_label else "h_%s_JetPt_Truth_R%sScaled" % (self.observable, str(jetR))
-      th2 = f.Get(name)
-      if not th2:
-        raise AttributeError("%s not found in %s" % (name, self.main_response))
+      th2 = self.object_cache.get(self.fastsim_response_list[1], name)
       if not th2.GetSumw2():
         th2.Sumw2()
 
@@ -2800,13 +2774,14 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
                                   i in range(1, h_data.GetNbinsX()+2)])
       move_underflow = (obs_bin_array[0] < 0)
 
-      th2.GetXaxis().SetRangeUser(min_pt_truth, max_pt_truth)
-      h = th2.ProjectionY()
-
-      # Finally, rename and truncate the histogram to the correct size
+      # Projection and rebinning are cached, for all overlays and plots of this pt bin
       name = 'hHerwig_{}_R{}_{}_{}-{}'.format(
         self.observable, jetR, obs_label, min_pt_truth, max_pt_truth)
-      h_rebin = h.Rebin(len(obs_bin_array)-1, name+"_Rebin", obs_bin_array)
+      ranges = {0: (min_pt_truth, max_pt_truth)}
+      h = self.object_cache.projection(th2, 'y', ranges)
+
+      # Finally, rename and truncate the histogram to the correct size
+      h_rebin = self.object_cache.projection(th2, 'y', ranges, name+"_Rebin", obs_bin_array)
       if move_underflow:
         h_rebin.SetBinContent(1, h.GetBinContent(0))
         h_rebin.SetBinError(1, h.GetBinError(0))
@@ -2818,18 +2793,14 @@ class RunAnalysisAng(run_analysis.RunAnalysis):
         filepath = os.path.join(self.output_dir_fastsim_generator1, 'response.root')
       except AttributeError:  # No fastsim generator
         return None
-      f = ROOT.TFile(filepath, 'READ')
 
       thn_name = 'hResponse_JetPt_{}_R{}_{}_rebinned'.format(
         self.observable, jetR, obs_label).replace("__", "_")
-      thn = f.Get(thn_name)
-      if not thn:
-        raise AttributeError("%s not found in %s" % (thn_name, filepath))
-      thn.GetAxis(1).SetRangeUser(min_pt_truth, max_pt_truth)
 
       name = 'hHerwig_{}_R{}_{}_{}-{}'.format(
         self.observable, jetR, obs_label, min_pt_truth, max_pt_truth)
-      h = self.truncate_hist(thn.Projection(3), None, maxbin, name)
+      h = self.truncate_hist(self.object_cache.projection(
+        (filepath, thn_name), 3, {1: (min_pt_truth, max_pt_truth)}), None, maxbin, name)
       h.SetDirectory(0)
 
     return h
@@ -30,6 +30,7 @@ import root_numpy
 # Base class
 sys.path.append('.')
 from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import plot_tasks
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 
 # Prevent ROOT from stealing focus when plotting
@@ -66,33 +67,48 @@ class PlotResults(common_base.CommonBase):
     #-------------------------------------------------------------------------------------------
     #
     #-------------------------------------------------------------------------------------------
-    def plot_results(self):
-        
-        # Jet and hadron RAA -- data only
-        self.plot_combined_raa()
-        
-        # Charged particle RAA
-        self.plot_hadron_raa()
+    def plot_results(self, n_workers=0, force=False):
+
+        plots = [
+            # Jet and hadron RAA -- data only
+            ('combined_raa', self.plot_combined_raa),
+            # Charged particle RAA
+            ('hadron_raa', self.plot_hadron_raa),
+            # Inclusive full jet RAA
+            ('jet_raa', self.plot_jet_raa),
+            # Charged jet g
+            ('girth', self.plot_girth),
+            # Charged jet mass
+            ('mass', self.plot_mass),
+            # Charged Soft Drop zg
+            ('zg', self.plot_zg),
+            # Charged Soft Drop theta_g
+            ('theta_g', self.plot_tg),
+            # h-jet
+            ('hjet_IAA', self.plot_hjet_IAA),
+            ('hjet_IAA_ratio', self.plot_hjet_IAA_ratio),
+            ('hjet_dphi', self.plot_hjet_dphi)
+        ]
+
+        # Each observable is a plot task, skipped if its config and input files are unchanged
+        with open(self.config_file, 'r') as stream:
+            config = yaml.safe_load(stream)
+        runner = plot_tasks.PlotTaskRunner(state_dir=self.output_dir, n_workers=n_workers,
+                                           init_functions=[self.init_worker], force=force)
+        for observable, plot_function in plots:
+            runner.add(observable, plot_function,
+                       inputs=plot_tasks.config_input_files(config[observable]),
+                       outputs=[os.path.join(self.output_dir, f'h_{observable}.pdf')],
+                       params=config[observable])
+        runner.run()
 
-        # Inclusive full jet RAA
-        self.plot_jet_raa()
-        
-        # Charged jet g
-        self.plot_girth()
-        
-        # Charged jet mass
-        self.plot_mass()
-        
-        # Charged Soft Drop zg
-        self.plot_zg()
-        
-        # Charged Soft Drop theta_g
-        self.plot_tg()
-        
-        # h-jet
-        self.plot_hjet_IAA()
-        self.plot_hjet_IAA_ratio()
-        self.plot_hjet_dphi()
+    #-------------------------------------------------------------------------------------------
+    # Set up plot style in a plot task worker
+    #-------------------------------------------------------------------------------------------
+    def init_worker(self):
+
+        self.utils.set_plotting_options()
+        ROOT.gROOT.ForceStyle()
         
     #-------------------------------------------------------------------------------------------
     def plot_combined_raa(self):
@@ -1457,9 +1473,23 @@ if __name__ == '__main__':
         default='.',
         help='Output directory for output to be written to'
     )
+    parser.add_argument(
+        '-n',
+        '--nWorkers',
+        action='store',
+        type=int,
+        metavar='nWorkers',
+        default=0,
+        help='Number of plotting processes (0: number of cores)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Replot also unchanged plots'
+    )
 
     # Parse the arguments
     args = parser.parse_args()
 
     analysis = PlotResults(config_file=args.configFile, output_dir=args.outputDir)
-    analysis.plot_results()
+    analysis.plot_results(n_workers=args.nWorkers, force=args.force)
@@ -15,6 +15,7 @@ import numpy as np
 
 # Base class
 from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import plot_tasks
 
 # Prevent ROOT from stealing focus when plotting
 ROOT.gROOT.SetBatch(True)
@@ -97,17 +98,36 @@ class PlotAngularityFigures(common_base.CommonBase):
     #-------------------------------------------------------------------------------------------
     #-------------------------------------------------------------------------------------------
     #-------------------------------------------------------------------------------------------
-    def plot_results(self):
+    def plot_results(self, n_workers=0, force=False):
 
         self.setOptions()
         ROOT.gROOT.ForceStyle()
 
-        if self.jetR == 0.2:
-            self.plot_multipanel(R=0.2, groomed=False)
-            self.plot_multipanel(R=0.2, groomed=True)
-        elif self.jetR == 0.4:
-            self.plot_multipanel(R=0.4, groomed=False)
-            self.plot_multipanel(R=0.4, groomed=True)
+        # Each multi-panel figure is a plot task, skipped if its inputs are unchanged
+        runner = plot_tasks.PlotTaskRunner(state_dir=self.output_dir, n_workers=n_workers,
+                                           init_functions=[self.init_worker], force=force)
+        if self.jetR in [0.2, 0.4]:
+            for groomed in [False, True]:
+                runner.add(self.output_name(self.jetR, groomed), self.plot_multipanel,
+                           kwargs={'R': self.jetR, 'groomed': groomed},
+                           inputs=self.predictions[str(self.jetR)],
+                           outputs=[os.path.join(self.output_dir, self.output_name(self.jetR, groomed))])
+        runner.run()
+
+    #-------------------------------------------------------------------------------------------
+    # Set up plot style in a plot task worker
+    #-------------------------------------------------------------------------------------------
+    def init_worker(self):
+
+        self.setOptions()
+        ROOT.gROOT.ForceStyle()
+
+    #-------------------------------------------------------------------------------------------
+    def output_name(self, R, groomed):
+
+        if groomed:
+            return 'hJetAngularity_{}_SD{}'.format(R, self.file_format)
+        return 'hJetAngularity_{}{}'.format(R, self.file_format)
 
     #-------------------------------------------------------------------------------------------
     def plot_multipanel(self, R=1, groomed=False):
@@ -131,11 +151,7 @@ class PlotAngularityFigures(common_base.CommonBase):
         self.plot_angularity(c, pad=3, R=R, ptbin=3, minpt=60, maxpt=80, groomed=groomed)
         self.plot_angularity(c, pad=4, R=R, ptbin=4, minpt=80, maxpt=100, groomed=groomed)
 
-        if groomed:
-            outfilename = 'hJetAngularity_{}_SD{}'.format(R, self.file_format)
-        else:
-            outfilename = 'hJetAngularity_{}{}'.format(R, self.file_format)
-        output_filename = os.path.join(self.output_dir, outfilename)
+        output_filename = os.path.join(self.output_dir, self.output_name(R, groomed))
         c.SaveAs(output_filename)
 
     #-------------------------------------------------------------------------------------------
@@ -706,9 +722,23 @@ if __name__ == '__main__':
         default='.',
         help='Output directory for output to be written to'
     )
+    parser.add_argument(
+        '-n',
+        '--nWorkers',
+        action='store',
+        type=int,
+        metavar='nWorkers',
+        default=0,
+        help='Number of plotting processes (0: number of cores)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Replot also unchanged plots'
+    )
 
     # Parse the arguments
     args = parser.parse_args()
 
     analysis = PlotAngularityFigures(output_dir=args.outputDir)
-    analysis.plot_results()
+    analysis.plot_results(n_workers=args.nWorkers, force=args.force)
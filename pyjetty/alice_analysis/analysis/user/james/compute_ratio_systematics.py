@@ -34,6 +34,7 @@ import yaml
 import hepdata_lib
 
 from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import systematics_engine
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 
 # Prevent ROOT from stealing focus when plotting
@@ -51,6 +52,7 @@ class ComputeRatioSystematics(common_base.CommonBase):
 
     # Initialize utils class
     self.utils = analysis_utils_obs.AnalysisUtils_Obs()
+    self.systematics = systematics_engine.SystematicsEngine()
 
     # Initialize yaml config
     self.initialize_config()
@@ -337,15 +339,8 @@ class ComputeRatioSystematics(common_base.CommonBase):
   #----------------------------------------------------------------------
   def change_to_per(self, h, signed=False):
 
-    for bin in range(0, h.GetNbinsX()+2):
-      content = h.GetBinContent(bin)
-      
-      if signed:
-        content_new = 1-content
-      else:
-        content_new = math.fabs(1-content)
-
-      h.SetBinContent(bin, content_new*100)
+    content = self.systematics.stack([h])[0][0]
+    self.systematics.set_hist(h, self.systematics.percentage(content, signed=signed))
 
   #----------------------------------------------------------------------
   def hist_average(self, h1, h2, signed=False, take_max_dev=False):
@@ -353,22 +348,14 @@ class ComputeRatioSystematics(common_base.CommonBase):
     h_avg = h1.Clone()
     h_avg.SetName('{}_avg'.format(h1.GetName()))
 
-    for i in range(1, h_avg.GetNbinsX()+1):
-      if signed:
-        value1 = h1.GetBinContent(i)
-        value2 = h2.GetBinContent(i)
-      else:
-        value1 = np.abs(h1.GetBinContent(i))
-        value2 = np.abs(h2.GetBinContent(i))
-      avg =  0.5*(value1 + value2)
-
-      if take_max_dev:
-        if value1 > value2:
-          avg = value1
-        else:  # value2 > value1:
-          avg = value2
-
-      h_avg.SetBinContent(i, avg)
+    values = self.systematics.hist_values([h1, h2])
+    if not signed:
+      values = np.abs(values)
+    if take_max_dev:
+      avg = values.max(axis=0)
+    else:
+      avg = self.systematics.average(values)
+    self.systematics.set_hist(h_avg, avg, overflow=False)
 
     return h_avg
 
@@ -380,15 +367,8 @@ class ComputeRatioSystematics(common_base.CommonBase):
     h_new = h_list[0].Clone()
     h_new.SetName('hCombinedUnfoldingSystematic_{}'.format(h_list[0].GetName()))
 
-    for i in range(1, h_new.GetNbinsX()+1):
-
-      values_i = [h.GetBinContent(i) for h in h_list]
-
-      new_value_squared = 0.
-      for value_i in values_i:
-        new_value_squared += value_i*value_i
-      new_value = math.sqrt(new_value_squared / len(h_list))
-      h_new.SetBinContent(i, new_value)
+    values = self.systematics.hist_values(h_list)
+    self.systematics.set_hist(h_new, self.systematics.rms(values), overflow=False)
 
     return h_new
 
@@ -400,15 +380,8 @@ class ComputeRatioSystematics(common_base.CommonBase):
     h_new = next(iter(h_dict.values())).Clone()
     h_new.SetName('total_systematic')
 
-    for i in range(1, h_new.GetNbinsX()+1):
-
-      values_i = [h.GetBinContent(i) for key,h in h_dict.items()]
-
-      new_value_squared = 0.
-      for value_i in values_i:
-        new_value_squared += value_i*value_i
-      new_value = math.sqrt(new_value_squared)
-      h_new.SetBinContent(i, new_value)
+    values = self.systematics.hist_values(list(h_dict.values()))
+    self.systematics.set_hist(h_new, self.systematics.quadrature(values), overflow=False)
 
     return h_new
 
@@ -422,26 +395,18 @@ class ComputeRatioSystematics(common_base.CommonBase):
         new_name = '{}_new'.format(h_list[0].GetName())
     h_new.SetName(new_name)
 
-    for i in range(1, h_new.GetNbinsX()+1):
-
-      values_i = [h.GetBinContent(i) for h in h_list]
-
-      new_value_squared = 0.
-      for value_i in values_i:
-        new_value_squared += value_i*value_i
-      new_value = math.sqrt(new_value_squared)
-      h_new.SetBinContent(i, new_value)
+    values = self.systematics.hist_values(h_list)
+    self.systematics.set_hist(h_new, self.systematics.quadrature(values), overflow=False)
 
     return h_new
 
   #----------------------------------------------------------------------
   def attach_uncertainty_to_hist(self, h, hPercError):
 
-    #Fill array with lower bin edges of data histogram
-    for bin in range(1, h.GetNbinsX()+1):
-      content = h.GetBinContent(bin)
-      perErr = hPercError.GetBinContent(bin)
-      h.SetBinError(bin, content*perErr*0.01)
+    content = self.systematics.hist_values([h])[0]
+    perErr = self.systematics.stack([hPercError])[0][0][1:h.GetNbinsX()+1]
+    errors = self.systematics.errors(content, perErr)
+    self.systematics.set_hist(h, sumw2=errors*errors, overflow=False)
 
   #----------------------------------------------------------------------
   # Returns truncated 1D histogram from bins [minbin, ..., maxbin] inclusive
@@ -13,6 +13,7 @@ import os
 import sys
 import math
 import yaml
+import inspect
 import argparse
 
 # Data analysis and plotting
@@ -22,6 +23,7 @@ import ROOT
 
 # Base class
 from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import plot_tasks
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 from pyjetty.alice_analysis.analysis.user.james import plotting_utils_theta_g, plotting_utils_subjet_z
 
@@ -134,8 +136,17 @@ class PlotGroomers(common_base.CommonBase):
       os.makedirs(output_dir)
 
   #---------------------------------------------------------------
-  def plot_groomers(self):
-  
+  # Plot all observables, R_max and R, as independent plot tasks
+  # (in n_workers processes; unchanged plots are skipped unless force)
+  #---------------------------------------------------------------
+  def plot_groomers(self, n_workers=0, force=False):
+
+    runner = plot_tasks.PlotTaskRunner(state_dir=self.output_dir, n_workers=n_workers,
+                                       init_functions=[self.init_worker], force=force)
+    # The plots are drawn by the plotting_utils modules: their sources are inputs of the tasks
+    inputs = [self.config_file, self.fMC.GetName(),
+              inspect.getsourcefile(plotting_utils_theta_g), inspect.getsourcefile(plotting_utils_subjet_z)]
+
     # Loop through all observables
     for observable in self.observables:
       self.init_observable(observable)
@@ -145,95 +156,131 @@ class PlotGroomers(common_base.CommonBase):
       
         # Plot for each R
         for jetR in self.jetR_list:
+          runner.add('{}_R{}_Rmax{}'.format(observable, jetR, R_max), self.plot_groomers_R,
+                     args=(observable, R_max, jetR), inputs=inputs,
+                     outputs=[self.output_dir_R(observable, jetR, R_max)])
+
+      # Plot performance plots only once per R (for the last R_max)
+      if observable == 'theta_g':
+        for jetR in self.jetR_list:
+          runner.add('performance_R{}'.format(jetR), self.plot_performance_R,
+                     args=(observable, self.max_distance[-1], jetR), inputs=inputs,
+                     outputs=[os.path.join(self.output_dir, 'performance')])
+
+    runner.run()
+
+  #---------------------------------------------------------------
+  # Set up plot style and reopen input file in a plot task worker
+  #---------------------------------------------------------------
+  def init_worker(self):
+
+    self.utils.set_plotting_options()
+    ROOT.gROOT.ForceStyle()
+    self.fMC = ROOT.TFile(self.fMC.GetName(), 'READ')
+
+  #---------------------------------------------------------------
+  # Plot a given observable, R_max and R
+  #---------------------------------------------------------------
+  def plot_groomers_R(self, observable, R_max, jetR):
+
+    self.init_observable(observable)
+    output_dir = self.output_dir_R(observable, jetR, R_max)
+  
+    # Plot subjet histograms
+    if observable == 'subjet_z':
+    
+      self.prong_match_threshold = 0.5
+      self.plotting_utils = plotting_utils_subjet_z.PlottingUtils(output_dir, self.config_file, R_max=R_max,
+                                                         thermal = False, groomer_studies = True)
+      
+      for i, overlay_list in enumerate(self.plot_overlay_list):
+
+        self.create_output_subdir(output_dir, 'prong_matching_fraction_pt_leading')
+        hname = 'h_subjet_z_fraction_leading_JetPt_R{}'.format(jetR)
+        self.plotting_utils.plot_subjet_matching(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
+      
+      for i, _ in enumerate(self.obs_subconfig_list):
+
+        obs_setting = self.obs_settings[i]
         
-          # Create output dir
-          output_dir = os.path.join(self.output_dir, observable)
-          output_dir = os.path.join(output_dir, 'jetR{}'.format(jetR))
-          output_dir = os.path.join(output_dir, 'Rmax{}'.format(R_max))
+        output_dir_money = os.path.join(output_dir, 'money_leading')
+        self.create_output_subdir(output_dir_money, str(obs_setting))
+        self.plot_subjet_money_plot(observable, jetR, R_max, obs_setting, output_dir_money)
+    
+    # Plot groomed histograms
+    if observable in ['theta_g', 'zg', 'kappa', 'tf']:
+      # Plot money plot for all observables
+      for i, _ in enumerate(self.obs_subconfig_list):
+
+        obs_setting = self.obs_settings[i]
+        grooming_setting = self.grooming_settings[i]
+        obs_label = self.utils.obs_label(obs_setting, grooming_setting)
+        self.set_zmin(observable, grooming_setting)
         
-          # Plot subjet histograms
-          if observable == 'subjet_z':
-          
-            self.prong_match_threshold = 0.5
-            self.plotting_utils = plotting_utils_subjet_z.PlottingUtils(output_dir, self.config_file, R_max=R_max,
-                                                               thermal = False, groomer_studies = True)
-            
-            for i, overlay_list in enumerate(self.plot_overlay_list):
-
-              self.create_output_subdir(output_dir, 'prong_matching_fraction_pt_leading')
-              hname = 'h_subjet_z_fraction_leading_JetPt_R{}'.format(jetR)
-              self.plotting_utils.plot_subjet_matching(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
-            
-            for i, _ in enumerate(self.obs_subconfig_list):
-
-              obs_setting = self.obs_settings[i]
-              obs_label = self.utils.obs_label(obs_setting, grooming_setting)
-              
-              output_dir_money = os.path.join(output_dir, 'money_leading')
-              self.create_output_subdir(output_dir_money, str(obs_setting))
-              self.plot_subjet_money_plot(observable, jetR, R_max, obs_setting, output_dir_money)
-          
-          # Plot groomed histograms
-          if observable in ['theta_g', 'zg', 'kappa', 'tf']:
-            # Plot money plot for all observables
-            for i, _ in enumerate(self.obs_subconfig_list):
-
-              obs_setting = self.obs_settings[i]
-              grooming_setting = self.grooming_settings[i]
-              obs_label = self.utils.obs_label(obs_setting, grooming_setting)
-              self.set_zmin(observable, grooming_setting)
-              
-              output_dir_money = os.path.join(output_dir, 'money')
-              self.create_output_subdir(output_dir_money, self.utils.grooming_label(grooming_setting))
-              self.plot_money_plot(observable, jetR, R_max, obs_label, obs_setting, grooming_setting, output_dir_money)
-
-              output_dir_toy = os.path.join(output_dir, 'toy')
-              self.create_output_subdir(output_dir_toy, self.utils.grooming_label(grooming_setting))
-              self.plot_money_plot(observable, jetR, R_max, obs_label, obs_setting, grooming_setting, output_dir_toy, option='toy')
-             
-            self.create_output_subdir(output_dir, 'ratios_Embedded_Truth')
-            self.plot_money_ratios(observable, output_dir, jetR, 'Embedded/Truth')
-            
-            self.create_output_subdir(output_dir, 'ratios_Purity')
-            self.plot_money_ratios(observable, output_dir, jetR, 'Tagging purity')
-
-            # Plot performance plots only once
-            if observable == 'theta_g':
-
-              # Create output subdirectories
-              output_dir = os.path.join(self.output_dir, 'performance')
-              self.create_output_subdir(output_dir, 'delta_pt')
-              self.create_output_subdir(output_dir, 'prong_matching_fraction_pt')
-              self.create_output_subdir(output_dir, 'prong_matching_deltaR')
-              self.create_output_subdir(output_dir, 'prong_matching_deltaZ')
-              self.create_output_subdir(output_dir, 'prong_matching_correlation')
-              
-              self.plotting_utils = plotting_utils_theta_g.PlottingUtils(output_dir, self.config_file, R_max=R_max,
-                                                                 thermal = False, groomer_studies = True)
-          
-              # Plot some subobservable-independent performance plots
-              self.plotting_utils.plot_delta_pt(jetR, self.pt_bins_reported)
-
-              # Plot prong matching histograms
-              self.prong_match_threshold = 0.5
-              min_pt = 80.
-              max_pt = 100.
-              prong_list = ['leading', 'subleading']
-              match_list = ['leading', 'subleading', 'ungroomed', 'outside']
-              for i, overlay_list in enumerate(self.plot_overlay_list):
-                for prong in prong_list:
-                  for match in match_list:
-
-                    hname = 'hProngMatching_{}_{}_JetPt_R{}'.format(prong, match, jetR)
-                    self.plotting_utils.plot_prong_matching(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
-                    self.plotting_utils.plot_prong_matching_delta(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold, min_pt, max_pt, plot_deltaz=False)
-
-                    if 'subleading' in prong or 'leading' in prong:
-                      hname = 'hProngMatching_{}_{}_JetPtZ_R{}'.format(prong, match, jetR)
-                      self.plotting_utils.plot_prong_matching_delta(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold, min_pt, max_pt, plot_deltaz=True)
-
-                hname = 'hProngMatching_subleading-leading_correlation_JetPt_R{}'.format(jetR)
-                self.plotting_utils.plot_prong_matching_correlation(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
+        output_dir_money = os.path.join(output_dir, 'money')
+        self.create_output_subdir(output_dir_money, self.utils.grooming_label(grooming_setting))
+        self.plot_money_plot(observable, jetR, R_max, obs_label, obs_setting, grooming_setting, output_dir_money)
+
+        output_dir_toy = os.path.join(output_dir, 'toy')
+        self.create_output_subdir(output_dir_toy, self.utils.grooming_label(grooming_setting))
+        self.plot_money_plot(observable, jetR, R_max, obs_label, obs_setting, grooming_setting, output_dir_toy, option='toy')
+       
+      self.create_output_subdir(output_dir, 'ratios_Embedded_Truth')
+      self.plot_money_ratios(observable, output_dir, jetR, 'Embedded/Truth')
+      
+      self.create_output_subdir(output_dir, 'ratios_Purity')
+      self.plot_money_ratios(observable, output_dir, jetR, 'Tagging purity')
+
+  #---------------------------------------------------------------
+  # Plot the performance plots for a given R (from the theta_g config)
+  #---------------------------------------------------------------
+  def plot_performance_R(self, observable, R_max, jetR):
+
+    self.init_observable(observable)
+
+    # Create output subdirectories
+    output_dir = os.path.join(self.output_dir, 'performance')
+    self.create_output_subdir(output_dir, 'delta_pt')
+    self.create_output_subdir(output_dir, 'prong_matching_fraction_pt')
+    self.create_output_subdir(output_dir, 'prong_matching_deltaR')
+    self.create_output_subdir(output_dir, 'prong_matching_deltaZ')
+    self.create_output_subdir(output_dir, 'prong_matching_correlation')
+    
+    self.plotting_utils = plotting_utils_theta_g.PlottingUtils(output_dir, self.config_file, R_max=R_max,
+                                                       thermal = False, groomer_studies = True)
+
+    # Plot some subobservable-independent performance plots
+    self.plotting_utils.plot_delta_pt(jetR, self.pt_bins_reported)
+
+    # Plot prong matching histograms
+    self.prong_match_threshold = 0.5
+    min_pt = 80.
+    max_pt = 100.
+    prong_list = ['leading', 'subleading']
+    match_list = ['leading', 'subleading', 'ungroomed', 'outside']
+    for i, overlay_list in enumerate(self.plot_overlay_list):
+      for prong in prong_list:
+        for match in match_list:
+
+          hname = 'hProngMatching_{}_{}_JetPt_R{}'.format(prong, match, jetR)
+          self.plotting_utils.plot_prong_matching(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
+          self.plotting_utils.plot_prong_matching_delta(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold, min_pt, max_pt, plot_deltaz=False)
+
+          if 'subleading' in prong or 'leading' in prong:
+            hname = 'hProngMatching_{}_{}_JetPtZ_R{}'.format(prong, match, jetR)
+            self.plotting_utils.plot_prong_matching_delta(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold, min_pt, max_pt, plot_deltaz=True)
+
+      hname = 'hProngMatching_subleading-leading_correlation_JetPt_R{}'.format(jetR)
+      self.plotting_utils.plot_prong_matching_correlation(i, jetR, hname, self.obs_subconfig_list, self.obs_settings, self.grooming_settings, overlay_list, self.prong_match_threshold)
+
+  #---------------------------------------------------------------
+  # Return output dir of a given observable, R and R_max
+  #---------------------------------------------------------------
+  def output_dir_R(self, observable, jetR, R_max):
+
+    output_dir = os.path.join(self.output_dir, observable)
+    output_dir = os.path.join(output_dir, 'jetR{}'.format(jetR))
+    return os.path.join(output_dir, 'Rmax{}'.format(R_max))
 
   #---------------------------------------------------------------
   def plot_subjet_money_plot(self, observable, jetR, R_max, obs_setting,
@@ -1220,7 +1267,8 @@ class PlotGroomers(common_base.CommonBase):
     output_subdir = os.path.join(output_dir, name)
     setattr(self, 'output_dir_{}'.format(name), output_subdir)
     if not os.path.isdir(output_subdir):
-      os.makedirs(output_subdir)
+      # Plot tasks may create the same directory concurrently
+      os.makedirs(output_subdir, exist_ok=True)
 
     return output_subdir
 
@@ -1233,6 +1281,12 @@ if __name__ == '__main__':
                       type=str, metavar='configFile',
                       default='analysis_config.yaml',
                       help='Path of config file for analysis')
+  parser.add_argument('-n', '--nWorkers', action='store',
+                      type=int, metavar='nWorkers',
+                      default=0,
+                      help='Number of plotting processes (0: number of cores)')
+  parser.add_argument('--force', action='store_true',
+                      help='Replot also unchanged plots')
 
   # Parse the arguments
   args = parser.parse_args()
@@ -1246,4 +1300,4 @@ if __name__ == '__main__':
     sys.exit(0)
 
   analysis = PlotGroomers(config_file = args.configFile)
-  analysis.plot_groomers()
+  analysis.plot_groomers(n_workers = args.nWorkers, force = args.force)
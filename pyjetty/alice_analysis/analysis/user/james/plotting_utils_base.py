@@ -19,6 +19,8 @@ import numpy as np
 from array import *
 import ROOT
 
+from pyjetty.alice_analysis.analysis.base import object_cache
+
 # Base class
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 
@@ -72,6 +74,9 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
     else:
       self.fData = None
     self.fMC = ROOT.TFile(self.main_response, 'READ')
+
+    # Histograms and projections of the response file, shared by all plots
+    self.object_cache = object_cache.get_object_cache()
     
     if self.R_max:
       self.suffix = '_Rmax{}'.format(self.R_max)
@@ -219,12 +224,8 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
   # Get JES shift distribution for a fixed pT-gen
   def getJESshiftProj(self, name, label, minPt, maxPt):
     
-    histDeltaJES = self.fMC.Get(name)
-    histDeltaJES.SetName('{}_{}'.format(histDeltaJES.GetName(), label))
-    
-    histDeltaJES.GetXaxis().SetRangeUser(minPt, maxPt)
-    histDeltaJES.GetYaxis().SetRangeUser(-1., 1.)
-    h = histDeltaJES.ProjectionY()
+    h = self.object_cache.projection((self.main_response, name), 'y',
+                                     {0: (minPt, maxPt), 1: (-1., 1.)}, '{}_{}_py'.format(name, label))
     
     integral = h.Integral()
     if integral > 0:
@@ -238,11 +239,8 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
     # (pt-det, pt-truth, theta_g-det, theta_g-truth)
     name = 'hResponse_JetPt_{}_R{}_{}{}{}'.format(
       self.observable, jetR, obs_label, self.suffix, self.scaled_suffix).replace("__", "_")
-    hRM_4d = self.fMC.Get(name)
-    if not hRM_4d:
-      raise AttributeError("%s not found in file %s" % (name, self.main_response))
-    hRM = hRM_4d.Projection(1,0)
-    hRM.SetName('hResponse_JetPt_{}_R{}_{}_Proj'.format(self.observable, jetR, obs_label))
+    hRM = self.object_cache.projection((self.main_response, name), (1,0),
+      name='hResponse_JetPt_{}_R{}_{}_Proj'.format(self.observable, jetR, obs_label))
     
     # For each pT^gen, compute the standard deviation of the pT^det distribution
     
@@ -289,11 +287,8 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
     # Then, get the pT^gen spectrum for matched jets
     name = 'hResponse_JetPt_{}_R{}_{}{}{}'.format(
       self.observable, jetR, obs_label, self.suffix, self.scaled_suffix).replace("__", "_")
-    hRM_4d = self.fMC.Get(name)
-    if not hRM_4d:
-      raise AttributeError("%s not found in file %s" % (name, self.main_response))
-    hRM = hRM_4d.Projection(1,0)
-    hRM.SetName('hResponse_JetPt_{}_R{}_{}_Proj'.format(self.observable, jetR, obs_label))
+    hRM = self.object_cache.projection((self.main_response, name), (1,0),
+      name='hResponse_JetPt_{}_R{}_{}_Proj'.format(self.observable, jetR, obs_label))
     histPtGenMatched = hRM.ProjectionY("_py",1,hRM.GetNbinsX()) #avoid under and overflow bins
     histPtGenMatched.SetName('histPtGenMatched_R{}_{}'.format(jetR, obs_label))
     hpgm_xbins = [histPtGenMatched.GetXaxis().GetBinLowEdge(i) for i in \
@@ -344,9 +339,7 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
     # (pt-det, pt-truth, theta_g-det, theta_g-truth)
     name = 'hResponse_JetPt_{}_R{}_{}{}{}'.format(
       self.observable, jetR, obs_label, self.suffix, self.scaled_suffix).replace("__", '_')
-    hRM_4d = self.fMC.Get(name)
-    if not hRM_4d:
-      raise AttributeError("%s not found in file %s" % (name, self.main_response))
+    hRM_4d = self.object_cache.get(self.main_response, name)
 
     h_list = [] # Store hists in a list, since otherwise it seems I lose the marker information
                 # (removed from memory?)
@@ -356,9 +349,7 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
       min_pt_truth = pt_bins[i]
       max_pt_truth = pt_bins[i+1]
       
-      hRM_4d_clone = hRM_4d.Clone()
-      hRM_4d_clone.SetName('{}_{}'.format(hRM_4d_clone.GetName(), i))
-      hResolution = self.get_resolution(hRM_4d_clone, jetR, obs_label, min_pt_truth, max_pt_truth, 'hResolution_{}'.format(i))
+      hResolution = self.get_resolution(hRM_4d, jetR, obs_label, min_pt_truth, max_pt_truth, 'hResolution_{}'.format(i))
 
       hResolution.SetMarkerColor(self.ColorArray[i])
       hResolution.SetMarkerStyle(21)
@@ -377,10 +368,8 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
   # Get resolution for a fixed pT-gen
   def get_resolution(self, hRM_4d, jetR, obs_label, minPt, maxPt, label):
 
-    hRM = hRM_4d.GetAxis(1).SetRangeUser(minPt, maxPt)
-    hRM = hRM_4d.Projection(3,2)
     hrm_name = 'hResponse_JetPt_{}_R{}_{}_{}-{}_{}Proj'.format(self.observable, jetR, obs_label, minPt, maxPt, label)
-    hRM.SetName(hrm_name)
+    hRM = self.object_cache.projection(hRM_4d, (3,2), {1: (minPt, maxPt)}, hrm_name)
     
     # For each pT^gen, compute the standard deviation of the pT^det distribution
     
@@ -540,22 +529,20 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
   # Get residual for a fixed pT-gen
   def get_residual_proj(self, name, label, min, max, option='pt', min_pt=80., max_pt=100.):
 
-    h_residual_pt = self.fMC.Get(name)
-    if not h_residual_pt:
-      raise AttributeError("%s not found in file %s" % (name, self.main_response))
-    h_residual_pt.SetName('{}_{}'.format(h_residual_pt.GetName(), label))
+    h_residual_pt = self.object_cache.get(self.main_response, name)
 
+    ranges = {}
     if option == 'pt':
-      h_residual_pt.GetXaxis().SetRangeUser(min, max)
+      ranges[0] = (min, max)
     elif option == 'obs':
-      h_residual_pt.GetXaxis().SetRangeUser(min_pt, max_pt)
+      ranges[0] = (min_pt, max_pt)
       # Make sure that we do not overset the range
       top_edge = h_residual_pt.GetYaxis().GetBinUpEdge(h_residual_pt.GetYaxis().GetNbins())
       max = max if max <= top_edge else top_edge
       min = min if min <= max else max
-      h_residual_pt.GetYaxis().SetRangeUser(min, max)
-    h_residual_pt.GetZaxis().SetRangeUser(-0.5, 0.5)
-    h = h_residual_pt.Project3D('z')
+      ranges[1] = (min, max)
+    ranges[2] = (-0.5, 0.5)
+    h = self.object_cache.projection(h_residual_pt, 'z', ranges, '{}_{}_z'.format(name, label))
     
     integral = h.Integral()
     if integral > 0:
@@ -983,11 +970,8 @@ class PlottingUtilsBase(analysis_utils_obs.AnalysisUtils_Obs):
   # Get delta_pt for a fixed pT-gen
   def get_delta_pt_proj(self, name, label, minPt, maxPt):
     
-    h_delta_pt = self.fMC.Get(name)
-    h_delta_pt.SetName('{}_{}'.format(h_delta_pt.GetName(), label))
-    
-    h_delta_pt.GetXaxis().SetRangeUser(minPt, maxPt)
-    h = h_delta_pt.ProjectionY()
+    h = self.object_cache.projection((self.main_response, name), 'y',
+                                     {0: (minPt, maxPt)}, '{}_{}_py'.format(name, label))
     
     integral = h.Integral()
     if integral > 0:
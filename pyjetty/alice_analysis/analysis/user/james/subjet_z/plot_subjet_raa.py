@@ -176,7 +176,7 @@ class PlotRAA(common_base.CommonBase):
         self.ytitle = f'#frac{{1}}{{ #it{{#sigma}}_{{#it{{z}}_{{#it{{r}}}} > {self.bins[0]} }} }} #frac{{d#it{{#sigma}}}}{{d{self.xtitle}}}'
         
         # Normalize to the integral over the reported range except for the last bin,
-        # Note that histograms are already scaled for bin width in run_analysis.get_obs_distribution()
+        # Note that histograms are already scaled for bin width in run_analysis.load_1D_observables()
         integral_AA = self.h_main_AA.Integral(1, self.n_bins, 'width')
         self.h_main_AA.Scale(1./integral_AA)
         self.h_sys_AA.Scale(1./integral_AA)
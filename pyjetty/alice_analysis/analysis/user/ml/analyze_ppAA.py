@@ -65,6 +65,32 @@ def filter_four_vectors(X_particles, min_pt=0.):
 
     return X_particles
 
+#---------------------------------------------------------------
+# Read a set of rows (in any order) from an hdf5 dataset, without loading it whole
+# The dataset is read in contiguous blocks (of ~64 MB), and only the requested rows are kept
+#---------------------------------------------------------------
+def read_rows(dataset, indices):
+
+    row_bytes = dataset.dtype.itemsize * int(np.prod(dataset.shape[1:]))
+    block_size = max(1, (64 << 20) // row_bytes)
+
+    order = np.argsort(indices)
+    sorted_indices = indices[order]
+
+    rows = np.empty((len(indices),) + dataset.shape[1:], dtype=dataset.dtype)
+    i = 0
+    while i < len(sorted_indices):
+        start = sorted_indices[i]
+        stop = min(start + block_size, dataset.shape[0])
+        j = np.searchsorted(sorted_indices, stop)
+        rows[i:j] = dataset[start:stop][sorted_indices[i:j] - start]
+        i = j
+
+    # Restore the requested order
+    result = np.empty_like(rows)
+    result[order] = rows
+    return result
+
 ################################################################
 class AnalyzePPAA(common_base.CommonBase):
 
@@ -249,13 +275,9 @@ class AnalyzePPAA(common_base.CommonBase):
                         key_suffix = f'_{event_type}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
                         with h5py.File(os.path.join(self.output_dir, self.filename), 'r') as hf:
 
-                            # First, get the full input arrays
+                            # First, get the labels -- the (large) feature arrays are read lazily below,
+                            # only for the jets that are selected
                             self.y_total = hf[f'y{key_suffix}'][:3*self.n_total]
-                            X_particles_total = hf[f'X_four_vectors{key_suffix}'][:3*self.n_total]
-                            X_Nsub_total = hf[f'X_Nsub{key_suffix}'][:3*self.n_total]
-
-                            # Check whether any training entries are empty
-                            [print(f'WARNING: input entry {i} is empty') for i,x in enumerate(X_Nsub_total) if not x.any()]
 
                             # Determine total number of jets
                             total_jets = int(self.y_total.size)
@@ -264,34 +286,32 @@ class AnalyzePPAA(common_base.CommonBase):
                             print(f'Total number of jets available: {total_jets_pp} (pp), {total_jets_AA} (AA)')
 
                             # If there is an imbalance, remove excess jets
+                            indices_to_remove = np.array([], dtype=int)
                             if total_jets_pp / total_jets_AA > 1.:
                                 indices_to_remove = np.where( np.isclose(self.y_total,0) )[0][total_jets_AA:]
                             elif total_jets_pp / total_jets_AA < 1.:
                                 indices_to_remove = np.where( np.isclose(self.y_total,1) )[0][total_jets_pp:]
-                            y_balanced = np.delete(self.y_total, indices_to_remove)
-                            X_particles_balanced = np.delete(X_particles_total, indices_to_remove, axis=0)
-                            X_Nsub_balanced = np.delete(X_Nsub_total, indices_to_remove, axis=0)
+                            indices_balanced = np.delete(np.arange(total_jets), indices_to_remove)
+                            y_balanced = self.y_total[indices_balanced]
                             total_jets = int(y_balanced.size)
                             total_jets_AA = int(np.sum(y_balanced))
                             total_jets_pp = total_jets - total_jets_AA 
                             print(f'Total number of jets available after balancing: {total_jets_pp} (pp), {total_jets_AA} (AA)')
 
-                            # Shuffle dataset 
+                            # Shuffle dataset, and truncate to the requested size
                             idx = np.random.permutation(len(y_balanced))
-                            if y_balanced.shape[0] == idx.shape[0]:
-                                y_shuffled = y_balanced[idx]
-                                X_particles_shuffled = X_particles_balanced[idx]
-                                X_Nsub_shuffled = X_Nsub_balanced[idx]
-                            else:
-                                print(f'MISMATCH of shape: {y_shuffled.shape} vs. {idx.shape}')
-
-                            # Truncate the input arrays to the requested size
-                            self.y = y_shuffled[:self.n_total]
-                            self.X_particles = X_particles_shuffled[:self.n_total]
-                            self.X_Nsub = X_Nsub_shuffled[:self.n_total]
+                            indices_selected = indices_balanced[idx][:self.n_total]
+
+                            # Read only the selected jets from file
+                            self.y = self.y_total[indices_selected]
+                            self.X_particles = read_rows(hf[f'X_four_vectors{key_suffix}'], indices_selected)
+                            self.X_Nsub = read_rows(hf[f'X_Nsub{key_suffix}'], indices_selected)
                             print(f'y_shuffled sum: {np.sum(self.y)}')
                             print(f'y_shuffled shape: {self.y.shape}')
 
+                            # Check whether any training entries are empty
+                            [print(f'WARNING: input entry {i} is empty') for i,x in enumerate(self.X_Nsub) if not x.any()]
+
                             # If testing against old dataset, load and swap the pp or AA values 
                             # (does not support balancing the number of jets at the moment)
                             if self.old_pp or self.old_AA:
@@ -12,6 +12,8 @@ import yaml
 # Analysis utilities
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 from pyjetty.alice_analysis.analysis.base import analysis_base
+from pyjetty.alice_analysis.analysis.base import object_cache
+from pyjetty.alice_analysis.process.base import bootstrap
 
 # Load pyjetty ROOT utils
 ROOT.gSystem.Load('libpyjetty_rutil')
@@ -32,7 +34,7 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
                output_dir='', file_format='', rebin_response=False, truncation=False,
                binning=False, prior_variation_parameter=0., R_max = None,
                prong_matching_response = False, thermal_model = False,
-               use_miss_fake = False, suffix='', **kwargs):
+               use_miss_fake = False, suffix='', response_cache=None, **kwargs):
 
     super(Roounfold_Obs, self).__init__(input_file_data, input_file_response, config_file,
                                         output_dir, file_format, **kwargs)
@@ -49,11 +51,16 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
     self.thermal_model = thermal_model
     self.use_miss_fake = use_miss_fake
     self.suffix = suffix
+    self.response_cache = response_cache
+    self.use_histutils = True
 
     self.initialize_config()
 
     self.histutils = ROOT.RUtil.HistUtils()
 
+    # Projections of the response, shared with the analysis and plotting stages
+    self.object_cache = object_cache.get_object_cache()
+
     self.get_responses(rebin_response)
 
     # Create output files to store results
@@ -222,17 +229,33 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
       self.reg_param_name = '#it{n}_{iter}'
       self.errorType = ROOT.RooUnfold.kCovToy
 
+      # Unfold the Poisson-bootstrap replicas of the data (<name_data>_bootstrap, see
+      # process/base/bootstrap.py), with the replicas of the response if present
+      self.bootstrap_unfolding = config['bootstrap_unfolding'] if 'bootstrap_unfolding' in config else False
+      # In the thermal closure the unfolded "data" is the smeared MC, not the data replicas
+      if self.bootstrap_unfolding and self.thermal_model:
+        raise ValueError('bootstrap_unfolding is not supported with thermal_model')
+
   #---------------------------------------------------------------
   # Get responses, either from file or manually rebin
   #---------------------------------------------------------------
   def get_responses(self, rebin_response=False):
 
     response_file_name = os.path.join(self.output_dir, 'response.root')
+
+    # If a response cache is used, load the rebinned response from it if the
+    # rebinning inputs are unchanged -- otherwise rebin, and store the result
+    cache_key = None
+    if self.response_cache:
+      cache_key = self.response_cache_key()
+      if not rebin_response:
+        rebin_response = not self.response_cache.fetch(cache_key, response_file_name)
+
     if rebin_response:
       f = ROOT.TFile(response_file_name, 'RECREATE')
       f.Close()
 
-    use_histutils = True
+    use_histutils = self.use_histutils
 
     # Rebin response matrix, and create RooUnfoldResponse object
     # THn response matrix is: (pt-det, pt-true, obs-det, obs-true)
@@ -270,14 +293,7 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
         n_bins_truth = getattr(self, 'n_bins_truth_{}'.format(obs_label))
         truth_bin_array = getattr(self, 'truth_bin_array_{}'.format(obs_label))
 
-        # For SD, fill underflow bin to include untagged fraction in the unfolding
-        # If underflow is activated, create a new underflow bin for the observable
-        if grooming_setting:
-          move_underflow = 'sd' in grooming_setting
-        else:
-          move_underflow = False
-        if self.prong_matching_response:
-          move_underflow = False
+        move_underflow = self.move_underflow(grooming_setting)
 
         # Get data histogram
         hData = self.fData.Get(name_data)
@@ -407,6 +423,58 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
         setattr(self, name_roounfold_shape2, roounfold_response_shape2)
         f.Close()
 
+    if cache_key and rebin_response:
+      self.response_cache.store(cache_key, response_file_name)
+
+  #---------------------------------------------------------------
+  # For SD, fill underflow bin to include untagged fraction in the unfolding
+  # If underflow is activated, create a new underflow bin for the observable
+  #---------------------------------------------------------------
+  def move_underflow(self, grooming_setting):
+
+    if self.prong_matching_response:
+      return False
+    if grooming_setting:
+      return 'sd' in grooming_setting
+    return False
+
+  #---------------------------------------------------------------
+  # Compute response cache key from all inputs that determine response.root:
+  #   input THn file, binnings, prior variations, move_underflow, use_miss_fake
+  #---------------------------------------------------------------
+  def response_cache_key(self):
+
+    input_files = [self.input_file_response]
+
+    # Option 6 scales the prior by data / MC-det, so the data enters the response
+    if int(self.prior_variation_option) == 6 and self.prior_variation_parameter > 1e-8:
+      input_files.append(self.input_file_data)
+
+    settings = {'observable': self.observable,
+                'use_histutils': self.use_histutils,
+                'prior_variation_parameter': self.prior_variation_parameter,
+                'prior_variation_option': self.prior_variation_option,
+                'shape_variation_parameter1': self.shape_variation_parameter1,
+                'shape_variation_parameter2': self.shape_variation_parameter2,
+                'use_miss_fake': self.use_miss_fake,
+                'responses': []}
+
+    for jetR in self.jetR_list:
+      for i, _ in enumerate(self.obs_subconfig_list):
+
+        obs_label = self.utils.obs_label(self.obs_settings[i], self.grooming_settings[i])
+        settings['responses'].append({
+          'name_thn': getattr(self, 'name_thn_R{}_{}'.format(jetR, obs_label)),
+          'name_thn_rebinned': getattr(self, 'name_thn_rebinned_R{}_{}'.format(jetR, obs_label)),
+          'name_roounfold': getattr(self, 'name_roounfold_R{}_{}'.format(jetR, obs_label)),
+          'det_pt_bin_array': getattr(self, 'det_pt_bin_array_{}'.format(obs_label)),
+          'truth_pt_bin_array': getattr(self, 'truth_pt_bin_array_{}'.format(obs_label)),
+          'det_bin_array': getattr(self, 'det_bin_array_{}'.format(obs_label)),
+          'truth_bin_array': getattr(self, 'truth_bin_array_{}'.format(obs_label)),
+          'move_underflow': self.move_underflow(self.grooming_settings[i])})
+
+    return self.response_cache.key(input_files, settings)
+
   #---------------------------------------------------------------
   # Create a set of output directories for a given observable
   #---------------------------------------------------------------
@@ -539,6 +607,11 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
       self.plot_correlation_coefficients(covariance_matrix, jetR, obs_label, i)
 
     fResult.Close()
+
+    # Unfold bootstrap replicas with the final regularization parameter
+    if self.bootstrap_unfolding:
+      self.unfold_bootstrap_replicas(jetR, obs_label, grooming_setting, reg_param_final)
+
     print('Done unfolding')
 
     # Plot unfolded results
@@ -548,6 +621,101 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
     self.plot_unfolded_observable(jetR, obs_label, obs_setting, grooming_setting, reg_param_final)
     self.plot_unfolded_pt(jetR, obs_label, obs_setting, grooming_setting)
 
+  #################################################################################################
+  # Unfold the bootstrap replicas of the data (each with the corresponding replica of the
+  # response, if the response file has replicas, otherwise with the nominal response), and
+  # write to the result file:
+  #   hUnfolded_..._bootstrap: TH3D of the unfolded replicas (pt-truth, obs-truth, replica)
+  #   hUnfolded_..._bootstrap_stat: nominal result, with the standard deviation of the replicas as errors
+  #################################################################################################
+  def unfold_bootstrap_replicas(self, jetR, obs_label, grooming_setting, reg_param):
+
+    name_data = getattr(self, 'name_data_R{}_{}'.format(jetR, obs_label))
+    hData_bootstrap = self.fData.Get('{}_bootstrap'.format(name_data))
+    if not hData_bootstrap:
+      print('No bootstrap replicas of {} in {}'.format(name_data, self.input_file_data))
+      return
+    data_replicas = bootstrap.replicas(hData_bootstrap)
+    n_replicas = len(data_replicas)
+
+    n_pt_bins_det = getattr(self, 'n_pt_bins_det_{}'.format(obs_label))
+    det_pt_bin_array = getattr(self, 'det_pt_bin_array_{}'.format(obs_label))
+    n_pt_bins_truth = getattr(self, 'n_pt_bins_truth_{}'.format(obs_label))
+    truth_pt_bin_array = getattr(self, 'truth_pt_bin_array_{}'.format(obs_label))
+    n_bins_det = getattr(self, 'n_bins_det_{}'.format(obs_label))
+    det_bin_array = getattr(self, 'det_bin_array_{}'.format(obs_label))
+    n_bins_truth = getattr(self, 'n_bins_truth_{}'.format(obs_label))
+    truth_bin_array = getattr(self, 'truth_bin_array_{}'.format(obs_label))
+    move_underflow = self.move_underflow(grooming_setting)
+
+    # Responses: rebinned replicas of the response THn, if present
+    response = getattr(self, 'roounfold_response_R{}_{}'.format(jetR, obs_label))
+    responses = [response] * n_replicas
+    name_thn = getattr(self, 'name_thn_R{}_{}'.format(jetR, obs_label))
+    hResponse_bootstrap = self.fResponse.Get('{}_bootstrap'.format(name_thn))
+    if hResponse_bootstrap:
+      response_file_name = os.path.join(self.output_dir, 'response_bootstrap_R{}_{}.root'.format(jetR, obs_label))
+      f = ROOT.TFile(response_file_name, 'RECREATE')
+      f.Close()
+      n_dim = 4
+      for k in range(n_replicas):
+        thn_sparse = bootstrap.replica(hResponse_bootstrap, k)
+        thn = ROOT.THnF('{}_{}'.format(name_thn, k), thn_sparse.GetTitle(), n_dim,
+                        array('i', [thn_sparse.GetAxis(j).GetNbins() for j in range(n_dim)]),
+                        array('d', [thn_sparse.GetAxis(j).GetXmin() for j in range(n_dim)]),
+                        array('d', [thn_sparse.GetAxis(j).GetXmax() for j in range(n_dim)]))
+        for j in range(n_dim):
+          if thn_sparse.GetAxis(j).GetXbins().GetSize() > 0:
+            thn.GetAxis(j).Set(thn_sparse.GetAxis(j).GetNbins(), thn_sparse.GetAxis(j).GetXbins().GetArray())
+        thn.Add(thn_sparse)
+        self.histutils.rebin_thn(
+          response_file_name, thn, '{}_rebinned_{}'.format(name_thn, k),
+          'roounfold_response_bootstrap{}'.format(k), n_dim,
+          n_pt_bins_det, det_pt_bin_array, n_bins_det, det_bin_array,
+          n_pt_bins_truth, truth_pt_bin_array, n_bins_truth, truth_bin_array,
+          'R{}_{}_bootstrap{}'.format(jetR, obs_label, k), self.prior_variation_parameter,
+          self.prior_variation_option, move_underflow, self.use_miss_fake)
+      f = ROOT.TFile(response_file_name, 'READ')
+      responses = []
+      for k in range(n_replicas):
+        response_k = f.Get('roounfold_response_bootstrap{}'.format(k))
+        response_k.UseOverflow(False)
+        responses.append(response_k)
+      f.Close()
+
+    # Unfold all replicas, and collect the in-range contents (replica, obs, pt)
+    hUnfolded = getattr(self, 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param))
+    n_x = n_pt_bins_truth
+    n_y = n_bins_truth
+    contents = np.zeros((n_replicas, n_y, n_x))
+    for k, h in enumerate(data_replicas):
+      h_k = self.histutils.rebin_th2(h, '{}_bootstrap{}'.format(name_data, k), det_pt_bin_array, n_pt_bins_det,
+                                     det_bin_array, n_bins_det, move_underflow)
+      unfold_bayes = ROOT.RooUnfoldBayes(responses[k], h_k, reg_param)
+      hUnfolded_k = unfold_bayes.Hreco(ROOT.RooUnfold.kNoError)
+      if not self.use_miss_fake:
+        hUnfolded_k.Divide(getattr(self, 'hKinematicEfficiency_R{}_{}'.format(jetR, obs_label)))
+      for j in range(n_y):
+        for i in range(n_x):
+          contents[k, j, i] = hUnfolded_k.GetBinContent(i+1, j+1)
+
+    name = '{}_bootstrap'.format(hUnfolded.GetName())
+    h_replicas = ROOT.TH3D(name, name, n_x, truth_pt_bin_array, n_y, truth_bin_array,
+                           n_replicas, array('d', range(n_replicas+1)))
+    h_stat = hUnfolded.Clone('{}_stat'.format(name))
+    std = np.std(contents, axis=0, ddof=1)
+    for j in range(n_y):
+      for i in range(n_x):
+        h_stat.SetBinError(i+1, j+1, std[j, i])
+        for k in range(n_replicas):
+          h_replicas.SetBinContent(i+1, j+1, k+1, contents[k, j, i])
+    fResult_name = getattr(self, 'fResult_name_R{}_{}'.format(jetR, obs_label))
+    fResult = ROOT.TFile(fResult_name, 'UPDATE')
+    h_replicas.Write()
+    h_stat.Write()
+    fResult.Close()
+    print('Unfolded {} bootstrap replicas of {}'.format(n_replicas, name_data))
+
   #################################################################################################
   # Plot unfolded observable for various pt slices
   #################################################################################################
@@ -1561,10 +1729,7 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
       getattr(self, 'name_thn_rebinned_R{}_{}'.format(jetR, obs_label))
     hResponse = getattr(self, name_response)
 
-    hResponse4D = hResponse.Clone('{}_clone'.format(hResponse.GetName()))
-
-    hMC_Det = hResponse4D.Projection(2,0)
-    hMC_Det.SetName(name)
+    hMC_Det = self.object_cache.projection(hResponse, (2,0), name=name)
     return hMC_Det
 
   #################################################################################################
@@ -1578,10 +1743,7 @@ class Roounfold_Obs(analysis_base.AnalysisBase):
       getattr(self, 'name_thn_rebinned_R{}_{}'.format(jetR, obs_label))
     hResponse = getattr(self, name_response)
 
-    hResponse4D = hResponse.Clone('{}_clone'.format(hResponse.GetName()))
-
-    hMC_Truth = hResponse4D.Projection(3,1)
-    hMC_Truth.SetName(name)
+    hMC_Truth = self.object_cache.projection(hResponse, (3,1), name=name)
     return hMC_Truth
 
   #################################################################################################
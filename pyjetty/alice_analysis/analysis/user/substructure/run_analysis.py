@@ -45,6 +45,10 @@ import shutil
 import hepdata_lib
 
 from pyjetty.alice_analysis.analysis.base import common_base
+from pyjetty.alice_analysis.analysis.base import object_cache
+from pyjetty.alice_analysis.analysis.base import response_cache
+from pyjetty.alice_analysis.analysis.base import systematics_engine
+from pyjetty.alice_analysis.analysis.base import hepdata_writer
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 from pyjetty.alice_analysis.analysis.user.substructure import roounfold_obs
 
@@ -97,6 +101,22 @@ class RunAnalysis(common_base.CommonBase):
         self.use_miss_fake = config['use_miss_fake']
     else:
         self.use_miss_fake = True
+
+    # Content-addressed cache of rebinned responses, shared across systematics and re-runs
+    if 'use_response_cache' in config:
+        self.use_response_cache = config['use_response_cache']
+    else:
+        self.use_response_cache = True
+    if 'response_cache_dir' in config:
+        self.response_cache_dir = config['response_cache_dir']
+    else:
+        self.response_cache_dir = os.path.join(config['output_dir'], 'response_cache')
+
+    # Memory limit of the process-wide cache of files, histograms and projections
+    if 'object_cache_max_mb' in config:
+        self.object_cache_max_mb = config['object_cache_max_mb']
+    else:
+        self.object_cache_max_mb = 2000
     
     # Set whether pp or PbPb
     if 'constituent_subtractor' in config:
@@ -189,6 +209,22 @@ class RunAnalysis(common_base.CommonBase):
     self.output_dir = config['output_dir']
     self.create_output_dirs()
 
+    self.response_cache = None
+    if self.use_response_cache:
+      self.response_cache = response_cache.ResponseCache(cache_dir=self.response_cache_dir)
+
+    # Open files, histograms and projections, shared by the analysis and plotting stages
+    self.object_cache = object_cache.get_object_cache()
+    self.object_cache.max_bytes = self.object_cache_max_mb * 1e6
+
+    # Systematic uncertainties as arrays (variation x pt bin x obs bin)
+    self.systematics = systematics_engine.SystematicsEngine()
+    self.systematic_tables = {}
+
+    # Final results and uncertainty breakdown in array form, for the HEPData submission
+    self.result_tables = hepdata_writer.ResultTables(
+      os.path.join(self.output_dir, self.observable, 'systematics', 'hepdata_results.json'))
+
   #---------------------------------------------------------------
   # Create a set of output directories for a given observable
   #---------------------------------------------------------------
@@ -276,6 +312,8 @@ class RunAnalysis(common_base.CommonBase):
     # Plot additional performance plots
     if self.do_plot_performance:
       self.plot_performance() # You must implement this
+
+    self.object_cache.print_stats()
         
   #----------------------------------------------------------------------
   def perform_unfolding(self):
@@ -324,7 +362,8 @@ class RunAnalysis(common_base.CommonBase):
         self.observable, data, response, self.config_file, output_dir, self.file_format,
         rebin_response=rebin_response, prior_variation_parameter=prior_variation_parameter,
         truncation=truncation, binning=binning, R_max=R_max,
-        prong_matching_response=prong_matching_response, use_miss_fake=self.use_miss_fake)
+        prong_matching_response=prong_matching_response, use_miss_fake=self.use_miss_fake,
+        response_cache=self.response_cache)
       analysis.roounfold_obs()
 
     # Unfold thermal closure test (for main R_max only)
@@ -336,25 +375,14 @@ class RunAnalysis(common_base.CommonBase):
       analysis = roounfold_obs.Roounfold_Obs(
         self.observable, self.main_data, self.fThermal, self.config_file, output_dir,
         self.file_format, rebin_response=rebin_response, R_max=R_max, thermal_model = True,
-        use_miss_fake=self.use_miss_fake)
+        use_miss_fake=self.use_miss_fake, response_cache=self.response_cache)
       analysis.roounfold_obs()
 
   #----------------------------------------------------------------------
   def check_rebin_response(self, output_dir):
 
-    rebin_response = True
-    response_path = os.path.join(output_dir, 'response.root')
-    if os.path.exists(response_path):
-      rebin_response = False
-      if self.force_rebin_response:
-        print('Response {} exists -- force re-create...'.format(response_path))
-        rebin_response = True
-      else:
-        print('Response {} exists -- don\'t re-create.'.format(response_path))
-    else:
-      print('Response {} doesn\'t exist -- create it...'.format(response_path))
-
-    return rebin_response
+    return self.utils.check_rebin_response(output_dir, self.force_rebin_response,
+                                           self.response_cache)
 
   #----------------------------------------------------------------------
   def get_obs_max_bins(self, subconfig, obs_label):
@@ -437,6 +465,10 @@ class RunAnalysis(common_base.CommonBase):
       # Load 2D unfolded results from their files into attributes
       self.load_2D_observables(jetR, obs_label, obs_setting, grooming_setting, reg_param)
 
+      # Load 1D unfolded results of all variations for all pt slices, and compute
+      # the systematic table (deviations of all variations) in one pass
+      self.load_1D_observables(jetR, obs_label, obs_setting, grooming_setting, reg_param)
+
       # Loop through pt slices, and compute systematics for each 1D observable distribution
       for i in range(0, len(self.pt_bins_reported) - 1):
         min_pt_truth = self.pt_bins_reported[i]
@@ -444,10 +476,6 @@ class RunAnalysis(common_base.CommonBase):
         minbin = self.obs_min_bins(obs_label)[i]
         maxbin = self.obs_max_bins(obs_label)[i]
 
-        # Load 1D unfolded results for each pt slice into attributes
-        self.load_1D_observables(jetR, obs_label, obs_setting, grooming_setting, reg_param,
-                                 min_pt_truth, max_pt_truth, minbin, maxbin)
-
         # Compute systematics of the 1D distributions for each pt slice
         self.compute_obs_systematic(jetR, obs_label, obs_setting, grooming_setting, reg_param,
                                     min_pt_truth, max_pt_truth, minbin, maxbin, final=False)
@@ -490,6 +518,11 @@ class RunAnalysis(common_base.CommonBase):
       # Copy plots of final reg param, for convenience
       self.copy_unfolding_tests(jetR, obs_label, reg_param_final, min_pt_truth, max_pt_truth)
 
+      # Store final result and uncertainty breakdown as arrays
+      self.add_result_table(jetR, obs_label, grooming_setting, min_pt_truth, max_pt_truth, maxbin)
+
+    self.result_tables.write()
+
   #----------------------------------------------------------------------
   def copy_unfolding_tests(self, jetR, obs_label, reg_param_final, min_pt, max_pt):
 
@@ -562,58 +595,111 @@ class RunAnalysis(common_base.CommonBase):
 
       output_dir = getattr(self, 'output_dir_{}'.format(systematic))
       path = os.path.join(output_dir, 'fResult_R{}_{}.root'.format(jetR, obs_label))
-      f = ROOT.TFile(path, 'READ')
       name = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param)
-      self.retrieve_histo_and_set_attribute(name, f, systematic)
+      self.retrieve_histo_and_set_attribute(name, path, systematic)
 
       if systematic == 'main':
         # Get regularization parameter variations, and store as attributes
         name = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param+self.reg_param_variation)
-        self.retrieve_histo_and_set_attribute(name, f)
+        self.retrieve_histo_and_set_attribute(name, path)
         name = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param-self.reg_param_variation)
-        self.retrieve_histo_and_set_attribute(name, f)
+        self.retrieve_histo_and_set_attribute(name, path)
 
   #----------------------------------------------------------------------
-  def retrieve_histo_and_set_attribute(self, name, f, suffix = ''):
+  def retrieve_histo_and_set_attribute(self, name, path, suffix = ''):
 
-    h = f.Get(name)
-    if not h:
-      raise ValueError("Histogram with name %s not found in file %s" % (name, f.GetName()))
-    h.SetDirectory(0)
+    # Read once per process (the file is kept open in the object cache)
+    h = self.object_cache.get(path, name)
     setattr(self, '{}{}'.format(name, suffix), h)
 
   #----------------------------------------------------------------------
-  # Get 1D histograms
-  # Normalize by integral, i.e. N_jets,inclusive in this pt-bin
+  # Get 1D histograms of all variations, for all pt slices at once
+  # Normalize by integral, i.e. N_jets,inclusive in each pt-bin
   #----------------------------------------------------------------------
-  def load_1D_observables(self, jetR, obs_label, obs_setting, grooming_setting,
-                          reg_param, min_pt_truth, max_pt_truth, minbin, maxbin):
+  def load_1D_observables(self, jetR, obs_label, obs_setting, grooming_setting, reg_param):
 
-    # Get all other systematic variations, and store as attributes
+    # 2D unfolded results of all systematic variations, and the labels of their 1D histograms
+    labels = []
+    hists = []
     for systematic in self.systematics_list:
-
       name2D = 'hUnfolded_{}_R{}_{}_{}{}'.format(self.observable, jetR, obs_label,
                                                  reg_param, systematic)
-      name1D = 'h{}_{}_R{}_{}_n{}_{}-{}'.format(systematic, self.observable, jetR,
-                                            obs_label, reg_param, min_pt_truth, max_pt_truth)
-      store_tagging_fraction = (systematic == 'main')
-      self.get_obs_distribution(jetR, obs_label, name2D, name1D, reg_param, grooming_setting,
-                                min_pt_truth, max_pt_truth, minbin, maxbin,
-                                store_tagging_fraction=store_tagging_fraction)
+      labels.append(systematic)
+      hists.append(getattr(self, name2D))
 
       if systematic == 'main':
-        # Get regularization parameter variations, and store as attributes
-        name2D = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param+self.reg_param_variation)
-        name1D = 'hRegParam1_{}_R{}_{}_n{}_{}-{}'.format(self.observable, jetR, obs_label,
-                                                         reg_param, min_pt_truth, max_pt_truth)
-        hRegParam1 = self.get_obs_distribution(jetR, obs_label, name2D, name1D, reg_param, grooming_setting,
-                                               min_pt_truth, max_pt_truth, minbin, maxbin)
-
-        name2D = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param-self.reg_param_variation)
-        name1D = 'hRegParam2_{}_R{}_{}_n{}_{}-{}'.format(self.observable, jetR, obs_label,
-                                                         reg_param, min_pt_truth, max_pt_truth)
-        hRegParam2 = self.get_obs_distribution(jetR, obs_label, name2D, name1D, reg_param, grooming_setting,
-                                               min_pt_truth, max_pt_truth, minbin, maxbin)
+        # Regularization parameter variations
+        for label, reg_param_varied in [('RegParam1', reg_param+self.reg_param_variation),
+                                        ('RegParam2', reg_param-self.reg_param_variation)]:
+          name2D = 'hUnfolded_{}_R{}_{}_{}'.format(self.observable, jetR, obs_label, reg_param_varied)
+          labels.append(label)
+          hists.append(getattr(self, name2D))
+
+    # Project, scale by bin width and normalize all variations and pt slices at once
+    n_pt_bins = len(self.pt_bins_reported) - 1
+    pt_bins = [(self.pt_bins_reported[i], self.pt_bins_reported[i+1]) for i in range(n_pt_bins)]
+    n_obs_bins = hists[0].GetNbinsY()
+    minbins = [minbin if minbin else 1 for minbin in self.obs_min_bins(obs_label)[:n_pt_bins]]
+    maxbins = [maxbin if maxbin else n_obs_bins for maxbin in self.obs_max_bins(obs_label)[:n_pt_bins]]
+    tagged = bool(grooming_setting and 'sd' in grooming_setting)
+    contents, sumw2, n_jets_inclusive, n_jets_tagged = self.systematics.distributions(
+      hists, pt_bins, minbins, maxbins, tagged=tagged)
+    distributions = {label: (contents[i], sumw2[i]) for i, label in enumerate(labels)}
+
+    # Store 1D histograms as attributes
+    h_template = self.object_cache.projection(hists[0], 'y')
+    for i, label in enumerate(labels):
+      for j, (min_pt_truth, max_pt_truth) in enumerate(pt_bins):
+        name1D = 'h{}_{}_R{}_{}_n{}_{}-{}'.format(label, self.observable, jetR,
+                                              obs_label, reg_param, min_pt_truth, max_pt_truth)
+        setattr(self, name1D, self.systematics.to_hist(h_template, name1D, contents[i, j], sumw2[i, j]))
+
+    # If SD, store tagging fraction of the main result
+    if tagged:
+      i = labels.index('main')
+      for j, (min_pt_truth, max_pt_truth) in enumerate(pt_bins):
+        f_tagging_name = 'tagging_fraction_R{}_{}_{}-{}_{}'.format(
+          jetR, obs_label, min_pt_truth, max_pt_truth, reg_param)
+        setattr(self, f_tagging_name, n_jets_tagged[i, j]/n_jets_inclusive[i, j])
+
+    # Compute deviations and combined systematics of all variations and pt slices
+    sources, groups = self.systematic_sources()
+    self.systematic_tables[(jetR, obs_label, reg_param)] = self.systematics.table(
+      distributions, sources, groups)
+
+  #----------------------------------------------------------------------
+  # Systematic sources computed from the unfolded variations, for the systematic table:
+  #   {name: (reference, [variations], method)}, and the groups of sources
+  # Sources which are not unfolded variations (thermal_closure) are not included
+  #----------------------------------------------------------------------
+  def systematic_sources(self):
+
+    sources = {}
+    generators = []
+    for systematic in self.systematics_list:
+
+      if systematic == 'main':
+        sources['RegParam'] = ('main', ['RegParam1', 'RegParam2'], 'average')
+      elif systematic == 'prior1':
+        sources['prior'] = ('main', ['prior1', 'prior2'], 'max')
+      elif systematic == 'subtraction1':
+        sources['subtraction'] = ('main', ['subtraction1', 'subtraction2'], 'max')
+      elif 'generator' in systematic:
+        if systematic[-1] != '0':
+          sources[systematic] = ('fastsim_generator0', [systematic], 'signed')
+          generators.append(systematic)
+      elif systematic not in ['prior2', 'subtraction2', 'thermal_closure']:
+        signed = (systematic == 'trkeff')
+        sources[systematic] = ('main', [systematic], 'signed' if signed else 'abs')
+
+    if generators:
+      sources['fastsim_generator'] = ('fastsim_generator0', generators, 'average')
+
+    groups = {}
+    unfolding = [source for source in ['RegParam', 'prior', 'truncation', 'binning'] if source in sources]
+    if unfolding:
+      groups['Unfolding'] = (unfolding, 'rms')
+    return sources, groups
 
   #----------------------------------------------------------------------
   # Compute systematics
@@ -676,8 +762,10 @@ class RunAnalysis(common_base.CommonBase):
         self.utils.remove_periods(jetR), obs_label, int(min_pt_truth), int(max_pt_truth))
       setattr(self, name, hSystematic_Unfolding)
     else:
-      hSystematic_Unfolding = self.construct_unfolding_uncertainty(h_unfolding_list)
-      setattr(self, name, hSystematic_Unfolding)
+      maxbin_adj = maxbin + 1 if (grooming_setting and maxbin) else maxbin
+      hSystematic_Unfolding = self.construct_systematic_average(
+        hMain, 'Unfolding', jetR, obs_label, reg_param, min_pt_truth, max_pt_truth,
+        minbin, maxbin_adj, name=name)
     h_list.append(hSystematic_Unfolding)
 
     if do_generator:
@@ -695,13 +783,11 @@ class RunAnalysis(common_base.CommonBase):
           'fastsim_generator0', self.observable, jetR, obs_label, reg_param, int(min_pt_truth), int(max_pt_truth))
         h_reference = getattr(self, name_reference)
 
-        # Calculate systematic average for final fast simulation uncertainty
+        # Systematic average for final fast simulation uncertainty
         maxbin_adj = maxbin + 1 if (grooming_setting and maxbin) else maxbin
-        n_generators = len([i for i in self.systematics_list if 'generator' in i])
         hSystematic_fastsim = self.construct_systematic_average(
           h_reference, 'fastsim_generator', jetR, obs_label, reg_param, min_pt_truth, max_pt_truth,
-          minbin, maxbin_adj, n_ratios=n_generators-1, takeMaxDev=False)
-        setattr(self, name, hSystematic_fastsim)
+          minbin, maxbin_adj, name=name)
       h_list.append(hSystematic_fastsim)
 
     # Construct total systematic uncertainty: Add all systematic uncertainties in quadrature
@@ -757,29 +843,34 @@ class RunAnalysis(common_base.CommonBase):
 
 
   #----------------------------------------------------------------------
-  # Retrieve a given systematic histogram
-  def retrieve_systematic(self, systematic, jetR, obs_label,
-                           reg_param, min_pt_truth, max_pt_truth):
+  # Return the label of the systematic histogram of a systematic variation,
+  # or None if the variation is combined into the histogram of another one
+  def systematic_label(self, systematic):
 
     if systematic == 'main':
-      sys_label = 'RegParam'
+      return 'RegParam'
     elif systematic in ['prior1', 'prior2']:
       if systematic == 'prior1':
-        sys_label = 'prior'
-      else:
-        return None
+        return 'prior'
+      return None
     elif systematic in ['subtraction1', 'subtraction2']:
       if systematic == 'subtraction1':
-        sys_label = 'subtraction'
-      else:
-        return None
+        return 'subtraction'
+      return None
     elif 'fastsim_generator' in systematic:
       if int(systematic[-1]) == (len(self.fastsim_response_list) - 1):
-        sys_label = 'generator'
-      else:
-        return None
-    else:
-      sys_label = systematic
+        return 'generator'
+      return None
+    return systematic
+
+  #----------------------------------------------------------------------
+  # Retrieve a given systematic histogram
+  def retrieve_systematic(self, systematic, jetR, obs_label,
+                           reg_param, min_pt_truth, max_pt_truth):
+
+    sys_label = self.systematic_label(systematic)
+    if not sys_label:
+      return None
     if reg_param:
         name = 'hSystematic_{}_{}_R{}_{}_n{}_{}-{}'.format(
                 self.observable, sys_label, jetR, obs_label,
@@ -822,13 +913,13 @@ class RunAnalysis(common_base.CommonBase):
     if systematic == 'main':
       h_systematic_ratio = self.construct_systematic_average(
             hMain, 'RegParam', jetR, obs_label, reg_param,
-            min_pt_truth, max_pt_truth, minbin, maxbin, takeMaxDev=False)
+            min_pt_truth, max_pt_truth, minbin, maxbin)
 
     elif systematic in ['prior1', 'prior2']:
       if systematic == 'prior1':
         h_systematic_ratio = self.construct_systematic_average(
               hMain, 'prior', jetR, obs_label, reg_param,
-              min_pt_truth, max_pt_truth, minbin, maxbin, takeMaxDev=True)
+              min_pt_truth, max_pt_truth, minbin, maxbin)
       else:
         return None
 
@@ -836,7 +927,7 @@ class RunAnalysis(common_base.CommonBase):
       if systematic == 'subtraction1':
         h_systematic_ratio = self.construct_systematic_average(
               hMain, 'subtraction', jetR, obs_label, reg_param,
-              min_pt_truth, max_pt_truth, minbin, maxbin, takeMaxDev=True)
+              min_pt_truth, max_pt_truth, minbin, maxbin)
       else:
         return None
 
@@ -927,82 +1018,47 @@ class RunAnalysis(common_base.CommonBase):
     name_ratio = 'hSystematic_{}_{}_R{}_{}_n{}_{}-{}'.format(
       self.observable, systematic, jetR, obs_label,
       reg_param, min_pt_truth, max_pt_truth)
-    h_systematic_ratio_temp = hMain.Clone()
-    h_systematic_ratio_temp.SetName(name_ratio+'_temp')
-    h_systematic_ratio_temp.Divide(h_systematic)
+
+    # Percentage deviation (hMain/h_systematic), from the systematic table
+    deviations, table = self.systematic_tables[(jetR, obs_label, reg_param)]
+    percentage, sumw2 = deviations[systematic]
+    i = self.pt_bins_reported.index(min_pt_truth)
+    percentage = percentage[i] if signed else np.abs(percentage[i])
+    h_systematic_ratio_temp = self.systematics.to_hist(hMain, name_ratio+'_temp', percentage, sumw2[i])
 
     if self.debug_level > 0:
-      print("Printing systematic variation ratio for", systematic)
+      print("Printing systematic variation percentage for", systematic)
       for i in range(1, h_systematic.GetNbinsX()+1):
         print("main:", hMain.GetBinContent(i), "-- sys:", h_systematic.GetBinContent(i),
-              "-- ratio:", h_systematic_ratio_temp.GetBinContent(i))
+              "-- percentage:", h_systematic_ratio_temp.GetBinContent(i))
 
-    self.change_to_per(h_systematic_ratio_temp, signed=signed)
     h_systematic_ratio = self.truncate_hist(h_systematic_ratio_temp, minbin, maxbin, name_ratio)
     del h_systematic_ratio_temp   # No longer need this -- prevents memory leaks
     setattr(self, name_ratio, h_systematic_ratio)
     return h_systematic_ratio
 
   #----------------------------------------------------------------------
+  # Get a combined systematic (average or maximum deviation of variations,
+  # or RMS of the unfolding systematics) from the systematic table, and
+  # save it as attribute (named name, if given)
   def construct_systematic_average(self, hMain, sys_label, jetR, obs_label,
                                   reg_param, min_pt_truth, max_pt_truth,
-                                  minbin, maxbin, n_ratios=2, takeMaxDev=False):
+                                  minbin, maxbin, name=None):
 
-    ratios = []
-    for i in range(1, n_ratios+1):
-      h_systematic_ratio = self.construct_systematic_percentage(
-        hMain, '%s%i' % (sys_label, i), jetR, obs_label, reg_param,
-        min_pt_truth, max_pt_truth, minbin, maxbin)
-      ratios.append(h_systematic_ratio)
+    if not name:
+      name = 'hSystematic_{}_{}_R{}_{}_n{}_{}-{}'.format(
+        self.observable, sys_label, jetR, obs_label, reg_param, min_pt_truth, max_pt_truth)
+
+    deviations, table = self.systematic_tables[(jetR, obs_label, reg_param)]
+    percentage, sumw2 = table[sys_label]
+    i = self.pt_bins_reported.index(min_pt_truth)
+    h_systematic_ratio_temp = self.systematics.to_hist(hMain, name+'_temp', percentage[i], sumw2[i])
 
-    name = 'hSystematic_{}_{}_R{}_{}_n{}_{}-{}'.format(
-      self.observable, sys_label, jetR, obs_label, reg_param, min_pt_truth, max_pt_truth)
-    h_systematic_ratio = self.build_average(ratios, name, takeMaxDev=takeMaxDev)
+    h_systematic_ratio = self.truncate_hist(h_systematic_ratio_temp, minbin, maxbin, name)
+    del h_systematic_ratio_temp
     setattr(self, name, h_systematic_ratio)
     return h_systematic_ratio
 
-  #----------------------------------------------------------------------
-  def get_obs_distribution(self, jetR, obs_label, name2D, name1D, reg_param, grooming_setting,
-                           min_pt_truth, max_pt_truth, minbin, maxbin, store_tagging_fraction=False):
-
-    h2D = getattr(self, name2D)
-    h2D.GetXaxis().SetRangeUser(min_pt_truth, max_pt_truth)
-    h = h2D.ProjectionY() # Better to use ProjectionY('{}_py'.format(h2D.GetName()), 1, h2D.GetNbinsX()) ?
-    h.SetName(name1D)
-    h.SetDirectory(0)
-
-    if not minbin:
-      minbin = 1
-    if not maxbin:
-      maxbin = h.GetNbinsX()
-        
-    # Normalize by integral, i.e. N_jets,inclusive in this pt-bin
-    
-    # First scale by bin width -- then normalize by integral
-    # (where integral weights by bin width)
-    h.Scale(1., 'width')
-
-    if grooming_setting and 'sd' in grooming_setting:
-    
-      # If SD, the untagged jets are in the first bin
-      n_jets_inclusive = h.Integral(minbin, maxbin, 'width')
-      n_jets_tagged = h.Integral(minbin+1, maxbin, 'width')
-      
-      if store_tagging_fraction:
-        f_tagging = n_jets_tagged/n_jets_inclusive
-        f_tagging_name = 'tagging_fraction_R{}_{}_{}-{}_{}'.format(
-          jetR, obs_label, min_pt_truth, max_pt_truth, reg_param)
-        setattr(self, f_tagging_name, f_tagging)
-      
-    else:
-      n_jets_inclusive = h.Integral(minbin, maxbin, 'width')
-    
-    h.Scale(1./n_jets_inclusive)
-    
-    setattr(self, name1D, h)
-    
-    return h
-
   #----------------------------------------------------------------------
   def plot_systematic_uncertainties(self, jetR, obs_label, obs_setting, grooming_setting,
                                     min_pt_truth, max_pt_truth, minbin, maxbin, h_list, h_total, suffix=''):
@@ -1178,35 +1234,8 @@ class RunAnalysis(common_base.CommonBase):
         new_name = '{}_new'.format(h_list[0].GetName())
     h_new.SetName(new_name)
 
-    for i in range(1, h_new.GetNbinsX()+1):
-
-      values_i = [h.GetBinContent(i) for h in h_list]
-
-      new_value_squared = 0.
-      for value_i in values_i:
-        new_value_squared += value_i*value_i
-      new_value = math.sqrt(new_value_squared)
-      h_new.SetBinContent(i, new_value)
-
-    return h_new
-
-  #----------------------------------------------------------------------
-  # Take stdev of a list of (identically-binned) histograms, bin-by-bin
-  #----------------------------------------------------------------------
-  def construct_unfolding_uncertainty(self, h_list):
-
-    h_new = h_list[0].Clone()
-    h_new.SetName('hCombinedUnfoldingSystematic_{}'.format(h_list[0].GetName()))
-
-    for i in range(1, h_new.GetNbinsX()+1):
-
-      values_i = [h.GetBinContent(i) for h in h_list]
-
-      new_value_squared = 0.
-      for value_i in values_i:
-        new_value_squared += value_i*value_i
-      new_value = math.sqrt(new_value_squared / len(h_list))
-      h_new.SetBinContent(i, new_value)
+    values = self.systematics.hist_values(h_list)
+    self.systematics.set_hist(h_new, self.systematics.quadrature(values), overflow=False)
 
     return h_new
 
@@ -1250,10 +1279,55 @@ class RunAnalysis(common_base.CommonBase):
 
     f.Close()
     
+  #----------------------------------------------------------------------
+  # Store the final result of a pt bin and its uncertainty breakdown as arrays
+  # (see hepdata_writer.ResultTables), from which the HEPData submission is built
+  #----------------------------------------------------------------------
+  def add_result_table(self, jetR, obs_label, grooming_setting, min_pt, max_pt, maxbin):
+
+    # Main result, truncated as in the final results of these observables
+    h = getattr(self, 'hmain_{}_R{}_{}_{}-{}'.format(self.observable, jetR, obs_label, min_pt, max_pt))
+    if self.observable == 'ang' or self.observable == 'mass':
+      maxbin_trunc = maxbin + 1 if (grooming_setting and maxbin) else maxbin
+      h = self.truncate_hist(h.Clone(), None, maxbin_trunc, '{}_trunc'.format(h.GetName()))
+
+    contents, sumw2 = self.systematics.stack([h], overflow=False)
+    x_edges = self.systematics.axis_edges(h.GetXaxis())
+
+    # Percentage uncertainties: unfolding, generator, and breakdown of the other sources
+    systematics = {}
+    name = 'hSystematic_Unfolding_R{}_{}_{}-{}'.format(self.utils.remove_periods(jetR), obs_label,
+                                                      int(min_pt), int(max_pt))
+    systematics['unfolding'] = getattr(self, name)
+    name = 'hSystematic_generator_R{}_{}_{}-{}'.format(self.utils.remove_periods(jetR), obs_label,
+                                                      int(min_pt), int(max_pt))
+    if hasattr(self, name):
+      systematics['generator'] = getattr(self, name)
+    for systematic in self.systematics_list:
+
+      if systematic in ['main', 'prior1', 'truncation', 'binning'] or 'generator' in systematic:
+        continue
+
+      sys_label = self.systematic_label(systematic)
+      if not sys_label:
+        continue
+      name = 'hSystematic_{}_{}_R{}_{}_{}-{}'.format(self.observable, sys_label, jetR, obs_label,
+                                                    min_pt, max_pt)
+      if getattr(self, name, None):
+        systematics[systematic] = getattr(self, name)
+
+    percentages = {source: self.systematics.hist_values([h_sys])[0][:contents.shape[1]]
+                   for source, h_sys in systematics.items()}
+    self.result_tables.add(self.result_tables.key(jetR, obs_label, min_pt, max_pt),
+                           x_edges, contents[0], np.sqrt(sumw2[0]), percentages)
+
   #----------------------------------------------------------------------
   # Write HEPData submission
   # You can test it here: https://www.hepdata.net/record/sandbox
   #
+  # The tables are built from the final results stored (as arrays) when the systematics
+  # were computed, so the submission can be rebuilt without rerunning the systematics.
+  #
   # You will want to edit the tables slightly to add observable-specific info:
   #   units, description, etc.
   #----------------------------------------------------------------------
@@ -1261,7 +1335,8 @@ class RunAnalysis(common_base.CommonBase):
   
     # Create submission
     self.hepdata_dir = os.path.join(getattr(self, 'output_dir_final_results'), 'hepdata')
-    self.hepdata_submission = hepdata_lib.Submission()
+    self.hepdata_writer = hepdata_writer.HEPDataWriter(output_dir=self.hepdata_dir)
+    self.hepdata_submission = self.hepdata_writer.submission
   
     # Loop through jet radii
     for jetR in self.jetR_list:
@@ -1281,11 +1356,17 @@ class RunAnalysis(common_base.CommonBase):
           self.add_hepdata_table(i, jetR, obs_label, obs_setting, grooming_setting,
                                  min_pt_truth, max_pt_truth)
       
-    # Write submission files
-    self.hepdata_submission.create_files(self.hepdata_dir, remove_old=True)
+    # Write and validate submission files
+    self.hepdata_writer.write()
 
   #----------------------------------------------------------------------
   def add_hepdata_table(self, i, jetR, obs_label, obs_setting, grooming_setting, min_pt, max_pt):
+
+    result = self.result_tables.get(self.result_tables.key(jetR, obs_label, min_pt, max_pt))
+    if not result:
+      print('No final result stored for R = {}, {}, pT = {}-{}: run the systematics first'.format(
+        jetR, obs_label, min_pt, max_pt))
+      return
   
     index = self.set_hepdata_table_index(i, jetR, min_pt)
     table = hepdata_lib.Table(f'Table {index}')
@@ -1294,84 +1375,19 @@ class RunAnalysis(common_base.CommonBase):
     
     # Set observable-specific info in table
     x_label, y_label = self.set_hepdata_table_descriptors(table, jetR, obs_label, obs_setting, grooming_setting, min_pt, max_pt)
- 
-    # Create readers to read histograms
-    final_result_root_filename = os.path.join(getattr(self, 'output_dir_final_results'), 'fFinalResults.root')
-    hepdata_reader = hepdata_lib.RootFileReader(final_result_root_filename)
- 
-    systematics_root_filename = os.path.join(self.output_dir_systematics, 'fSystematics.root')
-    hepdata_reader_systematics = hepdata_lib.RootFileReader(systematics_root_filename)
- 
-    # Define variables
-    h_name = 'hmain_{}_R{}_{}_{}-{}'.format(self.observable, jetR, obs_label, min_pt, max_pt).replace('__', '_')
-    if self.observable == 'ang' or  self.observable == 'mass':
-        h_name += '_trunc'
-    h = hepdata_reader.read_hist_1d(h_name)
- 
-    n_significant_digits = 3 # Note: use 2 significant digits for uncertainties
-    
-    x = hepdata_lib.Variable(x_label, is_independent=True, is_binned=True, units='')
-    x.digits = n_significant_digits
-    x.values = h['x_edges']
- 
-    y = hepdata_lib.Variable(y_label, is_independent=False, is_binned=False, units='')
-    y.digits = n_significant_digits
-    y.values = h['y']
+
+    qualifiers = []
     if self.is_pp:
-        y.add_qualifier('RE', 'P P --> jet+X')
+        qualifiers.append(('RE', 'P P --> jet+X'))
     else:
-        y.add_qualifier('RE', 'Pb Pb --> jet+X')
-    y.add_qualifier('SQRT(S)', 5.02, 'TeV')
-    y.add_qualifier('ETARAP', '|0.9-R|')
-    y.add_qualifier('jet radius', jetR)
-    y.add_qualifier('jet method', 'Anti-$k_{T}$')
- 
-    # Define uncertainties
-    stat = hepdata_lib.Uncertainty('stat', is_symmetric=True)
-    stat.values = h['dy'] #float('{:.2g}'.format(dy))
- 
-    # Add tables to submission
-    table.add_variable(x)
-    table.add_variable(y)
-    y.add_uncertainty(stat)
- 
-    # Add unfolding systematic
-    name = 'hSystematic_Unfolding_R{}_{}_{}-{}'.format(self.utils.remove_periods(jetR), obs_label,
-                                                      int(min_pt), int(max_pt))
-    h_sys_unfolding = hepdata_reader_systematics.read_hist_1d(getattr(self, name).GetName())
-    sys_unfolding = hepdata_lib.Uncertainty('sys,unfolding', is_symmetric=True)
-    #sys_unfolding_percent = h_sys_unfolding['y']  # Percent uncertainty
-    sys_unfolding.values = [h_sys_unfolding['y'][i] * y.values[i] / 100. for i in range(len(y.values))]
-    y.add_uncertainty(sys_unfolding)
-
-    # Add generator systematic
-    name = 'hSystematic_generator_R{}_{}_{}-{}'.format(self.utils.remove_periods(jetR), obs_label,
-                                                      int(min_pt), int(max_pt))
-    h_sys_generator = hepdata_reader_systematics.read_hist_1d(getattr(self, name).GetName())
-    sys_generator = hepdata_lib.Uncertainty('sys,generator', is_symmetric=True)
-    #sys_generator_percent = h_sys_generator['y']  # Percent uncertainty
-    sys_generator.values = [h_sys_generator['y'][i] * y.values[i] / 100. for i in range(len(y.values))]
-    y.add_uncertainty(sys_generator)
-
-    # Add systematic uncertainty breakdown
-    for systematic in self.systematics_list:
-
-        if systematic in ['main', 'prior1', 'truncation', 'binning'] or 'generator' in systematic:
-            continue
-
-        h_sys = self.retrieve_systematic(
-          systematic, jetR, obs_label, None, min_pt, max_pt)
-        if not h_sys:
-            continue
-
-        h_sys = hepdata_reader_systematics.read_hist_1d(h_sys.GetName())
-        sys = hepdata_lib.Uncertainty('sys,{}'.format(systematic), is_symmetric=True)
-        #sys_percent = h_sys['y']  # Percent uncertainty
-        sys.values = [h_sys['y'][i] * y.values[i] / 100. for i in range(len(y.values))]
-        y.add_uncertainty(sys)
+        qualifiers.append(('RE', 'Pb Pb --> jet+X'))
+    qualifiers.append(('SQRT(S)', 5.02, 'TeV'))
+    qualifiers.append(('ETARAP', '|0.9-R|'))
+    qualifiers.append(('jet radius', jetR))
+    qualifiers.append(('jet method', 'Anti-$k_{T}$'))
 
-    # Add table to the submission
-    self.hepdata_submission.add_table(table)
+    # Add variables, with statistical and systematic uncertainties, and the table to the submission
+    self.hepdata_writer.add_table(table, result, x_label, y_label, qualifiers)
 
   #----------------------------------------------------------------------
   def set_hepdata_table_index(self, i, jetR, min_pt):
@@ -1620,48 +1636,16 @@ class RunAnalysis(common_base.CommonBase):
   #----------------------------------------------------------------------
   def change_to_per(self, h, signed=False):
 
-    for bin in range(0, h.GetNbinsX()+2):
-      content = h.GetBinContent(bin)
-
-      if signed:
-        content_new = 1-content
-      else:
-        content_new = math.fabs(1-content)
-
-      h.SetBinContent(bin, content_new*100)
-
-  #----------------------------------------------------------------------
-  def build_average(self, h_list, name, takeMaxDev=False):
-
-    h_avg = h_list[0].Clone(name)
-
-    if takeMaxDev:
-      for i in range(1, h_avg.GetNbinsX()+1):
-        max_val = -1
-        for h in h_list:
-          val = h.GetBinContent(i)
-          if val > max_val:
-            max_val = val
-        h_avg.SetBinContent(i, max_val)
-
-    else:
-      for i in range(1, h_avg.GetNbinsX()+1):
-        sum = 0
-        for h in h_list:
-          sum += h.GetBinContent(i)
-        avg = sum / len(h_list)
-        h_avg.SetBinContent(i, avg)
-
-    return h_avg
+    content = self.systematics.stack([h])[0][0]
+    self.systematics.set_hist(h, self.systematics.percentage(content, signed=signed))
 
   #----------------------------------------------------------------------
   def AttachErrToHist(self, h, hPercError):
 
-    #Fill array with lower bin edges of data histogram
-    for bin in range(1, h.GetNbinsX()+1):
-      content = h.GetBinContent(bin)
-      perErr = hPercError.GetBinContent(bin)
-      h.SetBinError(bin, content*perErr*0.01)
+    content = self.systematics.hist_values([h])[0]
+    perErr = self.systematics.stack([hPercError])[0][0][1:h.GetNbinsX()+1]
+    errors = self.systematics.errors(content, perErr)
+    self.systematics.set_hist(h, sumw2=errors*errors, overflow=False)
 
   #----------------------------------------------------------------------
   # This function is called once for each subconfiguration
@@ -14,6 +14,7 @@ import ROOT
 ROOT.gSystem.Load("$HEPPY_DIR/external/roounfold/roounfold-current/lib/libRooUnfold.so")
 import yaml
 
+from pyjetty.alice_analysis.analysis.base import folding_engine
 from pyjetty.alice_analysis.analysis.user.substructure import analysis_utils_obs
 
 # Load pyjetty ROOT utils
@@ -37,6 +38,9 @@ class TheoryFolding():
     self.utils = analysis_utils_obs.AnalysisUtils_Obs()
     self.config_file = config_file
 
+    # Folds all scale variations with a response in one matrix product
+    self.folding_engine = folding_engine.FoldingEngine()
+
     # Initialize yaml config
     self.initialize_user_config()
 
@@ -380,11 +384,11 @@ class TheoryFolding():
            name_roounfold_obj = '%s_Roounfold_%s' % (name_RM, self.theory_response_labels[ri])
            response = getattr(self,name_roounfold_obj)
 
-           for sv in range(0,self.theory_scale_vars[jetR][i]):
-             h_folded_ch = response.ApplyToTruth(th_hists[sv])
-             folded_hist_name = 'h2_folded_'+self.observable+'_'+lev[1]+"_MPI"+lev[2]+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv )
-             h_folded_ch.SetNameTitle(folded_hist_name,folded_hist_name)
+           # Fold all scale variations at once
+           folded_hist_names = ['h2_folded_'+self.observable+'_'+lev[1]+"_MPI"+lev[2]+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv ) for sv in range(0,self.theory_scale_vars[jetR][i])]
+           folded_hists = self.folding_engine.fold(response, th_hists, folded_hist_names)
 
+           for folded_hist_name, h_folded_ch in zip(folded_hist_names, folded_hists):
              setattr(self, folded_hist_name, h_folded_ch)
 
   #----------------------------------------------------------------------
@@ -450,23 +454,30 @@ class TheoryFolding():
           # ----------------------------------------------------------------------------------------
           # Loop over response levels
           for lev in self.response_levels:
-            # Loop over scale variations
-            for sv in range(0,self.theory_scale_vars[jetR][i]):
-               
-              folded_hist_name = 'h2_folded_'+self.observable+'_'+lev[1]+"_MPI"+lev[2]+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv )
-              h2_folded_hist = getattr(self,folded_hist_name)
- 
-              if lev[2]=='off':
+
+            h2_folded_hists = [getattr(self, 'h2_folded_'+self.observable+'_'+lev[1]+"_MPI"+lev[2]+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv )) for sv in range(0,self.theory_scale_vars[jetR][i])]
+
+            if lev[2]=='off':
+              # Copies that won't have MPI corrections, then apply the MPI correction to all scale variations at once
+              h2_folded_hists_noMPI = []
+              for sv, h2_folded_hist in enumerate(h2_folded_hists):
                 yesMPI_hist_name = 'h2_folded_'+self.observable+"_"+lev[1]+"_MPIon"+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv )
                 h2_folded_hist.SetNameTitle(yesMPI_hist_name,yesMPI_hist_name)
-         
-                # Copy that won't have MPI corrections
-                h2_folded_hist_noMPI = h2_folded_hist.Clone() 
+
+                h2_folded_hist_noMPI = h2_folded_hist.Clone()
                 noMPI_hist_name = 'h2_folded_'+self.observable+"_"+lev[1]+"_MPI"+lev[2]+'_R%s_obs_pT_%s_%s_sv%i' % ((str)(jetR).replace('.','') , obs_setting , self.theory_response_labels[ri] , sv )
                 h2_folded_hist_noMPI.SetNameTitle(noMPI_hist_name,noMPI_hist_name)
-  
-                h2_folded_hist.Multiply(h2_mpi_ratio)
-           
+                h2_folded_hists_noMPI.append(h2_folded_hist_noMPI)
+
+              self.folding_engine.multiply(h2_folded_hists, h2_mpi_ratio)
+
+            # Loop over scale variations
+            for sv in range(0,self.theory_scale_vars[jetR][i]):
+
+              h2_folded_hist = h2_folded_hists[sv]
+              if lev[2]=='off':
+                h2_folded_hist_noMPI = h2_folded_hists_noMPI[sv]
+
               self.outfile.cd()
               h2_folded_hist.Write()
               if lev[2]=='off':
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""
+  Poisson-bootstrap replicas of histograms, filled in the same event loop as the histograms.
+
+  For each event, one set of K weights w_k ~ Poisson(1) is drawn, from a generator seeded by
+  (seed, input stream, event number) -- so that the weights do not depend on checkpointing or
+  on the order in which events are processed. Each entry of a selected histogram is then also
+  filled, with weight w * w_k, into replica k. All histograms share the weights of an event,
+  which keeps the correlations between them (e.g. between the response and the spectra).
+
+  Replicas are accumulated in numpy, per filled cell of the histogram (cell index, and one
+  column per replica), and written as a THnSparseD named <name>_bootstrap with the axes of
+  the histogram and a last axis for the replica index (K bins from 0 to K). Replica k is
+  retrieved with replica(h_bootstrap, k), or all replicas with replicas(h_bootstrap).
+
+  Histograms are selected by name patterns (fnmatch) in the config, e.g.
+    bootstrap:
+      n_replicas: 100
+      seed: 1
+      histograms: ['hResponse_JetPt_*', 'h_*_JetPt_R*']
+"""
+
+from __future__ import print_function
+
+# General
+import fnmatch
+import zlib
+
+# Data analysis and plotting
+import ROOT
+import numpy as np
+
+# Base class
+from pyjetty.alice_analysis.process.base import common_base
+
+################################################################
+class Bootstrap(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #   stream distinguishes the event numbering of different jobs (e.g. the input file name)
+  #---------------------------------------------------------------
+  def __init__(self, n_replicas=100, seed=0, stream='', histograms=[], **kwargs):
+    super(Bootstrap, self).__init__(**kwargs)
+    self.n_replicas = n_replicas
+    self.seed = seed
+    self.stream = zlib.crc32(str(stream).encode('utf-8'))
+    self.histograms = histograms
+
+    # Replica weights of the current event
+    self.weights = np.ones(self.n_replicas, dtype=np.uint8)
+
+  #---------------------------------------------------------------
+  # Return whether the histogram name is selected for replicas
+  #---------------------------------------------------------------
+  def selected(self, name):
+
+    return any([fnmatch.fnmatchcase(name, pattern) for pattern in self.histograms])
+
+  #---------------------------------------------------------------
+  # Draw the replica weights of an event
+  #---------------------------------------------------------------
+  def next_event(self, event_number):
+
+    rng = np.random.default_rng([self.seed, self.stream, event_number])
+    self.weights = np.minimum(rng.poisson(1., self.n_replicas), 255).astype(np.uint8)
+
+################################################################
+class ReplicaAccumulator(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor: replicas of histogram hist (TH1/TH2/TH3 or THnBase)
+  #---------------------------------------------------------------
+  def __init__(self, hist, n_replicas, **kwargs):
+    super(ReplicaAccumulator, self).__init__(**kwargs)
+    self.name = hist.GetName()
+    self.title = hist.GetTitle()
+    self.n_replicas = n_replicas
+
+    if isinstance(hist, ROOT.THnBase):
+      axes = [hist.GetAxis(i) for i in range(hist.GetNdimensions())]
+    else:
+      axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+    self.titles = [axis.GetTitle() for axis in axes]
+    self.edges = []
+    for axis in axes:
+      if axis.GetXbins().GetSize() > 0:
+        self.edges.append(np.array([axis.GetXbins()[i] for i in range(axis.GetXbins().GetSize())]))
+      else:
+        self.edges.append(np.linspace(axis.GetXmin(), axis.GetXmax(), axis.GetNbins() + 1))
+
+    # Cells (with under- and overflow) per axis, and index strides (first axis fastest)
+    self.shape = [len(edges) + 1 for edges in self.edges]
+    self.strides = np.cumprod([1] + self.shape[:-1]).astype(np.int64)
+
+    # Consolidated sums: sorted cell indices, and (n_cells, n_replicas) sums of weights
+    self.cells = np.zeros(0, dtype=np.int64)
+    self.sums = np.zeros((0, self.n_replicas))
+
+    # Sums of the fills since the last consolidation
+    self.pending = []
+    self.n_pending = 0
+
+  #---------------------------------------------------------------
+  # Add entries x (n, n_dim) with weights w (n) and replica weights (n, n_replicas)
+  #---------------------------------------------------------------
+  def add(self, x, w, replica_weights):
+
+    if len(w) == 0:
+      return
+    cells = np.zeros(len(w), dtype=np.int64)
+    for i, edges in enumerate(self.edges):
+      cells += np.searchsorted(edges, x[:, i], side='right') * self.strides[i]
+    weights = replica_weights * w[:, np.newaxis]
+
+    order = np.argsort(cells, kind='stable')
+    cells = cells[order]
+    first = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+    self.pending.append((cells[first], np.add.reduceat(weights[order], first, axis=0)))
+    self.n_pending += len(first)
+
+    # Merge into the consolidated sums when the pending sums are as large
+    if self.n_pending > max(len(self.cells), 100000):
+      self.consolidate()
+
+  #---------------------------------------------------------------
+  # Merge the pending sums into the consolidated sums
+  #---------------------------------------------------------------
+  def consolidate(self):
+
+    if not self.pending:
+      return
+    cells = np.concatenate([self.cells] + [p[0] for p in self.pending])
+    sums = np.concatenate([self.sums] + [p[1] for p in self.pending])
+    self.cells, inverse = np.unique(cells, return_inverse=True)
+    self.sums = np.zeros((len(self.cells), self.n_replicas))
+    np.add.at(self.sums, inverse.ravel(), sums)
+    self.pending = []
+    self.n_pending = 0
+
+  #---------------------------------------------------------------
+  # Return (cells, sums), e.g. to save in a checkpoint
+  #---------------------------------------------------------------
+  def get_state(self):
+
+    self.consolidate()
+    return (self.cells, self.sums)
+
+  #---------------------------------------------------------------
+  # Restore the state returned by get_state
+  #---------------------------------------------------------------
+  def set_state(self, state):
+
+    self.cells, self.sums = state
+    self.pending = []
+    self.n_pending = 0
+
+  #---------------------------------------------------------------
+  # Return THnSparseD of the replicas: axes of the histogram, and the replica index
+  #---------------------------------------------------------------
+  def to_thn(self, histutils):
+
+    self.consolidate()
+    n_dim = len(self.edges)
+    name = '{}_bootstrap'.format(self.name)
+    nbins = [len(edges) - 1 for edges in self.edges] + [self.n_replicas]
+    xmin = [edges[0] for edges in self.edges] + [0.]
+    xmax = [edges[-1] for edges in self.edges] + [float(self.n_replicas)]
+    h = ROOT.THnSparseD(name, self.title, n_dim + 1, np.array(nbins, dtype=np.int32),
+                        np.array(xmin), np.array(xmax))
+    for i, edges in enumerate(self.edges):
+      h.GetAxis(i).Set(len(edges) - 1, np.ascontiguousarray(edges))
+      h.GetAxis(i).SetTitle(self.titles[i])
+    h.GetAxis(n_dim).SetTitle('replica')
+
+    # One entry per filled (cell, replica), at a coordinate inside the cell
+    # (outside the axis range for under- and overflow)
+    cell_x = [np.concatenate(([edges[0] - 1.], 0.5 * (edges[1:] + edges[:-1]), [edges[-1] + 1.]))
+              for edges in self.edges]
+    i_cell, i_replica = np.nonzero(self.sums)
+    n = len(i_cell)
+    if n > 0:
+      x = np.empty((n, n_dim + 1))
+      indices = np.unravel_index(self.cells[i_cell], self.shape, order='F')
+      for i in range(n_dim):
+        x[:, i] = cell_x[i][indices[i]]
+      x[:, n_dim] = i_replica + 0.5
+      histutils.fill_thn(h, n, np.ascontiguousarray(x), np.ascontiguousarray(self.sums[i_cell, i_replica]))
+    return h
+
+#---------------------------------------------------------------
+# Return replica k (TH1D/TH2D/TH3D, or THnSparseD for more than 3 axes) of a
+# <name>_bootstrap THnSparse, named name
+#---------------------------------------------------------------
+def replica(h_bootstrap, k, name=None):
+
+  n_dim = h_bootstrap.GetNdimensions() - 1
+  axis = h_bootstrap.GetAxis(n_dim)
+  first, last = axis.GetFirst(), axis.GetLast()
+  axis.SetRange(k + 1, k + 1)
+  if n_dim == 1:
+    h = h_bootstrap.Projection(0, 'E')
+  elif n_dim == 2:
+    h = h_bootstrap.Projection(1, 0, 'E')
+  elif n_dim == 3:
+    h = h_bootstrap.Projection(0, 1, 2, 'E')
+  else:
+    h = h_bootstrap.ProjectionND(n_dim, np.arange(n_dim, dtype=np.int32), 'E')
+  axis.SetRange(first, last)
+  if name is None:
+    name = '{}_{}'.format(h_bootstrap.GetName(), k)
+  h.SetName(name)
+  if isinstance(h, ROOT.TH1):
+    h.SetDirectory(0)
+  return h
+
+#---------------------------------------------------------------
+# Return list of all replicas of a <name>_bootstrap THnSparse
+#---------------------------------------------------------------
+def replicas(h_bootstrap):
+
+  n_replicas = h_bootstrap.GetAxis(h_bootstrap.GetNdimensions() - 1).GetNbins()
+  return [replica(h_bootstrap, k) for k in range(n_replicas)]
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+"""
+  Registry of buffered histogram handles for bulk filling in the event loop.
+
+  Filling getattr(self, name).Fill(...) costs a name lookup and a PyROOT call per entry.
+  Instead, a handle is resolved once per histogram name, and entries (x, y, ..., w) are
+  buffered in a numpy array, which is flushed to the histogram in a single call:
+    TH1, TH2:        FillN
+    TH3, THn:        RUtil::HistUtils::fill_th3 / fill_thn
+  every flush_size entries, and at the end of the event loop (before writing output).
+  Entries are filled in the same order as direct filling, so the output is identical.
+
+  Usage:
+    h = self.hist_registry['hZ_R0.4']     # resolved via getattr(owner, name) once
+    h.fill(jet_pt, z)                    # or h.fill(jet_pt, z, weight)
+    h.fill_array(x)                      # THn: x is a list/array of n_dim coordinates
+
+  If a Bootstrap is set (see bootstrap.py), the entries of the selected histograms are also
+  accumulated in Poisson-bootstrap replicas, with the replica weights of the current event
+  (set with next_event for each event).
+"""
+
+from __future__ import print_function
+
+# General
+import fnmatch
+
+# Data analysis and plotting
+import ROOT
+import numpy as np
+
+# Base class
+from pyjetty.alice_analysis.process.base import common_base
+from pyjetty.alice_analysis.process.base import bootstrap
+
+################################################################
+class HistogramRegistry(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #   owner is the object holding the histograms as attributes
+  #---------------------------------------------------------------
+  def __init__(self, owner=None, flush_size=10000, **kwargs):
+    super(HistogramRegistry, self).__init__(**kwargs)
+    self.owner = owner
+    self.flush_size = flush_size
+    self.handles = {}
+    self.histutils = None
+
+    # Bootstrap replicas (optional): Bootstrap, and ReplicaAccumulator per histogram name,
+    # kept when the handles are cleared
+    self.bootstrap = None
+    self.replicas = {}
+
+  #---------------------------------------------------------------
+  # Return handle for a histogram, resolving it from the owner on first use
+  #---------------------------------------------------------------
+  def __getitem__(self, name):
+
+    handle = self.handles.get(name)
+    if handle is None:
+      handle = self.register(name, getattr(self.owner, name))
+    return handle
+
+  #---------------------------------------------------------------
+  # Register histogram under name and return its handle
+  #---------------------------------------------------------------
+  def register(self, name, hist):
+
+    if self.histutils is None and (isinstance(hist, ROOT.TH3) or isinstance(hist, ROOT.THnBase)):
+      ROOT.gSystem.Load('libpyjetty_rutil')
+      self.histutils = ROOT.RUtil.HistUtils()
+
+    handle = BufferedHistogram(hist, self.flush_size, self.histutils)
+    if self.bootstrap is not None and self.bootstrap.selected(name):
+      if name not in self.replicas:
+        self.replicas[name] = bootstrap.ReplicaAccumulator(hist, self.bootstrap.n_replicas)
+      handle.set_replicas(self.bootstrap, self.replicas[name])
+    self.handles[name] = handle
+    return handle
+
+  #---------------------------------------------------------------
+  # Draw the bootstrap replica weights of the next event (if bootstrap is enabled)
+  #---------------------------------------------------------------
+  def next_event(self, event_number):
+
+    if self.bootstrap is not None:
+      self.bootstrap.next_event(event_number)
+
+  #---------------------------------------------------------------
+  # Return list of THnSparseD <name>_bootstrap of the replicas of all histograms
+  #---------------------------------------------------------------
+  def replica_objects(self):
+
+    self.flush()
+    self.check_replicas()
+    if self.replicas and self.histutils is None:
+      ROOT.gSystem.Load('libpyjetty_rutil')
+      self.histutils = ROOT.RUtil.HistUtils()
+    return [self.replicas[name].to_thn(self.histutils) for name in sorted(self.replicas)]
+
+  #---------------------------------------------------------------
+  # Warn about bootstrap patterns that did not get replicas: only histograms
+  # filled through the registry have replicas, not those filled directly
+  #---------------------------------------------------------------
+  def check_replicas(self):
+
+    if self.bootstrap is None:
+      return
+
+    for pattern in self.bootstrap.histograms:
+      if not any([fnmatch.fnmatchcase(name, pattern) for name in self.replicas]):
+        print('Warning: no histogram matching bootstrap pattern {} was filled through the registry, no replicas are written'.format(pattern))
+
+    for name, obj in sorted(vars(self.owner).items()):
+      if isinstance(obj, (ROOT.TH1, ROOT.THnBase)) and self.bootstrap.selected(name) \
+         and name not in self.replicas and obj.GetEntries() > 0:
+        print('Warning: {} is selected for bootstrap replicas, but was not filled through the registry'.format(name))
+
+  #---------------------------------------------------------------
+  # Flush all buffered entries to their histograms
+  #---------------------------------------------------------------
+  def flush(self):
+    for handle in self.handles.values():
+      handle.flush()
+
+  #---------------------------------------------------------------
+  # Flush, and drop all handles (e.g. before histograms are deleted)
+  #---------------------------------------------------------------
+  def clear(self):
+    self.flush()
+    self.handles = {}
+
+################################################################
+class BufferedHistogram(common_base.CommonBase):
+
+  #---------------------------------------------------------------
+  # Constructor
+  #---------------------------------------------------------------
+  def __init__(self, hist, flush_size=10000, histutils=None, **kwargs):
+    super(BufferedHistogram, self).__init__(**kwargs)
+    self.hist = hist
+    self.flush_size = flush_size
+    self.histutils = histutils
+
+    if isinstance(hist, ROOT.THnBase):
+      self.n_dim = hist.GetNdimensions()
+    elif isinstance(hist, ROOT.TProfile) or isinstance(hist, ROOT.TProfile2D):
+      raise TypeError('BufferedHistogram: profiles are not supported ({})'.format(hist.GetName()))
+    elif isinstance(hist, ROOT.TH3):
+      self.n_dim = 3
+    elif isinstance(hist, ROOT.TH2):
+      self.n_dim = 2
+    elif isinstance(hist, ROOT.TH1):
+      self.n_dim = 1
+    else:
+      raise TypeError('BufferedHistogram: unsupported type {}'.format(type(hist)))
+
+    # Buffer of entries: one row (x_1, ..., x_n_dim, w) per entry, allocated on the first
+    # fill and grown geometrically up to flush_size, so that rarely filled histograms stay small
+    self.buffer = np.empty((0, self.n_dim+1), dtype=np.float64)
+    self.n = 0
+
+    # Bootstrap replicas (optional), and buffer of the replica weights of each entry
+    self.bootstrap = None
+    self.replicas = None
+    self.replica_weights = None
+
+  #---------------------------------------------------------------
+  # Also fill entries into the replicas, with the replica weights of bootstrap
+  #---------------------------------------------------------------
+  def set_replicas(self, bootstrap, replicas):
+
+    self.bootstrap = bootstrap
+    self.replicas = replicas
+    self.replica_weights = np.empty((len(self.buffer), bootstrap.n_replicas), dtype=np.uint8)
+
+  #---------------------------------------------------------------
+  # Grow the buffers (when full), by a factor 4 up to flush_size
+  #---------------------------------------------------------------
+  def grow(self):
+
+    size = min(max(4 * len(self.buffer), 16), self.flush_size)
+    buffer = np.empty((size, self.n_dim+1), dtype=np.float64)
+    buffer[:self.n] = self.buffer[:self.n]
+    self.buffer = buffer
+    if self.replicas is not None:
+      replica_weights = np.empty((size, self.bootstrap.n_replicas), dtype=np.uint8)
+      replica_weights[:self.n] = self.replica_weights[:self.n]
+      self.replica_weights = replica_weights
+
+  #---------------------------------------------------------------
+  # Fill entry (x, y, ...) with optional weight as last argument,
+  # as for TH1::Fill
+  #---------------------------------------------------------------
+  def fill(self, *values):
+
+    if self.n == len(self.buffer):
+      self.grow()
+    row = self.buffer[self.n]
+    if len(values) == self.n_dim:
+      row[:self.n_dim] = values
+      row[self.n_dim] = 1.
+    else:
+      row[:] = values
+    if self.replicas is not None:
+      self.replica_weights[self.n] = self.bootstrap.weights
+    self.n += 1
+    if self.n == self.flush_size:
+      self.flush()
+
+  #---------------------------------------------------------------
+  # Fill entry given as array of coordinates, as for THnBase::Fill
+  #---------------------------------------------------------------
+  def fill_array(self, x, w=1.):
+
+    if self.n == len(self.buffer):
+      self.grow()
+    row = self.buffer[self.n]
+    row[:self.n_dim] = x
+    row[self.n_dim] = w
+    if self.replicas is not None:
+      self.replica_weights[self.n] = self.bootstrap.weights
+    self.n += 1
+    if self.n == self.flush_size:
+      self.flush()
+
+  #---------------------------------------------------------------
+  # Fill buffered entries into histogram, in order
+  #---------------------------------------------------------------
+  def flush(self):
+
+    n = self.n
+    if n == 0:
+      return
+
+    entries = self.buffer[:n]
+    w = np.ascontiguousarray(entries[:, self.n_dim])
+    if isinstance(self.hist, ROOT.THnBase):
+      self.histutils.fill_thn(self.hist, n, np.ascontiguousarray(entries[:, :self.n_dim]), w)
+    elif self.n_dim == 1:
+      self.hist.FillN(n, np.ascontiguousarray(entries[:, 0]), w)
+    elif self.n_dim == 2:
+      self.hist.FillN(n, np.ascontiguousarray(entries[:, 0]), np.ascontiguousarray(entries[:, 1]), w)
+    else:
+      self.histutils.fill_th3(self.hist, n, np.ascontiguousarray(entries[:, 0]),
+                              np.ascontiguousarray(entries[:, 1]), np.ascontiguousarray(entries[:, 2]), w)
+
+    if self.replicas is not None:
+      self.replicas.add(entries[:, :self.n_dim], w, self.replica_weights[:n])
+
+    self.n = 0
@@ -12,6 +12,9 @@ from __future__ import print_function
 import os
 import sys
 import time
+import base64
+import pickle
+import random
 
 # Data analysis and plotting
 import ROOT
@@ -22,11 +25,14 @@ from array import *
 # Fastjet via python (from external library heppy)
 import fastjet as fj
 import fjcontrib
+import fjtools
 
 # Analysis utilities
 from pyjetty.alice_analysis.process.base import common_base
 from pyjetty.alice_analysis.process.base import process_utils
 from pyjetty.alice_analysis.process.base import jet_info
+from pyjetty.alice_analysis.process.base import hist_registry
+from pyjetty.alice_analysis.process.base import bootstrap
 
 ################################################################
 class ProcessBase(common_base.CommonBase):
@@ -56,6 +62,16 @@ class ProcessBase(common_base.CommonBase):
     # Initialize utils class
     self.utils = process_utils.ProcessUtils()
 
+    # Buffered histogram handles for bulk filling in the event loop
+    self.hist_registry = hist_registry.HistogramRegistry(owner=self)
+
+    # Storage of THn created with create_thn: 'dense' (THnF) or 'sparse' (THnSparseF)
+    self.thn_storage = 'dense'
+
+    # Checkpointing of the histograms and input position (disabled by default)
+    self.checkpoint_interval = 0
+    self.last_checkpoint_time = time.time()
+
   #---------------------------------------------------------------
   # Initialize config file into class members
   #---------------------------------------------------------------
@@ -110,6 +126,29 @@ class ProcessBase(common_base.CommonBase):
 
     self.m = config['m'] if 'm' in config else 0.1396
 
+    # Number of buffered entries per histogram before filling (optional)
+    if 'hist_flush_size' in config:
+      self.hist_registry.flush_size = config['hist_flush_size']
+
+    # Storage of response THn (optional): with 'sparse', only filled bins are kept in memory,
+    # and the THn are converted to dense THnF when written
+    self.thn_storage = config['response_storage'] if 'response_storage' in config else 'dense'
+    if self.thn_storage not in ['dense', 'sparse']:
+      raise ValueError("response_storage = %s not implemented" % self.thn_storage)
+
+    # Checkpoint interval in seconds (optional): the histograms and the input position are
+    # periodically saved to checkpoint.root in the output dir, and a restarted job resumes from there
+    self.checkpoint_interval = config['checkpoint_interval'] if 'checkpoint_interval' in config else 0
+
+    # Poisson-bootstrap replicas of selected histograms (optional): filled in the event loop
+    # and written as <name>_bootstrap, see bootstrap.py
+    if 'bootstrap' in config:
+      bootstrap_config = config['bootstrap']
+      self.hist_registry.bootstrap = bootstrap.Bootstrap(
+        n_replicas=bootstrap_config['n_replicas'] if 'n_replicas' in bootstrap_config else 100,
+        seed=bootstrap_config['seed'] if 'seed' in bootstrap_config else 0,
+        stream=self.input_file, histograms=bootstrap_config['histograms'])
+
   #---------------------------------------------------------------
   # Create thn and set as class attribute from name, dim
   #   and lists of nbins, xmin, xmax.
@@ -122,11 +161,62 @@ class ProcessBase(common_base.CommonBase):
     nbins_array = array('i', nbins)
     xmin_array = array('d', xmin)
     xmax_array = array('d', xmax)
-    h = ROOT.THnF(name, name, dim, nbins_array, xmin_array, xmax_array)
+    h = self.new_thn(name, dim, nbins_array, xmin_array, xmax_array)
     for i in range(0, dim):
       h.GetAxis(i).SetTitle(title[i])
     setattr(self, name, h)
 
+  #---------------------------------------------------------------
+  # Return empty THnF or THnSparseF, according to self.thn_storage
+  #---------------------------------------------------------------
+  def new_thn(self, name, dim, nbins_array, xmin_array, xmax_array):
+
+    if self.thn_storage == 'sparse':
+      return ROOT.THnSparseF(name, name, dim, nbins_array, xmin_array, xmax_array)
+    return ROOT.THnF(name, name, dim, nbins_array, xmin_array, xmax_array)
+
+  #---------------------------------------------------------------
+  # Return memory (MB) of a THn, and of the equivalent dense THn
+  #---------------------------------------------------------------
+  def thn_memory(self, thn):
+
+    n_cells = 1.
+    for i in range(thn.GetNdimensions()):
+      n_cells *= thn.GetAxis(i).GetNbins() + 2
+    bytes_per_cell = 4. if isinstance(thn, (ROOT.THnF, ROOT.THnSparseF)) else 8.
+    if thn.GetCalculateErrors():
+      bytes_per_cell += 8.
+    dense_memory = n_cells * bytes_per_cell / 1e6
+
+    if isinstance(thn, ROOT.THnSparse):
+      return thn.GetSparseFractionMem() * dense_memory, dense_memory
+    return dense_memory, dense_memory
+
+  #---------------------------------------------------------------
+  # Convert THnSparse to dense THn (as expected by analysis_utils.rebin_response)
+  #---------------------------------------------------------------
+  def dense_thn(self, thn):
+
+    if not isinstance(thn, ROOT.THnSparse):
+      return thn
+
+    memory, dense_memory = self.thn_memory(thn)
+    print('  {}: {:.1f} MB sparse ({} filled bins) -> {:.1f} MB dense'.format(
+      thn.GetName(), memory, thn.GetNbins(), dense_memory))
+    return ROOT.THn.CreateHn(thn.GetName(), thn.GetTitle(), thn)
+
+  #---------------------------------------------------------------
+  # Write THnSparse (as dense THn, see dense_thn) or THn to the current file;
+  # the dense copy is deleted once written, so that only one exists at a time
+  #---------------------------------------------------------------
+  def write_thn(self, thn):
+
+    h = self.dense_thn(thn)
+    h.Write()
+    if h is not thn:
+      ROOT.SetOwnership(h, True)
+      del h
+
   #---------------------------------------------------------------
   # Return Lund coordinates [log(1/deltaR), log(1/kt)] of a SD jet
   #---------------------------------------------------------------
@@ -363,14 +453,7 @@ class ProcessBase(common_base.CommonBase):
   #---------------------------------------------------------------
   def mc_fraction(self, jet_pp_det, jet_det_combined):
   
-    pt_total = jet_pp_det.pt()
-    
-    pt_contained = 0.
-    for track in jet_det_combined.constituents():
-      if track.user_index() >= 0:
-        pt_contained += track.pt()
-            
-    return pt_contained/pt_total
+    return fjtools.mc_fraction(jet_pp_det, jet_det_combined)
 
   #---------------------------------------------------------------
   # Return whether a jet has a unique match
@@ -392,10 +475,128 @@ class ProcessBase(common_base.CommonBase):
                   
     return False
 
+  #---------------------------------------------------------------
+  # Checkpoint file, in the output dir
+  #---------------------------------------------------------------
+  def checkpoint_file(self):
+
+    return os.path.join(self.output_dir, 'checkpoint.root')
+
+  #---------------------------------------------------------------
+  # Save a checkpoint if checkpoint_interval seconds have passed since the last one.
+  # position is the (picklable) input position to resume from, e.g. the number of
+  # processed events.
+  #---------------------------------------------------------------
+  def checkpoint(self, position, force=False):
+
+    if not self.checkpoint_interval:
+      return
+    if force or time.time() - self.last_checkpoint_time > self.checkpoint_interval:
+      self.save_checkpoint(position)
+      self.last_checkpoint_time = time.time()
+
+  #---------------------------------------------------------------
+  # Write all histograms, the input position and the random number generator states
+  # to the checkpoint file. The file is written to a temporary file and then renamed,
+  # so that a job killed while writing leaves the previous checkpoint intact.
+  #---------------------------------------------------------------
+  def save_checkpoint(self, position):
+
+    self.hist_registry.flush()
+
+    state = self.checkpoint_state()
+    state['position'] = position
+    state['random'] = random.getstate()
+    state['np_random'] = np.random.get_state()
+    state['bootstrap'] = {name: replicas.get_state() for name, replicas in self.hist_registry.replicas.items()}
+
+    filename = self.checkpoint_file()
+    fout = ROOT.TFile(filename + '.tmp', 'recreate')
+    fout.cd()
+    for attr in dir(self):
+      obj = getattr(self, attr)
+      if isinstance(obj, (ROOT.TH1, ROOT.THnBase)):
+        obj.Write(attr)
+    ROOT.TNamed('checkpoint_state', base64.b64encode(pickle.dumps(state)).decode('ascii')).Write()
+    fout.Close()
+    os.replace(filename + '.tmp', filename)
+
+    if self.debug_level > 0:
+      print('Checkpoint saved at position {}'.format(position))
+
+  #---------------------------------------------------------------
+  # Restore the histograms and random number generator states from the checkpoint file,
+  # if present and checkpointing is enabled, and return the saved input position
+  # (None if there is no checkpoint)
+  #---------------------------------------------------------------
+  def load_checkpoint(self):
+
+    filename = self.checkpoint_file()
+    if not self.checkpoint_interval or not os.path.exists(filename):
+      return None
+
+    # Histograms are restored in place (Reset + Add), so that existing references remain valid;
+    # histograms created on the fly (e.g. matching QA) are added as attributes
+    self.hist_registry.clear()
+    fin = ROOT.TFile(filename, 'read')
+    state = pickle.loads(base64.b64decode(fin.Get('checkpoint_state').GetTitle()))
+    for key in fin.GetListOfKeys():
+      name = key.GetName()
+      if name == 'checkpoint_state':
+        continue
+      saved = fin.Get(name)
+      if hasattr(self, name):
+        obj = getattr(self, name)
+        obj.Reset()
+        obj.Add(saved)
+      else:
+        if isinstance(saved, ROOT.TH1):
+          saved.SetDirectory(0)
+        setattr(self, name, saved)
+    fin.Close()
+
+    # Bootstrap replicas
+    for name, replica_state in state.get('bootstrap', {}).items():
+      replicas = bootstrap.ReplicaAccumulator(getattr(self, name), self.hist_registry.bootstrap.n_replicas)
+      replicas.set_state(replica_state)
+      self.hist_registry.replicas[name] = replicas
+
+    self.restore_checkpoint_state(state)
+    random.setstate(state['random'])
+    np.random.set_state(state['np_random'])
+
+    print('Resuming from checkpoint {} at position {}'.format(filename, state['position']))
+    return state['position']
+
+  #---------------------------------------------------------------
+  # Remove the checkpoint file (once the output is written)
+  #---------------------------------------------------------------
+  def remove_checkpoint(self):
+
+    filename = self.checkpoint_file()
+    if os.path.exists(filename):
+      os.remove(filename)
+
+  #---------------------------------------------------------------
+  # Additional (picklable) state to save in a checkpoint -- override in derived classes
+  #---------------------------------------------------------------
+  def checkpoint_state(self):
+
+    return {}
+
+  #---------------------------------------------------------------
+  # Restore the state returned by checkpoint_state -- override in derived classes
+  #---------------------------------------------------------------
+  def restore_checkpoint_state(self, state):
+
+    pass
+
   #---------------------------------------------------------------
   # Save all histograms
   #---------------------------------------------------------------
   def save_output_objects(self):
+
+    self.hist_registry.flush()
     
     outputfilename = os.path.join(self.output_dir, 'AnalysisResults.root')
     fout = ROOT.TFile(outputfilename, 'update')
@@ -407,8 +608,14 @@ class ProcessBase(common_base.CommonBase):
 
       # Write all ROOT histograms and trees to file
       types = (ROOT.TH1, ROOT.THnBase, ROOT.TTree)
-      if isinstance(obj, types):
+      if isinstance(obj, ROOT.THnSparse):
+        self.write_thn(obj)
+      elif isinstance(obj, types):
         obj.Write()
+
+    # Bootstrap replicas
+    for h in self.hist_registry.replica_objects():
+      h.Write()
   
     fout.Close()
 
@@ -416,6 +623,8 @@ class ProcessBase(common_base.CommonBase):
   # Save all THn and TH3, and remove them as class attributes (to clear memory)
   #---------------------------------------------------------------
   def save_thn_th3_objects(self):
+
+    self.hist_registry.clear()
     
     outputfilename = os.path.join(self.output_dir, 'AnalysisResults.root')
     fout = ROOT.TFile(outputfilename, 'update')
@@ -427,7 +636,7 @@ class ProcessBase(common_base.CommonBase):
       
       types = (ROOT.TH3, ROOT.THnBase)
       if isinstance(obj, types):
-        obj.Write()
+        self.write_thn(obj)
         delattr(self, attr)
 
     fout.Close()
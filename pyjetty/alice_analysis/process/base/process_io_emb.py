@@ -48,6 +48,7 @@ class ProcessIO_Emb(common_base.CommonBase):
     random.shuffle(list_of_files)
     self.list_of_files = list_of_files[0:n_files]
 
+    self.current_file = None
     self.current_file_df = None
     self.current_file_nevents = 0
     self.current_event_index = 0
@@ -78,14 +79,16 @@ class ProcessIO_Emb(common_base.CommonBase):
     return current_event
 
   #---------------------------------------------------------------
-  # Pick a random file from the file list, load it as the
+  # Pick a random file from the file list (or the given input_file), load it as the
   # current file as a dataframe, and remove it from the file list.
   #---------------------------------------------------------------
-  def load_file(self):
+  def load_file(self, input_file=None):
       
-    input_file = random.choice(self.list_of_files)
-    if self.remove_used_file:
-      self.list_of_files.remove(input_file)
+    if input_file is None:
+      input_file = random.choice(self.list_of_files)
+      if self.remove_used_file:
+        self.list_of_files.remove(input_file)
+    self.current_file = input_file
     print('Opening Pb-Pb file: {}'.format(input_file))
 
     io = process_io.ProcessIO(input_file=input_file, track_tree_name=self.track_tree_name,
@@ -94,3 +97,22 @@ class ProcessIO_Emb(common_base.CommonBase):
     self.current_file_df = io.load_data(m=self.m, offset_indices=True)
     self.current_file_nevents = len(self.current_file_df.index)
     self.current_event_index = 0
+
+  #---------------------------------------------------------------
+  # Return the position in the list of files, to resume from a checkpoint
+  #---------------------------------------------------------------
+  def get_state(self):
+
+    return {'list_of_files': list(self.list_of_files), 'current_file': self.current_file,
+            'current_event_index': self.current_event_index}
+
+  #---------------------------------------------------------------
+  # Restore the position saved with get_state: reload the current file
+  # and continue with the next event
+  #---------------------------------------------------------------
+  def set_state(self, state):
+
+    self.list_of_files = state['list_of_files']
+    if state['current_file'] != self.current_file:
+      self.load_file(state['current_file'])
+    self.current_event_index = state['current_event_index']
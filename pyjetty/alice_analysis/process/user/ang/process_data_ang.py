@@ -99,7 +99,7 @@ class ProcessData_ang(process_data_base.ProcessDataBase):
             if grooming_setting else fjext.lambda_beta_kappa(jet, obs_setting, 1, jetR)
 
       # Fill histograms
-      getattr(self, "h_ang_JetPt_R%s_%s%s" % (jetR, obs_label, suffix)).Fill(
+      self.hist_registry["h_ang_JetPt_R%s_%s%s" % (jetR, obs_label, suffix)].fill(
         jet_pt_ungroomed, ang)
 
     # Only do jet mass stuff once per set of angularity configs
@@ -887,17 +887,21 @@ class ProcessGroomers(process_base.ProcessBase):
     zg_truth = -1.
     if has_parents_truth and has_parents_combined:
     
+        # All pt-matching fractions in one call, with a single user_index->pt map of the truth prongs
+        matched_pt = fjtools.prong_matched_pt(jet_truth_prong1, jet_truth_prong2, jet_combined_prong1,
+                                              jet_combined_prong2, jet_combined_groomed, jet_combined, jet_truth)
+
         # Subleading jet pt-matching
         # --------------------------
         # (1) Fraction of pt matched: subleading pp-det in subleading combined
-        matched_pt_subleading_subleading = fjtools.matched_pt(jet_combined_prong2, jet_truth_prong2)
+        matched_pt_subleading_subleading = matched_pt[0]
         
         # (2) Fraction of pt matched: subleading pp-det in leading combined
-        matched_pt_subleading_leading = fjtools.matched_pt(jet_combined_prong1, jet_truth_prong2)
+        matched_pt_subleading_leading = matched_pt[1]
         
         # (3) Fraction of pt matched: subleading pp-det in ungroomed combined jet
-        matched_pt_subleading_groomed = fjtools.matched_pt(jet_combined_groomed, jet_truth_prong2)
-        matched_pt_subleading_ungroomed = fjtools.matched_pt(jet_combined, jet_truth_prong2)
+        matched_pt_subleading_groomed = matched_pt[2]
+        matched_pt_subleading_ungroomed = matched_pt[3]
         matched_pt_subleading_ungroomed_notgroomed = matched_pt_subleading_ungroomed - matched_pt_subleading_groomed
         
         # (4) Fraction of pt matched: subleading pp-det not in ungroomed combined jet
@@ -906,14 +910,14 @@ class ProcessGroomers(process_base.ProcessBase):
         # Leading jet pt-matching
         # --------------------------
         # (1) Fraction of pt matched: leading pp-det in subleading combined
-        matched_pt_leading_subleading = fjtools.matched_pt(jet_combined_prong2, jet_truth_prong1)
+        matched_pt_leading_subleading = matched_pt[4]
         
         # (2) Fraction of pt matched: leading pp-det in leading combined
-        matched_pt_leading_leading = fjtools.matched_pt(jet_combined_prong1, jet_truth_prong1)
+        matched_pt_leading_leading = matched_pt[5]
 
         # (3) Fraction of pt matched: leading pp-det in ungroomed combined jet
-        matched_pt_leading_groomed = fjtools.matched_pt(jet_combined_groomed, jet_truth_prong1)
-        matched_pt_leading_ungroomed = fjtools.matched_pt(jet_combined, jet_truth_prong1)
+        matched_pt_leading_groomed = matched_pt[6]
+        matched_pt_leading_ungroomed = matched_pt[7]
         matched_pt_leading_ungroomed_notgroomed = matched_pt_leading_ungroomed - matched_pt_leading_groomed
         
         # (4) Fraction of pt matched: leading pp-det not in ungroomed combined jet
@@ -113,7 +113,7 @@ def determine_shapes(output_keys, filelist, n_files_max, K_max):
                 break
 
             for output_key in output_keys:
-                shapes[output_key].append(hdf[output_key][:].shape)
+                shapes[output_key].append(hdf[output_key].shape)
 
             if i==0:
                 N_list = list(hdf['N_list'][:])
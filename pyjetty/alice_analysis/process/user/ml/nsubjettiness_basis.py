@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+Class to compute a full N-subjettiness basis {tau_N^beta} per jet in one call
+
+This reproduces fjcontrib.Nsubjettiness(N, KT_Axes(), UnnormalizedMeasure(beta)).result(jet)/jet.pt()
+for every (N, beta) in the basis, but:
+  - The KT axes do not depend on beta, and the exclusive kt clustering history contains the
+    axes for every N -- so we cluster each jet only once, and read off the axes for all N
+  - The minimal particle-axis distances are computed once per N, and reused for all beta
+  - Particle kinematics are cached as numpy arrays, which are also used for cone selection
+"""
+
+# Data analysis and plotting
+import numpy as np
+
+# Fastjet via python (from external library heppy)
+import fastjet as fj
+
+# Base class
+from pyjetty.alice_analysis.process.base import common_base
+
+################################################################
+class NsubjettinessBasis(common_base.CommonBase):
+
+    #---------------------------------------------------------------
+    # Constructor
+    #---------------------------------------------------------------
+    def __init__(self, N_list=[], beta_list=[], **kwargs):
+        super(NsubjettinessBasis, self).__init__(**kwargs)
+
+        self.N_list = N_list
+        self.beta_list = beta_list
+        self.n_features = len(self.N_list)
+
+        # Group feature indices by N, since the axes (and distances) only depend on N
+        self.feature_indices = {}
+        for i,N in enumerate(self.N_list):
+            self.feature_indices.setdefault(N, []).append(i)
+
+        # Same jet definition as fjcontrib::KT_Axes
+        self.axes_jet_def = fj.JetDefinition(fj.kt_algorithm, fj.JetDefinition.max_allowable_R,
+                                             fj.E_scheme, fj.Best)
+
+    #---------------------------------------------------------------
+    # Convert a list of particles into a (n_particles, 3) array of (pt, y, phi)
+    #---------------------------------------------------------------
+    def particle_array(self, particles):
+
+        return np.array([[p.perp(), p.rap(), p.phi_02pi()] for p in particles], dtype=np.float64).reshape(-1, 3)
+
+    #---------------------------------------------------------------
+    # Return (n_particles,) boolean mask of particles within distance R of jet
+    # (same distance as jet.delta_R(p))
+    #---------------------------------------------------------------
+    def cone_mask(self, particle_array, jet, R):
+
+        return self.delta_R2(particle_array, jet.rap(), jet.phi_02pi()) < R*R
+
+    #---------------------------------------------------------------
+    # Zero pad an array of particles to n_max entries of (pt, y, phi, 0)
+    #---------------------------------------------------------------
+    def zero_pad(self, particle_array, n_max):
+
+        four_vectors = np.zeros((n_max, 4))
+        four_vectors[:particle_array.shape[0], :3] = particle_array
+        return four_vectors
+
+    #---------------------------------------------------------------
+    # Compute N-subjettiness basis for a list of jets
+    # Returns (n_jets, n_features) array
+    #---------------------------------------------------------------
+    def compute(self, jets):
+
+        result = np.zeros((len(jets), self.n_features))
+        for i,jet in enumerate(jets):
+            constituents = jet.constituents()
+            result[i] = self.result(constituents, jet.pt(), self.particle_array(constituents))
+        return result
+
+    #---------------------------------------------------------------
+    # Compute N-subjettiness basis for the particles of a single jet,
+    # normalized by pt_norm (typically the jet pt)
+    # Returns (n_features,) array, ordered as N_list/beta_list
+    #---------------------------------------------------------------
+    def result(self, particles, pt_norm, particle_array=None):
+
+        tau = np.zeros(self.n_features)
+        if len(particles) == 0:
+            return tau
+        if particle_array is None:
+            particle_array = self.particle_array(particles)
+        pt = particle_array[:,0]
+
+        # One exclusive kt clustering gives the axes for all N
+        cs = fj.ClusterSequence(particles, self.axes_jet_def)
+        for N, indices in self.feature_indices.items():
+
+            # If N >= n_particles, each particle is an axis and tau_N = 0
+            if N >= len(particles):
+                continue
+
+            axes = cs.exclusive_jets(N)
+            dR2 = np.stack([self.delta_R2(particle_array, axis.rap(), axis.phi_02pi()) for axis in axes], axis=1)
+            dR2_min = np.min(dR2, axis=1)
+
+            for i in indices:
+                tau[i] = np.sum(pt * np.power(dR2_min, self.beta_list[i]/2.))
+
+        return tau / pt_norm
+
+    #---------------------------------------------------------------
+    # Compute N-subjettiness basis of all particles within distance R of jet,
+    # treating the cone as a single jet (as clustering the cone with R=infinity)
+    #---------------------------------------------------------------
+    def result_cone(self, particles, particle_array, jet, R):
+
+        indices = np.flatnonzero(self.cone_mask(particle_array, jet, R))
+        cone_particles = [particles[i] for i in indices]
+        cone_array = particle_array[indices]
+
+        # E-scheme pt of the sum of cone particles
+        pt_cone = np.hypot(np.sum(cone_array[:,0]*np.cos(cone_array[:,2])),
+                           np.sum(cone_array[:,0]*np.sin(cone_array[:,2])))
+
+        return self.result(cone_particles, pt_cone, cone_array)
+
+    #---------------------------------------------------------------
+    # Squared (y, phi) distance of each particle to a given (y, phi)
+    #---------------------------------------------------------------
+    def delta_R2(self, particle_array, y, phi):
+
+        delta_y = particle_array[:,1] - y
+        delta_phi = np.abs(particle_array[:,2] - phi)
+        delta_phi = np.where(delta_phi > np.pi, 2*np.pi - delta_phi, delta_phi)
+        return delta_y*delta_y + delta_phi*delta_phi
@@ -35,6 +35,8 @@ from pyjetty.alice_analysis.process.base import process_io_emb
 from pyjetty.alice_analysis.process.base import process_base
 from pyjetty.alice_analysis.process.base import process_utils
 from pyjetty.alice_analysis.process.base import thermal_generator
+from pyjetty.alice_analysis.process.user.ml import nsubjettiness_basis
+from pyjetty.alice_analysis.process.user.ml import streaming_h5_writer
 from pyjetty.mputils import CEventSubtractor
 
 # Base class
@@ -212,58 +214,41 @@ class ProcessppAA(common_base.CommonBase):
             self.beta_list += [0.5,1,2]
         self.N_list += [self.K-1] * 2  
         self.beta_list += [1,2]
+
+        # Engine to compute the full N-subjettiness basis for a jet in one call
+        self.nsub_basis = nsubjettiness_basis.NsubjettinessBasis(N_list=self.N_list, beta_list=self.beta_list)
         
-        # Construct dictionary to store all jet quantities of interest
-        self.jet_qa_variables = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.four_vectors = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.nsub_variables = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.nsub_cone_hard_variables = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.nsub_cone_beforeCS_variables = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.nsub_cone_afterCS_variables = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-        self.delta_pt_random_cone = []
-        for label in self.nsub_variables.keys():
+        # Label of all jets in this file: Pythia 0, Jewel 1
+        if self.PbPb_data:
+            self.y_label = 1
+        elif self.pp_data:
+            self.y_label = 0
+        elif 'jewel_PbPb' in self.input_file or 'pyquen' in self.input_file or 'qorg_glue' in self.input_file or 'Jetscape' in self.input_file or 'lbt' in self.input_file:
+            self.y_label = 1
+        else:
+            self.y_label = 0
+
+        # Stream all jet quantities of interest to file during the event loop,
+        # with one flat dataset per (observable, label, R, pt bin, R_max)
+        self.writer = streaming_h5_writer.StreamingH5Writer(filename=os.path.join(self.output_dir, 'nsubjettiness.h5'),
+                                                            chunk_size=self.h5_chunk_size)
+        self.labels = ['hard'] if self.test else ['hard', 'combined', 'combined_matched']
+        self.qa_observables = ['delta_pt', 'matched_pt', 'matched_deltaR', 'jet_pt', 'jet_angularity', 'thrust', 'LHA', 'pTD', 'jet_mass', 'jet_theta_g', 'zg', 'jet_subjet_z', 'hadron_z', 'multiplicity_0000', 'multiplicity_0150', 'multiplicity_0500', 'multiplicity_1000']
+        n_max = 800
+        for label in self.labels:
             for jetR in self.jetR_list:
-                self.jet_qa_variables[label][f'R{jetR}'] = {}
-                self.four_vectors[label][f'R{jetR}'] = {}
-                self.nsub_variables[label][f'R{jetR}'] = {}
-                self.nsub_cone_hard_variables[label][f'R{jetR}'] = {}
-                self.nsub_cone_beforeCS_variables[label][f'R{jetR}'] = {}
-                self.nsub_cone_afterCS_variables[label][f'R{jetR}'] = {}
-
                 for jet_pt_bin in self.jet_pt_bins:
-                    self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    self.nsub_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    self.nsub_cone_hard_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    self.nsub_cone_beforeCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    self.nsub_cone_afterCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-
                     for R_max in self.max_distance:
-                        
                         if 'combined' in label or np.isclose(R_max, 0.):
-                            self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                            self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                            self.nsub_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                            self.nsub_cone_hard_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                            self.nsub_cone_beforeCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                            self.nsub_cone_afterCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-
-                            for i,N in enumerate(self.N_list):
-                                beta = self.beta_list[i]
-                                self.nsub_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'n_subjettiness_N{N}_beta{beta}'] = []
-                                self.nsub_cone_hard_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_hard_N{N}_beta{beta}'] = []
-                                self.nsub_cone_beforeCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_beforeCS_N{N}_beta{beta}'] = []
-                                self.nsub_cone_afterCS_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_afterCS_N{N}_beta{beta}'] = []
-
-                            self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_constituent_four_vectors'] = []
-                            self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_hard'] = []
-                            self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_beforeCS'] = []
-                            self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_afterCS'] = []
-
-                            # Some QA
-                            self.qa_observables = ['delta_pt', 'matched_pt', 'matched_deltaR', 'jet_pt', 'jet_angularity', 'thrust', 'LHA', 'pTD', 'jet_mass', 'jet_theta_g', 'zg', 'jet_subjet_z', 'hadron_z', 'multiplicity_0000', 'multiplicity_0150', 'multiplicity_0500', 'multiplicity_1000']
+                            suffix = f'_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
+                            for nsub_name in ['X_Nsub', 'X_Nsub_cone_hard', 'X_Nsub_cone_beforeCS', 'X_Nsub_cone_afterCS']:
+                                self.writer.create(f'{nsub_name}{suffix}', (len(self.N_list),))
+                            for four_vector_name in ['X_four_vectors', 'cone_four_vectors_hard', 'cone_four_vectors_beforeCS', 'cone_four_vectors_afterCS']:
+                                self.writer.create(f'{four_vector_name}{suffix}', (n_max, 4))
+                            self.writer.create(f'y{suffix}')
                             for qa_observable in self.qa_observables:
-                                self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][qa_observable] = []
+                                self.writer.create(f'{qa_observable}{suffix}')
+        self.writer.create('delta_pt_random_cone')
 
         # Create constituent subtractors
         self.constituent_subtractor = [CEventSubtractor(max_distance=R_max, alpha=self.alpha, max_eta=self.eta_max, bge_rho_grid_size=self.bge_rho_grid_size, max_pt_correct=self.max_pt_correct, ghost_area=self.ghost_area, distance_type=fjcontrib.ConstituentSubtractor.deltaR) for R_max in self.max_distance]
@@ -291,6 +276,12 @@ class ProcessppAA(common_base.CommonBase):
         self.jet_matching_distance = config['jet_matching_distance']
         self.n_total = config['n_train'] + config['n_val'] + config['n_test']
         self.event_index = 0
+
+        # Number of jets buffered in memory per output dataset, before appending to file
+        if 'h5_chunk_size' in config:
+            self.h5_chunk_size = config['h5_chunk_size']
+        else:
+            self.h5_chunk_size = 1000
         
         # Initialize thermal model
         if 'thermal_model' in config:
@@ -326,7 +317,7 @@ class ProcessppAA(common_base.CommonBase):
     def process_ppAA(self):
 
         # Loop over events and do jet finding
-        # Fill each of the jet_variables into a list
+        # Stream each of the jet_variables to file
         fj.ClusterSequence.print_banner()
         print('Finding jets and computing N-subjettiness...')
         if self.is_data:
@@ -334,117 +325,37 @@ class ProcessppAA(common_base.CommonBase):
         else:
             result = [self.analyze_event(fj_particles_hard, fj_particles_combined) for fj_particles_hard, fj_particles_combined in zip(self.df_fjparticles['fj_particles_hard'], self.df_fjparticles['fj_particles_combined'])]        
         
-        # Transform the dictionary of lists into a dictionary of numpy arrays
-        self.jet_qa_variables_numpy = self.transform_to_numpy(self.jet_qa_variables)
-        self.four_vectors_numpy = self.transform_to_numpy(self.four_vectors)
-        self.nsub_variables_numpy = self.transform_to_numpy(self.nsub_variables)
-        self.nsub_cone_hard_variables_numpy = self.transform_to_numpy(self.nsub_cone_hard_variables)
-        self.nsub_cone_beforeCS_variables_numpy = self.transform_to_numpy(self.nsub_cone_beforeCS_variables)
-        self.nsub_cone_afterCS_variables_numpy = self.transform_to_numpy(self.nsub_cone_afterCS_variables)
-
+        # Write remaining buffered jets, and the N-subjettiness basis definition
+        self.writer.write('N_list', self.N_list)
+        self.writer.write('beta_list', self.beta_list)
+        self.writer.close()
         print()
-        
-        # Reformat output for ML algorithms (array with 1 array per jet which contain all N-subjettiness values)
-        if self.test:
-            X_Nsub = {'hard': {}}
-        else:
-            X_Nsub = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-            X_Nsub_cone_hard = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-            X_Nsub_cone_beforeCS = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-            X_Nsub_cone_afterCS = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-
-        for label in X_Nsub.keys():
-            for jetR in self.jetR_list:
-                X_Nsub[label][f'R{jetR}'] = {}
-                X_Nsub_cone_hard[label][f'R{jetR}'] = {}
-                X_Nsub_cone_beforeCS[label][f'R{jetR}'] = {}
-                X_Nsub_cone_afterCS[label][f'R{jetR}'] = {}
 
-                for jet_pt_bin in self.jet_pt_bins:
-                    X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    X_Nsub_cone_hard[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    X_Nsub_cone_beforeCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-                    X_Nsub_cone_afterCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-
-                    for R_max in self.max_distance:
-                        if 'combined' in label or np.isclose(R_max, 0.):
-                            X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = np.array([list(self.nsub_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].values())])[0].T
-                            X_Nsub_cone_hard[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = np.array([list(self.nsub_cone_hard_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].values())])[0].T
-                            X_Nsub_cone_beforeCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = np.array([list(self.nsub_cone_beforeCS_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].values())])[0].T
-                            X_Nsub_cone_afterCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = np.array([list(self.nsub_cone_afterCS_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].values())])[0].T
-
-        # Write jet arrays to file
-        with h5py.File(os.path.join(self.output_dir, 'nsubjettiness.h5'), 'w') as hf:
-            for label in X_Nsub.keys():
+        # Print summary and make some QA plots, reading the output file lazily
+        with h5py.File(os.path.join(self.output_dir, 'nsubjettiness.h5'), 'r') as hf:
+            for label in self.labels:
                 for jetR in self.jetR_list:
                     for jet_pt_bin in self.jet_pt_bins:
                         for R_max in self.max_distance:
                             if 'combined' in label or np.isclose(R_max, 0.):
-                            
+
                                 suffix = f'_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
-                        
-                                # Write Nsubjettiness
-                                hf.create_dataset(f'X_Nsub{suffix}', data=X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'])
-                                hf.create_dataset(f'X_Nsub_cone_hard{suffix}', data=X_Nsub_cone_hard[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'])
-                                hf.create_dataset(f'X_Nsub_cone_beforeCS{suffix}', data=X_Nsub_cone_beforeCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'])
-                                hf.create_dataset(f'X_Nsub_cone_afterCS{suffix}', data=X_Nsub_cone_afterCS[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'])
-
-                                # Check whether any training entries are empty
-                                [print(f'WARNING: input entry {i} is empty') for i,x in enumerate(X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']) if not x.any()]
-  
-                                # Write labels: Pythia 0, Jewel 1
-                                if self.PbPb_data:
-                                    self.y = np.ones(X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].shape[0])
-                                elif self.pp_data:
-                                    self.y = np.zeros(X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].shape[0])
-                                else:
-                                    if not self.test:
-                                        if 'jewel_PbPb' in self.input_file or 'pyquen' in self.input_file or 'qorg_glue' in self.input_file or 'Jetscape' in self.input_file or 'lbt' in self.input_file:
-                                            self.y = np.ones(X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].shape[0])
-                                        else:
-                                            self.y = np.zeros(X_Nsub[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].shape[0])
-                                hf.create_dataset(f'y{suffix}', data=self.y)
-                                
-                                # Write four-vectors
-                                X = self.four_vectors_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_constituent_four_vectors']
-                                hf.create_dataset(f'X_four_vectors{suffix}', data=X)
-
-                                # Write cone four-vectors for constituent subtraction study
-                                X_hard = self.four_vectors_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_hard']
-                                hf.create_dataset(f'cone_four_vectors_hard{suffix}', data=X_hard)
-                                X_beforeCS = self.four_vectors_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_beforeCS']
-                                hf.create_dataset(f'cone_four_vectors_beforeCS{suffix}', data=X_beforeCS)
-                                X_afterCS = self.four_vectors_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_afterCS']
-                                hf.create_dataset(f'cone_four_vectors_afterCS{suffix}', data=X_afterCS)
 
                                 print('-------------------------------------')
                                 print(label)
                                 print(f'R{jetR}')
                                 print(f'pt{jet_pt_bin}')
                                 print(f'Rmax{R_max}')
-                                print(f'labels: {self.y.shape}')
-                                print(f'jet four-vectors: {X.shape}')
-                                print(f'cone four-vectors hard: {X_hard.shape}')
-                                print(f'cone four-vectors before CS: {X_beforeCS.shape}')
-                                print(f'cone four-vectors after CS: {X_afterCS.shape}')
-
-                                # If test, compare four-vectors after jet-finding to those before jet-finding
-                                if self.test:
-                                    print(f'four-vectors before jet finding: {self.X}')
-                                    print(f'four-vectors after jet finding: {X}')
-                                
-                                for qa_observable in self.qa_observables:
-                                    hf.create_dataset(f'{qa_observable}{suffix}', data=self.jet_qa_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][qa_observable])
-
-                                # Make some QA plots
+                                print(f'N-subjettiness: {hf[f"X_Nsub{suffix}"].shape}')
+                                print(f'jet four-vectors: {hf[f"X_four_vectors{suffix}"].shape}')
+                                print(f'cone four-vectors hard: {hf[f"cone_four_vectors_hard{suffix}"].shape}')
+                                print(f'cone four-vectors before CS: {hf[f"cone_four_vectors_beforeCS{suffix}"].shape}')
+                                print(f'cone four-vectors after CS: {hf[f"cone_four_vectors_afterCS{suffix}"].shape}')
+
                                 self.output_dir_i = os.path.join(self.output_dir, f'{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}')
                                 if not os.path.exists(self.output_dir_i):
                                     os.makedirs(self.output_dir_i)
-                                self.plot_QA(label, jetR, jet_pt_bin, R_max)
-  
-            hf.create_dataset('N_list', data=self.N_list)
-            hf.create_dataset('beta_list', data=self.beta_list)
-            hf.create_dataset('delta_pt_random_cone', data=self.delta_pt_random_cone)
+                                self.plot_QA(hf, suffix)
                             
     #---------------------------------------------------------------
     # Process an event
@@ -494,6 +405,12 @@ class ProcessppAA(common_base.CommonBase):
                 else:
                     fj_particles_combined.append(self.constituent_subtractor[i].process_event(fj_particles_combined_beforeCS))
 
+            # Cache particle arrays for the cone selection around hard jets
+            if self.is_mc:
+                particle_array_hard = self.nsub_basis.particle_array(fj_particles_hard)
+                particle_array_beforeCS = self.nsub_basis.particle_array(fj_particles_combined_beforeCS)
+                particle_arrays_afterCS = [self.nsub_basis.particle_array(particles) for particles in fj_particles_combined]
+
         # Loop through jetR, and process event for each R
         for jetR in self.jetR_list:
              
@@ -564,21 +481,9 @@ class ProcessppAA(common_base.CommonBase):
                             # Loop through hard jets, and record four-vectors before and after constituent subtraction
                             for jet in jets_hard_selected:
 
-                                four_vectors_in_cone_hard = []
-                                four_vectors_in_cone_beforeCS = []
-                                four_vectors_in_cone_afterCS = []
-
-                                for p in fj_particles_hard:
-                                    if jet.delta_R(p) < jetR:
-                                        four_vectors_in_cone_hard.append(np.array([p.perp(), p.rapidity(), p.phi_02pi(), 0.]))
-
-                                for p in fj_particles_combined_beforeCS:
-                                    if jet.delta_R(p) < jetR:
-                                        four_vectors_in_cone_beforeCS.append(np.array([p.perp(), p.rapidity(), p.phi_02pi(), 0.]))
-
-                                for p in fj_particles_combined[i]:
-                                    if jet.delta_R(p) < jetR:
-                                        four_vectors_in_cone_afterCS.append(np.array([p.perp(), p.rapidity(), p.phi_02pi(), 0.]))
+                                four_vectors_in_cone_hard = particle_array_hard[self.nsub_basis.cone_mask(particle_array_hard, jet, jetR)]
+                                four_vectors_in_cone_beforeCS = particle_array_beforeCS[self.nsub_basis.cone_mask(particle_array_beforeCS, jet, jetR)]
+                                four_vectors_in_cone_afterCS = particle_arrays_afterCS[i][self.nsub_basis.cone_mask(particle_arrays_afterCS[i], jet, jetR)]
 
                                 # Zero pad such that all jets have the same number of four-vectors
                                 n_max = 800
@@ -588,64 +493,25 @@ class ProcessppAA(common_base.CommonBase):
                                     sys.exit(f'ERROR: particle list has {len(four_vectors_in_cone_beforeCS)} entries before zero-padding')
                                 if len(four_vectors_in_cone_afterCS) > n_max:
                                     sys.exit(f'ERROR: particle list has {len(four_vectors_in_cone_afterCS)} entries before zero-padding')
-                                four_vectors_in_cone_hard += [np.array([0,0,0,0])]*(n_max-len(four_vectors_in_cone_hard))
-                                four_vectors_in_cone_beforeCS += [np.array([0,0,0,0])]*(n_max-len(four_vectors_in_cone_beforeCS))
-                                four_vectors_in_cone_afterCS += [np.array([0,0,0,0])]*(n_max-len(four_vectors_in_cone_afterCS))
 
                                 # Append list of four-vectors to output
                                 # Note: need to store with "combined_matched" due to R_max dependence
                                 #       but make sure to use labels from hard jet 
-                                self.four_vectors['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_hard'].append(four_vectors_in_cone_hard)
-                                self.four_vectors['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_beforeCS'].append(four_vectors_in_cone_beforeCS)
-                                self.four_vectors['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['cone_four_vectors_afterCS'].append(four_vectors_in_cone_afterCS)
+                                self.writer.append(f'cone_four_vectors_hard_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', self.nsub_basis.zero_pad(four_vectors_in_cone_hard, n_max))
+                                self.writer.append(f'cone_four_vectors_beforeCS_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', self.nsub_basis.zero_pad(four_vectors_in_cone_beforeCS, n_max))
+                                self.writer.append(f'cone_four_vectors_afterCS_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', self.nsub_basis.zero_pad(four_vectors_in_cone_afterCS, n_max))
 
                                 # Also compute N-subjettiness for each of the cones
                                 nsub_cone = False
                                 if nsub_cone:
-                                    jet_particles = []
-                                    for p in fj_particles_hard:
-                                        if jet.delta_R(p) < jetR:
-                                            jet_particles.append(p)
-                                    jet_def = fj.JetDefinition(fj.antikt_algorithm, fj.JetDefinition.max_allowable_R)
-                                    cs = fj.ClusterSequence(jet_particles, jet_def)
-                                    jet_cone = fj.sorted_by_pt(cs.inclusive_jets())[0]
-                                    axis_definition = fjcontrib.KT_Axes()
-                                    for j,N in enumerate(self.N_list):
-                                        beta = self.beta_list[j]
-                                        measure_definition = fjcontrib.UnnormalizedMeasure(beta)
-                                        n_subjettiness_calculator = fjcontrib.Nsubjettiness(N, axis_definition, measure_definition)
-                                        n_subjettiness = n_subjettiness_calculator.result(jet_cone)/jet_cone.pt()
-                                        self.nsub_cone_hard_variables['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_hard_N{N}_beta{beta}'].append(n_subjettiness)
-
-                                    jet_particles = []
-                                    for p in fj_particles_combined_beforeCS:
-                                        if jet.delta_R(p) < jetR:
-                                            jet_particles.append(p)
-                                    jet_def = fj.JetDefinition(fj.antikt_algorithm, fj.JetDefinition.max_allowable_R)
-                                    cs = fj.ClusterSequence(jet_particles, jet_def)
-                                    jet_cone = fj.sorted_by_pt(cs.inclusive_jets())[0]
-                                    axis_definition = fjcontrib.KT_Axes()
-                                    for j,N in enumerate(self.N_list):
-                                        beta = self.beta_list[j]
-                                        measure_definition = fjcontrib.UnnormalizedMeasure(beta)
-                                        n_subjettiness_calculator = fjcontrib.Nsubjettiness(N, axis_definition, measure_definition)
-                                        n_subjettiness = n_subjettiness_calculator.result(jet_cone)/jet_cone.pt()
-                                        self.nsub_cone_beforeCS_variables['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_beforeCS_N{N}_beta{beta}'].append(n_subjettiness)
-
-                                    jet_particles = []
-                                    for p in fj_particles_combined[i]:
-                                        if jet.delta_R(p) < jetR:
-                                            jet_particles.append(p)
-                                    jet_def = fj.JetDefinition(fj.antikt_algorithm, fj.JetDefinition.max_allowable_R)
-                                    cs = fj.ClusterSequence(jet_particles, jet_def)
-                                    jet_cone = fj.sorted_by_pt(cs.inclusive_jets())[0]
-                                    axis_definition = fjcontrib.KT_Axes()
-                                    for j,N in enumerate(self.N_list):
-                                        beta = self.beta_list[j]
-                                        measure_definition = fjcontrib.UnnormalizedMeasure(beta)
-                                        n_subjettiness_calculator = fjcontrib.Nsubjettiness(N, axis_definition, measure_definition)
-                                        n_subjettiness = n_subjettiness_calculator.result(jet_cone)/jet_cone.pt()
-                                        self.nsub_cone_afterCS_variables['combined_matched'][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'nsub_cone_afterCS_N{N}_beta{beta}'].append(n_subjettiness)
+                                    n_subjettiness = self.nsub_basis.result_cone(fj_particles_hard, particle_array_hard, jet, jetR)
+                                    self.writer.append(f'X_Nsub_cone_hard_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', n_subjettiness)
+
+                                    n_subjettiness = self.nsub_basis.result_cone(fj_particles_combined_beforeCS, particle_array_beforeCS, jet, jetR)
+                                    self.writer.append(f'X_Nsub_cone_beforeCS_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', n_subjettiness)
+
+                                    n_subjettiness = self.nsub_basis.result_cone(fj_particles_combined[i], particle_arrays_afterCS[i], jet, jetR)
+                                    self.writer.append(f'X_Nsub_cone_afterCS_combined_matched_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', n_subjettiness)
 
         self.event_index += 1
         if self.event_index%100 == 0:
@@ -669,7 +535,7 @@ class ProcessppAA(common_base.CommonBase):
         rho = event_pt / (2*self.eta_max *2*np.pi)
         delta_pt = cone_pt - rho*np.pi*R_cone*R_cone
         
-        self.delta_pt_random_cone.append(delta_pt)
+        self.writer.append('delta_pt_random_cone', delta_pt)
 
     #---------------------------------------------------------------
     # Analyze jets of a given event.
@@ -755,12 +621,13 @@ class ProcessppAA(common_base.CommonBase):
             # Accept jet if hard jet is within pt bin
             if jet_pt_bin[0] < jet_pt_pp < jet_pt_bin[1]:
                 
+                suffix = f'_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
                 delta_pt = (jet_pt_combined - jet_pt_pp)
-                self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['delta_pt'].append(delta_pt)
+                self.writer.append(f'delta_pt{suffix}', delta_pt)
                 
-                self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['matched_deltaR'].append(jet_combined.delta_R(jet_pp))
+                self.writer.append(f'matched_deltaR{suffix}', jet_combined.delta_R(jet_pp))
                 matched_pt = fjtools.matched_pt(jet_combined, jet_pp)
-                self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['matched_pt'].append(matched_pt)
+                self.writer.append(f'matched_pt{suffix}', matched_pt)
 
                 self.fill_nsubjettiness(jet_combined, jetR, jet_pt_bin, R_max, label)
                 self.fill_four_vectors(jet_combined, jetR, jet_pt_bin, R_max, label)
@@ -770,45 +637,46 @@ class ProcessppAA(common_base.CommonBase):
     #---------------------------------------------------------------
     def fill_nsubjettiness(self, jet, jetR, jet_pt_bin, R_max = None, label = ''):
 
-        # Compute N-subjettiness
-        axis_definition = fjcontrib.KT_Axes()
-        for i,N in enumerate(self.N_list):
-            beta = self.beta_list[i]
-        
-            measure_definition = fjcontrib.UnnormalizedMeasure(beta)
-            n_subjettiness_calculator = fjcontrib.Nsubjettiness(N, axis_definition, measure_definition)
-            n_subjettiness = n_subjettiness_calculator.result(jet)/jet.pt()
-            self.nsub_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][f'n_subjettiness_N{N}_beta{beta}'].append(n_subjettiness)
+        suffix = f'_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
+
+        # Compute N-subjettiness basis
+        self.writer.append(f'X_Nsub{suffix}', self.nsub_basis.compute([jet])[0])
+
+        # Label: Pythia 0, Jewel 1 (in test mode, the qg label of this jet)
+        if self.test:
+            self.writer.append(f'y{suffix}', self.y[self.event_index])
+        else:
+            self.writer.append(f'y{suffix}', self.y_label)
             
         # Fill some jet QA
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_pt'].append(jet.pt())
+        self.writer.append(f'jet_pt{suffix}', jet.pt())
         
         # angularity
         alpha = 1
         kappa = 1
         angularity = fjext.lambda_beta_kappa(jet, alpha, kappa, jetR)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_angularity'].append(angularity)
+        self.writer.append(f'jet_angularity{suffix}', angularity)
 
         # thrust
         alpha = 2
         kappa = 1
         angularity = fjext.lambda_beta_kappa(jet, alpha, kappa, jetR)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['thrust'].append(angularity)
+        self.writer.append(f'thrust{suffix}', angularity)
 
         # LHA
         alpha = 0.5
         kappa = 1
         angularity = fjext.lambda_beta_kappa(jet, alpha, kappa, jetR)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['LHA'].append(angularity)
+        self.writer.append(f'LHA{suffix}', angularity)
 
         # pTD
         alpha = 0
         kappa = 2
         angularity = fjext.lambda_beta_kappa(jet, alpha, kappa, jetR)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['pTD'].append(angularity)
+        self.writer.append(f'pTD{suffix}', angularity)
         
         # mass
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_mass'].append(jet.m())
+        self.writer.append(f'jet_mass{suffix}', jet.m())
         
         # theta_g
         beta = 0
@@ -816,11 +684,11 @@ class ProcessppAA(common_base.CommonBase):
         gshop = fjcontrib.GroomerShop(jet, jetR, fj.cambridge_algorithm)
         jet_groomed_lund = gshop.soft_drop(beta, zcut, jetR)
         theta_g = jet_groomed_lund.Delta() / jetR
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_theta_g'].append(theta_g)
+        self.writer.append(f'jet_theta_g{suffix}', theta_g)
 
         # zg
         zg = jet_groomed_lund.z()
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['zg'].append(zg)
+        self.writer.append(f'zg{suffix}', zg)
         
         # subjet z
         subjetR = 0.1
@@ -829,16 +697,16 @@ class ProcessppAA(common_base.CommonBase):
         subjets = fj.sorted_by_pt(cs_subjet.inclusive_jets())
         leading_subjet = self.utils.leading_jet(subjets)
         z_leading = leading_subjet.pt() / jet.pt()
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_subjet_z'].append(z_leading)
+        self.writer.append(f'jet_subjet_z{suffix}', z_leading)
         
         # leading hadron z
         leading_particle = self.utils.leading_jet(jet.constituents())
         z_leading = leading_particle.pt() / jet.pt()
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['hadron_z'].append(z_leading)
+        self.writer.append(f'hadron_z{suffix}', z_leading)
         
         # multiplicity
         n_constituents = len(jet.constituents())
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['multiplicity_0000'].append(n_constituents)
+        self.writer.append(f'multiplicity_0000{suffix}', n_constituents)
         multiplicity_0150 = 0
         multiplicity_0500 = 0
         multiplicity_1000 = 0
@@ -849,9 +717,9 @@ class ProcessppAA(common_base.CommonBase):
                 multiplicity_0500 += 1
             if constituent.pt() > 1.:
                 multiplicity_1000 += 1
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['multiplicity_0150'].append(multiplicity_0150)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['multiplicity_0500'].append(multiplicity_0500)
-        self.jet_qa_variables[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['multiplicity_1000'].append(multiplicity_1000)
+        self.writer.append(f'multiplicity_0150{suffix}', multiplicity_0150)
+        self.writer.append(f'multiplicity_0500{suffix}', multiplicity_0500)
+        self.writer.append(f'multiplicity_1000{suffix}', multiplicity_1000)
         
     #---------------------------------------------------------------
     # Write four-vectors of jet constituents
@@ -872,42 +740,16 @@ class ProcessppAA(common_base.CommonBase):
         particle_list += [np.array([0,0,0,0])]*(n_max-len(particle_list))
         
         # Append list of four-vectors to output
-        self.four_vectors[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}']['jet_constituent_four_vectors'].append(particle_list)
+        self.writer.append(f'X_four_vectors_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}', particle_list)
           
-    #---------------------------------------------------------------
-    # Transform dictionary of lists into a dictionary of numpy arrays
-    #---------------------------------------------------------------
-    def transform_to_numpy(self, jet_variables_list):
-
-        if self.test:
-            jet_variables_numpy = {'hard': {}}
-        else:
-            jet_variables_numpy = {'hard': {}, 'combined': {}, 'combined_matched': {}}
-
-        for label in jet_variables_numpy.keys():
-            for jetR in self.jetR_list:
-                jet_variables_numpy[label][f'R{jetR}'] = {}
-                for jet_pt_bin in self.jet_pt_bins:
-                    jet_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'] = {}
-               
-                    for R_max in self.max_distance:
-                        if 'combined' in label or np.isclose(R_max, 0.):
-
-                            jet_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'] = {}
-                  
-                            for key,val in jet_variables_list[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'].items():
-                                jet_variables_numpy[label][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][key] = np.array(val)
-                            
-        return jet_variables_numpy
-
     #---------------------------------------------------------------
     # Plot QA
     #---------------------------------------------------------------
-    def plot_QA(self, event_type, jetR, jet_pt_bin, R_max):
+    def plot_QA(self, hf, suffix):
     
         for qa_observable in self.qa_observables:
             
-            qa_result = self.jet_qa_variables_numpy[event_type][f'R{jetR}'][f'pt{jet_pt_bin}'][f'Rmax{R_max}'][qa_observable]
+            qa_result = hf[f'{qa_observable}{suffix}'][:]
             qa_observable_shape = qa_result.shape
             if qa_observable_shape[0] == 0:
                 continue
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Class to stream jet arrays to an hdf5 file during the event loop
+
+Each dataset is resizable, chunked and compressed. Rows are buffered in memory,
+and appended to the dataset in blocks of chunk_size rows; the file is flushed after
+each block, so that memory is bounded and a crashed job keeps everything up to the
+last block written.
+
+Datasets are named flat, per (observable, label, R, pt bin, R_max):
+  {observable}_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}
+which is the naming scheme expected by aggregate_nsubjettiness.py and analyze_ppAA.py
+"""
+
+import h5py
+
+# Data analysis and plotting
+import numpy as np
+
+# Base class
+from pyjetty.alice_analysis.process.base import common_base
+
+################################################################
+class StreamingH5Writer(common_base.CommonBase):
+
+    #---------------------------------------------------------------
+    # Constructor
+    #---------------------------------------------------------------
+    def __init__(self, filename='', chunk_size=1000, compression='gzip', **kwargs):
+        super(StreamingH5Writer, self).__init__(**kwargs)
+
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.compression = compression
+
+        self.hf = h5py.File(self.filename, 'w')
+        self.buffers = {}
+        self.row_shapes = {}
+
+    #---------------------------------------------------------------
+    # Flat dataset name for a given observable and (label, R, pt bin, R_max)
+    #---------------------------------------------------------------
+    @staticmethod
+    def dataset_name(observable, label, jetR, jet_pt_bin, R_max):
+        return f'{observable}_{label}_R{jetR}_pt{jet_pt_bin}_Rmax{R_max}'
+
+    #---------------------------------------------------------------
+    # Create an empty, resizable dataset whose rows have shape row_shape
+    #---------------------------------------------------------------
+    def create(self, name, row_shape=(), dtype=np.float64):
+
+        row_shape = tuple(row_shape)
+
+        # Keep hdf5 chunks at ~1 MB, independent of the row size
+        row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+        chunk_rows = max(1, min(self.chunk_size, (1 << 20) // row_bytes))
+
+        self.hf.create_dataset(name, shape=(0,)+row_shape, maxshape=(None,)+row_shape,
+                               chunks=(chunk_rows,)+row_shape, dtype=dtype,
+                               compression=self.compression)
+        self.buffers[name] = []
+        self.row_shapes[name] = row_shape
+
+    #---------------------------------------------------------------
+    # Append a single row to a dataset (flushed to file every chunk_size rows)
+    #---------------------------------------------------------------
+    def append(self, name, row):
+
+        if name not in self.buffers:
+            self.create(name, np.shape(row))
+
+        buffer = self.buffers[name]
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush_dataset(name)
+            self.hf.flush()
+
+    #---------------------------------------------------------------
+    # Write a complete (non-streamed) dataset, e.g. N_list
+    #---------------------------------------------------------------
+    def write(self, name, data):
+        self.hf.create_dataset(name, data=data)
+
+    #---------------------------------------------------------------
+    # Append buffered rows of a dataset to file
+    #---------------------------------------------------------------
+    def flush_dataset(self, name):
+
+        buffer = self.buffers[name]
+        if not buffer:
+            return
+
+        block = np.array(buffer, dtype=self.hf[name].dtype).reshape((-1,)+self.row_shapes[name])
+        dataset = self.hf[name]
+        n_rows = dataset.shape[0]
+        dataset.resize(n_rows + block.shape[0], axis=0)
+        dataset[n_rows:] = block
+        self.buffers[name] = []
+
+    #---------------------------------------------------------------
+    # Append all buffered rows to file
+    #---------------------------------------------------------------
+    def flush(self):
+
+        for name in self.buffers:
+            self.flush_dataset(name)
+        self.hf.flush()
+
+    #---------------------------------------------------------------
+    # Flush and close file
+    #---------------------------------------------------------------
+    def close(self):
+
+        self.flush()
+        self.hf.close()
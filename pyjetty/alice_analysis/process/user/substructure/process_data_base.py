@@ -145,6 +145,7 @@ class ProcessDataBase(process_base.ProcessBase):
     # Plot histograms
     print('Save histograms...')
     process_base.ProcessBase.save_output_objects(self)
+    self.remove_checkpoint()
 
     print('--- {} seconds ---'.format(time.time() - self.start_time))
 
@@ -180,22 +181,30 @@ class ProcessDataBase(process_base.ProcessBase):
   #---------------------------------------------------------------
   def analyze_events(self):
 
+    # Resume from a checkpoint, if any (the track histograms are then already filled)
+    n_events_done = self.load_checkpoint()
+
     # Fill track histograms
-    print('--- {} seconds ---'.format(time.time() - self.start_time))
-    print('Fill track histograms')
-    for fj_particles in self.df_fjparticles:
-      for track in fj_particles:
-        self.fillTrackHistograms(track)
-    print('--- {} seconds ---'.format(time.time() - self.start_time))
+    if n_events_done is None:
+      print('--- {} seconds ---'.format(time.time() - self.start_time))
+      print('Fill track histograms')
+      for fj_particles in self.df_fjparticles:
+        for track in fj_particles:
+          self.fillTrackHistograms(track)
+      print('--- {} seconds ---'.format(time.time() - self.start_time))
+      n_events_done = 0
 
     print('Find jets...')
     fj.ClusterSequence.print_banner()
     print()
-    self.event_number = 0
+    self.event_number = n_events_done
 
     # Do jet-finding and fill histograms
-    for fj_particles in self.df_fjparticles:
+    for i, fj_particles in enumerate(self.df_fjparticles):
+      if i < n_events_done:
+        continue
       self.analyze_event(fj_particles)
+      self.checkpoint(i + 1)
 
     print('--- {} seconds ---'.format(time.time() - self.start_time))
     print('Save thn...')
@@ -206,8 +215,8 @@ class ProcessDataBase(process_base.ProcessBase):
   #---------------------------------------------------------------
   def fillTrackHistograms(self, track):
 
-    self.hTrackEtaPhi.Fill(track.eta(), track.phi())
-    self.hTrackPt.Fill(track.pt())
+    self.hist_registry['hTrackEtaPhi'].fill(track.eta(), track.phi())
+    self.hist_registry['hTrackPt'].fill(track.pt())
 
   #---------------------------------------------------------------
   # Analyze jets of a given event.
@@ -218,6 +227,7 @@ class ProcessDataBase(process_base.ProcessBase):
     self.event_number += 1
     if self.event_number > self.event_number_max:
       return
+    self.hist_registry.next_event(self.event_number)
     if self.debug_level > 1:
       print('-------------------------------------------------')
       print('event {}'.format(self.event_number))
@@ -312,10 +322,10 @@ class ProcessDataBase(process_base.ProcessBase):
     jet_pt_ungroomed = jet.pt()
     if self.is_pp or (len(suffix) and self.fill_Rmax_indep_hists):
 
-      hZ = getattr(self, 'hZ_R{}'.format(jetR))
+      hZ = self.hist_registry['hZ_R{}'.format(jetR)]
       for constituent in jet.constituents():
         z = constituent.pt() / jet_pt_ungroomed
-        hZ.Fill(jet_pt_ungroomed, z)
+        hZ.fill(jet_pt_ungroomed, z)
 
     # Loop through each jet subconfiguration (i.e. subobservable / grooming setting)
     for observable in self.observable_list:
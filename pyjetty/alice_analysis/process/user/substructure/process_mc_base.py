@@ -310,6 +310,7 @@ class ProcessMCBase(process_base.ProcessBase):
     # Plot histograms
     print('Save histograms...')
     process_base.ProcessBase.save_output_objects(self)
+    self.remove_checkpoint()
 
     print('--- {} seconds ---'.format(time.time() - self.start_time))
 
@@ -397,41 +398,81 @@ class ProcessMCBase(process_base.ProcessBase):
   #---------------------------------------------------------------
   def analyze_events(self):
 
+    self.event_number = 0
+
+    # Count det/truth jet finding per (event, jetR), and the passes that reuse it (Pb-Pb: one pass per R_max)
+    self.n_cluster_det_truth = 0
+    self.n_cluster_det_truth_reused = 0
+
+    for jetR in self.jetR_list:
+      if not self.dry_run:
+        self.initialize_output_objects_R(jetR)
+
+    # Resume from a checkpoint, if any (the track histograms are then already filled)
+    n_events_done = self.load_checkpoint()
+
     # Fill track histograms
-    if not self.dry_run:
+    if not self.dry_run and n_events_done is None:
       for fj_particles_det in self.df_fjparticles['fj_particles_det']:
         self.fill_track_histograms(fj_particles_det)
 
     fj.ClusterSequence.print_banner()
     print()
 
-    self.event_number = 0
-
-    for jetR in self.jetR_list:
-      if not self.dry_run:
-        self.initialize_output_objects_R(jetR)
+    if n_events_done is None:
+      n_events_done = 0
+    self.event_number = n_events_done
 
-    # Then can use list comprehension to iterate over the groupby and do jet-finding
-    # simultaneously for fj_1 and fj_2 per event, so that I can match jets -- and fill histograms
+    # Iterate over the groupby and do jet-finding simultaneously for fj_1 and fj_2
+    # per event, so that I can match jets -- and fill histograms
     if self.jetscape:
-        result = [self.analyze_event(
-          fj_particles_det, fj_particles_truth, fj_particles_det_holes, fj_particles_truth_holes) \
-          for fj_particles_det, fj_particles_truth, fj_particles_det_holes, fj_particles_truth_holes \
-          in zip(self.df_fjparticles['fj_particles_det'], self.df_fjparticles['fj_particles_truth'],
-                 self.df_fjparticles['fj_particles_det_holes'], self.df_fjparticles['fj_particles_truth_holes'])]
+      events = zip(self.df_fjparticles['fj_particles_det'], self.df_fjparticles['fj_particles_truth'],
+                   self.df_fjparticles['fj_particles_det_holes'], self.df_fjparticles['fj_particles_truth_holes'])
     else:
-        for fj_particles_det, fj_particles_truth in zip(
-          self.df_fjparticles['fj_particles_det'], self.df_fjparticles['fj_particles_truth']):
-            self.analyze_event(fj_particles_det, fj_particles_truth)
+      events = zip(self.df_fjparticles['fj_particles_det'], self.df_fjparticles['fj_particles_truth'])
+    for i, fj_particles in enumerate(events):
+      if i < n_events_done:
+        continue
+      self.analyze_event(*fj_particles)
+      self.checkpoint(i + 1)
 
     if self.debug_level > 0:
       for attr in dir(self):
         obj = getattr(self, attr)
-        print('size of {}: {}'.format(attr, sys.getsizeof(obj)))
+        if isinstance(obj, ROOT.THnBase):
+          memory, dense_memory = self.thn_memory(obj)
+          print('size of {}: {:.1f} MB ({:.1f} MB dense)'.format(attr, memory, dense_memory))
+        else:
+          print('size of {}: {}'.format(attr, sys.getsizeof(obj)))
+
+    if self.n_cluster_det_truth_reused > 0:
+      print('Det/truth jet finding: {} times, reused for {} further R_max passes'.format(
+        self.n_cluster_det_truth, self.n_cluster_det_truth_reused))
 
     print('Save thn...')
     process_base.ProcessBase.save_thn_th3_objects(self)
 
+  #---------------------------------------------------------------
+  # Additional state saved in checkpoints: position in the embedding files
+  #---------------------------------------------------------------
+  def checkpoint_state(self):
+
+    state = {'n_cluster_det_truth': self.n_cluster_det_truth,
+             'n_cluster_det_truth_reused': self.n_cluster_det_truth_reused}
+    if not self.is_pp and not self.thermal_model:
+      state['process_io_emb'] = self.process_io_emb.get_state()
+    return state
+
+  #---------------------------------------------------------------
+  # Restore the state saved with checkpoint_state
+  #---------------------------------------------------------------
+  def restore_checkpoint_state(self, state):
+
+    self.n_cluster_det_truth = state['n_cluster_det_truth']
+    self.n_cluster_det_truth_reused = state['n_cluster_det_truth_reused']
+    if 'process_io_emb' in state:
+      self.process_io_emb.set_state(state['process_io_emb'])
+
   #---------------------------------------------------------------
   # Fill track histograms.
   #---------------------------------------------------------------
@@ -444,8 +485,8 @@ class ProcessMCBase(process_base.ProcessBase):
       return
 
     for track in fj_particles_det:
-      self.hTrackEtaPhi.Fill(track.eta(), track.phi())
-      self.hTrackPt.Fill(track.pt())
+      self.hist_registry['hTrackEtaPhi'].fill(track.eta(), track.phi())
+      self.hist_registry['hTrackPt'].fill(track.pt())
 
 
   #---------------------------------------------------------------
@@ -457,6 +498,7 @@ class ProcessMCBase(process_base.ProcessBase):
     self.event_number += 1
     if self.event_number > self.event_number_max:
       return
+    self.hist_registry.next_event(self.event_number)
     if self.debug_level > 1:
       print('-------------------------------------------------')
       print('event {}'.format(self.event_number))
@@ -555,6 +597,17 @@ class ProcessMCBase(process_base.ProcessBase):
         max_distance = self.max_distance if isinstance(self.max_distance, list) else \
                        self.max_distance[jetR]
 
+        # Do det and truth jet finding once for all R_max (only the combined event depends on R_max)
+        cs_det = fj.ClusterSequence(fj_particles_det, jet_def)
+        jets_det_pp = fj.sorted_by_pt(cs_det.inclusive_jets())
+        jets_det_pp_selected_all = jet_selector_det(jets_det_pp)
+
+        cs_truth = fj.ClusterSequence(fj_particles_truth, jet_def)
+        jets_truth = fj.sorted_by_pt(cs_truth.inclusive_jets())
+        jets_truth_selected_all = jet_selector_det(jets_truth)
+        jets_truth_selected_matched_all = jet_selector_truth_matched(jets_truth)
+        self.n_cluster_det_truth += 1
+
         # Keep track of whether to fill R_max-independent histograms
         self.fill_Rmax_indep_hists = True
 
@@ -569,15 +622,14 @@ class ProcessMCBase(process_base.ProcessBase):
           # Perform constituent subtraction on det-level, if applicable
           self.fill_background_histograms(fj_particles_combined_beforeCS, fj_particles_combined[R_max], jetR, R_max)
 
-          # Do jet finding (re-do each time, to make sure matching info gets reset)
-          cs_det = fj.ClusterSequence(fj_particles_det, jet_def)
-          jets_det_pp = fj.sorted_by_pt(cs_det.inclusive_jets())
-          jets_det_pp_selected = jet_selector_det(jets_det_pp)
-
-          cs_truth = fj.ClusterSequence(fj_particles_truth, jet_def)
-          jets_truth = fj.sorted_by_pt(cs_truth.inclusive_jets())
-          jets_truth_selected = jet_selector_det(jets_truth)
-          jets_truth_selected_matched = jet_selector_truth_matched(jets_truth)
+          # Matching info is stored in the user_info of the jets: use fresh copies of the det and truth jets
+          # for each R_max, so that each pass starts from unmatched jets
+          # (copies share the cluster sequence, but not the user_info set in this pass)
+          jets_det_pp_selected = fj.vectorPJ(jets_det_pp_selected_all)
+          jets_truth_selected = fj.vectorPJ(jets_truth_selected_all)
+          jets_truth_selected_matched = fj.vectorPJ(jets_truth_selected_matched_all)
+          if not self.fill_Rmax_indep_hists:
+            self.n_cluster_det_truth_reused += 1
 
           cs_combined = fj.ClusterSequence(fj_particles_combined[R_max], jet_def)
           jets_combined = fj.sorted_by_pt(cs_combined.inclusive_jets())
@@ -710,10 +762,10 @@ class ProcessMCBase(process_base.ProcessBase):
 
     if before_CS:
         delta_pt = pt_sum - rho * np.pi * jetR * jetR
-        getattr(self, 'hDeltaPt_RC_beforeCS_R{}_Rmax{}'.format(jetR, R_max)).Fill(delta_pt)
+        self.hist_registry['hDeltaPt_RC_beforeCS_R{}_Rmax{}'.format(jetR, R_max)].fill(delta_pt)
     else:
         delta_pt = pt_sum
-        getattr(self, 'hDeltaPt_RC_afterCS_R{}_Rmax{}'.format(jetR, R_max)).Fill(delta_pt)
+        self.hist_registry['hDeltaPt_RC_afterCS_R{}_Rmax{}'.format(jetR, R_max)].fill(delta_pt)
 
     # Fill mean pt
     if before_CS and self.fill_R_indep_hists and self.fill_Rmax_indep_hists:
@@ -727,9 +779,10 @@ class ProcessMCBase(process_base.ProcessBase):
   def fill_truth_before_matching(self, jet, jetR):
 
     jet_pt = jet.pt()
+    hZ = self.hist_registry['hZ_Truth_R{}'.format(jetR)]
     for constituent in jet.constituents():
-      z = constituent.pt() / jet.pt()
-      getattr(self, 'hZ_Truth_R{}'.format(jetR)).Fill(jet.pt(), z)
+      z = constituent.pt() / jet_pt
+      hZ.fill(jet_pt, z)
 
     # Fill 2D histogram of truth (pt, obs)
     hname = 'h_{{}}_JetPt_Truth_R{}_{{}}'.format(jetR)
@@ -742,9 +795,10 @@ class ProcessMCBase(process_base.ProcessBase):
 
     if self.is_pp or self.fill_Rmax_indep_hists:
       jet_pt = jet.pt()
+      hZ = self.hist_registry['hZ_Det_R{}'.format(jetR)]
       for constituent in jet.constituents():
         z = constituent.pt() / jet_pt
-        getattr(self, 'hZ_Det_R{}'.format(jetR)).Fill(jet_pt, z)
+        hZ.fill(jet_pt, z)
 
     # Fill groomed histograms
     if self.thermal_model:
@@ -798,7 +852,7 @@ class ProcessMCBase(process_base.ProcessBase):
         jet_pt_det_ungroomed = jet_det.pt()
         jet_pt_truth_ungroomed = jet_truth.pt()
         JES = (jet_pt_det_ungroomed - jet_pt_truth_ungroomed) / jet_pt_truth_ungroomed
-        getattr(self, 'hJES_R' + str(jetR) + suffix).Fill(jet_pt_truth_ungroomed, JES)
+        self.hist_registry['hJES_R' + str(jetR) + suffix].fill(jet_pt_truth_ungroomed, JES)
 
         # If Pb-Pb case, we need to keep jet_det, jet_truth, jet_pp_det
         jet_pp_det = None
@@ -809,7 +863,7 @@ class ProcessMCBase(process_base.ProcessBase):
 
           # Fill delta-pt histogram
           if jet_pp_det:
-            getattr(self, 'hDeltaPt_emb_R' + str(jetR) + suffix).Fill(
+            self.hist_registry['hDeltaPt_emb_R' + str(jetR) + suffix].fill(
                 jet_pt_truth_ungroomed, jet_pt_det_ungroomed - jet_pp_det.pt())
 
         # Loop through each jet subconfiguration (i.e. subobservable / grooming setting)
@@ -884,8 +938,8 @@ class ProcessMCBase(process_base.ProcessBase):
                     jet_pp_det_groomed_lund, jetR, obs_setting, grooming_setting,
                     obs_label, jet_pp_det.pt())
 
-                getattr(self, 'hDeltaObs_%s_emb_R%s_%s%s' % (observable, jetR,
-                    obs_label, suffix)).Fill(jet_pt_truth_ungroomed, obs_det - obs_pp_det)
+                self.hist_registry['hDeltaObs_%s_emb_R%s_%s%s' % (observable, jetR,
+                    obs_label, suffix)].fill(jet_pt_truth_ungroomed, obs_det - obs_pp_det)
 
             # Call user function to fill histos
             self.fill_matched_jet_histograms(observable, jet_det, jet_det_groomed_lund,
@@ -902,12 +956,11 @@ class ProcessMCBase(process_base.ProcessBase):
 
     if self.fill_RM_histograms:
       x = ([jet_pt_det_ungroomed, jet_pt_truth_ungroomed, obs_det, obs_truth])
-      x_array = array('d', x)
       name = 'hResponse_JetPt_{}_R{}_{}'.format(observable, jetR, obs_label) if \
         len(obs_label) else 'hResponse_JetPt_{}_R{}'.format(observable, jetR)
       if not self.is_pp:
         name += '_Rmax{}'.format(R_max)
-      getattr(self, name).Fill(x_array)
+      self.hist_registry[name].fill_array(x)
 
     if obs_truth > 1e-5:
       obs_resolution = (obs_det - obs_truth) / obs_truth
@@ -915,7 +968,7 @@ class ProcessMCBase(process_base.ProcessBase):
         len(obs_label) else 'hResidual_JetPt_{}_R{}'.format(observable, jetR)
       if not self.is_pp:
         name += '_Rmax{}'.format(R_max)
-      getattr(self, name).Fill(jet_pt_truth_ungroomed, obs_truth, obs_resolution)
+      self.hist_registry[name].fill(jet_pt_truth_ungroomed, obs_truth, obs_resolution)
 
     # Fill prong-matched response
     if not self.is_pp:
@@ -925,13 +978,13 @@ class ProcessMCBase(process_base.ProcessBase):
         name = 'hResponse_JetPt_{}_R{}_{}_Rmax{}_matched'.format(
           observable, jetR, obs_label, R_max) if len(obs_label) else \
           'hResponse_JetPt_{}_R{}_Rmax{}_matched'.format(observable, jetR, R_max)
-        getattr(self, name).Fill(x_array)
+        self.hist_registry[name].fill_array(x)
 
         if obs_truth > 1e-5:
           name = 'hResidual_JetPt_{}_R{}_{}_Rmax{}_matched'.format(
             observable, jetR, obs_label, R_max) if len(obs_label) else \
             'hResidual_JetPt_{}_R{}_Rmax{}_matched'.format(observable, jetR, R_max)
-          getattr(self, name).Fill(jet_pt_truth_ungroomed, obs_truth, obs_resolution)
+          self.hist_registry[name].fill(jet_pt_truth_ungroomed, obs_truth, obs_resolution)
 
 
   #---------------------------------------------------------------
@@ -53,11 +53,6 @@ from pyjetty.alice_analysis.process.base import common_base
 # Prevent ROOT from stealing focus when plotting
 ROOT.gROOT.SetBatch(True)
 
-# Helper function
-# Turns 2D list into 1D list by concat'ing all sublists
-def li_concat(li):
-  return [item for sublist in li for item in sublist]
-
 ################################################################
 class ProcessPHBase(process_base.ProcessBase):
 
@@ -141,8 +136,6 @@ class ProcessPHBase(process_base.ProcessBase):
   def init_storage(self, level, MPI):
     setattr(self, "df_fjparticles_storage_%s_MPI%s" % (level, MPI),
             { "run_number": [], "ev_id": [], "fj_particle": [] })
-    setattr(self, "run_numbers_storage_%s_MPI%s" % (level, MPI), [])
-    setattr(self, "unique_ev_ids_per_run_storage_%s_MPI%s" % (level, MPI), [])
 
   #---------------------------------------------------------------
   # Main processing function
@@ -163,13 +156,25 @@ class ProcessPHBase(process_base.ProcessBase):
 
     # ------------------------------------------------------------------------
 
-    for MPI in ["off", "on"]:
+    # Resume from a checkpoint, if any: position is (index of MPI setting, number of analyzed iterations)
+    position = self.load_checkpoint()
+    if position is None:
+      position = (0, 0)
+
+    for i_MPI, MPI in enumerate(["off", "on"]):
+
+      # Skip MPI settings which are already fully analyzed
+      if i_MPI < position[0]:
+        continue
+      n_iter_done = position[1] if i_MPI == position[0] else 0
 
       # Initialize necessary objects for looping
       self.init_tree_readers(MPI)
-      getattr(self, "hNevents_MPI%s" % MPI).Fill(1, getattr(self, "nEvents_MPI%s" % MPI))
+      if n_iter_done == 0:
+        getattr(self, "hNevents_MPI%s" % MPI).Fill(1, getattr(self, "nEvents_MPI%s" % MPI))
       for level in ["p", "h", "ch"]:
         self.init_storage(level, MPI)
+      n_iter = 0
 
       # Initialize iteration number & max iteration number
       setattr(self, "df_iter_p_MPI"+MPI, 0)
@@ -195,14 +200,24 @@ class ProcessPHBase(process_base.ProcessBase):
         self.load_trees_to_dict(MPI)
         #print('--- {} seconds ---'.format(time.time() - self.start_time))
 
+        # The events of iterations analyzed before the checkpoint are only loaded
+        # (to reproduce the events kept in storage for the next iteration)
+        n_iter += 1
+        if n_iter <= n_iter_done:
+          delattr(self, "df_fjparticles_MPI"+MPI)
+          continue
+
         # ------------------------------------------------------------------------
 
         # Find jets and fill histograms
         print('Find jets with MPI %s...' % MPI)
         self.analyze_events(MPI)
+        self.checkpoint((i_MPI, n_iter))
 
         print('\n--- {} seconds ---'.format(time.time() - self.start_time))
 
+      self.checkpoint((i_MPI + 1, 0), force=True)
+
     # ------------------------------------------------------------------------
 
     print("Scale histograms by appropriate weighting...")
@@ -214,6 +229,7 @@ class ProcessPHBase(process_base.ProcessBase):
     # Plot histograms
     print('Save histograms...')
     process_base.ProcessBase.save_output_objects(self)
+    self.remove_checkpoint()
 
     print('--- {} seconds ---'.format(time.time() - self.start_time))
 
@@ -291,9 +307,6 @@ class ProcessPHBase(process_base.ProcessBase):
       self.append_df_fjparticles(level, MPI, df_to_append)
       setattr(self, "df_iter_%s_MPI%s" % (level, MPI), it+1)
 
-      # Save run_number / ev_id information for pairing & trimming
-      self.append_run_evid(getattr(self, "io_%s_MPI%s" % (level, MPI)), level, MPI)
-
     ###### level == "ch" ######
     # Do the ch case separately since it is slightly different
     self.copy_df_from_storage("ch", MPI)
@@ -302,7 +315,6 @@ class ProcessPHBase(process_base.ProcessBase):
       # Do the charge cut on the hadron-level tree (don't need to reload twice)
       df_to_append = getattr(self, "io_h_MPI"+str(MPI)).group_fjparticles(ch_cut=True)
       self.append_df_fjparticles("ch", MPI, df_to_append)
-      self.append_run_evid(getattr(self, "io_h_MPI"+str(MPI)), "ch", MPI)
 
     #print('--- {} seconds ---'.format(time.time() - self.start_time))
 
@@ -330,10 +342,6 @@ class ProcessPHBase(process_base.ProcessBase):
 
     setattr(self, "df_fjparticles_%s_MPI%s" % (level, MPI), getattr(
       self, "df_fjparticles_storage_%s_MPI%s" % (level, MPI)).copy())
-    setattr(self, "run_numbers_%s_MPI%s" % (level, MPI), getattr(
-      self, "run_numbers_storage_%s_MPI%s" % (level, MPI)).copy())
-    setattr(self, "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI), getattr(
-      self, "unique_ev_ids_per_run_storage_%s_MPI%s" % (level, MPI)).copy())
 
     # Remove any existing events from storage and create new pointers
     self.init_storage(level, MPI)
@@ -343,16 +351,18 @@ class ProcessPHBase(process_base.ProcessBase):
     name = "df_fjparticles_%s_MPI%s" % (level, MPI)
     # Merge events that were not fully loaded in last iteration
     if len(df_to_append["ev_id"]) and len(getattr(self, name)["ev_id"]) and \
-       df_to_append["ev_id"][0] == getattr(self, name)["ev_id"][-1]:
+       df_to_append["ev_id"][0] == getattr(self, name)["ev_id"][-1] and \
+       df_to_append["run_number"][0] == getattr(self, name)["run_number"][-1]:
       for key, val in df_to_append.items():
         if "fj" in key:
           getattr(self, name)[key][-1] += df_to_append[key][0]
         df_to_append[key].pop(0)
 
-    print("old ev tree")
-    self.print_df(getattr(self, name))
-    print("appending")
-    self.print_df(df_to_append)
+    if self.debug_level > 2:
+      print("old ev tree")
+      self.print_df(getattr(self, name))
+      print("appending")
+      self.print_df(df_to_append)
 
     # Merge dfs
     for key, val in df_to_append.items():
@@ -374,56 +384,19 @@ class ProcessPHBase(process_base.ProcessBase):
 
 
   #---------------------------------------------------------------
-  # Save the run_numbers and unique ev_ids as attributes for given io, level
+  # Delete all unpaired track DFs from memory
   #---------------------------------------------------------------
-  def append_run_evid(self, io, level, MPI):
-
-    nr = "run_numbers_%s_MPI%s" % (level, MPI)
-    ne = "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI)
-
-    if self.debug_level > 1:
-      print("nr before:", getattr(self, nr))
-
-    # Merge ev info with existing rather than creating additional list per run
-    if len(getattr(self, nr)) == 0:
-      setattr(self, nr, getattr(self, nr) + list(io.run_numbers[0]))
-
-      if len(getattr(self, ne)):
-        if getattr(self, ne)[-1][0][-1] == io.unique_ev_ids_per_run[0][0][0]:
-          # Remove duplicate event number which was split across iterations
-          getattr(self, ne)[-1][0] = getattr(self, ne)[-1][0][:-1]
-        setattr(self, ne, list(getattr(self, ne)[:-1]) + [[np.concatenate((
-          getattr(self, ne)[-1][0], io.unique_ev_ids_per_run[0][0]))]] + \
-                list(io.unique_ev_ids_per_run)[1:])
-      else:
-        setattr(self, ne, list(io.unique_ev_ids_per_run))
-
-    elif getattr(self, nr)[-1] == io.run_numbers[0][0]:
-      # Ignore repeated entry
-      setattr(self, nr, getattr(self, nr) + list(io.run_numbers[0][:-1]))
-
-      if getattr(self, ne)[-1][0][-1] == io.unique_ev_ids_per_run[0][0][0]:
-        # Remove duplicate event number which was split across iterations
-        getattr(self, ne)[-1][0] = getattr(self, ne)[-1][0][1:]
-      setattr(self, ne, list(getattr(self, ne)[:-1]) + [[np.concatenate((
-        getattr(self, ne)[-1][0], io.unique_ev_ids_per_run[0][0]))]] + \
-              list(io.unique_ev_ids_per_run)[1:])
-
-    else:  # different runs
-      setattr(self, nr, getattr(self, nr) + list(io.run_numbers[0]))
-      setattr(self, ne, getattr(self, ne) + list(io.unique_ev_ids_per_run))
-
-    if self.debug_level > 1:
-      print("nr after:", getattr(self, nr))
-    #setattr(self, n, getattr(self, n) + list(io.unique_ev_ids_per_run))
+  def del_unpaired_dfs(self, level, MPI):
+    delattr(self, "df_fjparticles_%s_MPI%s" % (level, MPI))
 
   #---------------------------------------------------------------
-  # Delete all unpaired track / run / event DFs from memory
+  # Return int64 keys (run_number, ev_id) of the events of a df,
+  # ordered as (run_number, ev_id) (both are int32 in the TTrees)
   #---------------------------------------------------------------
-  def del_unpaired_dfs(self, level, MPI):
-    delattr(self, "df_fjparticles_%s_MPI%s" % (level, MPI))
-    delattr(self, "run_numbers_%s_MPI%s" % (level, MPI))
-    delattr(self, "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI))
+  def event_keys(self, df):
+    run_numbers = np.asarray(df["run_number"], dtype=np.int64)
+    ev_ids = np.asarray(df["ev_id"], dtype=np.int64)
+    return np.left_shift(run_numbers, 32) + ev_ids
 
   #---------------------------------------------------------------
   # Find the ev's at the end which have not yet been parsed in one or
@@ -431,112 +404,33 @@ class ProcessPHBase(process_base.ProcessBase):
   #---------------------------------------------------------------
   def move_extra_ev_to_storage(self, MPI):
 
-    # Check to make sure that there are events at each level
-    # This could happen if there is only 1 ev left but it is missing at some level
-    if not len(getattr(self, "df_fjparticles_p_MPI" + MPI)["run_number"]) or \
-       not len(getattr(self, "df_fjparticles_h_MPI" + MPI)["run_number"]) or \
-       not len(getattr(self, "df_fjparticles_ch_MPI" + MPI)["run_number"]):
-      return
-
-    # Check to see if there are any extra run_numbers
-    self.check_and_move_extra_runs(MPI)
-
-    # Now check to see if there are extra events
-    self.check_and_move_extra_evs(MPI)
-
-  #---------------------------------------------------------------
-  # Check track df for extra runs and move to storage
-  #---------------------------------------------------------------
-  def check_and_move_extra_runs(self, MPI):
-
-    # Load required info for splicing
-    last_run_nums = [getattr(self, "df_fjparticles_p_MPI" + MPI)["run_number"][-1],
-                     getattr(self, "df_fjparticles_h_MPI" + MPI)["run_number"][-1],
-                     getattr(self, "df_fjparticles_ch_MPI" + MPI)["run_number"][-1]]
-
-    if len(np.unique(last_run_nums)) != 1:
-
-      last_run = min(last_run_nums)  # assuming run_number is sorted in TTree
-      for i, level in zip([0, 1, 2], ["p", "h", "ch"]):
-        if last_run_nums[i] != last_run:
-          extra_i, extra_run_i = self.get_extra_index_run(level, MPI, last_run)
-          self.move_df_to_storage_index(level, MPI, extra_i)
-          self.move_run_to_storage_index(level, MPI, extra_run_i)
-
-  #---------------------------------------------------------------
-  # Return first index in track df where extra runs start
-  #---------------------------------------------------------------
-  def get_extra_index_run(self, level, MPI, last_run):
-
-    run_numbers = getattr(self, "run_numbers_%s_MPI%s" % (level, MPI))
-    unique_ev_ids_per_run = getattr(self, "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI))
-
-    extra_runs = []
-    for i in range(len(run_numbers)-1, -1, -1):
-      if run_numbers[i] != last_run:
-        extra_runs += [run_numbers[i]]
-      else:
-        break
-
-    extra_run_i = len(run_numbers) - len(extra_runs)
-    return sum([len(unique_ev_ids_per_run[i][0]) for i in range(extra_run_i)]), extra_run_i
-
-  #---------------------------------------------------------------
-  # Check for extra events in track df and move them to storage
-  #---------------------------------------------------------------
-  def check_and_move_extra_evs(self, MPI):
-
-    # Load required info for splicing
-    last_ev_ids = [getattr(self, "df_fjparticles_p_MPI" + MPI)["ev_id"][-1],
-                   getattr(self, "df_fjparticles_h_MPI" + MPI)["ev_id"][-1],
-                   getattr(self, "df_fjparticles_ch_MPI" + MPI)["ev_id"][-1]]
-
-    last_ev = min(last_ev_ids)  # assuming ev_id is sorted in TTree
-    # Unless there is only 1 ev, and only if it is the last event in the file,
-    #     move last ev to storage to make sure we have all its tracks
-    if getattr(self, "df_fjparticles_p_MPI" + MPI)["ev_id"][0] == max(last_ev_ids):
-      # Look for a case where we have not exhausted the datafile
-      for level in ["p", "h"]:
-        if getattr(self, "tree_len_%s_MPI%s" % (level, MPI)) <= \
-           getattr(self, "df_iter_%s_MPI%s" % (level, MPI)) * self.track_df_step_size:
-          last_ev -= 1
-          break
-    else:
-      last_ev -= 1
+    # Events are complete and can be paired if they are before the last event
+    # loaded at both the p and h levels (the last event of a tree which has not
+    # been read entirely may have more tracks in the next step, and the events
+    # after it are not loaded yet); ch events are a subset of the h events.
+    # This assumes that the TTrees are sorted by (run_number, ev_id).
+    cut = None
+    for level in ["p", "h"]:
+      if getattr(self, "tree_len_%s_MPI%s" % (level, MPI)) <= \
+         getattr(self, "df_iter_%s_MPI%s" % (level, MPI)) * self.track_df_step_size:
+        continue
+      df = getattr(self, "df_fjparticles_%s_MPI%s" % (level, MPI))
+      if not len(df["ev_id"]):
+        cut = np.iinfo(np.int64).min
+        continue
+      last_key = self.event_keys({"run_number": df["run_number"][-1:], "ev_id": df["ev_id"][-1:]})[0]
+      cut = last_key if cut is None else min(cut, last_key)
     if self.debug_level > 1:
-      print("last_ev:", last_ev)
-
-    if last_ev != min(last_ev_ids) or len(np.unique(last_ev_ids)) != 1:
-
-      for i, level in zip([0, 1, 2], ["p", "h", "ch"]):
-        if last_ev_ids[i] != last_ev:
-          extra_i, extra_i_ev = self.get_extra_index_ev(level, MPI, last_ev)
-          self.move_df_to_storage_index(level, MPI, extra_i)
-          self.move_ev_to_storage_index(level, MPI, extra_i_ev)
-          # Update run storage to contain run number of these extra events
-          self.add_last_run_to_storage(level, MPI)
-
-  #---------------------------------------------------------------
-  # Return first index in track df where extra runs start
-  #---------------------------------------------------------------
-  def get_extra_index_ev(self, level, MPI, last_ev):
-
-    run_numbers = getattr(self, "run_numbers_%s_MPI%s" % (level, MPI))
-    unique_ev_ids_per_run = getattr(self, "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI))
+      print("cut (run_number, ev_id):", None if cut is None else divmod(int(cut), 1 << 32))
 
-    extra_evs = []
-    # We have already moved the extra runs, so only have to consider the last one
-    run_i = len(run_numbers)-1
-    if self.debug_level > 1:
-      print("unique:", unique_ev_ids_per_run[run_i][0])
-    for i in range(len(unique_ev_ids_per_run[run_i][0])-1, -1, -1):
-      if unique_ev_ids_per_run[run_i][0][i] > last_ev:
-        extra_evs += [unique_ev_ids_per_run[run_i][0][i]]
-      else:
-        break
+    # All TTrees have been read: nothing left for the next iteration
+    if cut is None:
+      return
 
-    extra_ev_i = len(unique_ev_ids_per_run[run_i][0]) - len(extra_evs)
-    return sum([len(unique_ev_ids_per_run[i][0]) for i in range(run_i)]) + extra_ev_i, extra_ev_i
+    for level in ["p", "h", "ch"]:
+      df = getattr(self, "df_fjparticles_%s_MPI%s" % (level, MPI))
+      i_cut = int(np.searchsorted(self.event_keys(df), cut, side='left'))
+      self.move_df_to_storage_index(level, MPI, i_cut)
 
   #---------------------------------------------------------------
   # Move entries in track df to storage starting at move_index
@@ -546,187 +440,51 @@ class ProcessPHBase(process_base.ProcessBase):
     df_name_storage = "df_fjparticles_storage_%s_MPI%s" % (level, MPI)
     df_name = "df_fjparticles_%s_MPI%s" % (level, MPI)
     for key, val in getattr(self, df_name).items():
-      # Move to _beginning_ of storage array (we move extra runs first)
+      # Move to _beginning_ of storage array
       getattr(self, df_name_storage)[key] = val[move_index:] + getattr(self, df_name_storage)[key]
       getattr(self, df_name)[key] = val[:move_index]
 
-  #---------------------------------------------------------------
-  # Move entries in runs/ev_ids to storage starting at move_index
-  #---------------------------------------------------------------
-  def move_run_to_storage_index(self, level, MPI, move_index):
-
-    names = ["run_numbers_%s_MPI%s" % (level, MPI),
-             "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI)]
-    storage_names = ["run_numbers_storage_%s_MPI%s" % (level, MPI),
-                     "unique_ev_ids_per_run_storage_%s_MPI%s" % (level, MPI)]
-
-    for n, sn in zip(names, storage_names):
-      setattr(self, sn, getattr(self, sn) + getattr(self, n)[move_index:])
-      setattr(self, n, getattr(self, n)[:move_index])
-
-  #---------------------------------------------------------------
-  # Move ev_ids in last run to storage starting at move_index
-  #---------------------------------------------------------------
-  def move_ev_to_storage_index(self, level, MPI, move_index):
-
-    n = "unique_ev_ids_per_run_%s_MPI%s" % (level, MPI)
-    sn = "unique_ev_ids_per_run_storage_%s_MPI%s" % (level, MPI)
-
-    setattr(self, sn, getattr(self, sn) + [[getattr(self, n)[-1][0][move_index:]]])
-    setattr(self, n, getattr(self, n)[:-1] + [[getattr(self, n)[-1][0][:move_index]]])
-    if self.debug_level > 1:
-      print("storage ev id %s:" % level, getattr(self, sn)[-1][0])
-      print("ana ev id %s:" % level, getattr(self, n)[-1][0])
-
-  #---------------------------------------------------------------
-  # Copy last run number in run_numbers to end of storage list
-  #---------------------------------------------------------------
-  def add_last_run_to_storage(self, level, MPI):
-
-    n = "run_numbers_%s_MPI%s" % (level, MPI)
-    sn = "run_numbers_storage_%s_MPI%s" % (level, MPI)
-
-    setattr(self, sn, list(getattr(self, sn)) + [getattr(self, n)[-1]])
-    if self.debug_level > 1:
-      print("storage run id:", getattr(self, sn), type(getattr(self, sn)))
-
   #---------------------------------------------------------------
   # Pair NumPy dictionaries at p, h, and ch levels
   #---------------------------------------------------------------
   def pair_dictionary(self, MPI):
 
-    run_numbers_p = getattr(self, "run_numbers_p_MPI" + MPI)
-    run_numbers_h = getattr(self, "run_numbers_h_MPI" + MPI)
-    run_numbers_ch = getattr(self, "run_numbers_ch_MPI" + MPI)
-
-    unique_ev_ids_per_run_p = getattr(self, "unique_ev_ids_per_run_p_MPI" + MPI)
-    unique_ev_ids_per_run_h = getattr(self, "unique_ev_ids_per_run_h_MPI" + MPI)
-    unique_ev_ids_per_run_ch = getattr(self, "unique_ev_ids_per_run_ch_MPI" + MPI)
-
     df_fjparticles_p = getattr(self, "df_fjparticles_p_MPI" + MPI)
     df_fjparticles_h = getattr(self, "df_fjparticles_h_MPI" + MPI)
     df_fjparticles_ch = getattr(self, "df_fjparticles_ch_MPI" + MPI)
 
-    # Need to figure out which ev_id to save.
     # For some reason, it can be the case that the ev_id does not exist
     #    at one level (e.g. parton), while it does at another (e.g. hadron).
-    # Deal with this by simply removing these bad run_numbers / ev_ids.
-    # First, check if there are any bad run_numbers
-    bad_index_p = None
-    bad_runs_p = np.setdiff1d(run_numbers_p, run_numbers_ch)
-    if len(bad_runs_p):
-      # This is what we want, but can get it more trivially using available info
-      #bad_index_p = np.isin(df_fjparticles_p_MPIoff["run_number"], bad_runs_p)
-      print("bad_runs_p:", bad_runs_p)
-      bad_index_p = li_concat([
-        [run_numbers_p[i] in bad_runs_p]*len(unique_ev_ids_per_run_p[i][0]) \
-        for i in range(len(run_numbers_p))])
-    else:
-      bad_index_p = li_concat([[False] * len(unique_ev_ids_per_run_p[i][0]) \
-                               for i in range(len(run_numbers_p))])
-
-    bad_index_h = None
-    bad_runs_h = np.concatenate((np.setdiff1d(run_numbers_h, run_numbers_p),
-                                 np.setdiff1d(run_numbers_h, run_numbers_ch)))
-    if len(bad_runs_h):
-      print("bad_runs_h:", bad_runs_h)
-      bad_index_h = li_concat([
-        [run_numbers_h[i] in bad_runs_h]*len(unique_ev_ids_per_run_h[i][0]) \
-        for i in range(len(run_numbers_h))])
-    else:
-      bad_index_h = li_concat([[False] * len(unique_ev_ids_per_run_h[i][0]) \
-                               for i in range(len(run_numbers_h))])
-
-    bad_index_ch = None
-    bad_runs_ch = bad_runs_p  #np.setdiff1d(run_numbers_ch, run_numbers_p)
-    if len(bad_runs_ch):
-      print("bad_runs_ch:", bad_runs_ch)
-      bad_index_ch = li_concat([
-        [run_numbers_ch[i] in bad_runs_ch]*len(unique_ev_ids_per_run_ch[i][0]) \
-        for i in range(len(run_numbers_ch))])
-    else:
-      bad_index_ch = li_concat([[False] * len(unique_ev_ids_per_run_ch[i][0]) \
-                                for i in range(len(run_numbers_ch))])
-
-    # Now check for bad ev_ids for each run.
-    overall_index_p = 0
-    run_index_p = 0
-    overall_index_h = 0
-    run_index_h = 0
-    overall_index_ch = 0
-    run_index_ch = 0
-
-    while run_index_p < len(run_numbers_p):
-      ev_ids_p = unique_ev_ids_per_run_p[run_index_p][0]
-      if run_numbers_p[run_index_p] in bad_runs_p:
-        overall_index_p += len(ev_ids_p)
-        run_index_p += 1
-        continue
-      ev_ids_h = unique_ev_ids_per_run_h[run_index_h][0]
-      if run_numbers_h[run_index_h] in bad_runs_h:
-        overall_index_h += len(ev_ids_h)
-        run_index_h += 1
-        continue
-      ev_ids_ch = unique_ev_ids_per_run_ch[run_index_ch][0]
-      if run_numbers_ch[run_index_ch] in bad_runs_ch:
-        overall_index_ch += len(ev_ids_ch)
-        run_index_ch += 1
-        continue
+    # Keep only the events at all three levels: merge join of the (unique)
+    #    event keys, giving the indices of the paired events in each df
+    keys_ph, index_p, index_h = np.intersect1d(
+      self.event_keys(df_fjparticles_p), self.event_keys(df_fjparticles_h),
+      assume_unique=True, return_indices=True)
+    keys, index_ph, index_ch = np.intersect1d(
+      keys_ph, self.event_keys(df_fjparticles_ch), assume_unique=True, return_indices=True)
+    index_p = index_p[index_ph]
+    index_h = index_h[index_ph]
 
-      # Use the fact that ev_ids are sorted for efficiency improvement
-      good_ev_id_index_1 = ROOT.RUtil.sorted_match(
-        ev_ids_p, len(ev_ids_p), ev_ids_ch, len(ev_ids_ch))
-      bad_ev_id_index = np.array([not good_ev_id_index_1[i] for i in range(len(ev_ids_p))])
-      bad_index_p[overall_index_p:overall_index_p+len(bad_ev_id_index)] = bad_index_p[
-        overall_index_p:overall_index_p+len(bad_ev_id_index)] | bad_ev_id_index
-
-      good_ev_id_index_1 = ROOT.RUtil.sorted_match(
-        ev_ids_h, len(ev_ids_h), ev_ids_p, len(ev_ids_p))
-      good_ev_id_index_2 = ROOT.RUtil.sorted_match(
-        ev_ids_h, len(ev_ids_h), ev_ids_ch, len(ev_ids_ch))
-      bad_ev_id_index = np.array(
-        [not (good_ev_id_index_1[i] and good_ev_id_index_2[i]) for i in range(len(ev_ids_h))])
-      bad_index_h[overall_index_h:overall_index_h+len(bad_ev_id_index)] = bad_index_h[
-        overall_index_h:overall_index_h+len(bad_ev_id_index)] | bad_ev_id_index
-
-      good_ev_id_index_1 = ROOT.RUtil.sorted_match(
-        ev_ids_ch, len(ev_ids_ch), ev_ids_p, len(ev_ids_p))
-      bad_ev_id_index = np.array([not good_ev_id_index_1[i] for i in range(len(ev_ids_ch))])
-      bad_index_ch[overall_index_ch:overall_index_ch+len(bad_ev_id_index)] = bad_index_ch[
-        overall_index_ch:overall_index_ch+len(bad_ev_id_index)] | bad_ev_id_index
-
-      overall_index_p += len(ev_ids_p)
-      run_index_p += 1
-      overall_index_h += len(ev_ids_h)
-      run_index_h += 1
-      overall_index_ch += len(ev_ids_ch)
-      run_index_ch += 1
+    if self.debug_level > 1:
+      print("unpaired events: %i (p), %i (h), %i (ch)" % (
+        len(df_fjparticles_p["ev_id"]) - len(keys), len(df_fjparticles_h["ev_id"]) - len(keys),
+        len(df_fjparticles_ch["ev_id"]) - len(keys)))
 
     # DEBUGGING CODE ONLY
     # Test random pairing rate by pairing incorrect events
-    #bad_index_p[0] = bad_index_p[1] = True
-    #bad_index_h[-1] = bad_index_h[0] = True
-    #bad_index_ch[-2] = bad_index_ch[-1] = True
-
-    [df_fjparticles_p["run_number"].pop(i) and df_fjparticles_p["ev_id"].pop(i) and \
-     df_fjparticles_p["fj_particle"].pop(i) for i in range(len(bad_index_p)-1, -1, -1) \
-     if bad_index_p[i]]
-    [df_fjparticles_h["fj_particle"].pop(i) for i in range(len(bad_index_h)-1, -1, -1) \
-     if bad_index_h[i]]
-    [df_fjparticles_ch["fj_particle"].pop(i) for i in range(len(bad_index_ch)-1, -1, -1) \
-     if bad_index_ch[i]]
-
-    df_fjparticles_p["fj_particles_p"] = df_fjparticles_p["fj_particle"]
-    df_fjparticles_p.pop("fj_particle")
-    df_fjparticles_p["fj_particles_h"] = df_fjparticles_h["fj_particle"]
-    df_fjparticles_p["fj_particles_ch"] = df_fjparticles_ch["fj_particle"]
+    #index_h = np.roll(index_h, 1)
+
+    df_fjparticles = {
+      "run_number": [df_fjparticles_p["run_number"][i] for i in index_p],
+      "ev_id": [df_fjparticles_p["ev_id"][i] for i in index_p],
+      "fj_particles_p": [df_fjparticles_p["fj_particle"][i] for i in index_p],
+      "fj_particles_h": [df_fjparticles_h["fj_particle"][i] for i in index_h],
+      "fj_particles_ch": [df_fjparticles_ch["fj_particle"][i] for i in index_ch] }
 
     if self.debug_level > 1:
-      print("number of p events:", len(df_fjparticles_p["fj_particles_p"]))
-      print("number of h events:", len(df_fjparticles_p["fj_particles_h"]))
-      print("number of ch events:", len(df_fjparticles_p["fj_particles_ch"]))
+      print("number of paired events:", len(keys))
 
-    return df_fjparticles_p
+    return df_fjparticles
 
   #---------------------------------------------------------------
   # Initialize histograms
@@ -1174,7 +932,7 @@ class ProcessPHBase(process_base.ProcessBase):
     xmax_array = array('d', [pt_bins[-1], pt_bins[-1], obs_bins[-1], obs_bins[-1]])
 
     # assume 4 dimmensions
-    h = ROOT.THnF(name, name, 4, nbins_array, xmin_array, xmax_array)
+    h = self.new_thn(name, 4, nbins_array, xmin_array, xmax_array)
     for i in range(0, 4):
       h.GetAxis(i).SetTitle(title[i])
       if i == 0 or i == 1:
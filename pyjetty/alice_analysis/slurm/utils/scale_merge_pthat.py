@@ -0,0 +1,335 @@
+# Script to scale and merge histograms of all pT-hard bins in a single pass, using xsec from a yaml file.
+# This replaces running scaleHistograms.py in each X/AnalysisResults.root followed by hadd:
+#   - The pT-hard bins are read (read-only) and scaled in parallel worker processes
+#   - Outlier removal is done with numpy on the raw GetArray() buffers of the histograms
+#     (on the C++ side for dense THn, and over the filled bins for THnSparse, e.g. bootstrap replicas)
+#   - The weighted sum of all bins is accumulated in memory as the bins arrive, and written
+#     to a single output file with suffix "Scaled" (no intermediate Scaled objects are written)
+# hNevents is summed without scaling, as the number of accepted events.
+#
+# Example:
+#   python scale_merge_pthat.py -c xsec.yaml -i Stage0 -o AnalysisResultsFinal.root -j 10
+#
+
+import ROOT
+import argparse
+import multiprocessing
+import os
+import sys
+import yaml
+import numpy as np
+
+# Prevent ROOT from stealing focus when plotting
+ROOT.gROOT.SetBatch(True)
+
+# Upper pT-hat edge of each pT-hard bin (index = pT-hard bin), for pT-hat outlier removal
+pThatBinsDefault = [5, 7, 9, 12, 16, 21, 28, 36, 45, 57, 70, 85,
+                    99, 115, 132, 150, 169, 190, 212, 235, None]  ## PYTHIA
+
+# Histograms on which to apply pT-hat outlier removal; must have pT on x-axis (or axis 1)
+pThatHistogramsToCut = [
+  "h_ang_JetPt_", "h_mass_JetPt_", "hResponse_JetPt_", "hResidual_JetPt_",
+  "hJES_R", "hDeltaR_", "hDeltaObs_", "hDeltaPt_emb_R", "hZ_", "hTrackPt"]
+# Dimension in the THn to do the cut
+pTdimForTHn = 1
+
+# numpy dtype of the GetArray() buffer for each TArray type
+arrayTypes = [("TArrayD", np.float64), ("TArrayF", np.float32), ("TArrayI", np.int32),
+              ("TArrayS", np.int16), ("TArrayC", np.int8), ("TArrayL64", np.int64)]
+
+###################################################################################
+# Main function
+def scaleMergeHistograms(configFile, inputDir, outputFile, nWorkers, simpleOutlierLimit,
+                         pThatMaxMultiplier, verbose):
+
+  with open(configFile, 'r') as stream:
+    config = yaml.safe_load(stream)
+
+  # Find EndPtHardBin
+  EndPtHardBin = 0
+  for i in range(1,100):
+    if i in config:
+      EndPtHardBin = i
+    else:
+      break
+  print("EndPtHardBin: {}".format(EndPtHardBin))
+
+  pThatBins = config['pt_hat_bins'] if 'pt_hat_bins' in config else pThatBinsDefault
+
+  # Compute average number of events per bin
+  fileNames = [os.path.join(inputDir, str(bin), "AnalysisResults.root") for bin in range(1, EndPtHardBin+1)]
+  nEvents = [getNevents(fileName) for fileName in fileNames]
+  nEventsAvg = sum(nEvents)*1./EndPtHardBin
+  print("nEventsAvg per bin: {}".format(nEventsAvg))
+
+  tasks = []
+  for bin in range(1, EndPtHardBin+1):
+    eventScaleFactor = nEvents[bin-1] / nEventsAvg
+    scaleFactor = config[bin] / eventScaleFactor
+    print("ooo Pt-hard bin {}: eventScaleFactor: {}, total scaleFactor: {}".format(bin, eventScaleFactor, scaleFactor))
+
+    pThatHighEdge = None
+    if pThatMaxMultiplier > 0 and pThatBins[bin] != None:
+      pThatHighEdge = pThatBins[bin] * pThatMaxMultiplier
+    tasks.append((fileNames[bin-1], scaleFactor, simpleOutlierLimit, pThatHighEdge, verbose))
+
+  # Scale bins in parallel, and add them to the merged objects as they arrive (in order of pT-hard bin)
+  merged = {}
+  order = []
+  with multiprocessing.Pool(nWorkers) as pool:
+    for bin, objects in enumerate(pool.imap(scaleFile, tasks), 1):
+      print("ooo Merging Pt-hard bin {} of {}".format(bin, EndPtHardBin))
+      for name, obj in objects:
+        if name in merged:
+          addObjects(merged[name], obj)
+        else:
+          merged[name] = obj
+          order.append(name)
+
+  fOut = ROOT.TFile(outputFile, "RECREATE")
+  for name in order:
+    merged[name].Write(name)
+  fOut.Close()
+  print("Wrote merged histograms to {}".format(outputFile))
+
+###################################################################################
+# Number of accepted events in a pT-hard bin
+def getNevents(fileName):
+
+  f = ROOT.TFile(fileName, "READ")
+  nEvents = f.Get("hNevents").GetBinContent(2)
+  f.Close()
+  return nEvents
+
+###################################################################################
+# Read all objects of one pT-hard bin, remove outliers and scale them
+# Returns list of (output name, object), to be sent back to the main process
+def scaleFile(task):
+
+  fileName, scaleFactor, simpleOutlierLimit, pThatHighEdge, verbose = task
+
+  ROOT.TH1.AddDirectory(False)
+  f = ROOT.TFile(fileName, "READ")
+
+  objects = []
+  for key in f.GetListOfKeys():
+    name = key.GetName()
+    if "Scaled" in name:
+      continue
+    elif "roounfold" in name:
+      continue
+
+    obj = key.ReadObj()
+    if not obj:
+      print('obj {} not found!'.format(name))
+      continue
+
+    if "hNevents" in name:
+      objects.append((name, obj))
+      continue
+
+    # Bootstrap replicas (THnSparse) have the axes of their histogram: pT is on its pT axis
+    pTdim = pTdimForTHn
+    if name.endswith("_bootstrap"):
+      nominal = f.Get(name[:-len("_bootstrap")])
+      if nominal and nominal.InheritsFrom(ROOT.TH1.Class()):
+        pTdim = 0
+
+    ScaleAllHistograms(obj, scaleFactor, verbose, simpleOutlierLimit, pThatHighEdge, pTdim)
+    objects.append(("%sScaled" % name, obj))
+
+  f.Close()
+  return objects
+
+###################################################################################
+# Function to iterate recursively through an object to scale all TH1/TH2/THn
+def ScaleAllHistograms(obj, scaleFactor, verbose, simpleOutlierLimit=0, pThatHighEdge=None,
+                       pTdim=pTdimForTHn):
+
+  # Set Sumw2 if not already done
+  if obj.InheritsFrom(ROOT.THnBase.Class()):
+    if obj.GetSumw2() == 0:
+      obj.Sumw2()
+  elif obj.InheritsFrom(ROOT.TH1.Class()):
+    if obj.GetSumw2N() == 0:
+      obj.Sumw2()
+
+  cutName = pThatHighEdge != None and any([name in obj.GetName() for name in pThatHistogramsToCut])
+
+  if obj.InheritsFrom(ROOT.TProfile.Class()):
+    if verbose:
+      print("TProfile %s not scaled..." % obj.GetName())
+  elif obj.InheritsFrom(ROOT.TH1.Class()):
+    if cutName:
+      pThatRemoveOutliers(obj, verbose, pThatHighEdge)
+    if simpleOutlierLimit > 0:
+      simpleRemoveOutliers(obj, verbose, simpleOutlierLimit)
+    obj.Scale(scaleFactor)
+    if verbose:
+      print("TH1 %s was scaled..." % obj.GetName())
+  elif obj.InheritsFrom(ROOT.THnBase.Class()):
+    # Dense THn are handled on the C++ side
+    if obj.InheritsFrom(ROOT.THn.Class()) and (cutName or simpleOutlierLimit > 0):
+      histutils = getHistUtils()
+      if cutName:
+        histutils.pThatRemoveOutliers(obj, verbose, pThatHighEdge, obj.GetNdimensions(), pTdimForTHn)
+      if simpleOutlierLimit > 0:
+        histutils.simpleRemoveOutliersTHn(obj, verbose, simpleOutlierLimit, obj.GetNdimensions())
+    elif obj.InheritsFrom(ROOT.THnSparse.Class()) and (cutName or simpleOutlierLimit > 0):
+      sparseRemoveOutliers(obj, verbose, pThatHighEdge if cutName else None, pTdim, simpleOutlierLimit)
+    obj.Scale(scaleFactor)
+    if verbose:
+      print("THn %s was scaled..." % obj.GetName())
+  elif obj.InheritsFrom(ROOT.TCollection.Class()):
+    for subobj in obj:
+      ScaleAllHistograms(subobj, scaleFactor, verbose, simpleOutlierLimit, pThatHighEdge, pTdim)
+  elif verbose:
+    print("Not a histogram!")
+    print(obj.GetName())
+
+###################################################################################
+# Add obj to the merged object acc (recursing through lists)
+def addObjects(acc, obj):
+
+  if acc.InheritsFrom(ROOT.TH1.Class()) or acc.InheritsFrom(ROOT.THnBase.Class()):
+    acc.Add(obj)
+  elif acc.InheritsFrom(ROOT.TCollection.Class()):
+    for accSubobj, subobj in zip(acc, obj):
+      addObjects(accSubobj, subobj)
+
+###################################################################################
+# Load pyjetty ROOT utils (only needed for THn outlier removal)
+def getHistUtils():
+
+  if not hasattr(getHistUtils, 'histutils'):
+    ROOT.gSystem.Load("libpyjetty_rutil.so")
+    getHistUtils.histutils = ROOT.RUtil.HistUtils()
+  return getHistUtils.histutils
+
+###################################################################################
+# Return (content, sumw2) numpy views of the GetArray() buffers of a TH1/TH2/TH3
+# sumw2 is None if the histogram has no Sumw2 structure
+def getHistArrays(hist):
+
+  nCells = hist.GetNcells()
+  content = None
+  for arrayType, dtype in arrayTypes:
+    if hist.InheritsFrom(getattr(ROOT, arrayType).Class()):
+      buffer = hist.GetArray()
+      buffer.reshape((nCells,))
+      content = np.ndarray((nCells,), dtype=dtype, buffer=buffer)
+      break
+  if content is None:
+    raise TypeError("Unsupported array type for {}".format(hist.GetName()))
+
+  sumw2 = None
+  if hist.GetSumw2N() > 0:
+    buffer = hist.GetSumw2().GetArray()
+    buffer.reshape((nCells,))
+    sumw2 = np.ndarray((nCells,), dtype=np.float64, buffer=buffer)
+
+  return content, sumw2
+
+###################################################################################
+# "Simple" remove outliers function
+# Just delete any bin contents with N counts < limit (underflow cell 0 is kept, as on the C++ side)
+def simpleRemoveOutliers(hist, verbose=False, limit=2):
+
+  if verbose:
+    print("Applying simple removal of outliers with counts < %i for %s" % (limit, hist.GetName()))
+
+  content, sumw2 = getHistArrays(hist)
+  mask = content < limit
+  mask[0] = False
+  content[mask] = 0
+  if sumw2 is not None:
+    sumw2[mask] = 0
+
+###################################################################################
+# Remove outliers via pT-hat method: delete any bin contents with pT > limit
+# Assumes that pT is on the x-axis
+def pThatRemoveOutliers(hist, verbose, limit):
+
+  axis = hist.GetXaxis()
+  lowEdges = np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins()+1)])
+  above = np.flatnonzero(lowEdges > limit)
+  if above.size == 0:
+    return
+
+  if verbose:
+    print("Applying pT-hat removal of outliers for pT > %s for %s" % (limit, hist.GetName()))
+
+  # x bin of each global cell: global bin = x + (nx+2)*(y + (ny+2)*z)
+  content, sumw2 = getHistArrays(hist)
+  xBin = np.arange(content.size) % (axis.GetNbins()+2)
+  mask = xBin >= above[0] + 1
+  content[mask] = 0
+  if sumw2 is not None:
+    sumw2[mask] = 0
+
+###################################################################################
+# Remove outliers from a THnSparse, iterating over its filled bins:
+# bins with pT > pThatLimit on axis pTdim (if pThatLimit is not None),
+# and bins with counts < simpleLimit (if simpleLimit > 0)
+def sparseRemoveOutliers(hist, verbose, pThatLimit, pTdim, simpleLimit=0):
+
+  firstBin = None
+  if pThatLimit is not None:
+    axis = hist.GetAxis(pTdim)
+    lowEdges = np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins()+1)])
+    above = np.flatnonzero(lowEdges > pThatLimit)
+    if above.size > 0:
+      firstBin = above[0] + 1
+      if verbose:
+        print("Applying pT-hat removal of outliers for pT > %s for %s" % (pThatLimit, hist.GetName()))
+  if simpleLimit > 0 and verbose:
+    print("Applying simple removal of outliers with counts < %i for %s" % (simpleLimit, hist.GetName()))
+  if firstBin is None and simpleLimit <= 0:
+    return
+
+  coord = np.zeros(hist.GetNdimensions(), dtype=np.int32)
+  for i in range(hist.GetNbins()):
+    content = hist.GetBinContent(i, coord)
+    if (firstBin is not None and coord[pTdim] >= firstBin) or (simpleLimit > 0 and content < simpleLimit):
+      hist.SetBinContent(i, 0)
+      hist.SetBinError2(i, 0)
+
+#---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+  print("Executing scale_merge_pthat.py...")
+  print("")
+
+  # Define arguments
+  parser = argparse.ArgumentParser(description='Scale and merge pT-hard bins')
+  parser.add_argument('-c', '--configFile', action='store',
+                      type=str, metavar='configFile',
+                      default='analysis_config.yaml',
+                      help="Path of yaml file with xsec of each pT-hard bin")
+  parser.add_argument('-i', '--inputDir', action='store', type=str, default='.',
+                      help="Directory containing X/AnalysisResults.root for each pT-hard bin X")
+  parser.add_argument('-o', '--outputFile', action='store', type=str, default='AnalysisResultsFinal.root',
+                      help="Merged output file")
+  parser.add_argument('-j', '--nWorkers', action='store', type=int, default=10,
+                      help="Number of pT-hard bins to read and scale in parallel")
+  parser.add_argument('--simpleOutlierLimit', action='store', type=float, default=0,
+                      help="Remove bins with counts < limit (0 = off)")
+  parser.add_argument('--pThatMaxMultiplier', action='store', type=float, default=0,
+                      help="Remove bins with pT > multiplier * pT-hat max of the bin (0 = off)")
+  parser.add_argument('-v', '--verbose', action='store_true',
+                      help="Print detailed info about scaling and outlier removal")
+
+  # Parse the arguments
+  args = parser.parse_args()
+
+  print('Configuring...')
+  print('configFile: \'{0}\''.format(args.configFile))
+  print('----------------------------------------------------------------')
+
+  # If invalid configFile is given, exit
+  if not os.path.exists(args.configFile):
+    print('File \"{0}\" does not exist! Exiting!'.format(args.configFile))
+    sys.exit(0)
+
+  scaleMergeHistograms(configFile=args.configFile, inputDir=args.inputDir, outputFile=args.outputFile,
+                       nWorkers=args.nWorkers, simpleOutlierLimit=args.simpleOutlierLimit,
+                       pThatMaxMultiplier=args.pThatMaxMultiplier, verbose=args.verbose)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+"""
+Class to histogram energy correlators (EEC and projected N-point ENC) for batches of jets
+
+Jets are buffered as flat constituent arrays (pt, eta, phi, tag) plus per-jet offsets,
+and every batch is passed through a compiled kernel which loops over all N-tuples
+of constituents, and accumulates directly into log-binned RL histograms per jet pt bin:
+
+  ENC(RL) = sum_{i1<...<iN} pt_i1^n ... pt_iN^n / jet_pt^(N*n),   RL = max pairwise dR
+
+With use_ptRL, jet_pt*RL is histogrammed instead of RL. Entries below/above the RL range
+are kept in the under/overflow bins, and counted (see n_outside).
+
+Constituents carry a tag (TAG_TRACK, TAG_DMESON, TAG_SOFTPION). The track pt threshold
+only applies to TAG_TRACK constituents, and which (tag, tag) pairs enter the EEC is set by
+softpion_action, as for the --softpion option of pythia_quark_gluon_ezra.py:
+  0: all pairs
+  1: remove soft pion
+  2: only pairs of soft pion with (other) tracks
+  3: only the pair of soft pion with D meson
+  4: pairs of soft pion with everything
+For N > 2, a constituent enters the N-tuples if it is allowed in any pair.
+"""
+
+from numba import jit
+
+import ROOT
+
+# Data analysis and plotting
+import numpy as np
+
+# Base class
+from pyjetty.alice_analysis.process.base import common_base
+
+TAG_TRACK = 0
+TAG_DMESON = 1
+TAG_SOFTPION = 2
+
+#---------------------------------------------------------------
+# Accumulate ENC of all jets in a batch into hist_w/hist_w2 [jet pt bin, RL bin],
+# where RL bin 0 is the underflow and n_rl_bins+1 the overflow, as for TH1
+#---------------------------------------------------------------
+@jit(nopython=True)
+def fill_correlator(pt, eta, phi, tag, offsets, jet_pt, jet_pt_bin, pair_allowed, N,
+                    trk_pt_min, power, use_ptRL, log_rl_min, inv_dlog, hist_w, hist_w2):
+
+    n_rl_bins = hist_w.shape[1] - 2
+    tag_allowed = np.zeros(pair_allowed.shape[0], dtype=np.bool_)
+    for a in range(pair_allowed.shape[0]):
+        for b in range(pair_allowed.shape[1]):
+            if pair_allowed[a, b]:
+                tag_allowed[a] = True
+
+    for i_jet in range(offsets.shape[0] - 1):
+
+        pt_bin = jet_pt_bin[i_jet]
+        if pt_bin < 0:
+            continue
+
+        # Select constituents
+        begin = offsets[i_jet]
+        end = offsets[i_jet+1]
+        index = np.empty(end - begin, dtype=np.int64)
+        n = 0
+        for i in range(begin, end):
+            if tag[i] == TAG_TRACK and pt[i] < trk_pt_min:
+                continue
+            if not tag_allowed[tag[i]]:
+                continue
+            index[n] = i
+            n += 1
+        if n < N:
+            continue
+
+        # Pairwise distances and single-particle weights
+        dR = np.zeros((n, n))
+        w = np.empty(n)
+        for a in range(n):
+            i = index[a]
+            w[a] = (pt[i] / jet_pt[i_jet])**power
+            for b in range(a):
+                j = index[b]
+                delta_phi = np.abs(phi[i] - phi[j])
+                if delta_phi > np.pi:
+                    delta_phi = 2*np.pi - delta_phi
+                delta_eta = eta[i] - eta[j]
+                dR[a, b] = np.sqrt(delta_eta*delta_eta + delta_phi*delta_phi)
+                dR[b, a] = dR[a, b]
+
+        x_scale = jet_pt[i_jet] if use_ptRL else 1.
+
+        # Loop over N-tuples a_0 < a_1 < ... < a_{N-1} in lexicographic order
+        a = np.arange(N)
+        while True:
+
+            accept = True
+            if N == 2:
+                accept = pair_allowed[tag[index[a[0]]], tag[index[a[1]]]]
+
+            if accept:
+                weight = 1.
+                rl = 0.
+                for k in range(N):
+                    weight *= w[a[k]]
+                    for l in range(k):
+                        if dR[a[k], a[l]] > rl:
+                            rl = dR[a[k], a[l]]
+                x = rl * x_scale
+                rl_bin = 0
+                if x > 0:
+                    rl_bin = min(max(int(np.floor((np.log(x) - log_rl_min) * inv_dlog)) + 1, 0), n_rl_bins + 1)
+                hist_w[pt_bin, rl_bin] += weight
+                hist_w2[pt_bin, rl_bin] += weight*weight
+
+            # Advance to next N-tuple
+            k = N - 1
+            while k >= 0 and a[k] == n - N + k:
+                k -= 1
+            if k < 0:
+                break
+            a[k] += 1
+            for l in range(k+1, N):
+                a[l] = a[l-1] + 1
+
+################################################################
+class EnergyCorrelatorEngine(common_base.CommonBase):
+
+    #---------------------------------------------------------------
+    # Constructor
+    #---------------------------------------------------------------
+    def __init__(self, jet_pt_bins=[], rl_min=1e-4, rl_max=1., n_rl_bins=50, N_list=[2],
+                 power=1., trk_pt_min=0., softpion_action=0, use_ptRL=False, batch_size=1000, **kwargs):
+        super(EnergyCorrelatorEngine, self).__init__(**kwargs)
+
+        for N in N_list:
+            if N < 2:
+                raise ValueError("Energy correlator with N=%i is not defined" % N)
+
+        self.jet_pt_bins = np.array(jet_pt_bins, dtype=np.float64)
+        self.n_jet_pt_bins = len(self.jet_pt_bins) - 1
+        self.rl_bins = np.logspace(np.log10(rl_min), np.log10(rl_max), n_rl_bins+1)
+        self.log_rl_min = np.log(rl_min)
+        self.inv_dlog = n_rl_bins / (np.log(rl_max) - np.log(rl_min))
+        self.N_list = N_list
+        self.power = power
+        self.trk_pt_min = trk_pt_min
+        self.use_ptRL = use_ptRL
+        self.batch_size = batch_size
+        self.pair_allowed = self.pair_selection(softpion_action)
+
+        # Histograms [N][jet pt bin, RL bin] (with RL under/overflow), and number of jets per jet pt bin
+        self.hist_w = {N: np.zeros((self.n_jet_pt_bins, n_rl_bins+2)) for N in self.N_list}
+        self.hist_w2 = {N: np.zeros((self.n_jet_pt_bins, n_rl_bins+2)) for N in self.N_list}
+        self.n_jets = np.zeros(self.n_jet_pt_bins)
+
+        self.reset_batch()
+
+    #---------------------------------------------------------------
+    # (tag, tag) -> bool matrix of pairs entering the EEC
+    #---------------------------------------------------------------
+    @staticmethod
+    def pair_selection(softpion_action):
+
+        pair_allowed = np.ones((3, 3), dtype=np.bool_)
+        if softpion_action == 1:
+            pair_allowed[TAG_SOFTPION, :] = False
+            pair_allowed[:, TAG_SOFTPION] = False
+        elif softpion_action in [2, 3, 4]:
+            pair_allowed[:, :] = False
+            if softpion_action in [2, 4]:
+                pair_allowed[TAG_SOFTPION, TAG_TRACK] = pair_allowed[TAG_TRACK, TAG_SOFTPION] = True
+            if softpion_action in [3, 4]:
+                pair_allowed[TAG_SOFTPION, TAG_DMESON] = pair_allowed[TAG_DMESON, TAG_SOFTPION] = True
+        return pair_allowed
+
+    #---------------------------------------------------------------
+    # Clear buffered jets
+    #---------------------------------------------------------------
+    def reset_batch(self):
+
+        self.batch_pt = []
+        self.batch_eta = []
+        self.batch_phi = []
+        self.batch_tag = []
+        self.batch_jet_pt = []
+
+    #---------------------------------------------------------------
+    # Add a jet from its constituent arrays; tag defaults to TAG_TRACK
+    #---------------------------------------------------------------
+    def add_jet(self, jet_pt, pt, eta, phi, tag=None):
+
+        pt = np.asarray(pt, dtype=np.float64)
+        if tag is None:
+            tag = np.full(pt.shape[0], TAG_TRACK, dtype=np.int64)
+
+        self.batch_pt.append(pt)
+        self.batch_eta.append(np.asarray(eta, dtype=np.float64))
+        self.batch_phi.append(np.asarray(phi, dtype=np.float64))
+        self.batch_tag.append(np.asarray(tag, dtype=np.int64))
+        self.batch_jet_pt.append(jet_pt)
+
+        if len(self.batch_jet_pt) >= self.batch_size:
+            self.flush()
+
+    #---------------------------------------------------------------
+    # Add a batch of jets given as flat constituent arrays plus offsets,
+    # where constituents of jet i are [offsets[i], offsets[i+1])
+    #---------------------------------------------------------------
+    def fill(self, jet_pt, pt, eta, phi, offsets, tag=None):
+
+        jet_pt = np.asarray(jet_pt, dtype=np.float64)
+        pt = np.asarray(pt, dtype=np.float64)
+        if tag is None:
+            tag = np.full(pt.shape[0], TAG_TRACK, dtype=np.int64)
+
+        # Jets outside the jet pt binning are flagged with bin -1
+        jet_pt_bin = np.searchsorted(self.jet_pt_bins, jet_pt, side='right') - 1
+        jet_pt_bin[jet_pt_bin >= self.n_jet_pt_bins] = -1
+        self.n_jets += np.bincount(jet_pt_bin[jet_pt_bin >= 0], minlength=self.n_jet_pt_bins)
+
+        for N in self.N_list:
+            fill_correlator(pt, np.asarray(eta, dtype=np.float64), np.asarray(phi, dtype=np.float64),
+                            np.asarray(tag, dtype=np.int64), np.asarray(offsets, dtype=np.int64),
+                            jet_pt, jet_pt_bin, self.pair_allowed, N, self.trk_pt_min, self.power,
+                            self.use_ptRL, self.log_rl_min, self.inv_dlog, self.hist_w[N], self.hist_w2[N])
+
+    #---------------------------------------------------------------
+    # Histogram all buffered jets
+    #---------------------------------------------------------------
+    def flush(self):
+
+        if not self.batch_jet_pt:
+            return
+
+        offsets = np.zeros(len(self.batch_pt)+1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(pt) for pt in self.batch_pt])
+        self.fill(self.batch_jet_pt, np.concatenate(self.batch_pt), np.concatenate(self.batch_eta),
+                  np.concatenate(self.batch_phi), offsets, np.concatenate(self.batch_tag))
+        self.reset_batch()
+
+    #---------------------------------------------------------------
+    # Return TH2D (jet pt, RL) of the N-point correlator
+    #---------------------------------------------------------------
+    def histogram(self, name, N=2):
+
+        self.flush()
+
+        h = ROOT.TH2D(name, name, self.n_jet_pt_bins, self.jet_pt_bins,
+                      len(self.rl_bins)-1, self.rl_bins)
+        h.Sumw2()
+        h.GetXaxis().SetTitle('#it{p}_{T}^{ch jet}')
+        h.GetYaxis().SetTitle('#it{p}_{T}^{ch jet}#it{R}_{L}' if self.use_ptRL else '#it{R}_{L}')
+        for i in range(self.n_jet_pt_bins):
+            for j in range(len(self.rl_bins)+1):
+                h.SetBinContent(i+1, j, self.hist_w[N][i, j])
+                h.SetBinError(i+1, j, np.sqrt(self.hist_w2[N][i, j]))
+        return h
+
+    #---------------------------------------------------------------
+    # Return (weight in range, weight below, weight above the RL range)
+    # of the N-point correlator, summed over jet pt bins
+    #---------------------------------------------------------------
+    def n_outside(self, N=2):
+
+        self.flush()
+
+        hist_w = self.hist_w[N].sum(axis=0)
+        return hist_w[1:-1].sum(), hist_w[0], hist_w[-1]
+
+    #---------------------------------------------------------------
+    # Return TH1D of the number of jets per jet pt bin (for normalization)
+    #---------------------------------------------------------------
+    def histogram_njets(self, name):
+
+        self.flush()
+
+        h = ROOT.TH1D(name, name, self.n_jet_pt_bins, self.jet_pt_bins)
+        h.GetXaxis().SetTitle('#it{p}_{T}^{ch jet}')
+        for i in range(self.n_jet_pt_bins):
+            h.SetBinContent(i+1, self.n_jets[i])
+        return h
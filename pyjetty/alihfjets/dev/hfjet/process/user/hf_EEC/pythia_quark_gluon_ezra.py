@@ -34,6 +34,7 @@ import pythiafjext
 import pythiaext
 
 from pyjetty.alice_analysis.process.base import process_base
+from pyjetty.alihfjets.dev.hfjet.process.user.hf_EEC import eec_engine
 
 from enum import Enum
 import fjtools
@@ -143,6 +144,17 @@ class PythiaQuarkGluon(process_base.ProcessBase):
 
             self.obs_names[observable] = obs_config_dict["common_settings"]["xtitle"]
 
+            # Energy correlator settings
+            if observable == "EEC":
+                common_settings = obs_config_dict["common_settings"]
+                self.eec_trk_thrd = common_settings["trk_thrd"] if "trk_thrd" in common_settings else 1
+                # Default range of RL, or of pT*RL (in GeV) with --giveptRL
+                self.eec_rl_min = common_settings["rl_min"] if "rl_min" in common_settings else (1e-2 if self.use_ptRL else 1e-4)
+                self.eec_rl_max = common_settings["rl_max"] if "rl_max" in common_settings else (1e2 if self.use_ptRL else 1)
+                self.eec_n_rl_bins = common_settings["n_rl_bins"] if "n_rl_bins" in common_settings else 50
+                self.eec_N_list = common_settings["N_list"] if "N_list" in common_settings else [2]
+                self.eec_power = common_settings["power"] if "power" in common_settings else 1
+
     #---------------------------------------------------------------
     # Main processing function
     #---------------------------------------------------------------
@@ -277,6 +289,8 @@ class PythiaQuarkGluon(process_base.ProcessBase):
         self.pythia.stat()
         print()
 
+        self.write_correlator_histograms()
+
         self.scale_print_final_info(self.pythia)
 
         outf.Write()
@@ -306,6 +320,9 @@ class PythiaQuarkGluon(process_base.ProcessBase):
             self.hphiNevents = ROOT.TH1I("hphiNevents", "Total Number of phi events (unscaled)", 2, -0.5, 1.5)
             self.hphiNjets = ROOT.TH1I("hphiNjets", "Number of phi jets (unscaled)", 2, -0.5, 1.5)
 
+        # Energy correlator engines, keyed by the name of their output histogram
+        self.eec_engines = {}
+
         for jetR in self.jetR_list:
 
             # Store a list of all the histograms just so that we can rescale them later
@@ -316,7 +333,10 @@ class PythiaQuarkGluon(process_base.ProcessBase):
 
             for observable in self.observable_list:
 
-                if observable != "mass":
+                if observable == "EEC":
+                    self.initialize_correlators(observable, jetR)
+                    continue
+                elif observable != "mass":
                     raise ValueError("Observable %s is not implemented in this script" % observable)
 
                 obs_name = self.obs_names[observable]
@@ -397,6 +417,50 @@ class PythiaQuarkGluon(process_base.ProcessBase):
                         setattr(self, name, h3D)
                         getattr(self, hist_list_name).append(h3D)
 
+    #---------------------------------------------------------------
+    # Initialize energy correlator engines (histograms are created after the event loop)
+    #---------------------------------------------------------------
+    def initialize_correlators(self, observable, jetR):
+
+        for i in range(len(self.obs_settings[observable])):
+
+            obs_setting = self.obs_settings[observable][i]
+            grooming_setting = self.obs_grooming_settings[observable][i]
+            obs_label = self.utils.obs_label(obs_setting, grooming_setting)
+
+            for parton_type in ["charm"]:
+                # Traditional anti-kT jet, SD-with-JADE and WTA tagged jets
+                for tag_label in ["", "_jade", "_wta"]:
+                    name = ('h2D_%s%s_JetPt_%s_R%s_%s' % (observable, tag_label, parton_type, jetR, obs_label)) if \
+                        len(obs_label) else ('h2D_%s%s_JetPt_%s_R%s' % (observable, tag_label, parton_type, jetR))
+                    self.eec_engines.setdefault(jetR, {})[name] = eec_engine.EnergyCorrelatorEngine(
+                        jet_pt_bins=self.pt_bins, rl_min=self.eec_rl_min, rl_max=self.eec_rl_max,
+                        n_rl_bins=self.eec_n_rl_bins, N_list=self.eec_N_list, power=self.eec_power,
+                        trk_pt_min=self.eec_trk_thrd, softpion_action=self.softpion_action,
+                        use_ptRL=self.use_ptRL)
+
+    #---------------------------------------------------------------
+    # Convert energy correlator engines to histograms, to be scaled and saved
+    #---------------------------------------------------------------
+    def write_correlator_histograms(self):
+
+        for jetR, engines in self.eec_engines.items():
+            hist_list_name = "hist_list_R%s" % str(jetR).replace('.', '')
+            for name, engine in engines.items():
+                for N in engine.N_list:
+                    h_name = name if N == 2 else name.replace("EEC", "E%iC" % N, 1)
+                    n_in, n_below, n_above = engine.n_outside(N)
+                    if n_below + n_above > 0:
+                        pwarning(h_name, ': weight {:.3g} below and {:.3g} above the RL range [{}, {}] (in under/overflow), {:.3g} in range'.format(
+                            n_below, n_above, self.eec_rl_min, self.eec_rl_max, n_in))
+                    h = engine.histogram(h_name, N)
+                    setattr(self, h_name, h)
+                    getattr(self, hist_list_name).append(h)
+
+                # Number of jets per jet pt bin, for normalization (not scaled)
+                h_name = name.replace("h2D_", "hNjets_", 1)
+                setattr(self, h_name, engine.histogram_njets(h_name))
+
     #---------------------------------------------------------------
     # Initiate jet defs, selectors, and sd (if required)
     #---------------------------------------------------------------
@@ -717,6 +781,7 @@ class PythiaQuarkGluon(process_base.ProcessBase):
                 D0taggedjet = False
                 N_D0 = 0
                 Dstartaggedjet = False
+                softpion_index = -1
                 if ( self.replaceKPpairs ):
                     # print("There are ", len(jet.constituents()), "constituents.")
                     for c in jet.constituents():
@@ -734,7 +799,7 @@ class PythiaQuarkGluon(process_base.ProcessBase):
                                 Dstartaggedjet = True
 
                                 # save soft pion info from D* if needed
-                                if ( self.softpion_action >= 2 ): #(self.Dstar):
+                                if ( self.softpion_action >= 1 ): #(self.Dstar):
                                     # get the soft pion
                                     if (self.checkD0motherIsDstar(self.D0particleinfo, self.event)):
                                         # print("mother is in fact a Dstar")
@@ -891,6 +956,11 @@ class PythiaQuarkGluon(process_base.ProcessBase):
                             if (softpion_index == -1): #skip because soft pion is not in the jet!
                                 continue
 
+                        if observable == "EEC":
+                            self.fill_correlators(observable, jet, jetR, obs_label, jade_tagged, wta_tagged,
+                                                  D0taggedjet or Dstartaggedjet or phitaggedjet, softpion_index)
+                            continue
+
                         obs = self.calculate_observable(
                             observable, jet, jet_groomed_lund, jetR, obs_setting,
                             grooming_setting, obs_label, jet.pt())
@@ -923,6 +993,33 @@ class PythiaQuarkGluon(process_base.ProcessBase):
             setattr(self, "count1_R%s" % jetR_str, count1)
             setattr(self, "count2_R%s" % jetR_str, count2)
 
+    #---------------------------------------------------------------
+    # Pass jet constituents, tagged as track/D meson/soft pion, to the energy correlator engines
+    #---------------------------------------------------------------
+    def fill_correlators(self, observable, jet, jetR, obs_label, jade_tagged, wta_tagged,
+                         HF_taggedjet, softpion_index):
+
+        D_index = self.D0particleinfo.index() if HF_taggedjet else -1
+
+        constituents = jet.constituents()
+        pt = np.array([c.perp() for c in constituents])
+        rap = np.array([c.rap() for c in constituents])
+        phi = np.array([c.phi_02pi() for c in constituents])
+        tag = np.full(len(constituents), eec_engine.TAG_TRACK, dtype=np.int64)
+        for i, c in enumerate(constituents):
+            if c.user_index() == D_index:
+                tag[i] = eec_engine.TAG_DMESON
+            elif softpion_index >= 0 and c.user_index() == softpion_index:
+                tag[i] = eec_engine.TAG_SOFTPION
+
+        for parton_type in ["charm"]:
+            for tag_label, tagged in [("", True), ("_jade", jade_tagged), ("_wta", wta_tagged)]:
+                if not tagged:
+                    continue
+                name = ('h2D_%s%s_JetPt_%s_R%s_%s' % (observable, tag_label, parton_type, jetR, obs_label)) if \
+                    len(obs_label) else ('h2D_%s%s_JetPt_%s_R%s' % (observable, tag_label, parton_type, jetR))
+                self.eec_engines[jetR][name].add_jet(jet.perp(), pt, rap, phi, tag)
+
     #---------------------------------------------------------------
     # Calculate the observable given a jet
     #---------------------------------------------------------------
@@ -23,6 +23,7 @@ from pyjetty.mputils import CEventSubtractor, CSubtractorJetByJet
 from pyjetty.mputils import RTreeWriter
 from pyjetty.mputils import fill_tree_matched, fill_tree_data, JetAnalysis, JetAnalysisWithRho, JetAnalysisPerJet
 from pyjetty.mputils import DataBackgroundIO
+from pyjetty.mputils import ColumnarWriter, fill_columns_data, fill_columns_matched
 
 from alice_efficiency import AliceChargedParticleEfficiency
 
@@ -50,6 +51,8 @@ def main():
 	parser.add_argument('--efficiency', help='apply charged particle efficiency', default=False, action='store_true')
 	parser.add_argument('--benchmark', help='benchmark pthat setting - 80 GeV', default=False, action='store_true')
 	parser.add_argument('--csjet', help='constituent subtration jet-by-jet', default=False, action='store_true')
+	parser.add_argument('--columnar', help='write the trees in blocks of columns - root (uproot) or parquet (one file per tree)', default=None, type=str)
+	parser.add_argument('--block-size', help='rows per written block with --columnar', default=100000, type=int)
 	args = parser.parse_args()
 
 	if args.output == 'output.root':
@@ -132,12 +135,31 @@ def main():
 	if args.nev < 1:
 		args.nev = 1
 
-	outf = ROOT.TFile(args.output, 'recreate')
-	outf.cd()
-	t = ROOT.TTree('t', 't')
-	tw = RTreeWriter(tree=t)
-	te = ROOT.TTree('te', 'te')
-	twe = RTreeWriter(tree=te)
+	if args.columnar == 'parquet':
+		tw = ColumnarWriter(tree_name='t', file_name=args.output.replace('.root', '_t.parquet'), block_size=args.block_size)
+		twe = ColumnarWriter(tree_name='te', file_name=args.output.replace('.root', '_te.parquet'), block_size=args.block_size)
+	elif args.columnar == 'root':
+		outf = uproot.recreate(args.output)
+		tw = ColumnarWriter(tree_name='t', file_name=args.output, fout=outf, block_size=args.block_size)
+		twe = ColumnarWriter(tree_name='te', file_name=args.output, fout=outf, block_size=args.block_size)
+	elif args.columnar is None:
+		outf = ROOT.TFile(args.output, 'recreate')
+		outf.cd()
+		t = ROOT.TTree('t', 't')
+		tw = RTreeWriter(tree=t)
+		te = ROOT.TTree('te', 'te')
+		twe = RTreeWriter(tree=te)
+	else:
+		print('[e] unknown --columnar format', args.columnar)
+		return
+
+	def fill_trees(sjet, jets, rho, iev):
+		if args.columnar:
+			fill_columns_data(jets, twe, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen())
+			fill_columns_matched(sjet, jets, tw, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen())
+		else:
+			tmp = [fill_tree_data(ej, twe, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jets]
+			tmp = [fill_tree_matched(sjet, ej, tw, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jets]
 
 	# effi_pp = AliceChargedParticleEfficiency(csystem='pp')
 	effi_PbPb = None
@@ -201,8 +223,7 @@ def main():
 				cs_parts = cs.process_event(full_event)
 				rho = cs.bge_rho.rho()
 				jarho.analyze_event(cs_parts)							
-				tmp = [fill_tree_data(ej, twe, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jarho.jets]
-				tmp = [fill_tree_matched(sjet, ej, tw, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jarho.jets]
+				fill_trees(sjet, jarho.jets, rho, iev)
 			else:
 				jarho.analyze_event(full_event)
 				rho = jarho.rho
@@ -226,15 +247,19 @@ def main():
 					# 	_sd_j = sd.result(_j)
 					# https://phab.hepforge.org/source/fastjetsvn/browse/contrib/contribs/RecursiveTools/trunk/Recluster.cc L 270
 					# tmp = [fill_tree_matched(sjet, ej, tw, sd, rho, iev, pythia.info.sigmaGen()) for ej in subtr_jets_wcs]
-					tmp = [fill_tree_data(ej, twe, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in japerjet.jets]
-					tmp = [fill_tree_matched(sjet, ej, tw, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in japerjet.jets]
+					fill_trees(sjet, japerjet.jets, rho, iev)
 				else:
-					tmp = [fill_tree_data(ej, twe, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jarho.jets]
-					tmp = [fill_tree_matched(sjet, ej, tw, sd, rho, iev, pythia.info.weight(), pythia.info.sigmaGen()) for ej in jarho.jets]
+					fill_trees(sjet, jarho.jets, rho, iev)
 	pythia.stat()
-	outf.Write()
-	outf.Close()
-	print('[i] written', outf.GetName())
+	if args.columnar:
+		tw.close()
+		twe.close()
+		if args.columnar == 'root':
+			outf.close()
+	else:
+		outf.Write()
+		outf.Close()
+		print('[i] written', outf.GetName())
 
 
 if __name__ == '__main__':
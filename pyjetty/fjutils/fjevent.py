@@ -1,4 +1,5 @@
 import fastjet as fj
+import numpy as np
 import pandas as pd
 
 class KineSelectorFactory(object):
@@ -51,7 +52,8 @@ class FJEvent(object):
 		if self.name is None:
 			self.name = '{}_{}'.format(self.R, self.algorithm)
 		self.background_estimator = None
-		self.jets_df = []
+		# jets of all events as columns (one array per event), the DataFrame is built once in get_pandas
+		self.jets_columns = dict([(c, []) for c in self.df_columns])
 
 	def run_jet_finder_csaa(self, particles = [], evid = -1):
 		self.particles = particles
@@ -67,12 +69,28 @@ class FJEvent(object):
 		_grid_spacing = self.particle_selector.absetamax / self.ngrid
 		self.background_estimator = fj.GridMedianBackgroundEstimator(self.particle_selector.absetamax, _grid_spacing)
 		self.background_estimator.set_particles(self.particle_selector.selector(self.particles))
-		self.jets_df.append(pd.DataFrame([[	self.id, j.perp(), j.eta(), j.phi(), j.area(), 
-										j.perp() - self.background_estimator.rho() * j.area(), self.name] 
-										for j in self.inclusive_jets], 
-									columns=self.df_columns))
+		self.fill_jets_columns()
+
+	def fill_jets_columns(self):
+		njets = len(self.inclusive_jets)
+		kine = np.array([[j.perp(), j.eta(), j.phi(), j.area()] for j in self.inclusive_jets]).reshape(njets, 4)
+		self.jets_columns['evid'].append(np.full(njets, self.id))
+		self.jets_columns['pt'].append(kine[:, 0])
+		self.jets_columns['eta'].append(kine[:, 1])
+		self.jets_columns['phi'].append(kine[:, 2])
+		self.jets_columns['area'].append(kine[:, 3])
+		self.jets_columns['ptsub'].append(kine[:, 0] - self.background_estimator.rho() * kine[:, 3])
+		self.jets_columns['name'].append(np.full(njets, self.name, dtype=object))
+
 	def get_pandas(self):
-		return pd.concat(self.jets_df, ignore_index=True)
+		if len(self.jets_columns['pt']) == 0:
+			return pd.DataFrame(columns=self.df_columns)
+		return pd.DataFrame(dict([(c, np.concatenate(self.jets_columns[c])) for c in self.df_columns]), columns=self.df_columns)
+
+	@property
+	def jets_df(self):
+		# kept for backward compatibility, builds the DataFrame of all jets so far on each access
+		return self.get_pandas()
 
 	def leading_pt_particle(self):
 		return fj.sorted_by_pt(self.particles)[0]
@@ -6,7 +6,7 @@ for pthat in ${pthats}
 do
 	merged=hout_pthat_${pthat}.root
 	[ "x${1}" == "xoverwrite" ] && rm -vf ${merged}
-	[ ! -f ${merged} ] && tdraw_cfg.py tdraw_hjet_template.cfg -r pthat:${pthat} --clean --merged-output ${merged}
+	[ ! -f ${merged} ] && ${PYJETTYDIR}/pyjetty/rootutils/tdraw_rdf.py tdraw_hjet_template.cfg -r pthat:${pthat} --clean --merged-output ${merged}
 done
 
 rm -vf hout_pthat_merged.root
@@ -30,15 +30,18 @@ import pythiafjext
 import pythiaext
 
 class BackgroundEstimator(MPBase):
+	# The eta-phi grid is held as numpy arrays in the TProfile2D cell layout (including under/overflow):
+	# sum of pt, sum of pt^2 and number of entries per cell; written to / read from the TProfile2D
 	def __init__(self, **kwargs):
 		self.configure_from_args(grid_size_phi=0.1, grid_size_eta=0.1, particle_eta_max=1., input_file=None)
 		super(BackgroundEstimator, self).__init__(**kwargs)
 		self._sname = self.name
 		if self.input_file:
 			self.fin = ROOT.TFile(self.input_file)
-			self.grid_eta_phi = self.fin.Get(self.name)	
-			self.tlv = ROOT.TLorentzVector()
-			self.tlvS = ROOT.TLorentzVector()
+			self.grid_eta_phi = self.fin.Get(self.name)
+			self.nevents = 0
+			self._set_axes(self.grid_eta_phi)
+			self._read_grid(self.grid_eta_phi)
 		else:
 			self.nevents = 0
 			self._nbinsX = int(2 * self.particle_eta_max/self.grid_size_eta)
@@ -48,30 +51,66 @@ class BackgroundEstimator(MPBase):
 												# int(2 * (ROOT.TMath.Pi())/self.grid_size), -ROOT.TMath.Pi(), ROOT.TMath.Pi())
 												self._nbinsY, 0., 2. * ROOT.TMath.Pi())
 			self.grid_eta_phi.SetDirectory(0)
-			self._sname = UniqueString.str('h_grid_bg_estim_tmp')
-			self.grid_eta_phi_tmp = ROOT.TProfile2D(self._sname, self._sname, 
-													self._nbinsX, -self.particle_eta_max, self.particle_eta_max, 
-													# int(2 * (ROOT.TMath.Pi())/self.grid_size), -ROOT.TMath.Pi(), ROOT.TMath.Pi())
-													self._nbinsY, 0., 2. * ROOT.TMath.Pi())
-			self.grid_eta_phi_tmp.SetDirectory(0)
+			self._set_axes(self.grid_eta_phi)
+			self.sum_pt = np.zeros(self._ncells)
+			self.sum_pt2 = np.zeros(self._ncells)
+			self.entries = np.zeros(self._ncells)
+			self.mean_pt = np.zeros(self._ncells)
+
+	def _set_axes(self, h):
+		self._nbinsX = h.GetXaxis().GetNbins()
+		self._nbinsY = h.GetYaxis().GetNbins()
+		self._xmin, self._xmax = h.GetXaxis().GetXmin(), h.GetXaxis().GetXmax()
+		self._ymin, self._ymax = h.GetYaxis().GetXmin(), h.GetYaxis().GetXmax()
+		self._ncells = (self._nbinsX + 2) * (self._nbinsY + 2)
+
+	def _read_grid(self, h):
+		self.entries = np.array([h.GetBinEntries(i) for i in range(self._ncells)])
+		self.mean_pt = np.array([h.GetBinContent(i) for i in range(self._ncells)])
+		self.sum_pt = self.mean_pt * self.entries
+		self.sum_pt2 = np.array([h.GetSumw2().At(i) for i in range(self._ncells)])
+
+	def _write_grid(self, h):
+		h.Reset()
+		for i in np.flatnonzero(self.entries):
+			h.SetBinEntries(int(i), self.entries[i])
+			h.SetBinContent(int(i), self.sum_pt[i])
+			h.GetSumw2().SetAt(self.sum_pt2[i], int(i))
+		h.SetEntries(np.sum(self.entries))
+		h.ResetStats()
+
+	def cell_index(self, eta, phi):
+		# as TAxis::FindBin on the uniform axes (0: underflow, nbins+1: overflow), and the global bin
+		ieta = np.floor(self._nbinsX * (eta - self._xmin) / (self._xmax - self._xmin)).astype(np.int64) + 1
+		iphi = np.floor(self._nbinsY * (phi - self._ymin) / (self._ymax - self._ymin)).astype(np.int64) + 1
+		ieta = np.clip(ieta, 0, self._nbinsX + 1)
+		iphi = np.clip(iphi, 0, self._nbinsY + 1)
+		return ieta + (self._nbinsX + 2) * iphi
 
 	def write(self):
+		self._write_grid(self.grid_eta_phi)
 		self.grid_eta_phi.Write()
 
-	def fill_grid(self, parts):
-		self.grid_eta_phi_tmp.Reset()
-		_tmp = [self.grid_eta_phi_tmp.Fill(p.eta(), p.phi(), p.pt()) for p in parts]
-		self.grid_eta_phi.Add(self.grid_eta_phi_tmp, 1.)
+	def fill_grid_arrays(self, pt, eta, phi):
+		icell = self.cell_index(np.asarray(eta), np.asarray(phi))
+		pt = np.asarray(pt, dtype=np.float64)
+		self.sum_pt += np.bincount(icell, weights=pt, minlength=self._ncells)
+		self.sum_pt2 += np.bincount(icell, weights=pt*pt, minlength=self._ncells)
+		self.entries += np.bincount(icell, minlength=self._ncells)
+		self.mean_pt = np.divide(self.sum_pt, self.entries, out=np.zeros(self._ncells), where=self.entries > 0)
 		self.nevents = self.nevents + 1
 
+	def fill_grid(self, parts):
+		_pt_eta_phi = np.array([(p.pt(), p.eta(), p.phi()) for p in parts]).reshape(-1, 3)
+		self.fill_grid_arrays(_pt_eta_phi[:, 0], _pt_eta_phi[:, 1], _pt_eta_phi[:, 2])
+
 	def get_subtracted_vector(self, p):
-		self.tlv.SetPtEtaPhiM(p.pt(), p.eta(), p.phi(), 0)
-		ieta = self.grid_eta_phi.GetXaxis().FindBin(p.eta())
-		iphi = self.grid_eta_phi.GetYaxis().FindBin(p.phi())
-		spt = self.grid_eta_phi.GetBinContent(ieta, iphi)
-		self.tlvS.SetPtEtaPhiM(spt, p.eta(), p.phi(), 0)
-		self.tlv = self.tlv - self.tlvS
-		return self.tlv
+		tlv = ROOT.TLorentzVector()
+		tlv.SetPtEtaPhiM(p.pt(), p.eta(), p.phi(), 0)
+		spt = self.mean_pt[self.cell_index(p.eta(), p.phi())]
+		tlvS = ROOT.TLorentzVector()
+		tlvS.SetPtEtaPhiM(spt, p.eta(), p.phi(), 0)
+		return tlv - tlvS
 
 	def subtract_particle(self, p):
 		sp = fj.PseudoJet(p.px(), p.py(), p.pz(), p.e())
@@ -79,19 +118,28 @@ class BackgroundEstimator(MPBase):
 		sp.reset_PtYPhiM(_sv.Pt(), _sv.Rapidity(), _sv.Phi(), _sv.M())
 		return sp
 
+	def subtracted_arrays(self, pt, eta, phi, m):
+		# subtract (grid pt, eta, phi, m) from (pt, eta, phi, m) as four-vectors, for particles with grid pt <= pt
+		spt = self.mean_pt[self.cell_index(eta, phi)]
+		sel = spt <= pt
+		pt, eta, phi, m, spt = pt[sel], eta[sel], phi[sel], m[sel], spt[sel]
+		dpt = pt - spt
+		px = dpt * np.cos(phi)
+		py = dpt * np.sin(phi)
+		pz = dpt * np.sinh(eta)
+		cosh_eta = np.cosh(eta)
+		e = np.sqrt((pt * cosh_eta)**2 + m*m) - np.sqrt((spt * cosh_eta)**2 + m*m)
+		return px, py, pz, e
+
 	def subtracted_particles(self, parts):
-		sparts = []
-		for p in parts:
-			self.tlv.SetPtEtaPhiM(p.pt(), p.eta(), p.phi(), p.m())
-			ieta = self.grid_eta_phi.GetXaxis().FindBin(p.eta())
-			iphi = self.grid_eta_phi.GetYaxis().FindBin(p.phi())
-			spt = self.grid_eta_phi.GetBinContent(ieta, iphi)
-			if spt <= self.tlv.Pt():
-				self.tlvS.SetPtEtaPhiM(spt, p.eta(), p.phi(), p.m())
-				self.tlv = self.tlv - self.tlvS
-				sp = fj.PseudoJet(self.tlv.Px(), self.tlv.Py(), self.tlv.Pz(), self.tlv.E())
-				sparts.append(sp)
-		return sparts
+		_pt_eta_phi_m = np.array([(p.pt(), p.eta(), p.phi(), p.m()) for p in parts]).reshape(-1, 4)
+		px, py, pz, e = self.subtracted_arrays(_pt_eta_phi_m[:, 0], _pt_eta_phi_m[:, 1], _pt_eta_phi_m[:, 2], _pt_eta_phi_m[:, 3])
+		# keep the default user_index (-1) of subtracted particles: >= 0 marks inserted signal particles
+		_parts = fj.vectorPJ()
+		for p in fjext.vectorize_px_py_pz_e(px, py, pz, e):
+			p.set_user_index(-1)
+			_parts.push_back(p)
+		return _parts
 
 
 def main_make(args):
@@ -4,6 +4,7 @@ from pyjetty.mputils import MPBase, DataIO, JetAnalysis, UniqueString, RTreeWrit
 import argparse
 import os
 import tqdm
+import numpy as np
 
 import ROOT
 load_extra = ROOT.gSystem.Load("$PYJETTYDIR/cpptools/lib/libpyjetty_rutil.dylib")
@@ -42,7 +43,9 @@ class GridFastJetROOT(JetAnalysis):
 
 	def analyze_event(self, parts):
 		self.gridR.Reset()
-		_tmp = [self.gridR.fillParticle(p.eta(), p.phi(), p.e()) for p in parts]
+		# PseudoJets of the ROOT dictionary and of the fastjet python module are distinct types
+		_eta_phi_e = np.array([(p.eta(), p.phi(), p.e()) for p in parts]).reshape(-1, 3)
+		self.gridR.fillArrays(len(_eta_phi_e), _eta_phi_e[:, 0].copy(), _eta_phi_e[:, 1].copy(), _eta_phi_e[:, 2].copy())
 		self.particles = [fj.PseudoJet(p.px(), p.py(), p.pz(), p.e()) for p in self.gridR.getGridParticles()]
 		JetAnalysis.analyze_event(self, self.particles)
 
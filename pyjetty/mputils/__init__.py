@@ -5,6 +5,7 @@ from .boltzmann import *
 from .csubtractor import *
 from .data_io import *
 from .jet_analysis import *
+from .columnar_writer import *
 from .memtrace import *
 
 try:
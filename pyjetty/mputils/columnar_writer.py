@@ -0,0 +1,195 @@
+import numpy as np
+import fastjet as fj
+import fjcontrib
+import fjtools
+from pyjetty.mputils import MPBase
+
+
+class ColumnarWriter(MPBase):
+	# Buffers columns (one row per entry, e.g. per jet) as numpy arrays, and writes them in blocks
+	# of block_size rows to a ROOT tree (via uproot) or a parquet file (via pyarrow)
+	def __init__(self, **kwargs):
+		self.configure_from_args(	tree_name='t',
+									file_name='ColumnarWriter.root',
+									output_format=None,
+									block_size=100000,
+									fout=None)
+		super(ColumnarWriter, self).__init__(**kwargs)
+		# an open uproot file (fout) can be shared by several writers (trees); it is then not closed here
+		self._own_file = self.fout is None
+		if self.output_format is None:
+			self.output_format = 'parquet' if self.file_name.endswith('.parquet') else 'root'
+		if self.output_format not in ['root', 'parquet']:
+			raise ValueError('ColumnarWriter: unknown output format {}'.format(self.output_format))
+		self.columns = {}
+		self.nrows = 0
+		self.nrows_written = 0
+		self._fout = None
+		self._tree_created = False
+
+	def append(self, **columns):
+		# columns: arrays of n rows, or scalars (repeated for all rows)
+		n = None
+		for value in columns.values():
+			if np.ndim(value) > 0:
+				n = len(value)
+				break
+		if n is None:
+			n = 1
+		if n == 0:
+			return
+		for key, value in columns.items():
+			if key not in self.columns:
+				if self.nrows_written > 0 or self.nrows > 0:
+					raise ValueError('ColumnarWriter: column {} not present in the first entries'.format(key))
+				self.columns[key] = []
+			if np.ndim(value) == 0:
+				value = np.full(n, value)
+			self.columns[key].append(np.asarray(value))
+		self.nrows += n
+		if self.nrows >= self.block_size:
+			self.flush()
+
+	def flush(self):
+		if self.nrows == 0:
+			return
+		block = {key: np.concatenate(values) for key, values in self.columns.items()}
+		if self.output_format == 'root':
+			self._write_root(block)
+		else:
+			self._write_parquet(block)
+		for key in self.columns:
+			self.columns[key] = []
+		self.nrows_written += self.nrows
+		self.nrows = 0
+
+	def _write_root(self, block):
+		if self._fout is None:
+			if self.fout is None:
+				import uproot
+				self.fout = uproot.recreate(self.file_name)
+			self._fout = self.fout
+		if self._tree_created:
+			self._fout[self.tree_name].extend(block)
+		else:
+			self._fout[self.tree_name] = block
+			self._tree_created = True
+
+	def _write_parquet(self, block):
+		import pyarrow
+		import pyarrow.parquet
+		table = pyarrow.table(block)
+		if self._fout is None:
+			self._fout = pyarrow.parquet.ParquetWriter(self.file_name, table.schema)
+		self._fout.write_table(table)
+
+	def close(self):
+		self.flush()
+		if self._fout is not None and (self._own_file or self.output_format == 'parquet'):
+			self._fout.close()
+		self._fout = None
+		print('[i] written {} rows to {}:{}'.format(self.nrows_written, self.file_name, self.tree_name))
+
+
+def _psj_columns(jets, prefix, rho=None):
+	# pt, phi, eta, m, area (and rho-corrected pt) of a list of jets, named as by RTreeWriter
+	n = len(jets)
+	a = np.empty((n, 5))
+	nconst = np.zeros(n, dtype=np.int32)
+	for i, j in enumerate(jets):
+		a[i] = (j.pt(), j.phi(), j.eta(), j.m(), j.area() if j.has_area() else 0.)
+		if j.has_constituents():
+			nconst[i] = len(j.constituents())
+	columns = {	prefix + '_pt' : a[:, 0], prefix + '_phi' : a[:, 1], prefix + '_eta' : a[:, 2],
+				prefix + '_m' : a[:, 3], prefix + '_a' : a[:, 4], prefix + '_nconst' : nconst }
+	if rho is not None:
+		columns[prefix + '_ptc'] = a[:, 0] - a[:, 4] * rho
+	return columns
+
+
+def _sd_columns(jets, sd, rho, prefix, prong_prefix):
+	# SD groomed jets, z, dR, and rho-corrected pt of the prongs (-1000 if not passed)
+	n = len(jets)
+	sd_jets = [sd.result(j) for j in jets]
+	z_dR = np.empty((n, 2))
+	prongs_ptc = np.full((n, 2), -1000.)
+	prongs = []
+	for i, sd_jet in enumerate(sd_jets):
+		sd_info = fjcontrib.get_SD_jet_info(sd_jet)
+		z_dR[i] = (sd_info.z, sd_info.dR)
+		p1 = fj.PseudoJet()
+		p2 = fj.PseudoJet()
+		if sd_jet.has_parents(p1, p2):
+			prongs_ptc[i] = (p1.pt() - p1.area() * rho, p2.pt() - p2.area() * rho)
+			prongs.append((p1, p2))
+		else:
+			prongs.append(None)
+	columns = _psj_columns(sd_jets, prefix)
+	columns[prefix + '_cpt'] = columns[prefix + '_pt'] - columns[prefix + '_a'] * rho
+	columns[prefix + '_z'] = z_dR[:, 0]
+	columns[prefix + '_dR'] = z_dR[:, 1]
+	columns[prong_prefix + '_p1_ptc'] = prongs_ptc[:, 0]
+	columns[prong_prefix + '_p2_ptc'] = prongs_ptc[:, 1]
+	return columns, prongs
+
+
+def fill_columns_data(jets, writer, sd, rho, iev=None, weight=None, sigma=None):
+	# columnar equivalent of fill_tree_data, for all jets of an event in one call
+	if len(jets) == 0:
+		return jets
+	columns = {}
+	# unlike the tree version, None (not falsy) omits a column: the set of columns is fixed by the first entries
+	if iev is not None:
+		columns['ev_id'] = iev
+	if weight is not None:
+		columns['weight'] = weight
+	if sigma is not None:
+		columns['sigma'] = sigma
+	columns['rho'] = rho
+	columns['good'] = np.array([1.0 if len(j.constituents()) > 0 and fj.sorted_by_pt(j.constituents())[0].pt() < 100. else 0.0
+								for j in jets])
+	columns.update(_psj_columns(jets, 'j', rho))
+	sd_columns, _ = _sd_columns(jets, sd, rho, 'sd_j', 'j')
+	columns.update(sd_columns)
+	writer.append(**columns)
+	return jets
+
+
+def fill_columns_matched(signal_jet, emb_jets, writer, sd, rho, iev=None, weight=None, sigma=None):
+	# columnar equivalent of fill_tree_matched: one row per embedded jet with matched pt > 0.5
+	mpt = np.array([fjtools.matched_pt(ej, signal_jet) for ej in emb_jets])
+	emb_jets = [ej for ej, m in zip(emb_jets, mpt) if m > 0.5]
+	mpt = mpt[mpt > 0.5]
+	if len(emb_jets) == 0:
+		return emb_jets
+	columns = {'j_mpt' : mpt}
+	if iev is not None:
+		columns['ev_id'] = iev
+	if weight is not None:
+		columns['weight'] = weight
+	if sigma is not None:
+		columns['sigma'] = sigma
+	columns['rho'] = rho
+
+	# signal jet: the same for all rows
+	signal_columns = _psj_columns([signal_jet], 'j')
+	signal_sd_columns, signal_prongs = _sd_columns([signal_jet], sd, rho, 'sd_j', 'j')
+	for key, value in list(signal_columns.items()) + list(signal_sd_columns.items()):
+		if key not in ['j_p1_ptc', 'j_p2_ptc', 'sd_j_cpt']:
+			columns[key] = value[0]
+	columns['j_nc'] = len(signal_jet.constituents())
+
+	columns.update(_psj_columns(emb_jets, 'ej', rho))
+	emb_sd_columns, emb_prongs = _sd_columns(emb_jets, sd, rho, 'sd_ej', 'ej')
+	columns.update(emb_sd_columns)
+
+	mpt12 = np.full((len(emb_jets), 2), -1.0)
+	if signal_prongs[0] is not None:
+		p1, p2 = signal_prongs[0]
+		for i, prongs in enumerate(emb_prongs):
+			if prongs is not None:
+				mpt12[i] = (fjtools.matched_pt(prongs[0], p1), fjtools.matched_pt(prongs[1], p2))
+	columns['mpt1'] = mpt12[:, 0]
+	columns['mpt2'] = mpt12[:, 1]
+	writer.append(**columns)
+	return emb_jets
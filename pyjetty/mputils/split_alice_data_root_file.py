@@ -1,124 +1,129 @@
 #!/usr/bin/env python3
 
-from pyjetty.mputils import MPBase, perror, pinfo, pwarning, pindent, pdebug, treewriter
+from pyjetty.mputils import MPBase, perror, pinfo, pwarning, pindent, pdebug
 import pyjetty.rootutils as rootutils
 import argparse
 import os
-import uproot
-import pandas as pd
-import tqdm
+import multiprocessing
+import numpy as np
 import ROOT
 ROOT.gROOT.SetBatch(True)
 
+# The file is split at event boundaries: the events (run_number, ev_id) are read once per tree,
+# sorted, and cut into chunks of n events (in the order of the tree with most events).
+# The rows of each chunk are then copied per tree in bulk (TTree::CopyTree of an entry range,
+# or of an entry list if the rows of the chunk are not contiguous in the tree), which keeps
+# the branch types and the directories of the trees. Output files are written in parallel.
+
 class SplitDataFileIO(MPBase):
 	def __init__(self, **kwargs):
+		self.configure_from_args(nworkers=1)
 		super(SplitDataFileIO, self).__init__(**kwargs)
-		self.fout = None
 
 	def get_list_of_trees(self, fname):
 		with rootutils.QuietWarning():
 			tu = rootutils.list_trees_dict(fname)
-		return [t.decode("utf-8") for t in tu]
-
-	def get_event_id(self, df):
-		self.ev_id = df['ev_id'].values[0]
-		self.run_number = df['run_number'].values[0]
-		#pindent('processing', 'run_number=', self.run_number, 'ev_id=', self.ev_id, 'internal iev=', self.iev, 'cyclical iev=', self.iev_count)
-		if self.iev_count >= self.max_events or self.iev == 0:
-			#open a new file
-			if self.fout:
-				self.fout.Write()
-				self.fout.Close()
-				self.td = None
-				self.fout = None
-			outfname = self.file_output.replace('.root', '_{}.root'.format(self.nfile))
-			pinfo('opening new file at', self.iev, 'file number', self.nfile, 'file name', outfname)
-			self.fout = ROOT.TFile(outfname, 'recreate')
-			self.nfile = self.nfile + 1
-			self.iev_count = 0
-			self.trees = {}
-
-			# these are branches
-			# for sdf in df:
-
-			for sdf in self.df:
-				foldername = os.path.dirname(sdf.split(';')[0])
-				tname = os.path.basename(sdf.split(';')[0])
-				self.fout.cd()
-				if self.td is None:
-					self.td = ROOT.TDirectoryFile(foldername, foldername)
-				self.td.cd()
-				# tw = ROOT.TNtuple(tname, tname, ':'.join(self.df[sdf].columns))
-				self.trees[tname] = treewriter.RTreeWriter(tree_name=tname, fout=self.td)
-
-		# fill for loc of iev and run number for each tree
-
-		# for sdf in self.df:
-		# 	pinfo(self.df[sdf])
-
-		for sdf in self.df:
-			tname = os.path.basename(sdf.split(';')[0])
-			_df_sel = self.df[sdf].loc[(self.df[sdf]['run_number']==self.run_number) & (self.df[sdf]['ev_id']==self.ev_id)]
-			#if len(_df_sel) < 1:
-			#	pwarning('no entries for', sdf, len(_df_sel), self.run_number, self.ev_id)
-			#else:
-			#	pinfo('rows for', sdf, len(_df_sel))
-			for index, row in _df_sel.iterrows():
-				#print(row)
-				for c in _df_sel.columns:
-					# pindent(self.trees[tname])
-					# pindent(tname, index, c, '=', row[c])
-					val = row[c]
-					self.trees[tname].fill_branch(c, row[c])
-				# pindent(self.trees[tname].tree.GetName(), 'fill')
-				self.trees[tname].fill_tree()
+		return [t.decode("utf-8") if isinstance(t, bytes) else t for t in tu]
 
-		self.iev = self.iev + 1
-		self.iev_count = self.iev_count + 1
+	def get_event_keys(self, file_input, tname):
+		# (run_number, ev_id) of each entry of the tree, read in bulk
+		df = ROOT.RDataFrame(tname, file_input)
+		cols = df.AsNumpy(['run_number', 'ev_id'])
+		return np.column_stack([cols['run_number'].astype(np.int64), cols['ev_id'].astype(np.int64)])
 
-	def fill_evid_rno(self, df):
-		#pindent(df)
-		pass
+	def get_chunks(self, file_input, tlist, nevents):
+		# returns a list of chunks; each chunk is a list of (tree name, sorted entry numbers)
+		keys = {tname : self.get_event_keys(file_input, tname) for tname in tlist}
+		# event index of each row: events of all trees, numbered in (run_number, ev_id) order
+		all_keys = np.concatenate([keys[tname] for tname in tlist])
+		events, codes = np.unique(all_keys, axis=0, return_inverse=True)
+		codes = codes.ravel()
+		offset = 0
+		tree_codes = {}
+		for tname in tlist:
+			tree_codes[tname] = codes[offset:offset + len(keys[tname])]
+			offset += len(keys[tname])
+		tree_events = {tname : np.unique(tree_codes[tname]) for tname in tlist}
+		for tname in tlist:
+			pindent('tree', tname, 'Nrows:', len(tree_codes[tname]), 'Nevents:', len(tree_events[tname]))
+		# events of the tree with most events define the chunks (rows of other events are not written)
+		ref_events = tree_events[sorted(tlist, key=lambda s: len(tree_events[s]), reverse=True)[0]]
+		nchunks = int(np.ceil(len(ref_events) / nevents))
+		chunks = [[] for i in range(nchunks)]
+		for tname in tlist:
+			# event offsets in the tree: rows sorted by event, and the first row of each chunk
+			order = np.argsort(tree_codes[tname], kind='stable')
+			sorted_codes = tree_codes[tname][order]
+			keep = np.isin(tree_codes[tname], ref_events)
+			first_events = ref_events[0::nevents]
+			last_events = ref_events[np.minimum(np.arange(1, nchunks + 1) * nevents, len(ref_events)) - 1]
+			row_start = np.searchsorted(sorted_codes, first_events, side='left')
+			row_stop = np.searchsorted(sorted_codes, last_events, side='right')
+			for ichunk in range(nchunks):
+				entries = order[row_start[ichunk]:row_stop[ichunk]]
+				entries = np.sort(entries[keep[entries]])
+				chunks[ichunk].append((tname, entries))
+		return chunks
 
 	def split_file(self, file_input, file_output, nevents, tolerance=0.1):
 		pinfo('spliting file', file_input, 'max nevents:', nevents, 'tolerance:', tolerance)
-		tlist = self.get_list_of_trees(file_input)
+		tlist = [tname.split(';')[0] for tname in self.get_list_of_trees(file_input)]
 		pinfo('list of trees:', tlist)
-		self.df_grouped = {}
-		self.df = {}
-		for tname in tlist:
-			t = uproot.open(file_input)[tname]
-			self.df[tname] = t.pandas.df()
-			self.df_grouped[tname] = self.df[tname].groupby(['run_number','ev_id'])
-			pindent('tree', tname, 'Nrows in pandas:', len(self.df[tname]), 'Nevents:', len(self.df_grouped[tname]))
-		# get max events order
-		df_names_sorted = sorted(self.df_grouped, key=lambda s: len(self.df_grouped[s]), reverse=True)
-		for dfname in df_names_sorted:
-			pindent(dfname, len(self.df_grouped[dfname]))
-		self.iev = 0
-		self.iev_count = 0
-		self.max_events = nevents
-		self.file_output = file_output
-		self.nfile = 0
-		self.fout = None
-		self.td = None
-		self.df_grouped[df_names_sorted[0]].apply(self.get_event_id)
-		# for sname in df_names_sorted:
-		# 	pinfo('processing for', sname)
-		# 	self.df_grouped[sname].apply(self.get_event_id)
+		chunks = self.get_chunks(file_input, tlist, nevents)
+		tasks = [(file_input, file_output.replace('.root', '_{}.root'.format(nfile)), chunk) for nfile, chunk in enumerate(chunks)]
+		nworkers = self.nworkers if self.nworkers > 0 else multiprocessing.cpu_count()
+		nworkers = max(1, min(nworkers, len(tasks)))
+		pinfo('writing', len(tasks), 'files in', nworkers, 'workers')
+		if nworkers == 1:
+			outputs = [write_chunk(task) for task in tasks]
+		else:
+			pool = multiprocessing.Pool(nworkers)
+			outputs = pool.map(write_chunk, tasks)
+			pool.close()
+			pool.join()
+		return outputs
+
+
+def write_chunk(task):
+	# copy the entries of each tree into the output file, in the directory of the tree
+	file_input, outfname, chunk = task
+	fin = ROOT.TFile(file_input)
+	fout = ROOT.TFile(outfname, 'recreate')
+	for tname, entries in chunk:
+		t = fin.Get(tname)
+		foldername = os.path.dirname(tname)
+		td = fout
+		if foldername:
+			td = fout.GetDirectory(foldername)
+			if not td:
+				td = fout.mkdir(foldername)
+		td.cd()
+		if len(entries) == 0:
+			tout = t.CloneTree(0)
+		elif entries[-1] - entries[0] + 1 == len(entries):
+			tout = t.CopyTree('', '', int(len(entries)), int(entries[0]))
+		else:
+			elist = ROOT.TEntryList('{}_elist'.format(t.GetName()), '', t)
+			for e in entries:
+				elist.Enter(int(e))
+			t.SetEntryList(elist)
+			tout = t.CopyTree('')
+			t.SetEntryList(0)
+		tout.Write()
+	fout.Close()
+	fin.Close()
+	pinfo('written', outfname)
+	return outfname
 
-	def __del__(self):
-		if self.fout:
-			self.fout.Write()
-			self.fout.Close()
 
 def main():
 	parser = argparse.ArgumentParser(description='split a root file', prog=os.path.basename(__file__))
 	parser.add_argument('-f', '--fname', help='path to a root file', default=None, type=str, required=True)
 	parser.add_argument('-o', '--fout', help='output a root file - basename', default=None, type=str, required=True)
 	parser.add_argument('-n', '--n-max-events', help='maximum number of events in a file', default=500, type=int, required=True)
-	args = parser.parse_args()	
-	sp = SplitDataFileIO()
+	parser.add_argument('--nworkers', help='number of output files written in parallel (0: number of cores)', default=1, type=int)
+	args = parser.parse_args()
+	sp = SplitDataFileIO(nworkers=args.nworkers)
 	sp.split_file(args.fname, args.fout, args.n_max_events)
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+## tests of the TransferManager with the local filesystem backend
+## run with: python -m pytest pyjetty/mputils/test_transfer.py  (or python -m pyjetty.mputils.test_transfer)
+
+import os
+import json
+import tempfile
+
+from pyjetty.mputils.transfer import TransferManager, LocalBackend
+
+
+class FailingStatBackend(LocalBackend):
+	def stat(self, src):
+		raise IOError('stat not available')
+
+
+def make_files(tmpdir, n=3, size=1000):
+	files = []
+	for i in range(n):
+		src = os.path.join(tmpdir, 'src', 'f{}.root'.format(i))
+		os.makedirs(os.path.dirname(src), exist_ok=True)
+		with open(src, 'wb') as f:
+			f.write(os.urandom(size))
+		files.append((src, os.path.join(tmpdir, 'dst', 'f{}.root'.format(i))))
+	return files
+
+
+def read(fname):
+	with open(fname, 'rb') as f:
+		return f.read()
+
+
+def test_resume():
+	with tempfile.TemporaryDirectory() as tmpdir:
+		files = make_files(tmpdir)
+		manifest = os.path.join(tmpdir, 'manifest.json')
+		tm = TransferManager(LocalBackend(), manifest=manifest, nworkers=2, backoff=0.)
+		assert tm.run(files) == []
+		for src, dst in files:
+			assert read(src) == read(dst)
+			assert not os.path.exists(dst + '.part')
+		with open(manifest) as f:
+			assert all([entry['status'] == 'done' for entry in json.load(f).values()])
+		# rerun: everything is skipped without querying the source
+		tm = TransferManager(FailingStatBackend(), manifest=manifest, backoff=0.)
+		assert all([tm.is_done(src, dst) for src, dst in files])
+		assert tm.run(files) == []
+		assert tm.nbytes == 0
+
+
+def test_corrupted_destination():
+	with tempfile.TemporaryDirectory() as tmpdir:
+		files = make_files(tmpdir)
+		manifest = os.path.join(tmpdir, 'manifest.json')
+		assert TransferManager(LocalBackend(), manifest=manifest, backoff=0.).run(files) == []
+		src, dst = files[0]
+		# same size rewrite (possibly within the same second): no longer recorded as done
+		stat = os.stat(dst)
+		with open(dst, 'r+b') as f:
+			f.write(b'corrupted')
+		os.utime(dst, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+		tm = TransferManager(LocalBackend(), manifest=manifest, backoff=0.)
+		assert not tm.is_done(src, dst)
+		assert tm.transfer(src, dst)[0] == 'done'
+		assert read(src) == read(dst)
+		# truncated destination without a manifest: copied again
+		with open(dst, 'wb') as f:
+			f.write(b'trunc')
+		tm = TransferManager(LocalBackend(checksum=False), backoff=0.)
+		assert tm.transfer(src, dst)[0] == 'done'
+		assert read(src) == read(dst)
+
+
+def test_failed_stat():
+	with tempfile.TemporaryDirectory() as tmpdir:
+		files = make_files(tmpdir)
+		src, dst = files[0]
+		os.makedirs(os.path.dirname(dst))
+		with open(dst, 'wb') as f:
+			f.write(b'trunc')
+		tm = TransferManager(FailingStatBackend(), backoff=0.)
+		status, nbytes, error = tm.transfer(src, dst)
+		assert (status, error) == ('unverified', None)
+		assert nbytes == os.path.getsize(src)
+		assert read(src) == read(dst)
+		assert tm.manifest[dst]['status'] == 'unverified'
+		# unverified files are not skipped on a rerun
+		assert not tm.is_done(src, dst)
+
+
+def test_failed_copy():
+	with tempfile.TemporaryDirectory() as tmpdir:
+		src, dst = os.path.join(tmpdir, 'missing.root'), os.path.join(tmpdir, 'dst', 'missing.root')
+		tm = TransferManager(LocalBackend(), retries=1, backoff=0.)
+		failed = tm.run([(src, dst)])
+		assert len(failed) == 1
+		assert not os.path.exists(dst) and not os.path.exists(dst + '.part')
+		assert tm.manifest[dst]['status'] == 'failed'
+
+
+if __name__ == '__main__':
+	for test in [test_resume, test_corrupted_destination, test_failed_stat, test_failed_copy]:
+		test()
+		print('[i]', test.__name__, 'ok')
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import threading
+import subprocess
+import concurrent.futures
+import tqdm
+
+## bulk file transfers (e.g. of LHC train outputs) with a bounded pool of workers
+## - the copy itself is done by a backend: alien_cp (AlienBackend), xrdcp (XRootDBackend), or a local copy (LocalBackend)
+## - files are copied to <file>.part and renamed when complete (and verified)
+## - failed copies are retried with exponential backoff
+## - existing files are verified against the size (and checksum) of the source, and copied again if different;
+##   if neither is known (e.g. the stat of the source failed), files are copied again and recorded as unverified
+## - the state of each file is kept in a json manifest; on a rerun, files recorded as done (and unchanged on disk) are skipped
+##   without querying the source again
+
+
+def file_checksum(fname, algorithm='md5'):
+	if algorithm == 'adler32':
+		value = 1
+		with open(fname, 'rb') as f:
+			for block in iter(lambda: f.read(1 << 24), b''):
+				value = zlib.adler32(block, value)
+		return '{:08x}'.format(value & 0xffffffff)
+	h = hashlib.new(algorithm)
+	with open(fname, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 24), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+def run_cmnd(args, timeout=None):
+	# returns (return code, stdout, stderr)
+	cproc = subprocess.run(args, shell=False, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+	return cproc.returncode, cproc.stdout.decode('utf-8', 'replace'), cproc.stderr.decode('utf-8', 'replace')
+
+
+class CopyBackend(object):
+	# copy(src, dst) raises on failure; stat(src) returns (size, (checksum algorithm, checksum)) of the source,
+	# with None for what is not known
+	name = 'none'
+	def __init__(self, timeout=None):
+		self.timeout = timeout
+
+	def copy(self, src, dst):
+		raise NotImplementedError('CopyBackend.copy() must be implemented by the {} backend'.format(self.name))
+
+	def stat(self, src):
+		return None, None
+
+
+class AlienBackend(CopyBackend):
+	name = 'alien'
+	def copy(self, src, dst):
+		rc, out, err = run_cmnd(['alien_cp', 'alien://{}'.format(src), 'file://{}'.format(dst)], timeout=self.timeout)
+		if rc != 0 or not os.path.isfile(dst):
+			raise IOError('alien_cp {} failed ({}): {}'.format(src, rc, err.strip()))
+
+	def stat(self, src):
+		rc, out, err = run_cmnd(['alien_stat', src], timeout=self.timeout)
+		if rc != 0:
+			return None, None
+		size = re.search(r'Size:\s*(\d+)', out)
+		md5 = re.search(r'MD5:\s*([0-9a-fA-F]{32})', out)
+		return (int(size.group(1)) if size else None), (('md5', md5.group(1).lower()) if md5 else None)
+
+
+class XRootDBackend(CopyBackend):
+	name = 'xrootd'
+	def __init__(self, prefix='', **kwargs):
+		super(XRootDBackend, self).__init__(**kwargs)
+		# prepended to sources which are not root:// urls (e.g. root://eospublic.cern.ch/)
+		self.prefix = prefix
+
+	def url(self, src):
+		return src if src.startswith('root://') else self.prefix + src
+
+	def copy(self, src, dst):
+		rc, out, err = run_cmnd(['xrdcp', '-f', '-s', self.url(src), dst], timeout=self.timeout)
+		if rc != 0 or not os.path.isfile(dst):
+			raise IOError('xrdcp {} failed ({}): {}'.format(src, rc, err.strip()))
+
+	def stat(self, src):
+		m = re.match(r'(root://[^/]+)/(/.*)', self.url(src))
+		if m is None:
+			return None, None
+		host, path = m.group(1), m.group(2)
+		size = None
+		checksum = None
+		rc, out, err = run_cmnd(['xrdfs', host, 'stat', path], timeout=self.timeout)
+		if rc == 0:
+			_size = re.search(r'Size:\s*(\d+)', out)
+			size = int(_size.group(1)) if _size else None
+		rc, out, err = run_cmnd(['xrdfs', host, 'query', 'checksum', path], timeout=self.timeout)
+		if rc == 0 and len(out.split()) >= 2:
+			checksum = (out.split()[0].lower(), out.split()[1].lower())
+		return size, checksum
+
+
+class LocalBackend(CopyBackend):
+	# local filesystem stand-in for the grid backends (e.g. for tests)
+	name = 'local'
+	def __init__(self, checksum=True, **kwargs):
+		super(LocalBackend, self).__init__(**kwargs)
+		self.checksum = checksum
+
+	def copy(self, src, dst):
+		shutil.copyfile(src, dst)
+
+	def stat(self, src):
+		if not os.path.isfile(src):
+			return None, None
+		return os.path.getsize(src), (('md5', file_checksum(src)) if self.checksum else None)
+
+
+backends = {'alien' : AlienBackend, 'xrootd' : XRootDBackend, 'local' : LocalBackend}
+
+
+def get_backend(name, **kwargs):
+	if name not in backends:
+		raise ValueError('unknown copy backend {} - known: {}'.format(name, ', '.join(sorted(backends))))
+	return backends[name](**kwargs)
+
+
+class TransferManager(object):
+	def __init__(self, backend, manifest=None, nworkers=10, retries=3, backoff=5., verify_checksum=True, manifest_interval=10.):
+		self.backend = backend
+		self.manifest_fname = manifest
+		self.nworkers = max(1, nworkers)
+		self.retries = retries
+		self.backoff = backoff
+		self.verify_checksum = verify_checksum
+		self.manifest_interval = manifest_interval
+		self.manifest = {}
+		if self.manifest_fname and os.path.isfile(self.manifest_fname):
+			with open(self.manifest_fname, 'r') as f:
+				self.manifest = json.load(f)
+		self._lock = threading.Lock()
+		self._manifest_written = time.time()
+		self.nbytes = 0
+
+	def is_done(self, src, dst):
+		# recorded as done, for the same source, and unchanged on disk since
+		entry = self.manifest.get(dst)
+		if entry is None or entry['status'] != 'done' or entry['source'] != src or not os.path.isfile(dst):
+			return False
+		return os.path.getsize(dst) == entry['size'] and os.stat(dst).st_mtime_ns == entry.get('mtime_ns')
+
+	def verify(self, fname, size, checksum):
+		# returns None if fname matches the size and checksum of the source, the reason otherwise
+		if size is not None and os.path.getsize(fname) != size:
+			return 'size {} != {}'.format(os.path.getsize(fname), size)
+		if self.verify_checksum and checksum is not None:
+			local_checksum = file_checksum(fname, checksum[0])
+			if local_checksum != checksum[1]:
+				return '{} {} != {}'.format(checksum[0], local_checksum, checksum[1])
+		return None
+
+	def record(self, src, dst, status, error=None, checksum=None):
+		entry = {'source' : src, 'status' : status}
+		if status in ['done', 'unverified']:
+			entry.update({'size' : os.path.getsize(dst), 'mtime_ns' : os.stat(dst).st_mtime_ns, 'checksum' : checksum})
+		if error:
+			entry['error'] = error
+		with self._lock:
+			self.manifest[dst] = entry
+			if time.time() - self._manifest_written > self.manifest_interval:
+				self.write_manifest()
+
+	def write_manifest(self):
+		if not self.manifest_fname:
+			return
+		tmp = '{}.tmp{}'.format(self.manifest_fname, os.getpid())
+		with open(tmp, 'w') as f:
+			json.dump(self.manifest, f, indent=1)
+		os.replace(tmp, self.manifest_fname)
+		self._manifest_written = time.time()
+
+	def transfer(self, src, dst):
+		# returns (status, bytes copied, error); status is one of done, verified, unverified, failed
+		size, checksum = None, None
+		try:
+			size, checksum = self.backend.stat(src)
+		except Exception as e:
+			print('[w] stat of {} failed: {}'.format(src, e), file=sys.stderr)
+		# nothing to verify against: an existing file is copied again, and the copy is not verified
+		known = size is not None or (self.verify_checksum and checksum is not None)
+		if os.path.isfile(dst) and known:
+			reason = self.verify(dst, size, checksum)
+			if reason is None:
+				self.record(src, dst, 'done', checksum=checksum)
+				return 'verified', 0, None
+			print('[w] {} differs from the source ({}) - copying again'.format(dst, reason), file=sys.stderr)
+		os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+		tmp = dst + '.part'
+		error = None
+		for attempt in range(self.retries + 1):
+			if attempt > 0:
+				time.sleep(self.backoff * 2 ** (attempt - 1))
+			try:
+				if os.path.exists(tmp):
+					os.remove(tmp)
+				self.backend.copy(src, tmp)
+				reason = self.verify(tmp, size, checksum)
+				if reason is not None:
+					raise IOError('copy of {} does not match the source: {}'.format(src, reason))
+				os.replace(tmp, dst)
+				status = 'done' if known else 'unverified'
+				self.record(src, dst, status, checksum=checksum)
+				return status, os.path.getsize(dst), None
+			except Exception as e:
+				error = str(e)
+		if os.path.exists(tmp):
+			os.remove(tmp)
+		self.record(src, dst, 'failed', error=error)
+		return 'failed', 0, error
+
+	def run(self, files):
+		# files: list of (source, destination); returns the list of (source, destination, error) of the failed transfers
+		start = time.time()
+		todo = [(src, dst) for src, dst in files if not self.is_done(src, dst)]
+		counts = {'done' : 0, 'verified' : 0, 'unverified' : 0, 'failed' : 0, 'skipped' : len(files) - len(todo)}
+		failed = []
+		print('[i] {} files to transfer ({} already done) with {} workers, backend {}'.format(len(todo), counts['skipped'], self.nworkers, self.backend.name))
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.nworkers) as executor:
+			futures = {executor.submit(self.transfer, src, dst) : (src, dst) for src, dst in todo}
+			pbar = tqdm.tqdm(concurrent.futures.as_completed(futures), total=len(futures))
+			for future in pbar:
+				src, dst = futures[future]
+				status, nbytes, error = future.result()
+				counts[status] += 1
+				self.nbytes += nbytes
+				if error:
+					failed.append((src, dst, error))
+					print('[e] copying', src, '\n', error, file=sys.stderr)
+				pbar.set_postfix_str('{:.1f} MB/s'.format(self.nbytes / 1e6 / max(time.time() - start, 1e-9)))
+		with self._lock:
+			self.write_manifest()
+		duration = time.time() - start
+		print('[i] transfer done: {} copied, {} verified, {} copied unverified, {} skipped, {} failed; {:.1f} MB in {:.1f} s ({:.2f} MB/s)'.format(
+			counts['done'], counts['verified'], counts['unverified'], counts['skipped'], counts['failed'], self.nbytes / 1e6, duration, self.nbytes / 1e6 / max(duration, 1e-9)))
+		return failed
@@ -4,16 +4,16 @@ import argparse
 import os
 import subprocess
 import string
-import tqdm
 import yaml
-import os
+from pyjetty.mputils import transfer
 
 ## this is YAAC - yet another alien copy
 
 ## # this is example configuration file to download some MC
 ## run yaac.py twice:
 ## 1) with --list to build the list of files to download
-## 2) without --list to actually copy - note existing files on local disk are NOT overwritten; warning will be printed
+## 2) without --list to actually copy - existing files on local disk are verified (size and checksum) and copied again if different;
+##    the state of the copy is kept in <file_list>.manifest.json, so an interrupted copy resumes where it stopped
 
 ## # Configuration to download LHC18a4a2 sim
 ## # (to be used by download_data.py)
@@ -30,6 +30,9 @@ import os
 ## 
 ## # these are taken as some default values by yaac.py
 ## nthreads: 20
+## backend: 'alien' # or 'xrootd' (with backend_args: {prefix: 'root://...'}) or 'local'
+## retries: 3
+## verify_checksum: True
 ## file_pattern: 'AnalysisResults.root'
 ## pt_hat_bins: ['/']
 ## or could be
@@ -48,27 +51,6 @@ def exec_cmnd(cmnd_with_args):
 	return vret
 
 
-import threading
-
-class AlienCopyFile(threading.Thread):
-	def __init__(self, name, alien_fname, local_fname):
-		threading.Thread.__init__(self)
-		self.name = name
-		self.alien_fname = alien_fname
-		self.local_fname = local_fname
-		self.stdout = None
-		self.stderr = None
-
-	def run(self):
-		cmnd = 'alien_cp alien://{} file://{}'.format(self.alien_fname, self.local_fname)
-		cproc = subprocess.run(cmnd.split(' '), shell=False, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		if cproc.stdout:
-			self.stdout = cproc.stdout.decode('utf-8')
-		if cproc.stderr:
-			self.stderr = cproc.stderr.decode('utf-8')
-			os.remove(self.local_fname)
-
-
 def str_run_number_from_file(alien_f, config):
 	# guess the run number in the file as stand alone directory name
 	parts = alien_f.split('/')
@@ -80,8 +62,6 @@ def str_run_number_from_file(alien_f, config):
 
 
 def do_copy(config):
-	copy_jobs = []
-	copy_jobs_finished = []
 	try:
 		with open(config['file_list'], 'r') as flist:
 			file_list = [_f.strip('\n') for _f in flist.readlines()]
@@ -90,39 +70,26 @@ def do_copy(config):
 		return
 	if len(file_list) < 1:
 		print('[e] no files to copy - read from {}'.format(config['file_list']))
-		return		
-	print('[i] will use {} threads'.format(config['nthreads']))
+		return
 	warnings = []
-	skipped = []
-	for alien_f in tqdm.tqdm(file_list):
+	files = []
+	for alien_f in file_list:
 		run_number = str_run_number_from_file(alien_f, config)
 		if run_number is None:
 			warnings.append('[w] skipped {} - missing run number?'.format(alien_f))
 			continue
 		local_fname = '/'.join([config['output_dir'], str(run_number), alien_f.strip('\n').split(config['train_number'])[1]])
-		# print('cp {} to {}'.format(alien_f, local_fname))
-		if os.path.isfile(local_fname):
-			warnings.append(local_fname)
-			continue
-		os.makedirs(os.path.dirname(local_fname), exist_ok=True)
-		cj = AlienCopyFile(name=alien_f.replace('/', '_'), alien_fname=alien_f, local_fname=local_fname)
-		while len(copy_jobs) > config['nthreads']:
-			for j in copy_jobs:
-				j.join(1)
-				if j.is_alive():
-					pass
-				else:
-					if j.stderr:
-						print('[e] copying', j.alien_fname, '\n', j.stderr)
-					copy_jobs.remove(j)
-		copy_jobs.append(cj)
-		cj.start()
-	if len(skipped) > 0:
-		print('[w] files NOT copied - already existing:')
-		for _f in skipped:
-			print('    ', _f)
+		files.append((alien_f, local_fname))
 	for _w in warnings:
 		print(_w)
+	backend = transfer.get_backend(config['backend'], **config['backend_args'])
+	tm = transfer.TransferManager(backend, manifest=config['manifest'], nworkers=config['nthreads'], retries=config['retries'],
+									verify_checksum=config['verify_checksum'])
+	failed = tm.run(files)
+	if len(failed) > 0:
+		print('[w] {} files NOT copied - rerun to retry:'.format(len(failed)))
+		for _src, _dst, _err in failed:
+			print('    ', _src)
 	print('[i] copy done.')
 
 def compile_basedir_list(config):
@@ -171,6 +138,7 @@ def main():
 	#parser.add_argument('input', default=None, help="list of files in a directory to be copied; alternatively could be /alice/data/2018/LHC18 with --list", type=str)
 	parser.add_argument('--list', default=False, action="store_true")
 	parser.add_argument('--nthreads', default=0, type=int, help='number of threads')
+	parser.add_argument('--backend', default=None, type=str, help='copy backend: alien, xrootd or local')
 	parser.add_argument('-c', '--configFile', default='', 
 									help='yaml config file',
 									type=str, required=True)
@@ -203,6 +171,14 @@ def main():
 	if args.nthreads > 0:
 		config['nthreads'] = args.nthreads
 
+	for _key, _default in [('backend', 'alien'), ('backend_args', {}), ('retries', 3), ('verify_checksum', True),
+							('manifest', config['file_list'] + '.manifest.json')]:
+		if _key not in config:
+			config[_key] = _default
+
+	if args.backend:
+		config['backend'] = args.backend
+
 	print('config', config)
 
 	if args.list:
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+# Run a PYTHIA analysis in N worker processes, each with its own pythia instance
+# (configured with create_and_init_pythia_from_args, plus a distinct Random:seed),
+# and merge the output histograms, event counts and generated cross sections.
+#
+# The user analysis derives from PythiaWorkerAnalysis:
+#	init(worker_id)          book histograms (as attributes)
+#	analyze_event(pythia)    called for every generated event
+#	output_objects()         objects to merge; by default all TH1/THnBase/TTree attributes
+# Histograms are merged unscaled: the merged cross section (sigmaGen) and number of events
+# are written as hxsec and hNev, and returned, to scale by sigma/N after the merge.
+
+from __future__ import print_function
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+import numpy as np
+import ROOT
+
+from pyjetty.pythiautils import configuration as pyconf
+
+
+class PythiaWorkerAnalysis(object):
+	def __init__(self, **kwargs):
+		for key, value in kwargs.items():
+			setattr(self, key, value)
+
+	def init(self, worker_id):
+		pass
+
+	def analyze_event(self, pythia):
+		pass
+
+	def finalize(self, pythia):
+		pass
+
+	def output_objects(self):
+		objects = []
+		for attr in sorted(vars(self)):
+			obj = getattr(self, attr)
+			if isinstance(obj, (ROOT.TH1, ROOT.THnBase, ROOT.TTree)):
+				objects.append(obj)
+		return objects
+
+
+def worker_seeds(seed, nworkers):
+	# distinct, statistically independent seeds in the range allowed by Random:seed (1 - 900000000)
+	states = [s.generate_state(1)[0] for s in np.random.SeedSequence(seed).spawn(nworkers)]
+	return [int(s % 900000000) + 1 for s in states]
+
+
+def split_events(nev, nworkers):
+	return [nev // nworkers + (1 if i < nev % nworkers else 0) for i in range(nworkers)]
+
+
+def run_worker(task):
+	analysis_class, analysis_kwargs, args, user_args, worker_id, seed, nev, output_file = task
+	ROOT.gROOT.SetBatch(True)
+	ROOT.TH1.AddDirectory(False)
+
+	mycfg = list(user_args)
+	mycfg.extend(['Random:setSeed=on', 'Random:seed={}'.format(seed)])
+	pythia = pyconf.create_and_init_pythia_from_args(args, mycfg)
+	if not pythia:
+		raise RuntimeError('pythia initialization failed in worker {}'.format(worker_id))
+
+	analysis = analysis_class(**analysis_kwargs)
+	analysis.init(worker_id)
+
+	start = time.time()
+	n_events = 0
+	while n_events < nev:
+		if not pythia.next():
+			continue
+		n_events += 1
+		analysis.analyze_event(pythia)
+	duration = time.time() - start
+	analysis.finalize(pythia)
+
+	fout = ROOT.TFile(output_file, 'recreate')
+	fout.cd()
+	for obj in analysis.output_objects():
+		obj.Write(obj.GetName())
+	fout.Close()
+
+	return {'worker_id': worker_id, 'seed': seed, 'output_file': output_file,
+			'n_events': n_events, 'n_tried': pythia.info.nTried(), 'n_accepted': pythia.info.nAccepted(),
+			'sigma_gen': pythia.info.sigmaGen(), 'sigma_err': pythia.info.sigmaErr(),
+			'weight_sum': pythia.info.weightSum(), 'time': duration}
+
+
+def merge_cross_sections(results):
+	# sigmaGen of each worker is an estimate from its nTried trials: combine weighted by nTried
+	n_tried = np.array([r['n_tried'] for r in results], dtype=np.float64)
+	sigma = np.array([r['sigma_gen'] for r in results])
+	sigma_err = np.array([r['sigma_err'] for r in results])
+	if np.sum(n_tried) <= 0:
+		return 0., 0.
+	w = n_tried / np.sum(n_tried)
+	return float(np.sum(w * sigma)), float(np.sqrt(np.sum((w * sigma_err)**2)))
+
+
+def write_xsec_N(fout, sigma_gen, sigma_err, n_events):
+	fout.cd()
+	hxsec = ROOT.TH1F('hxsec', 'hxsec', 1, -0.5, 0.5)
+	hxsec.SetBinContent(1, sigma_gen)
+	hxsec.SetBinError(1, sigma_err)
+	hxsec.Write()
+	hNev = ROOT.TH1F('hNev', 'hNev', 1, -0.5, 0.5)
+	hNev.SetBinContent(1, n_events)
+	hNev.SetBinError(1, 0)
+	hNev.Write()
+
+
+def run_parallel(args, analysis_class, output_file, nworkers=None, nev=None, seed=1,
+				 user_args=[], analysis_kwargs={}, verbose=True):
+	# Generate nev events (default args.nev) in nworkers processes, and merge the outputs into output_file
+	if nworkers is None or nworkers < 1:
+		nworkers = multiprocessing.cpu_count()
+	if nev is None:
+		nev = args.nev
+	nworkers = max(1, min(nworkers, nev))
+
+	tmpdir = tempfile.mkdtemp(prefix='pythia_parallel_', dir=os.path.dirname(os.path.abspath(output_file)))
+	seeds = worker_seeds(seed, nworkers)
+	tasks = [(analysis_class, analysis_kwargs, args, user_args, i, seeds[i], n,
+			  os.path.join(tmpdir, 'worker_{}.root'.format(i)))
+			 for i, n in enumerate(split_events(nev, nworkers))]
+
+	start = time.time()
+	if nworkers == 1:
+		results = [run_worker(tasks[0])]
+	else:
+		pool = multiprocessing.Pool(nworkers)
+		results = pool.map(run_worker, tasks)
+		pool.close()
+		pool.join()
+	duration = time.time() - start
+
+	# Histograms (and trees) are added, in worker order
+	merger = ROOT.TFileMerger(False)
+	merger.SetPrintLevel(0)
+	for r in results:
+		merger.AddFile(r['output_file'])
+	merger.OutputFile(output_file, 'RECREATE')
+	if not merger.Merge():
+		raise RuntimeError('merging of worker outputs into {} failed'.format(output_file))
+	shutil.rmtree(tmpdir)
+
+	sigma_gen, sigma_err = merge_cross_sections(results)
+	summary = {'n_events': sum([r['n_events'] for r in results]),
+			   'n_tried': sum([r['n_tried'] for r in results]),
+			   'n_accepted': sum([r['n_accepted'] for r in results]),
+			   'weight_sum': sum([r['weight_sum'] for r in results]),
+			   'sigma_gen': sigma_gen, 'sigma_err': sigma_err,
+			   'nworkers': nworkers, 'seeds': seeds, 'time': duration}
+
+	fout = ROOT.TFile(output_file, 'update')
+	write_xsec_N(fout, summary['sigma_gen'], summary['sigma_err'], summary['n_events'])
+	fout.Close()
+
+	if verbose:
+		print('[i] {} events in {} workers in {:.1f} s ({:.1f} events/s), sigmaGen = {:.6g} +- {:.3g} mb'.format(
+			summary['n_events'], nworkers, duration, summary['n_events'] / duration, sigma_gen, sigma_err))
+		print('[i] written', output_file)
+	return summary
+
+
+class JetPtBenchmark(PythiaWorkerAnalysis):
+	# charged-particle anti-kt R=0.4 jets, for the benchmark
+	def init(self, worker_id):
+		import fastjet as fj
+		import pythiafjext
+		self.fj = fj
+		self.pythiafjext = pythiafjext
+		self.jet_def = fj.JetDefinition(fj.antikt_algorithm, 0.4)
+		self.jet_selector = fj.SelectorPtMin(5.0) & fj.SelectorAbsEtaMax(0.5)
+		self.hJetPt = ROOT.TH1F('hJetPt', 'hJetPt', 100, 0, 200)
+		self.hJetPt.Sumw2()
+
+	def analyze_event(self, pythia):
+		parts = self.pythiafjext.vectorize_select(pythia, [self.pythiafjext.kFinal, self.pythiafjext.kCharged], 0, True)
+		for j in self.jet_selector(self.jet_def(parts)):
+			self.hJetPt.Fill(j.perp())
+
+
+def main():
+	parser = argparse.ArgumentParser(description='benchmark of parallel pythia generation', prog=os.path.basename(__file__))
+	pyconf.add_standard_pythia_args(parser)
+	parser.add_argument('--workers', help='comma separated numbers of workers to benchmark', default='1,2,4,8', type=str)
+	parser.add_argument('--seed', help='base seed', default=1, type=int)
+	parser.add_argument('--output', help='output file', default='pythia_parallel_benchmark.root', type=str)
+	args = parser.parse_args()
+
+	rates = {}
+	for nworkers in [int(n) for n in args.workers.split(',')]:
+		summary = run_parallel(args, JetPtBenchmark, args.output, nworkers=nworkers, seed=args.seed, verbose=False)
+		rates[nworkers] = summary['n_events'] / summary['time']
+		print('{:>3d} workers: {:10.1f} events/s, speedup {:5.2f}, sigmaGen = {:.6g} +- {:.3g} mb'.format(
+			nworkers, rates[nworkers], rates[nworkers] / rates[min(rates)] * min(rates),
+			summary['sigma_gen'], summary['sigma_err']))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+# Single-pass engine for tdraw .cfg files (as used with tdraw_cfg.py):
+# all histograms of a cfg are booked lazily on one RDataFrame per (input, tree),
+# and filled in one (multi-threaded) event loop, instead of one TTree::Draw per entry.
+#
+# cfg format (ConfigObj): settings are inherited by subsections
+#   [options]            libs = ... (libraries to load)
+#   [name]               top level section: input_dir, input_file (glob), output_file, tree_name, ...
+#   [[name]]             subsections; a histogram is drawn for each section with a varexp
+#     varexp = y:x       TTree::Draw convention (last expression on x)
+#     selection = ...    selection =+ ... is and-ed with the parent selection
+#     option = e prof    e: Sumw2, prof: TProfile for y:x
+#     nbinsx, x = lo, hi, logx, nbinsy, y = lo, hi, logy, x_title, y_title, title, name
+#     active = False     skip section and its subsections
+# Histogram names are the section names joined with '_' (or name, if given), e.g. h_ev_mV0.
+# Collections in an expression (and in a selection) are iterated together, as in TTree::Draw:
+# scalars and collections of size 1 are broadcast, otherwise the shortest collection sets the length.
+# output_file = +suffix writes <input file><suffix>.root next to each input file;
+# with --merged-output all input files are processed as one chain into a single file.
+
+from __future__ import print_function
+from __future__ import division
+
+import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
+ROOT.gROOT.SetBatch(True)
+ROOT.TH1.AddDirectory(False)
+
+import os
+import re
+import glob
+import math
+import argparse
+from array import array
+from configobj import ConfigObj
+
+# helpers for expressions on collections (see above)
+ROOT.gInterpreter.Declare('''
+#include <algorithm>
+#include <initializer_list>
+#include "ROOT/RVec.hxx"
+namespace tdraw {
+	// number of iterations over collections of the given sizes
+	inline std::size_t common_size(std::initializer_list<std::size_t> sizes) {
+		std::size_t n = 1;
+		bool found = false;
+		for (auto s : sizes) {
+			if (s == 1) continue;
+			n = found ? std::min(n, s) : s;
+			found = true;
+		}
+		return n;
+	}
+	template <typename T> ROOT::RVec<T> bcast(const ROOT::RVec<T> &v, std::size_t n) {
+		if (v.size() == n) return v;
+		if (v.size() == 1) return ROOT::RVec<T>(n, v[0]);
+		return ROOT::RVec<T>(v.begin(), v.begin() + std::min(n, v.size()));
+	}
+	template <typename T> ROOT::RVec<T> bcast(const T &x, std::size_t n) { return ROOT::RVec<T>(n, x); }
+	// values (collection or scalar) of the elements passing a per-element selection
+	template <typename T, typename M> ROOT::RVec<T> select(const ROOT::RVec<T> &v, const ROOT::RVec<M> &m) {
+		auto n = common_size({v.size(), m.size()});
+		return bcast(v, n)[bcast(m, n)];
+	}
+	template <typename T, typename M> ROOT::RVec<T> select(const T &x, const ROOT::RVec<M> &m) {
+		return bcast(x, m.size())[m];
+	}
+}
+''')
+
+
+class TDrawHistogram(object):
+	def __init__(self, name, settings):
+		self.name = name
+		self.settings = settings
+		self.title = settings.get('title', name) if settings.get('title') else name
+		self.varexp = settings['varexp']
+		self.selection = settings.get('selection', '')
+		self.option = settings.get('option', '').split()
+		# TTree::Draw convention: 'y:x' -> [x, y]
+		self.variables = [v.strip() for v in re.split(r'(?<!:):(?!:)', self.varexp)][::-1]
+
+	def binning(self, axis):
+		nbins = int(self.settings.get('nbins' + axis) or 100)
+		limits = self.settings.get(axis, '')
+		lo, hi = 0., 0.
+		if limits:
+			lo, hi = [float(eval(s, {'__builtins__': None}, {'PI': math.pi, 'pi': math.pi})) for s in limits.split(',')]
+		if is_true(self.settings.get('log' + axis, False)) and lo > 0:
+			return nbins, array('d', [lo * math.pow(hi / lo, i / nbins) for i in range(nbins + 1)])
+		return nbins, lo, hi
+
+	def model(self):
+		nd = len(self.variables)
+		if nd == 1:
+			return ROOT.RDF.TH1DModel(self.name, self.title, *self.binning('x'))
+		if nd == 2 and 'prof' in self.option:
+			return ROOT.RDF.TProfile1DModel(self.name, self.title, *self.binning('x'))
+		if nd == 2:
+			return ROOT.RDF.TH2DModel(self.name, self.title, *(self.binning('x') + self.binning('y')))
+		if nd == 3:
+			return ROOT.RDF.TH3DModel(self.name, self.title, *(self.binning('x') + self.binning('y') + self.binning('z')))
+		raise ValueError('tdraw_rdf: cannot draw {} with varexp {}'.format(self.name, self.varexp))
+
+	def book(self, graph):
+		node, columns = graph.node(self.selection), [graph.column(self.selection, v) for v in self.variables]
+		model = self.model()
+		if len(columns) == 1:
+			self.result = node.Histo1D(model, columns[0])
+		elif len(columns) == 2 and 'prof' in self.option:
+			self.result = node.Profile1D(model, columns[0], columns[1])
+		elif len(columns) == 2:
+			self.result = node.Histo2D(model, columns[0], columns[1])
+		else:
+			self.result = node.Histo3D(model, columns[0], columns[1], columns[2])
+
+	def histogram(self):
+		h = self.result.GetValue()
+		if 'e' in self.option:
+			h.Sumw2()
+		for axis, key in [(h.GetXaxis(), 'x_title'), (h.GetYaxis(), 'y_title')]:
+			if self.settings.get(key):
+				axis.SetTitle(self.settings[key])
+		return h
+
+
+class TDrawGraph(object):
+	# One RDataFrame for a tree over a list of files, booking a list of histograms:
+	# all expressions are defined once on the data frame, and histograms with the same selection share a filter
+	def __init__(self, tree_name, files, histograms, nentries=None, firstentry=None):
+		self.chain = ROOT.TChain(tree_name)
+		for fn in files:
+			self.chain.Add(fn)
+		df = ROOT.RDataFrame(self.chain)
+		if nentries or firstentry:
+			first = int(firstentry or 0)
+			df = df.Range(first, first + int(nentries) if nentries else 0)
+		self.branches = set([str(c) for c in df.GetColumnNames()])
+		self.collections = set([b for b in self.branches if is_collection(df.GetColumnType(b))])
+		self.histograms = histograms
+
+		# Selections: event level selections are filters, per-element selections (on collections) mask the values
+		self.selections = {}
+		self.masks = {}
+		for selection in sorted(set([h.selection for h in histograms if h.selection.strip()])):
+			name = '_tdraw_s{}'.format(len(self.selections))
+			df = df.Define(name, self.broadcast(selection))
+			self.selections[selection] = name
+			if is_collection(df.GetColumnType(name)):
+				self.masks[selection] = name
+
+		# Expressions, and their values passing per-element selections
+		self.expressions = {}
+		self.defines = {}
+		for h in histograms:
+			for expr in h.variables:
+				if expr not in self.branches and expr not in self.expressions:
+					self.expressions[expr] = '_tdraw_e{}'.format(len(self.expressions))
+					df = df.Define(self.expressions[expr], self.broadcast(expr))
+				key = self.key(h.selection, expr)
+				if key in self.defines or not self.masks.get(h.selection):
+					continue
+				self.defines[key] = '_tdraw_v{}'.format(len(self.defines))
+				df = df.Define(self.defines[key], key)
+
+		self.df = df
+		self.nodes = {}
+		for selection, name in self.selections.items():
+			if selection not in self.masks:
+				self.nodes[selection] = self.df.Filter(name)
+
+		for h in histograms:
+			h.book(self)
+
+	def broadcast(self, expr):
+		# expression iterating together over the collections it uses (see above)
+		names = [n for n in sorted(set(re.findall(r'(?<![\w.])[A-Za-z_]\w*', expr))) if n in self.collections]
+		if len(names) < 2:
+			return expr
+		for n in names:
+			expr = re.sub(r'(?<![\w.]){}\b'.format(n), 'tdraw::bcast({}, _tdraw_n)'.format(n), expr)
+		return 'const auto _tdraw_n = tdraw::common_size({{{}}}); return {};'.format(
+			', '.join(['{}.size()'.format(n) for n in names]), expr)
+
+	def key(self, selection, expr):
+		column = expr if expr in self.branches else self.expressions[expr]
+		mask = self.masks.get(selection)
+		return 'tdraw::select({}, {})'.format(column, mask) if mask else column
+
+	def node(self, selection):
+		return self.nodes.get(selection, self.df)
+
+	def column(self, selection, expr):
+		key = self.key(selection, expr)
+		return self.defines.get(key, key)
+
+
+def is_collection(column_type):
+	column_type = str(column_type)
+	return 'RVec' in column_type or 'vector<' in column_type
+
+
+def is_true(value):
+	return str(value).strip().lower() in ['true', 'yes', '1']
+
+
+def unquote(value):
+	value = str(value).strip()
+	if len(value) > 1 and value[0] == value[-1] and value[0] in ['"', "'"]:
+		return value[1:-1]
+	return value
+
+
+def substitute(value, replacements):
+	for key, val in replacements.items():
+		value = value.replace('<{}>'.format(key), val)
+	return os.path.expandvars(value)
+
+
+def combine_selection(parent, selection):
+	if selection.startswith('+'):
+		selection = selection[1:].strip()
+		if parent.strip() and selection:
+			return '({}) && ({})'.format(parent, selection)
+		return parent if parent.strip() else selection
+	return selection
+
+
+def collect_histograms(section, settings, name, replacements, histograms):
+	settings = dict(settings)
+	for key in section.scalars:
+		value = substitute(unquote(section[key]), replacements)
+		if key == 'selection':
+			value = combine_selection(settings.get('selection', ''), value)
+		settings[key] = value
+	if not is_true(settings.get('active', True)):
+		return
+	if 'name' in section.scalars and settings['name']:
+		name = settings['name']
+	if 'title' not in section.scalars:
+		settings.pop('title', None)
+	if settings.get('varexp'):
+		histograms.append(TDrawHistogram(name, settings))
+	for sub in section.sections:
+		collect_histograms(section[sub], settings, '{}_{}'.format(name, sub), replacements, histograms)
+
+
+def output_name(fn, output_file):
+	if output_file.startswith('+'):
+		return '{}{}.root'.format(fn[:-len('.root')] if fn.endswith('.root') else fn, output_file[1:])
+	return output_file
+
+
+def main():
+	parser = argparse.ArgumentParser(description='fill all histograms of a tdraw cfg file in one pass per tree', prog=os.path.basename(__file__))
+	parser.add_argument('cfg', help='tdraw cfg file', type=str)
+	parser.add_argument('-r', '--replace', help='replace <key> with value in the cfg, given as key:value', default=[], action='append')
+	parser.add_argument('--clean', help='recreate output files (always done; kept for tdraw_cfg.py compatibility)', default=False, action='store_true')
+	parser.add_argument('--merged-output', help='process all input files as one chain into this file', default=None, type=str)
+	parser.add_argument('-t', '--threads', help='number of threads (0: all cores)', default=0, type=int)
+	args = parser.parse_args()
+
+	replacements = dict([r.split(':', 1) for r in args.replace])
+	cfg = ConfigObj(args.cfg, list_values=False)
+
+	if 'options' in cfg.sections:
+		for lib in cfg['options'].get('libs', '').split():
+			ROOT.gSystem.Load(lib)
+
+	# jobs: (output file, input files, histograms)
+	jobs = []
+	for top in cfg.sections:
+		if top == 'options':
+			continue
+		histograms = []
+		collect_histograms(cfg[top], {}, top, replacements, histograms)
+		if len(histograms) == 0:
+			continue
+		settings = histograms[0].settings
+		input_pattern = os.path.join(settings.get('input_dir', '.'), settings.get('input_file', ''))
+		files = sorted(glob.glob(input_pattern))
+		if len(files) == 0:
+			print('[w] {}: no input files for {}'.format(top, input_pattern))
+			continue
+		output_file = settings.get('output_file', '+_tdraw')
+		if args.merged_output:
+			jobs.append((args.merged_output, files, histograms))
+		elif output_file.startswith('+'):
+			jobs.extend([(output_name(fn, output_file), [fn], histograms) for fn in files])
+		else:
+			jobs.append((output_file, files, histograms))
+
+	# Range() (nentries, firstentry) is not available with implicit multi-threading
+	use_range = any([h.settings.get('nentries') or h.settings.get('firstentry') for job in jobs for h in job[2]])
+	if not use_range:
+		ROOT.EnableImplicitMT(args.threads)
+
+	# One graph per input and (tree, range); output file -> list of graphs
+	outputs = {}
+	for fout, fins, histograms in jobs:
+		per_tree = {}
+		for h in histograms:
+			key = (h.settings.get('tree_name'), h.settings.get('nentries'), h.settings.get('firstentry'))
+			per_tree.setdefault(key, []).append(TDrawHistogram(h.name, h.settings))
+		for (tree_name, nentries, firstentry), hs in per_tree.items():
+			outputs.setdefault(fout, []).append(TDrawGraph(tree_name, fins, hs, nentries, firstentry))
+
+	# Run all event loops (concurrently, if available)
+	results = [h.result for graphs in outputs.values() for g in graphs for h in g.histograms]
+	if hasattr(ROOT.RDF, 'RunGraphs'):
+		ROOT.RDF.RunGraphs(results)
+
+	for fout, graphs in outputs.items():
+		f = ROOT.TFile(fout, 'recreate')
+		f.cd()
+		n = 0
+		for g in graphs:
+			for h in g.histograms:
+				h.histogram().Write(h.name)
+				n += 1
+		f.Close()
+		print('[i] written {} histograms to {} ({} trees read once)'.format(n, fout, len(graphs)))
+
+
+if __name__ == '__main__':
+	main()